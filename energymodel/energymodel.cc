@@ -10,9 +10,12 @@ help@multistrand.org
 #include "moveutil.h"
 #include "sequtil.h"
 #include "options.h"
+#include "energyoptions.h"
 
 #include <iostream>
 #include <fstream>
+#include <sstream>
+#include <stdlib.h>
 
 
 bool printedRates = false; // to print the constants to file once
@@ -78,6 +81,11 @@ void EnergyModel::computeArrheniusRates(double temperature) {
 
 void EnergyModel::writeConstantsToFile() {
 
+	if (constantsWritten)
+		return;
+
+	constantsWritten = true;
+
 	// Print constants to file.
 
 	std::stringstream ss;
@@ -407,3 +415,301 @@ int baseLookup(char base) {
 	return lookuphelper[temp - 'A'];
 }
 
+std::mutex EnergyModelRegistry::lock;
+EnergyModelRegistry::entryList EnergyModelRegistry::entries;
+std::unordered_map<string, EnergyModelRegistry::entryList::iterator> EnergyModelRegistry::index;
+int EnergyModelRegistry::capacity = 8;
+long EnergyModelRegistry::hits = 0;
+long EnergyModelRegistry::misses = 0;
+
+// Returns the model for these options, which is only built (reading the
+// parameter files) if no model for the same conditions is cached. Models only
+// used to evaluate energies (see energy_batch) skip writing the constants file.
+std::shared_ptr<EnergyModel> EnergyModelRegistry::get(SimOptions* options, bool writeConstants) {
+
+	string modelKey = key(options);
+
+	std::lock_guard<std::mutex> guard(lock);
+
+	auto found = index.find(modelKey);
+
+	if (found != index.end()) {
+		hits++;
+		entries.splice(entries.begin(), entries, found->second);
+		if (writeConstants)
+			found->second->second->writeConstantsToFile();
+		return found->second->second;
+	}
+
+	misses++;
+
+	std::shared_ptr<EnergyModel> model(new NupackEnergyModel(options->copy()));
+	if (writeConstants)
+		model->writeConstantsToFile();
+
+	if (capacity > 0) {
+		entries.push_front(std::make_pair(modelKey, model));
+		index[modelKey] = entries.begin();
+		evict();
+	}
+
+	return model;
+
+}
+
+// Every option read by NupackEnergyModel, and the location of the parameter files
+// or of the compiled parameter set.
+string EnergyModelRegistry::key(SimOptions* options) {
+
+	EnergyOptions* energyOptions = options->getEnergyOptions();
+	char *nupackhome = getenv("NUPACKHOME");
+
+	std::stringstream ss;
+
+	ss << std::hexfloat;
+	ss << energyOptions->getSubstrateType() << " " << energyOptions->getTemperature() << " ";
+	ss << energyOptions->getDangles() << " " << energyOptions->getLogml() << " " << energyOptions->getGtenable() << " ";
+	ss << energyOptions->getKineticRateMethod() << " " << energyOptions->getJoinConcentration() << " ";
+	ss << energyOptions->getBiScale() << " " << energyOptions->getUniScale() << " ";
+	ss << energyOptions->sodium << " " << energyOptions->magnesium << " ";
+	ss << energyOptions->usingArrhenius() << " " << energyOptions->dSA << " " << energyOptions->dHA << " ";
+
+	for (int i = 0; i < MOVETYPE_SIZE; i++)
+		ss << energyOptions->AValues[i] << " " << energyOptions->EValues[i] << " ";
+
+	ss << (nupackhome == NULL ? "" : nupackhome) << " " << energyOptions->getCompiledParameters() << " ";
+	ss << energyOptions->getParameterFile();
+
+	return ss.str();
+
+}
+
+void EnergyModelRegistry::evict(void) {
+
+	while ((int) entries.size() > capacity) {
+		index.erase(entries.back().first);
+		entries.pop_back();
+	}
+
+}
+
+void EnergyModelRegistry::setCapacity(int newCapacity) {
+
+	std::lock_guard<std::mutex> guard(lock);
+
+	capacity = newCapacity < 0 ? 0 : newCapacity;
+	evict();
+
+}
+
+int EnergyModelRegistry::getCapacity(void) {
+
+	return capacity;
+
+}
+
+int EnergyModelRegistry::getSize(void) {
+
+	std::lock_guard<std::mutex> guard(lock);
+
+	return entries.size();
+
+}
+
+long EnergyModelRegistry::getHits(void) {
+
+	return hits;
+
+}
+
+long EnergyModelRegistry::getMisses(void) {
+
+	return misses;
+
+}
+
+void EnergyModelRegistry::clear(void) {
+
+	std::lock_guard<std::mutex> guard(lock);
+
+	entries.clear();
+	index.clear();
+
+}
+
+std::atomic<long> LoopEnergyCache::capacity(0);
+std::atomic<long> LoopEnergyCache::generations(0);
+std::atomic<long> LoopEnergyCache::modelIds(0);
+std::atomic<long> LoopEnergyCache::totalHits(0);
+std::atomic<long> LoopEnergyCache::totalMisses(0);
+
+static uint64_t rotateLeft(uint64_t x, int k) {
+
+	return (x << k) | (x >> (64 - k));
+
+}
+
+long LoopEnergyCache::newModelId(void) {
+
+	return modelIds++;
+
+}
+
+LoopEnergyCache* LoopEnergyCache::local(void) {
+
+	static thread_local std::unique_ptr<LoopEnergyCache> cache;
+
+	if (!cache)
+		cache.reset(new LoopEnergyCache());
+
+	return cache.get();
+
+}
+
+// Empties the table, sized to the capacity rounded up to a power of two.
+void LoopEnergyCache::reset(void) {
+
+	long slots = 1;
+
+	while (slots < capacity)
+		slots <<= 1;
+
+	entries.assign(slots, entry { 0, 0, 0.0 });
+	size = 0;
+	hits = 0;
+	misses = 0;
+	generation = generations.load();
+
+}
+
+// Returns the cache of this thread with a new key for the model and loop type.
+// Models never share an id, so their energies can be kept side by side.
+LoopEnergyCache* LoopEnergyCache::get(long modelId, int loopType) {
+
+	if (capacity.load(std::memory_order_relaxed) <= 0)
+		return NULL;
+
+	LoopEnergyCache* cache = local();
+
+	if (cache->generation != generations.load(std::memory_order_relaxed))
+		cache->reset();
+
+	cache->low = state_fingerprint::mix((uint64_t) modelId * 0x9e3779b97f4a7c15ULL + loopType);
+	cache->high = state_fingerprint::mix(cache->low ^ 0x632be59bd9b4e019ULL);
+
+	return cache;
+
+}
+
+// Counters of worker threads are added to the totals when the thread exits.
+LoopEnergyCache::~LoopEnergyCache(void) {
+
+	if (generation == generations.load()) {
+		totalHits += hits;
+		totalMisses += misses;
+	}
+
+}
+
+// Adds the length of a loop side and its bases first through last to the key.
+void LoopEnergyCache::append(int length, const char *bases, int first, int last) {
+
+	uint64_t word = (uint32_t) length;
+
+	low = rotateLeft(low ^ word, 29) * 0x9e3779b97f4a7c15ULL;
+	high = rotateLeft(high ^ word, 31) * 0xc2b2ae3d27d4eb4fULL;
+
+	for (int i = first; i <= last; i += 8) {
+
+		word = 0;
+		memcpy(&word, bases + i, (last - i + 1) < 8 ? (last - i + 1) : 8);
+
+		low = rotateLeft(low ^ word, 29) * 0x9e3779b97f4a7c15ULL;
+		high = rotateLeft(high ^ word, 31) * 0xc2b2ae3d27d4eb4fULL;
+
+	}
+
+}
+
+bool LoopEnergyCache::find(double& energy) {
+
+	low = state_fingerprint::mix(low);
+	high = state_fingerprint::mix(high) | 1; // empty slots never match
+
+	entry& slot = entries[low & (entries.size() - 1)];
+
+	if (slot.low != low || slot.high != high) {
+		misses++;
+		return false;
+	}
+
+	hits++;
+	energy = slot.energy;
+	return true;
+
+}
+
+// Stores energy under the key of the last call to find.
+void LoopEnergyCache::insert(double energy) {
+
+	entry& slot = entries[low & (entries.size() - 1)];
+
+	if (slot.high == 0)
+		size++;
+
+	slot.low = low;
+	slot.high = high;
+	slot.energy = energy;
+
+}
+
+// Takes effect in every thread the next time it looks up an energy.
+void LoopEnergyCache::setCapacity(long newCapacity) {
+
+	capacity = newCapacity < 0 ? 0 : newCapacity;
+
+	totalHits = 0;
+	totalMisses = 0;
+	generations++;
+
+}
+
+long LoopEnergyCache::getCapacity(void) {
+
+	return capacity;
+
+}
+
+// The number of energies cached by the calling thread.
+long LoopEnergyCache::getSize(void) {
+
+	LoopEnergyCache* cache = local();
+
+	return cache->generation == generations.load() ? cache->size : 0;
+
+}
+
+long LoopEnergyCache::getHits(void) {
+
+	LoopEnergyCache* cache = local();
+
+	return totalHits + (cache->generation == generations.load() ? cache->hits : 0);
+
+}
+
+long LoopEnergyCache::getMisses(void) {
+
+	LoopEnergyCache* cache = local();
+
+	return totalMisses + (cache->generation == generations.load() ? cache->misses : 0);
+
+}
+
+// Empties the caches of all threads and resets the counters.
+void LoopEnergyCache::clear(void) {
+
+	totalHits = 0;
+	totalMisses = 0;
+	generations++;
+
+}
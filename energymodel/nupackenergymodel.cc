@@ -13,6 +13,13 @@ help@multistrand.org
 #include "simoptions.h"
 #include "options.h"
 
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <stdint.h>
+#include <memory>
+
 #undef DEBUG
 //#define DEBUG
 
@@ -34,8 +41,9 @@ extern int basepair_sw[8];
 extern int baseLookup(char base);
 
 NupackEnergyModel::~NupackEnergyModel(void) {
-	// TODO: is anything allocated now? Don't think so, all arrays are static still.
-	// nothing is allocated within an energy model.
+	// the tables are released with ownedTables and scaledTables, or with the mapping.
+	if (mappedTables != NULL)
+		munmap(mappedTables, mappedLength);
 }
 
 
@@ -84,6 +92,113 @@ double NupackEnergyModel::getAssocEnergy(void) {
 	return dG_assoc;
 }
 
+// Hairpin, interior, multi- and open loop energies are looked up in the loop
+// energy cache first. Stacks, bulges and the special 1x1, 2x1 and 2x2 interior
+// loops are single table lookups and are always computed.
+double NupackEnergyModel::InteriorEnergy(char *seq1, char *seq2, int size1, int size2) {
+
+	LoopEnergyCache* cache = NULL;
+
+	if (size1 > 2 || size2 > 2)
+		cache = LoopEnergyCache::get(loopCacheId, interiorLoop);
+
+	if (cache == NULL)
+		return computeInteriorEnergy(seq1, seq2, size1, size2);
+
+	double energy;
+
+	cache->append(size1, seq1, 0, size1 + 1);
+	cache->append(size2, seq2, 0, size2 + 1);
+
+	if (!cache->find(energy)) {
+		energy = computeInteriorEnergy(seq1, seq2, size1, size2);
+		cache->insert(energy);
+	}
+
+	return energy;
+
+}
+
+double NupackEnergyModel::HairpinEnergy(char *seq, int size) {
+
+	LoopEnergyCache* cache = LoopEnergyCache::get(loopCacheId, hairpinLoop);
+
+	if (cache == NULL)
+		return computeHairpinEnergy(seq, size);
+
+	double energy;
+
+	cache->append(size, seq, 0, size + 1);
+
+	if (!cache->find(energy)) {
+		energy = computeHairpinEnergy(seq, size);
+		cache->insert(energy);
+	}
+
+	return energy;
+
+}
+
+double NupackEnergyModel::MultiloopEnergy(int size, int *sidelen, char **sequences) {
+
+	LoopEnergyCache* cache = LoopEnergyCache::get(loopCacheId, multiLoop);
+
+	if (cache == NULL)
+		return computeMultiloopEnergy(size, sidelen, sequences);
+
+	double energy;
+
+	for (int loop = 0; loop < size; loop++)
+		cache->append(sidelen[loop], sequences[loop], 0, sidelen[loop] + 1);
+
+	if (!cache->find(energy)) {
+		energy = computeMultiloopEnergy(size, sidelen, sequences);
+		cache->insert(energy);
+	}
+
+	return energy;
+
+}
+
+// The first side of an open loop can start before its strand, and the last side
+// ends on the last base, so only the bases the energy function reads are part
+// of the key: the base before the first side only matters for single stranded
+// stacking (see arrheniusLoopEnergy).
+double NupackEnergyModel::OpenloopEnergy(int size, int *sidelen, char **sequences) {
+
+	LoopEnergyCache* cache = NULL;
+
+	if (size > 0)
+		cache = LoopEnergyCache::get(loopCacheId, openLoop);
+
+	if (cache == NULL)
+		return computeOpenloopEnergy(size, sidelen, sequences);
+
+	double energy;
+
+	for (int loop = 0; loop <= size; loop++) {
+
+		int first = 0;
+		int last = sidelen[loop] + 1;
+
+		if (loop == 0 && !(simOptions->energyOptions->usingArrhenius() && sidelen[0] > 4))
+			first = 1;
+		if (loop == size)
+			last = sidelen[loop];
+
+		cache->append(sidelen[loop], sequences[loop], first, last);
+
+	}
+
+	if (!cache->find(energy)) {
+		energy = computeOpenloopEnergy(size, sidelen, sequences);
+		cache->insert(energy);
+	}
+
+	return energy;
+
+}
+
 // non entropy/enthalpy energy functions
 double NupackEnergyModel::StackEnergy(int i, int j, int p, int q) {
 
@@ -121,7 +236,7 @@ double NupackEnergyModel::BulgeEnergy(int i, int j, int p, int q, int bulgesize)
 	return energy;
 }
 
-double NupackEnergyModel::InteriorEnergy(char *seq1, char *seq2, int size1, int size2) {
+double NupackEnergyModel::computeInteriorEnergy(char *seq1, char *seq2, int size1, int size2) {
 
 	double energy, ninio;
 
@@ -182,7 +297,7 @@ double NupackEnergyModel::InteriorEnergy(char *seq1, char *seq2, int size1, int
 	return energy;
 }
 
-double NupackEnergyModel::HairpinEnergy(char *seq, int size) {
+double NupackEnergyModel::computeHairpinEnergy(char *seq, int size) {
 
 	double energy = 0.0;
 	int lookup_index = 0;
@@ -220,7 +335,7 @@ double NupackEnergyModel::HairpinEnergy(char *seq, int size) {
 	return energy;
 }
 
-double NupackEnergyModel::MultiloopEnergy(int size, int *sidelen, char **sequences) {
+double NupackEnergyModel::computeMultiloopEnergy(int size, int *sidelen, char **sequences) {
 
 	// no dangle terms yet, this is equiv to dangles = 0;
 	int totallength = 0;
@@ -312,7 +427,7 @@ double NupackEnergyModel::MultiloopEnergy(int size, int *sidelen, char **sequenc
 
 }
 
-double NupackEnergyModel::OpenloopEnergy(int size, int *sidelen, char **sequences) {
+double NupackEnergyModel::computeOpenloopEnergy(int size, int *sidelen, char **sequences) {
 
 	if(debugTraces){
 		cout << "Computing OpenLoopEnergy, size = " << size << endl;
@@ -408,6 +523,11 @@ double NupackEnergyModel::OpenloopEnergy(int size, int *sidelen, char **sequence
 
 // constructors, internal functions
 
+NupackEnergyModel::NupackEnergyModel(void) :
+		log_loop_penalty_37(107.856), kinetic_rate_method(RATE_METHOD_KAWASAKI), bimolecular_penalty(1.96), kBoltzmann(.00198717), current_temp(310.15) {
+	simOptions = NULL;
+}
+
 NupackEnergyModel::NupackEnergyModel(PyObject* energy_options) :
 
 		log_loop_penalty_37(107.856), kinetic_rate_method(RATE_METHOD_KAWASAKI), bimolecular_penalty(1.96), kBoltzmann(.00198717), current_temp(310.15) // Check references for this loop penalty term.
@@ -437,10 +557,8 @@ NupackEnergyModel::NupackEnergyModel(SimOptions* options) :
 
 void NupackEnergyModel::processOptions() {
 // This is the tough part, performing all read/input duties.
-	char in_buffer[2048];
 	int loop, loop2, loop3, loop4, loop5, loop6;
 	double temperature;
-	FILE *fp = NULL, *fp2 = NULL; // fp is dG energy file, fp2 is dH.
 
 	EnergyOptions* myEnergyOptions = simOptions->getEnergyOptions();
 
@@ -463,20 +581,212 @@ void NupackEnergyModel::processOptions() {
 		for (loop2 = 0; loop2 < NUM_BASES; loop2++)
 			pairtypes[loop][loop2] = pairtypes_mfold[loop][loop2];
 
-	if (myEnergyOptions->compareSubstrateType(SUBSTRATE_INVALID)) {
-		PyObject *tmpStr = NULL;
+	bool enthalpy;
+
+	if (myEnergyOptions->getCompiledParameters().empty())
+		enthalpy = readParameterFiles(myEnergyOptions);
+	else
+		enthalpy = loadParameterSet(myEnergyOptions->getCompiledParameters());
+
+	if (!enthalpy) {
+		if (temperature < CELSIUS37_IN_KELVIN - .0001 || temperature > CELSIUS37_IN_KELVIN + .0001) {
+			fprintf(stderr,
+					"ERROR: Temperature was set to %0.2lf C, but only dG type data files could be found. Please ensure that the requested parameter set has both .dG and .dH files!\n",
+					temperature);
+			exit(0);
+		}
+		return;
+	}
+
+// Temperature change section.
+//  double getDoubleAttr(energy_options, temperature,&temperature);
+
+	_RT = kBoltzmann * current_temp;
+	log_loop_penalty = 100.0 * 1.75 * kBoltzmann * current_temp;
+
+	if (!  ((temperature < CELSIUS37_IN_KELVIN - .00001) || (temperature > CELSIUS37_IN_KELVIN + .00001))   ) {
+		current_temp = CELSIUS37_IN_KELVIN;
+		setupRates();
+		return;
+	}
+
+	if (mappedTables != NULL)
+		copyScaledTables();
+
+	for (loop = 0; loop < NUM_BASEPAIRS_NUPACK; loop++){
+		for (loop2 = 0; loop2 < NUM_BASEPAIRS_NUPACK; loop2++){
+
+			stack_37_dG[loop][loop2] = T_scale(stack_37_dG[loop][loop2], stack_37_dH[loop][loop2], temperature);
+			// now adjusting for a single salt correction term.
+			stack_37_dG[loop][loop2] += saltCorrection(2)* -temperature / 1000.0;
+		}
+	}
+
+
+	for (loop = 0; loop < 31; loop++)
+		hairpin_37_dG[loop] = T_scale(hairpin_37_dG[loop], hairpin_37_dH[loop], temperature);
+
+	for (loop = 0; loop < NUM_BASEPAIRS_NUPACK; loop++)
+		for (loop2 = 0; loop2 < NUM_BASES; loop2++)
+			for (loop3 = 0; loop3 < NUM_BASES; loop3++)
+				hairpin_mismatch_37_dG[loop][loop2][loop3] = T_scale(hairpin_mismatch_37_dG[loop][loop2][loop3], hairpin_mismatch_37_dH[loop][loop2][loop3],
+						temperature);
+
+	for (loop = 0; loop < 4096; loop++)
+		*(double *) (hairpin_tetraloop_37_dG + loop) = T_scale(*(double *) (hairpin_tetraloop_37_dG + loop), *(int *) (hairpin_tetraloop_37_dH + loop),
+				temperature);
+
+	for (loop = 0; loop < 1024; loop++)
+		*(double *) (hairpin_triloop_37_dG + loop) = T_scale(*(double *) (hairpin_triloop_37_dG + loop), *(int *) (hairpin_triloop_37_dH + loop), temperature);
+
+	for (loop = 0; loop < 31; loop++)
+		bulge_37_dG[loop] = T_scale(bulge_37_dG[loop], bulge_37_dH[loop], temperature);
+
+	for (loop = 0; loop < 31; loop++)
+		internal_37_dG[loop] = T_scale(internal_37_dG[loop], internal_37_dH[loop], temperature);
+
+	for (loop = 0; loop < NUM_BASES; loop++)
+		//  for( loop = 0; loop < NUM_BASEPAIRS_NUPACK; loop++ )
+		for (loop2 = 0; loop2 < NUM_BASES; loop2++)
+			for (loop3 = 0; loop3 < NUM_BASEPAIRS_NUPACK; loop3++)
+				//      for( loop3 = 0; loop3 < NUM_BASES; loop3++ )
+				internal_mismatch_37_dG[loop][loop2][loop3] = T_scale(internal_mismatch_37_dG[loop][loop2][loop3], internal_mismatch_37_dH[loop][loop2][loop3],
+						temperature);
+
+	maximum_NINIO = T_scale(maximum_NINIO, maximum_NINIO_dH, temperature);
+
+	for (loop = 0; loop < 5; loop++)
+		ninio_correction_37[loop] = T_scale(ninio_correction_37[loop], ninio_correction_37_dH[loop], temperature);
+
+	for (loop = 0; loop < NUM_BASEPAIRS_NUPACK; loop++)
+		for (loop2 = 0; loop2 < NUM_BASEPAIRS_NUPACK; loop2++)
+			for (loop3 = 0; loop3 < NUM_BASES; loop3++)
+				for (loop4 = 0; loop4 < NUM_BASES; loop4++)
+					internal_1_1_37_dG[loop][loop2][loop3][loop4] = T_scale(internal_1_1_37_dG[loop][loop2][loop3][loop4],
+							internal_1_1_37_dH[loop][loop2][loop3][loop4], temperature);
+
+	for (loop = 0; loop < NUM_BASEPAIRS_NUPACK; loop++)
+		for (loop5 = 0; loop5 < NUM_BASES; loop5++)
+			for (loop2 = 0; loop2 < NUM_BASEPAIRS_NUPACK; loop2++)
+				for (loop3 = 0; loop3 < NUM_BASES; loop3++)
+					for (loop4 = 0; loop4 < NUM_BASES; loop4++)
+						internal_2_1_37_dG[loop][loop5][loop2][loop3][loop4] = T_scale(internal_2_1_37_dG[loop][loop5][loop2][loop3][loop4],
+								internal_2_1_37_dH[loop][loop5][loop2][loop3][loop4], temperature);
+
+	for (loop = 0; loop < NUM_BASEPAIRS_NUPACK; loop++)
+		for (loop2 = 0; loop2 < NUM_BASEPAIRS_NUPACK; loop2++)
+			for (loop3 = 0; loop3 < NUM_BASES; loop3++)
+				for (loop4 = 0; loop4 < NUM_BASES; loop4++)
+					for (loop5 = 0; loop5 < NUM_BASES; loop5++)
+						for (loop6 = 0; loop6 < NUM_BASES; loop6++)
+							internal_2_2_37_dG[loop][loop2][loop3][loop4][loop5][loop6] = T_scale(internal_2_2_37_dG[loop][loop2][loop3][loop4][loop5][loop6],
+									internal_2_2_37_dH[loop][loop2][loop3][loop4][loop5][loop6], temperature);
+
+	multiloop_base = T_scale(multiloop_base, multiloop_base_dH, temperature);
+	multiloop_closing = T_scale(multiloop_closing, multiloop_closing_dH, temperature);
+	multiloop_internal = T_scale(multiloop_internal, multiloop_internal_dH, temperature);
+
+	for (loop = 0; loop < NUM_BASEPAIRS_NUPACK; loop++)
+		for (loop2 = 0; loop2 < NUM_BASES; loop2++)
+			dangle_3_37_dG[loop][loop2] = T_scale(dangle_3_37_dG[loop][loop2], dangle_3_37_dH[loop][loop2], temperature);
+
+	for (loop = 0; loop < NUM_BASEPAIRS_NUPACK; loop++)
+		for (loop2 = 0; loop2 < NUM_BASES; loop2++)
+			dangle_5_37_dG[loop][loop2] = T_scale(dangle_5_37_dG[loop][loop2], dangle_5_37_dH[loop][loop2], temperature);
+
+	terminal_AU = T_scale(terminal_AU, terminal_AU_dH, temperature);
+
+	bimolecular_penalty = T_scale(bimolecular_penalty, bimolecular_penalty_dH, temperature);
+// need additional conversion as well
 
-		char* tmp = NULL;
-		myEnergyOptions->getParameterFile(tmp, tmpStr);
+	_RT = kBoltzmann * temperature;
+	current_temp = temperature;
+
+//	cout << "Current Temperature is " << current_temp << "\n";
+
+	setupRates();
+}
+
+/*
+ Compiled parameter sets hold the tables read by readParameterFiles, at 37
+ degrees and before any temperature or salt scaling:
+
+ 	char[8]	magic "MSPARAM"
+ 	int32	format version
+ 	int32	substrate type
+ 	int32	1 if the dH tables are present, else 0
+ 	int32	table count T
+ 	int32[T]	size of each table in bytes, to check the layout against this build
+
+ followed by the tables in the order of PARAMETER_TABLES, each padded to a
+ multiple of 8 bytes. All values are in native byte order. The array tables of a
+ model always point into a block with this layout (everything after the header).
+ */
+
+#define PARAMETER_TABLES(SCALED, FIXED, VALUE) \
+	SCALED(stack_37_dG, NUM_BASEPAIRS_NUPACK) FIXED(stack_37_dH, NUM_BASEPAIRS_NUPACK) \
+	SCALED(hairpin_37_dG, 31) FIXED(hairpin_37_dH, 31) \
+	SCALED(hairpin_mismatch_37_dG, NUM_BASEPAIRS_NUPACK) FIXED(hairpin_mismatch_37_dH, NUM_BASEPAIRS_NUPACK) \
+	SCALED(hairpin_triloop_37_dG, 1024) FIXED(hairpin_triloop_37_dH, 1024) \
+	SCALED(hairpin_tetraloop_37_dG, 4096) FIXED(hairpin_tetraloop_37_dH, 4096) \
+	SCALED(bulge_37_dG, 31) FIXED(bulge_37_dH, 31) \
+	SCALED(internal_37_dG, 31) FIXED(internal_37_dH, 31) \
+	SCALED(internal_mismatch_37_dG, NUM_BASES) FIXED(internal_mismatch_37_dH, NUM_BASES) \
+	VALUE(maximum_NINIO) VALUE(maximum_NINIO_dH) \
+	SCALED(ninio_correction_37, 5) FIXED(ninio_correction_37_dH, 5) \
+	SCALED(internal_1_1_37_dG, NUM_BASEPAIRS_NUPACK) FIXED(internal_1_1_37_dH, NUM_BASEPAIRS_NUPACK) \
+	SCALED(internal_2_1_37_dG, NUM_BASEPAIRS_NUPACK) FIXED(internal_2_1_37_dH, NUM_BASEPAIRS_NUPACK) \
+	SCALED(internal_2_2_37_dG, NUM_BASEPAIRS_NUPACK) FIXED(internal_2_2_37_dH, NUM_BASEPAIRS_NUPACK) \
+	VALUE(multiloop_base) VALUE(multiloop_closing) VALUE(multiloop_internal) \
+	VALUE(multiloop_base_dH) VALUE(multiloop_closing_dH) VALUE(multiloop_internal_dH) \
+	SCALED(dangle_3_37_dG, NUM_BASEPAIRS_NUPACK) SCALED(dangle_5_37_dG, NUM_BASEPAIRS_NUPACK) \
+	FIXED(dangle_3_37_dH, NUM_BASEPAIRS_NUPACK) FIXED(dangle_5_37_dH, NUM_BASEPAIRS_NUPACK) \
+	VALUE(terminal_AU) VALUE(terminal_AU_dH) \
+	VALUE(bimolecular_penalty) VALUE(bimolecular_penalty_dH)
+
+// array tables are given with their number of rows; the rest are single values.
+#define TABLE_BYTES(name, rows) ((rows) * sizeof(name[0]))
+#define COUNT_TABLE(name, rows) + 1
+#define COUNT_VALUE(name) + 1
+#define TABLE_SIZE(name, rows) (int32_t) TABLE_BYTES(name, rows),
+#define VALUE_SIZE(name) (int32_t) sizeof(name),
+#define ADD_TABLE(name, rows) bytes += padTo8(TABLE_BYTES(name, rows));
+#define ADD_VALUE(name) bytes += padTo8(sizeof(name));
+#define SKIP_TABLE(name, rows)
+#define SKIP_VALUE(name)
+
+static const char parameterMagic[8] = "MSPARAM";
+static const int32_t parameterVersion = 1;
+static const int parameterTableCount = 0 PARAMETER_TABLES(COUNT_TABLE, COUNT_TABLE, COUNT_VALUE);
+
+static size_t padTo8(size_t size) {
+
+	return (size + 7) & ~((size_t) 7);
+
+}
+
+// Parses the dG and dH tables at 37 degrees for the substrate in the options,
+// returns false if there is no dH file.
+bool NupackEnergyModel::readParameterFiles(EnergyOptions* myEnergyOptions) {
+
+	char in_buffer[2048];
+	FILE *fp = NULL, *fp2 = NULL; // fp is dG energy file, fp2 is dH.
+
+	size_t bytes = 0;
+	PARAMETER_TABLES(ADD_TABLE, ADD_TABLE, ADD_VALUE)
+
+	ownedTables.reset(new char[bytes]());
+	placeTables(ownedTables.get());
+
+	if (myEnergyOptions->compareSubstrateType(SUBSTRATE_INVALID)) {
+		string parameterFile = myEnergyOptions->getParameterFile();
 
-		if (tmp != NULL) {
-			fp = fopen(tmp, "rt");
+		if (!parameterFile.empty()) {
+			fp = fopen(parameterFile.c_str(), "rt");
 			if (fp == NULL) {
-				fprintf(stderr, "ERROR: Bad Parameter Filename: %s not found in path.\n", tmp);
+				fprintf(stderr, "ERROR: Bad Parameter Filename: %s not found in path.\n", parameterFile.c_str());
 				exit(1);
 			}
-			Py_DECREF(tmpStr);
-			tmp = NULL;
 		} else {
 			fprintf(stderr, "ERROR: Invalid substrate chosen, and no parameter file given. Try the #Energymodel option!\n");
 			exit(1);
@@ -711,15 +1021,9 @@ void NupackEnergyModel::processOptions() {
 	fclose(fp);
 	/* Enthalpy loading section for all those pesky dH terms. */
 
-	if (fp2 == NULL) {
-		if (temperature < CELSIUS37_IN_KELVIN - .0001 || temperature > CELSIUS37_IN_KELVIN + .0001) {
-			fprintf(stderr,
-					"ERROR: Temperature was set to %0.2lf C, but only dG type data files could be found. Please ensure that the requested parameter set has both .dG and .dH files!\n",
-					temperature);
-			exit(0);
-		}
-		return;
-	}
+	if (fp2 == NULL)
+		return false;
+
 
 	fgets(in_buffer, 2048, fp2);
 	while (!feof(fp2)) {
@@ -853,110 +1157,157 @@ void NupackEnergyModel::processOptions() {
 
 	fclose(fp2);
 
-// Temperature change section.
-//  double getDoubleAttr(energy_options, temperature,&temperature);
+	return true;
+}
 
-	_RT = kBoltzmann * current_temp;
-	log_loop_penalty = 100.0 * 1.75 * kBoltzmann * current_temp;
 
-	if (!  ((temperature < CELSIUS37_IN_KELVIN - .00001) || (temperature > CELSIUS37_IN_KELVIN + .00001))   ) {
-		current_temp = CELSIUS37_IN_KELVIN;
-		setupRates();
-		return;
+// Reads the parameter files for the substrate in options and writes them to path
+// as a compiled parameter set. Returns false if path could not be written.
+bool NupackEnergyModel::compileParameterSet(SimOptions* options, string path) {
+
+	std::unique_ptr<NupackEnergyModel> model(new NupackEnergyModel());
+	model->simOptions = options;
+
+	bool enthalpy = model->readParameterFiles(options->getEnergyOptions());
+
+	return model->writeParameterSet(path, options->getEnergyOptions()->getSubstrateType(), enthalpy);
+
+}
+
+bool NupackEnergyModel::writeParameterSet(string path, long substrate, bool enthalpy) {
+
+	FILE *fp = fopen(path.c_str(), "wb");
+
+	if (fp == NULL)
+		return false;
+
+	int32_t header[4] = { parameterVersion, (int32_t) substrate, enthalpy, parameterTableCount };
+	int32_t sizes[parameterTableCount] = { PARAMETER_TABLES(TABLE_SIZE, TABLE_SIZE, VALUE_SIZE) };
+	char padding[8] = { 0 };
+
+	fwrite(parameterMagic, 1, sizeof(parameterMagic), fp);
+	fwrite(header, sizeof(int32_t), 4, fp);
+	fwrite(sizes, sizeof(int32_t), parameterTableCount, fp);
+	fwrite(padding, 1, padTo8(sizeof(header) + sizeof(sizes)) - sizeof(header) - sizeof(sizes), fp);
+
+#define WRITE_TABLE(name, rows) \
+	fwrite(name, 1, TABLE_BYTES(name, rows), fp); \
+	fwrite(padding, 1, padTo8(TABLE_BYTES(name, rows)) - TABLE_BYTES(name, rows), fp);
+#define WRITE_VALUE(name) \
+	fwrite(&name, 1, sizeof(name), fp); \
+	fwrite(padding, 1, padTo8(sizeof(name)) - sizeof(name), fp);
+
+	PARAMETER_TABLES(WRITE_TABLE, WRITE_TABLE, WRITE_VALUE)
+
+#undef WRITE_TABLE
+#undef WRITE_VALUE
+
+	bool written = !ferror(fp);
+
+	return (fclose(fp) == 0) && written;
+
+}
+
+// Memory maps a compiled parameter set and points the tables of this model into it,
+// so worker processes share the file through the page cache instead of each parsing
+// the text files. The mapping lives as long as the model; only the single values are
+// copied out, and the dG tables when processOptions rescales them for the temperature.
+// Returns whether the dH tables are present.
+bool NupackEnergyModel::loadParameterSet(string path) {
+
+	int fd = open(path.c_str(), O_RDONLY);
+	struct stat status;
+
+	if (fd < 0 || fstat(fd, &status) != 0) {
+		fprintf(stderr, "ERROR: compiled parameter set %s could not be opened.\n", path.c_str());
+		exit(1);
 	}
 
-	for (loop = 0; loop < NUM_BASEPAIRS_NUPACK; loop++){
-		for (loop2 = 0; loop2 < NUM_BASEPAIRS_NUPACK; loop2++){
+	size_t length = status.st_size;
+	void *mapped = mmap(NULL, length, PROT_READ, MAP_SHARED, fd, 0);
+	close(fd);
 
-			stack_37_dG[loop][loop2] = T_scale(stack_37_dG[loop][loop2], stack_37_dH[loop][loop2], temperature);
-			// now adjusting for a single salt correction term.
-			stack_37_dG[loop][loop2] += saltCorrection(2)* -temperature / 1000.0;
-		}
+	if (mapped == MAP_FAILED) {
+		fprintf(stderr, "ERROR: compiled parameter set %s could not be mapped.\n", path.c_str());
+		exit(1);
 	}
 
+	char *data = (char *) mapped;
+	const int32_t *header = (const int32_t *) (data + sizeof(parameterMagic));
+	int32_t sizes[parameterTableCount] = { PARAMETER_TABLES(TABLE_SIZE, TABLE_SIZE, VALUE_SIZE) };
 
-	for (loop = 0; loop < 31; loop++)
-		hairpin_37_dG[loop] = T_scale(hairpin_37_dG[loop], hairpin_37_dH[loop], temperature);
+	size_t offset = sizeof(parameterMagic) + padTo8(4 * sizeof(int32_t) + sizeof(sizes));
+	size_t bytes = offset;
 
-	for (loop = 0; loop < NUM_BASEPAIRS_NUPACK; loop++)
-		for (loop2 = 0; loop2 < NUM_BASES; loop2++)
-			for (loop3 = 0; loop3 < NUM_BASES; loop3++)
-				hairpin_mismatch_37_dG[loop][loop2][loop3] = T_scale(hairpin_mismatch_37_dG[loop][loop2][loop3], hairpin_mismatch_37_dH[loop][loop2][loop3],
-						temperature);
+	PARAMETER_TABLES(ADD_TABLE, ADD_TABLE, ADD_VALUE)
 
-	for (loop = 0; loop < 4096; loop++)
-		*(double *) (hairpin_tetraloop_37_dG + loop) = T_scale(*(double *) (hairpin_tetraloop_37_dG + loop), *(int *) (hairpin_tetraloop_37_dH + loop),
-				temperature);
+	bool valid = length == bytes && memcmp(data, parameterMagic, sizeof(parameterMagic)) == 0;
+	valid = valid && header[0] == parameterVersion && header[3] == parameterTableCount;
+	valid = valid && memcmp(header + 4, sizes, sizeof(sizes)) == 0;
+	valid = valid && simOptions->getEnergyOptions()->compareSubstrateType(header[1]);
 
-	for (loop = 0; loop < 1024; loop++)
-		*(double *) (hairpin_triloop_37_dG + loop) = T_scale(*(double *) (hairpin_triloop_37_dG + loop), *(int *) (hairpin_triloop_37_dH + loop), temperature);
+	if (!valid) {
+		fprintf(stderr, "ERROR: %s is not a compiled parameter set for this substrate and version of Multistrand.\n", path.c_str());
+		exit(1);
+	}
 
-	for (loop = 0; loop < 31; loop++)
-		bulge_37_dG[loop] = T_scale(bulge_37_dG[loop], bulge_37_dH[loop], temperature);
+	bool enthalpy = header[2] != 0;
 
-	for (loop = 0; loop < 31; loop++)
-		internal_37_dG[loop] = T_scale(internal_37_dG[loop], internal_37_dH[loop], temperature);
+	if (mappedTables != NULL)
+		munmap(mappedTables, mappedLength);
 
-	for (loop = 0; loop < NUM_BASES; loop++)
-		//  for( loop = 0; loop < NUM_BASEPAIRS_NUPACK; loop++ )
-		for (loop2 = 0; loop2 < NUM_BASES; loop2++)
-			for (loop3 = 0; loop3 < NUM_BASEPAIRS_NUPACK; loop3++)
-				//      for( loop3 = 0; loop3 < NUM_BASES; loop3++ )
-				internal_mismatch_37_dG[loop][loop2][loop3] = T_scale(internal_mismatch_37_dG[loop][loop2][loop3], internal_mismatch_37_dH[loop][loop2][loop3],
-						temperature);
+	mappedTables = mapped;
+	mappedLength = length;
+	placeTables(data + offset);
 
-	maximum_NINIO = T_scale(maximum_NINIO, maximum_NINIO_dH, temperature);
+#define NEXT_TABLE(name, rows) offset += padTo8(TABLE_BYTES(name, rows));
+#define READ_VALUE(name) \
+	memcpy(&name, data + offset, sizeof(name)); \
+	offset += padTo8(sizeof(name));
 
-	for (loop = 0; loop < 5; loop++)
-		ninio_correction_37[loop] = T_scale(ninio_correction_37[loop], ninio_correction_37_dH[loop], temperature);
+	PARAMETER_TABLES(NEXT_TABLE, NEXT_TABLE, READ_VALUE)
 
-	for (loop = 0; loop < NUM_BASEPAIRS_NUPACK; loop++)
-		for (loop2 = 0; loop2 < NUM_BASEPAIRS_NUPACK; loop2++)
-			for (loop3 = 0; loop3 < NUM_BASES; loop3++)
-				for (loop4 = 0; loop4 < NUM_BASES; loop4++)
-					internal_1_1_37_dG[loop][loop2][loop3][loop4] = T_scale(internal_1_1_37_dG[loop][loop2][loop3][loop4],
-							internal_1_1_37_dH[loop][loop2][loop3][loop4], temperature);
+#undef NEXT_TABLE
+#undef READ_VALUE
 
-	for (loop = 0; loop < NUM_BASEPAIRS_NUPACK; loop++)
-		for (loop5 = 0; loop5 < NUM_BASES; loop5++)
-			for (loop2 = 0; loop2 < NUM_BASEPAIRS_NUPACK; loop2++)
-				for (loop3 = 0; loop3 < NUM_BASES; loop3++)
-					for (loop4 = 0; loop4 < NUM_BASES; loop4++)
-						internal_2_1_37_dG[loop][loop5][loop2][loop3][loop4] = T_scale(internal_2_1_37_dG[loop][loop5][loop2][loop3][loop4],
-								internal_2_1_37_dH[loop][loop5][loop2][loop3][loop4], temperature);
+	return enthalpy;
 
-	for (loop = 0; loop < NUM_BASEPAIRS_NUPACK; loop++)
-		for (loop2 = 0; loop2 < NUM_BASEPAIRS_NUPACK; loop2++)
-			for (loop3 = 0; loop3 < NUM_BASES; loop3++)
-				for (loop4 = 0; loop4 < NUM_BASES; loop4++)
-					for (loop5 = 0; loop5 < NUM_BASES; loop5++)
-						for (loop6 = 0; loop6 < NUM_BASES; loop6++)
-							internal_2_2_37_dG[loop][loop2][loop3][loop4][loop5][loop6] = T_scale(internal_2_2_37_dG[loop][loop2][loop3][loop4][loop5][loop6],
-									internal_2_2_37_dH[loop][loop2][loop3][loop4][loop5][loop6], temperature);
+}
 
-	multiloop_base = T_scale(multiloop_base, multiloop_base_dH, temperature);
-	multiloop_closing = T_scale(multiloop_closing, multiloop_closing_dH, temperature);
-	multiloop_internal = T_scale(multiloop_internal, multiloop_internal_dH, temperature);
+void NupackEnergyModel::placeTables(char *block) {
 
-	for (loop = 0; loop < NUM_BASEPAIRS_NUPACK; loop++)
-		for (loop2 = 0; loop2 < NUM_BASES; loop2++)
-			dangle_3_37_dG[loop][loop2] = T_scale(dangle_3_37_dG[loop][loop2], dangle_3_37_dH[loop][loop2], temperature);
+	size_t offset = 0;
 
-	for (loop = 0; loop < NUM_BASEPAIRS_NUPACK; loop++)
-		for (loop2 = 0; loop2 < NUM_BASES; loop2++)
-			dangle_5_37_dG[loop][loop2] = T_scale(dangle_5_37_dG[loop][loop2], dangle_5_37_dH[loop][loop2], temperature);
+#define PLACE_TABLE(name, rows) \
+	name = (decltype(name)) (block + offset); \
+	offset += padTo8(TABLE_BYTES(name, rows));
+#define NEXT_VALUE(name) offset += padTo8(sizeof(name));
 
-	terminal_AU = T_scale(terminal_AU, terminal_AU_dH, temperature);
+	PARAMETER_TABLES(PLACE_TABLE, PLACE_TABLE, NEXT_VALUE)
 
-	bimolecular_penalty = T_scale(bimolecular_penalty, bimolecular_penalty_dH, temperature);
-// need additional conversion as well
+#undef PLACE_TABLE
+#undef NEXT_VALUE
 
-	_RT = kBoltzmann * temperature;
-	current_temp = temperature;
+}
 
-//	cout << "Current Temperature is " << current_temp << "\n";
+// Moves the tables that processOptions rescales out of a read only mapping.
+void NupackEnergyModel::copyScaledTables(void) {
+
+	size_t bytes = 0;
+	PARAMETER_TABLES(ADD_TABLE, SKIP_TABLE, SKIP_VALUE)
+
+	scaledTables.reset(new char[bytes]);
+	size_t offset = 0;
+
+#define COPY_TABLE(name, rows) \
+	memcpy(scaledTables.get() + offset, name, TABLE_BYTES(name, rows)); \
+	name = (decltype(name)) (scaledTables.get() + offset); \
+	offset += padTo8(TABLE_BYTES(name, rows));
+
+	PARAMETER_TABLES(COPY_TABLE, SKIP_TABLE, SKIP_VALUE)
+
+#undef COPY_TABLE
 
-	setupRates();
 }
 
 /* ------------------------------------------------------------------------
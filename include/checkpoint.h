@@ -0,0 +1,95 @@
+/*
+Copyright (c) 2017 California Institute of Technology. All rights reserved.
+Multistrand nucleic acid kinetic simulator
+help@multistrand.org
+*/
+
+/* Checkpoint holds the state of a run at the start of a trajectory or in it, see
+ Options.checkpoint_file. SimSystem.resume() continues the run from it.
+
+ The file is written as:
+
+ 	char[8]	magic "MSCHKP2"
+ 	int64	simulation mode, number of simulations, run seed
+ 	int64	trajectory index, trajectory seed, trajectories remaining, steps done,
+ 		steps done in the trajectory (0 at its start)
+ 	int64	number of trajectories without initial moves, number timed out
+ 	uint64[4]	random generator state
+ 	float64	time of the trajectory, float64 forward rate (first step mode)
+ 	int32	next complex id, int32 complex count
+
+ followed by each complex, in complex list order: int32 id, int32 strand count,
+ per strand an int32 uid, an int32 index (see orderingList::index) and a string
+ name, then the string sequence and string
+ structure, with '+' between strands. Then the results so far:
+
+ 	int32	call count
+
+ and per call int32 type, int64 seed, int32 flag, float64 time, float64 rate,
+ int32 1 if there is a tag, and the strings tag, names, sequence and structure.
+ Strings are an int32 length followed by the characters. All values are in native
+ byte order.
+ */
+
+#ifndef __CHECKPOINT_H__
+#define __CHECKPOINT_H__
+
+#include <cstdio>
+#include <string>
+#include <vector>
+#include <stdint.h>
+
+#include "simoptions.h"
+
+struct checkpoint_complex {
+	int id = 0;
+	std::vector<long> uids;
+	std::vector<int> indices;
+	std::vector<std::string> names;
+	std::string sequence;
+	std::string structure;
+};
+
+class Checkpoint {
+public:
+	// The file is replaced in one step, so an interrupted write leaves the previous checkpoint.
+	bool write(std::string path);
+	bool read(std::string path);
+
+	long simulationMode = 0;
+	long simulationCount = 0;
+	long runSeed = 0;
+	long trajectoryIndex = 0;
+	long currentSeed = 0;
+	long remaining = 0;
+	long steps = 0;
+	long trajectorySteps = 0;
+	long noInitialMoves = 0;
+	long timeOut = 0;
+	uint64_t rng[4] = { 0, 0, 0, 0 };
+
+	double time = 0.0;
+	double forwardRate = 0.0;
+	int idCounter = 0;
+	std::vector<checkpoint_complex> complexes;
+
+	std::vector<python_call> calls;
+
+	std::string error; // set when read or write fails
+
+private:
+	void putInt(int32_t value);
+	void putLong(int64_t value);
+	void putDouble(double value);
+	void putString(const std::string& value);
+
+	int32_t getInt(void);
+	int64_t getLong(void);
+	double getDouble(void);
+	std::string getString(void);
+
+	FILE *file = NULL;
+	bool failed = false;
+};
+
+#endif
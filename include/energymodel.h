@@ -11,6 +11,13 @@ help@multistrand.org
 #include <stdio.h>
 #include <python2.7/Python.h>
 #include <string>
+#include <list>
+#include <memory>
+#include <mutex>
+#include <atomic>
+#include <unordered_map>
+#include <vector>
+#include <stdint.h>
 #include <moveutil.h>
 #include <sequtil.h>
 
@@ -71,7 +78,7 @@ public:
 	MoveType prefactorOpen(int, int, int[]);
 	MoveType prefactorInternal(int, int);
 
-	void writeConstantsToFile(void);
+	void writeConstantsToFile(void); // once per model
 
 //	void printPrecomputedArrRates(void);
 //	void printkBikUni(void);
@@ -110,9 +117,62 @@ public:
 protected:
 	long dangles;
 	double arrheniusRates[MOVETYPE_SIZE * MOVETYPE_SIZE];
+	bool constantsWritten = false;
 
 };
 
+// Loop energies only depend on the bases a loop touches and the sizes of its
+// sides, and the same local contexts come up over and over, for example during
+// branch migration. Each thread keeps a direct mapped table of the energies
+// computed so far, keyed by a 128 bit hash of the model, the loop type and every
+// base the energy function reads; a new entry replaces the one in its slot.
+class LoopEnergyCache {
+
+public:
+	static LoopEnergyCache* get(long modelId, int loopType); // NULL if the cache is disabled
+	static long newModelId(void);
+
+	void append(int length, const char *bases, int first, int last);
+	bool find(double& energy);
+	void insert(double energy);
+
+	static void setCapacity(long capacity);
+	static long getCapacity(void);
+	static long getSize(void);
+	static long getHits(void);
+	static long getMisses(void);
+	static void clear(void);
+
+private:
+	struct entry {
+		uint64_t low;
+		uint64_t high;
+		double energy;
+	};
+
+	~LoopEnergyCache(void);
+
+	std::vector<entry> entries;
+	long size = 0;
+	long generation = -1;
+	long hits = 0;
+	long misses = 0;
+
+	uint64_t low = 0; // hash of the current key
+	uint64_t high = 0;
+
+	static LoopEnergyCache* local(void);
+	void reset(void);
+
+	static std::atomic<long> capacity;
+	static std::atomic<long> generations;
+	static std::atomic<long> modelIds;
+	static std::atomic<long> totalHits; // from threads that have finished
+	static std::atomic<long> totalMisses;
+
+	friend struct std::default_delete<LoopEnergyCache>;
+};
+
 class NupackEnergyModel: public EnergyModel {
 
 public:
@@ -122,6 +182,8 @@ public:
 	~NupackEnergyModel(void);
 	void processOptions();
 
+	static bool compileParameterSet(SimOptions* options, string path);
+
 	double returnRate(double start_energy, double end_energy, int enth_entr_toggle);
 	double returnRate(energyS &start_energy, energyS &end_energy);
 	double getJoinRate(void);
@@ -140,50 +202,69 @@ public:
 
 private:
 
+	const long loopCacheId = LoopEnergyCache::newModelId();
+
+	double computeInteriorEnergy(char *seq1, char *seq2, int size1, int size2);
+	double computeHairpinEnergy(char *seq, int size);
+	double computeMultiloopEnergy(int size, int *sidelen, char **sequences);
+	double computeOpenloopEnergy(int size, int *sidelen, char **sequences);
+
 	// All energy units are integers, in units of .01 kcal/mol, as used by ViennaRNA
 
+	// The array tables point into one block laid out like a compiled parameter set (see
+	// PARAMETER_TABLES for their sizes): the file mapped by loadParameterSet, or ownedTables
+	// when readParameterFiles parses the text files. A mapped block is read only, so the dG
+	// tables are copied to scaledTables before they are rescaled for the temperature.
+	void placeTables(char *block);
+	void copyScaledTables(void);
+
+	std::unique_ptr<char[]> ownedTables;
+	std::unique_ptr<char[]> scaledTables;
+	void *mappedTables = NULL;
+	size_t mappedLength = 0;
+
 	// Stacking Info
-	double stack_37_dG[NUM_BASEPAIRS_NUPACK][NUM_BASEPAIRS_NUPACK]; // Delta G's for stacks, matrix form, at 37 degrees C.
-	int stack_37_dH[NUM_BASEPAIRS_NUPACK][NUM_BASEPAIRS_NUPACK]; // Delta H's for stacks, matrix form, for use comparing to dG at 37 deg C.
+	double (*stack_37_dG)[NUM_BASEPAIRS_NUPACK]; // Delta G's for stacks, matrix form, at 37 degrees C.
+	int (*stack_37_dH)[NUM_BASEPAIRS_NUPACK]; // Delta H's for stacks, matrix form, for use comparing to dG at 37 deg C.
 
 	// Hairpin Info
-	double hairpin_37_dG[31];
-	int hairpin_37_dH[31];
-	double hairpin_mismatch_37_dG[NUM_BASEPAIRS_NUPACK][NUM_BASES][NUM_BASES];
-	int hairpin_mismatch_37_dH[NUM_BASEPAIRS_NUPACK][NUM_BASES][NUM_BASES];
+	double *hairpin_37_dG;
+	int *hairpin_37_dH;
+	double (*hairpin_mismatch_37_dG)[NUM_BASES][NUM_BASES];
+	int (*hairpin_mismatch_37_dH)[NUM_BASES][NUM_BASES];
 
-	double hairpin_triloop_37_dG[1024];
-	int hairpin_triloop_37_dH[1024];
+	double *hairpin_triloop_37_dG;
+	int *hairpin_triloop_37_dH;
 	// This needs about 1024 doubles to store the entire matrix.
 	// lookups on this are then 4 shifts, 5adds, 5 dec 1s, but better than a strstr.
 
-	double hairpin_tetraloop_37_dG[4096];
-	int hairpin_tetraloop_37_dH[4096];
+	double *hairpin_tetraloop_37_dG;
+	int *hairpin_tetraloop_37_dH;
 
 	// Bulge Info
-	double bulge_37_dG[31];
-	int bulge_37_dH[31];
+	double *bulge_37_dG;
+	int *bulge_37_dH;
 
 	// Internal Loop Info
-	double internal_37_dG[31];
-	double internal_mismatch_37_dG[NUM_BASES][NUM_BASES][NUM_BASEPAIRS_NUPACK];
-	int internal_37_dH[31];
-	int internal_mismatch_37_dH[NUM_BASES][NUM_BASES][NUM_BASEPAIRS_NUPACK];
+	double *internal_37_dG;
+	double (*internal_mismatch_37_dG)[NUM_BASES][NUM_BASEPAIRS_NUPACK];
+	int *internal_37_dH;
+	int (*internal_mismatch_37_dH)[NUM_BASES][NUM_BASEPAIRS_NUPACK];
 
 	double maximum_NINIO;
 	int maximum_NINIO_dH;
-	double ninio_correction_37[5];
-	int ninio_correction_37_dH[5];
+	double *ninio_correction_37;
+	int *ninio_correction_37_dH;
 
 	/* special internal loop lookup tables */
-	double internal_1_1_37_dG[NUM_BASEPAIRS_NUPACK][NUM_BASEPAIRS_NUPACK][NUM_BASES][NUM_BASES];
-	int internal_1_1_37_dH[NUM_BASEPAIRS_NUPACK][NUM_BASEPAIRS_NUPACK][NUM_BASES][NUM_BASES];
+	double (*internal_1_1_37_dG)[NUM_BASEPAIRS_NUPACK][NUM_BASES][NUM_BASES];
+	int (*internal_1_1_37_dH)[NUM_BASEPAIRS_NUPACK][NUM_BASES][NUM_BASES];
 
-	double internal_2_1_37_dG[NUM_BASEPAIRS_NUPACK][NUM_BASES][NUM_BASEPAIRS_NUPACK][NUM_BASES][NUM_BASES];
-	int internal_2_1_37_dH[NUM_BASEPAIRS_NUPACK][NUM_BASES][NUM_BASEPAIRS_NUPACK][NUM_BASES][NUM_BASES];
+	double (*internal_2_1_37_dG)[NUM_BASES][NUM_BASEPAIRS_NUPACK][NUM_BASES][NUM_BASES];
+	int (*internal_2_1_37_dH)[NUM_BASES][NUM_BASEPAIRS_NUPACK][NUM_BASES][NUM_BASES];
 
-	double internal_2_2_37_dG[NUM_BASEPAIRS_NUPACK][NUM_BASEPAIRS_NUPACK][NUM_BASES][NUM_BASES][NUM_BASES][NUM_BASES];
-	int internal_2_2_37_dH[NUM_BASEPAIRS_NUPACK][NUM_BASEPAIRS_NUPACK][NUM_BASES][NUM_BASES][NUM_BASES][NUM_BASES];
+	double (*internal_2_2_37_dG)[NUM_BASEPAIRS_NUPACK][NUM_BASES][NUM_BASES][NUM_BASES][NUM_BASES];
+	int (*internal_2_2_37_dH)[NUM_BASEPAIRS_NUPACK][NUM_BASES][NUM_BASES][NUM_BASES][NUM_BASES];
 
 	// Multiloop Info
 	double multiloop_base;
@@ -198,10 +279,10 @@ private:
 	// it actually appears to be the scaling term for internal, hairpin and (the outdated) multiloop mismatches.
 
 	// Dangle Info for multiloops and open loops
-	double dangle_3_37_dG[NUM_BASEPAIRS_NUPACK][NUM_BASES];
-	double dangle_5_37_dG[NUM_BASEPAIRS_NUPACK][NUM_BASES];
-	int dangle_3_37_dH[NUM_BASEPAIRS_NUPACK][NUM_BASES];
-	int dangle_5_37_dH[NUM_BASEPAIRS_NUPACK][NUM_BASES];
+	double (*dangle_3_37_dG)[NUM_BASES];
+	double (*dangle_5_37_dG)[NUM_BASES];
+	int (*dangle_3_37_dH)[NUM_BASES];
+	int (*dangle_5_37_dH)[NUM_BASES];
 
 	// Terminal AU penalty for multiloops and open loops (included in mismatch penalties elsewhere
 	// Appears to be pure dH.
@@ -236,6 +317,10 @@ private:
 	// data loading functions:
 	void setupRates();
 
+	bool readParameterFiles(EnergyOptions* myEnergyOptions);
+	bool writeParameterSet(string path, long substrate, bool enthalpy);
+	bool loadParameterSet(string path);
+
 	void internal_set_stack_energies(FILE *fp, char *buffer);
 	void internal_set_stack_enthalpies(FILE *fp, char *buffer);
 	void internal_set_hairpin_energies(FILE *fp, char *buffer);
@@ -276,4 +361,34 @@ private:
 	double setWaterDensity(double temp);
 };
 
+// Energy models are immutable once built, so every system with the same
+// conditions can share one. The registry keeps the most recently used models,
+// keyed by all options that go into a model; a model that is evicted stays
+// alive for as long as a system still holds it.
+class EnergyModelRegistry {
+
+public:
+	static std::shared_ptr<EnergyModel> get(SimOptions* options, bool writeConstants = true);
+	static string key(SimOptions* options);
+
+	static void setCapacity(int capacity);
+	static int getCapacity(void);
+	static int getSize(void);
+	static long getHits(void);
+	static long getMisses(void);
+	static void clear(void);
+
+private:
+	typedef std::list<std::pair<string, std::shared_ptr<EnergyModel> > > entryList;
+
+	static std::mutex lock;
+	static entryList entries; // most recently used first
+	static std::unordered_map<string, entryList::iterator> index;
+	static int capacity;
+	static long hits;
+	static long misses;
+
+	static void evict(void);
+};
+
 #endif /* __ENERGYMODEL_H__ */
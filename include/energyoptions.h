@@ -34,18 +34,23 @@ public:
 	long getLogml(void);
 	bool getGtenable(void);
 	long getKineticRateMethod(void);
+	long getSubstrateType(void);
+	string getCompiledParameters(void);
+	string getParameterFile(void);
 	double getJoinConcentration(void);
 	bool usingArrhenius(void);
 
 	double getBiScale(void);
 	double getUniScale(void);
 
+	void setTemperature(double);
+
 	string toString(void);
 //	static string primeRateToString(double);
 
 	// virtual
 	virtual bool compareSubstrateType(long) =0;
-	virtual void getParameterFile(char*, PyObject*) = 0;
+	virtual EnergyOptions* copy(void) = 0;
 
 	// unprotected Arrhenius variables
 	double AStack = -0.1;
@@ -97,6 +102,12 @@ protected:
 	// not sure if these are long
 	long substrate_type;
 
+	// path of a parameter set written by compile_parameters, or empty to parse the parameter files
+	string compiledParameters;
+
+	// parameter_file, read instead of the substrate's files when substrate_type is invalid
+	string parameterFile;
+
 	// Hard coding some default Arrhenius constants (for now)
 	bool useArrRates = false;
 
@@ -109,7 +120,7 @@ public:
 
 	// implemented virtual
 	bool compareSubstrateType(long);
-	void getParameterFile(char*, PyObject*);
+	EnergyOptions* copy(void);
 
 protected:
 	PyObject* python_settings;
@@ -123,7 +134,11 @@ public:
 
 	// implemented virtual
 	bool compareSubstrateType(long);
-	void getParameterFile(char*, PyObject*);
+	EnergyOptions* copy(void);
+
+	// sets the energy option named key from the rest of a job file line, false if
+	// there is no such option or the value is invalid.
+	bool readOption(string& key, std::istream& value);
 
 protected:
 	// empty
@@ -10,6 +10,7 @@ help@multistrand.org
 
 #include <string>
 #include <vector>
+#include <unordered_map>
 #include "energymodel.h"
 #include "move.h"
 #include "moveutil.h"
@@ -37,13 +38,43 @@ struct RateArr {
 	}
 };
 
+// Maps the loops of a complex, and the strand sequences they point into, to those
+// of a copy being made by StrandComplex::copy.
+class CopyMap {
+public:
+	void addStrand(char *from, char *to, int size);
+	char *map(char *location);
+	Loop *map(Loop *loop);
+
+	std::unordered_map<Loop*, Loop*> loops;
+
+private:
+	struct strand_copy {
+		char *from;
+		char *to;
+		int size;
+	};
+	vector<strand_copy> strands;
+};
+
 class Loop {
 public:
-	inline double getEnergy(void);
-	inline double getTotalRate(void);
+	double getEnergy(void);
+	double getTotalRate(void) {
+		return totalRate;
+	}
 	char getType(void);
 	Loop(void);
 	virtual ~Loop(void);
+
+	// every loop type is allocated from the active ObjectPool.
+	static void *operator new(size_t size) {
+		return ObjectPool::allocate(size);
+	}
+	static void operator delete(void *object, size_t size) {
+		ObjectPool::release(object, size);
+	}
+
 	virtual void calculateEnergy(void) = 0;
 	virtual void generateMoves(void) = 0;
 	virtual void generateDeleteMoves(void) = 0;
@@ -53,6 +84,12 @@ public:
 	virtual char *verifyLoop(char *incoming_sequence, Loop *from) =0;
 	virtual string typeInternalsToString(void) = 0;
 	virtual void printMove(Loop *comefrom, char *structure_p, char *seq_p) = 0;
+
+	// copy() makes a loop with the same contents, still pointing at the original's
+	// neighbours and sequence; copyLinks then points it at the copies from map.
+	virtual Loop *copy(void) = 0;
+	virtual void copyLinks(CopyMap& map);
+
 	Loop *getAdjacent(int index);
 	int getCurAdjacent(void);
 	int getNumAdjacent(void);
@@ -62,9 +99,14 @@ public:
 	void cleanupAdjacent(void); // sets adjacentLoops up to be deleted.
 	double returnEnergies(Loop *comefrom); // returns the total energy of all loops underneath this one.
 	double returnFlux(Loop *comefrom); // returns the total rate of all loops underneath this one.
+	void indexFlux(Loop *comefrom, vector<Loop*>& loops, vector<double>& cumulative); // lists the loops underneath this one in getChoice order, with running totals of their rates.
+	Move *getLocalChoice(double *randomchoice); // picks one of this loop's own moves.
 	void firstGen(Loop *comefrom);
-	static void SetEnergyModel(EnergyModel *newEnergyModel);
+	static void SetEnergyModel(std::shared_ptr<EnergyModel> newEnergyModel);
+	static void SetActiveEnergyModel(EnergyModel *newEnergyModel);
 	static EnergyModel *GetEnergyModel(void);
+	static void SetMoveContainerType(int newType);
+	static int GetMoveContainerType(void);
 	static RateArr generateDeleteMoveRate(Loop *start, Loop *end);
 	static Loop *performDeleteMove(Move *move);
 	static void performComplexSplit(Move *move, Loop **firstOpen, Loop **secondOpen);
@@ -81,9 +123,15 @@ public:
 
 	// FD: moving private to public
 	int numAdjacent;
+	int fluxSlot = -1; // position in the flux index of the owning StrandComplex, -1 until it is indexed
 
 protected:
-	static EnergyModel *energyModel;
+	// the model and container type in use are per thread, so that systems
+	// can run side by side; defaultEnergyModel is shared by the process.
+	static thread_local EnergyModel *energyModel;
+	static thread_local int moveContainerType;
+	static std::shared_ptr<EnergyModel> defaultEnergyModel;
+	static MoveContainer *newMoveContainer(int initial_size);
 
 	Loop** adjacentLoops;
 	int curAdjacent;
@@ -103,6 +151,8 @@ public:
 	Move *getChoice(double *randnum, Loop *from);
 	double doChoice(Move *move, Loop **returnLoop);
 	void printMove(Loop *comefrom, char *structure_p, char *seq_p);
+	Loop *copy(void);
+	void copyLinks(CopyMap& map);
 	char *getLocation(Move *move, int index);
 	char *verifyLoop(char *incoming_sequence,  Loop *from);
 	friend RateArr Loop::generateDeleteMoveRate(Loop *start, Loop *end);
@@ -124,6 +174,8 @@ public:
 	Move *getChoice(double *randnum, Loop *from);
 	double doChoice(Move *move, Loop **returnLoop);
 	void printMove(Loop *comefrom, char *structure_p, char *seq_p);
+	Loop *copy(void);
+	void copyLinks(CopyMap& map);
 	char *getLocation(Move *move, int index);
 	char *verifyLoop(char *incoming_sequence,  Loop *from);
 
@@ -147,6 +199,8 @@ public:
 	Move *getChoice(double *randnum, Loop *from);
 	double doChoice(Move *move, Loop **returnLoop);
 	void printMove(Loop *comefrom, char *structure_p, char *seq_p);
+	Loop *copy(void);
+	void copyLinks(CopyMap& map);
 	char *getLocation(Move *move, int index);
 	char *verifyLoop(char *incoming_sequence, Loop *from);
 	BulgeLoop(void);
@@ -169,6 +223,8 @@ public:
 	Move *getChoice(double *randnum, Loop *from);
 	double doChoice(Move *move, Loop **returnLoop);
 	void printMove(Loop *comefrom, char *structure_p, char *seq_p);
+	Loop *copy(void);
+	void copyLinks(CopyMap& map);
 	char *getLocation(Move *move, int index);
 	char *verifyLoop(char *incoming_sequence,  Loop *from);
 	InteriorLoop(void);
@@ -192,6 +248,8 @@ public:
 	Move *getChoice(double *randnum, Loop *from);
 	double doChoice(Move *move, Loop **returnLoop);
 	void printMove(Loop *comefrom, char *structure_p, char *seq_p);
+	Loop *copy(void);
+	void copyLinks(CopyMap& map);
 	char *getLocation(Move *move, int index);
 	char *verifyLoop(char *incoming_sequence, Loop *from);
 	MultiLoop(void);
@@ -216,6 +274,8 @@ public:
 	Move *getChoice(double *randomchoice, Loop *from);
 	double doChoice(Move *move, Loop **returnLoop);
 	void printMove(Loop *comefrom, char *structure_p, char *seq_p);
+	Loop *copy(void);
+	void copyLinks(CopyMap& map);
 	char *getLocation(Move *move, int index);
 	char *verifyLoop(char *incoming_sequence,  Loop *from);
 
@@ -25,11 +25,22 @@ const int MOVE_1 = 8;
 const int MOVE_2 = 16;
 const int MOVE_3 = 32;
 
+/* WARNING: If you change the following defines, you must also
+ change the values of Options.moveList and Options.moveTree
+ in the file interface/_options/options.py.
+ */
+const int MOVECONTAINER_LIST = 0;
+const int MOVECONTAINER_TREE = 1;
+
 #include <string>
+#include <vector>
 #include <moveutil.h>
+#include "objectpool.h"
 using std::string;
+using std::vector;
 
 class Loop;
+class CopyMap;
 class EnergyModel;
 
 class RateEnv {
@@ -56,8 +67,9 @@ public:
 	Move(int mtype, RateEnv mrate, Loop *affected_1, Loop *affected_2, int index1, int index2RateEnv);
 	Move(int mtype, RateEnv mrate, Loop *affected_1, Loop *affected_2, int index1RateEnv);
 	~Move(void);
-	double getRate(void);
-	int getType(void);
+
+	double getRate(void) const;
+	int getType(void) const;
 	int getArrType(void);
 	Loop *getAffected(int index);
 	Loop *doChoice(void);
@@ -71,6 +83,7 @@ public:
 	friend class OpenLoop;
 	friend class BulgeLoop;
 	friend class StrandComplex;
+	friend class MoveArray;
 protected:
 	int type;
 
@@ -80,15 +93,57 @@ protected:
 
 };
 
+// The moves of one kind (creation or deletion) held by a container, stored column by
+// column in a single block from the ObjectPool: the rates, which every choice and
+// rate sum scans, are one contiguous array, with the types, arrhenius types and
+// indices in parallel arrays beside them. All moves of a container affect the loop
+// that owns it, so only the second affected loop is kept per move.
+// get() rebuilds a move into a Move held by the array, which stays valid until the
+// next get() or until the array is deleted, like the heap allocated moves before.
+class MoveArray {
+public:
+	MoveArray(void);
+	~MoveArray(void);
+	void add(const Move& move);
+	void copy(MoveArray& other, CopyMap& map); // replaces the moves by those of other, for the copies of its loops
+	void clear(void);
+	void reserve(int size);
+	int size(void) {
+		return count;
+	}
+	double getRate(int index) {
+		return rates[index];
+	}
+	const double *getRates(void) {
+		return rates;
+	}
+	Move *get(int index);
+
+private:
+	static const size_t bytesPerMove = sizeof(double) + sizeof(Loop *) + 5 * sizeof(int) + 1;
+
+	int count;
+	int capacity;
+	char *block;
+	double *rates;
+	Loop **partners; // affected[1] of each move
+	int *arrTypes;
+	int *indices; // four per move
+	unsigned char *types;
+	Loop *owner; // affected[0] of every move
+	Move current;
+};
+
 class MoveContainer {
 public:
 	MoveContainer(void);
 	virtual ~MoveContainer(void);
-	virtual void addMove(Move *newmove) = 0;
+	virtual void addMove(const Move& newmove) = 0;
 	double getRate(void);
 	virtual void resetDeleteMoves(void) = 0;
 	virtual Move *getChoice(double *rnd) = 0;
 	virtual Move *getMove(Move *iterator) = 0;
+	virtual MoveContainer *copy(CopyMap& map) = 0;
 
 	virtual void printAllMoves(bool) = 0;
 
@@ -97,35 +152,49 @@ protected:
 
 };
 
-//// not using this storage method yet... refer to the list...
-//class MoveTree: public Move {
-//public:
-//	~MoveTree(void);
-//
-//private:
-//	Move *left, *right; // also an uplink?
-//	double totalrate;
-//};
+// Stores moves in a binary indexed (Fenwick) sum-tree, so a choice takes O(log n) instead of a linear scan.
+// Creation moves precede deletion moves, as in MoveList, so both containers pick the same move for the same random number.
+class MoveTree: public MoveContainer {
+public:
+	MoveTree(int initial_size);
+	~MoveTree(void);
+	void addMove(const Move& newmove);
+	Move *getChoice(double *rnd);
+	Move *getMove(Move *iterator);
+	MoveContainer *copy(CopyMap& map);
+	void resetDeleteMoves(void);
+
+	void printAllMoves(bool);
+
+private:
+	void buildTree(MoveArray& list, vector<double>& tree);
+	Move *searchTree(MoveArray& list, vector<double>& tree, double *rnd);
+
+	MoveArray moves;
+	MoveArray del_moves;
+	vector<double> moves_tree; // 1-based partial sums, rebuilt lazily after an addMove
+	vector<double> del_moves_tree;
+	double moves_rate;
+	bool dirty;
+	int int_index;
+};
 
 class MoveList: public MoveContainer {
 public:
 	MoveList(int initial_size);
 	~MoveList(void);
-	void addMove(Move *newmove);
+	void addMove(const Move& newmove);
 	Move *getChoice(double *rnd);
 	Move *getMove(Move *iterator);
+	MoveContainer *copy(CopyMap& map);
 	void resetDeleteMoves(void);
 
 	void printAllMoves(bool);
 
 	//  friend class Move;
 private:
-	Move **moves;
-	Move **del_moves;
-	int moves_size;
-	int moves_index;
-	int del_moves_size;
-	int del_moves_index;
+	MoveArray moves;
+	MoveArray del_moves;
 	int int_index;
 };
 
@@ -72,6 +72,7 @@ struct JoinCriteria {
 	// arrhenius rates only
 	HalfContext half[2] = { HalfContext(), HalfContext() };
 	int arrType = 0; // used for returning the chosen movetype.
+	double rate = 0.0; // the rate of the chosen join move.
 
 };
 
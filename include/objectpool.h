@@ -0,0 +1,136 @@
+/*
+Copyright (c) 2017 California Institute of Technology. All rights reserved.
+Multistrand nucleic acid kinetic simulator
+help@multistrand.org
+*/
+
+/* ObjectPool hands out the memory for Loop objects and for the move arrays of
+ the move containers. Every SimulationSystem owns a pool, which is made active for
+ the thread running it by InitializeSystem, like the energy model; an ActivePool
+ guard puts back the pool that was active before once the system returns, so no
+ thread keeps a pointer to the pool of a system that may be deleted. Blocks are cut
+ from large chunks in size classes of 8 bytes and kept on a free list per class
+ when released, so the many small objects created and deleted by every move do
+ not go through malloc.
+
+ Each block starts with a pointer to the pool it came from (NULL for blocks taken
+ from the heap, when no pool is active or the block is too large), so a block is
+ always returned to its own pool. A pool is only used by one thread at a time.
+
+ Loops own arrays on the heap, so the objects of a trajectory are still destroyed
+ one by one; there is no bulk release of the pool. Once every block has been
+ returned, for example after the complexes of a trajectory are deleted, reset()
+ empties the free lists so that the next trajectory is cut from the start of the
+ first chunk again, instead of from free lists in the order the previous
+ trajectory happened to release its objects. */
+
+#ifndef __OBJECTPOOL_H__
+#define __OBJECTPOOL_H__
+
+#include <cstddef>
+#include <new>
+#include <vector>
+
+class ObjectPool {
+public:
+	ObjectPool(void);
+	~ObjectPool(void);
+
+	static inline void *allocate(size_t size);
+	static inline void release(void *object, size_t size);
+
+	static void setActive(ObjectPool *pool);
+	static void clearActive(ObjectPool *pool); // only if pool is the active one
+	static ObjectPool *getActive(void);
+
+	void reset(void);
+	long getLive(void);
+
+private:
+	static const size_t headerSize = 8;
+	static const size_t classSize = 8;
+	static const int classCount = 64; // blocks up to 512 bytes, including the header
+	static const size_t chunkSize = 1 << 16;
+
+	inline void *take(int sizeClass);
+	void *cut(size_t size);
+
+	void *freeLists[classCount];
+	std::vector<char *> chunks;
+	size_t chunk = 0; // index of the chunk blocks are cut from
+	char *next = NULL;
+	char *end = NULL;
+	long live = 0;
+
+	static thread_local ObjectPool *active;
+};
+
+// Makes pool (NULL for the heap) the active one on the calling thread until the
+// guard goes out of scope, then restores the pool that was active before.
+class ActivePool {
+public:
+	ActivePool(ObjectPool *pool) :
+			previous(ObjectPool::getActive()) {
+		ObjectPool::setActive(pool);
+	}
+	~ActivePool(void) {
+		ObjectPool::setActive(previous);
+	}
+
+private:
+	ObjectPool *previous;
+};
+
+inline void *ObjectPool::allocate(size_t size) {
+
+	int sizeClass = (size + headerSize + classSize - 1) / classSize - 1;
+	ObjectPool *owner = (sizeClass < classCount) ? active : NULL;
+	char *block;
+
+	if (owner == NULL)
+		block = (char *) ::operator new(size + headerSize);
+	else
+		block = (char *) owner->take(sizeClass);
+
+	*(ObjectPool **) block = owner;
+
+	return block + headerSize;
+
+}
+
+inline void ObjectPool::release(void *object, size_t size) {
+
+	if (object == NULL)
+		return;
+
+	char *block = (char *) object - headerSize;
+	ObjectPool *owner = *(ObjectPool **) block;
+
+	if (owner == NULL) {
+		::operator delete(block);
+		return;
+	}
+
+	int sizeClass = (size + headerSize + classSize - 1) / classSize - 1;
+
+	owner->live--;
+	*(void **) block = owner->freeLists[sizeClass];
+	owner->freeLists[sizeClass] = block;
+
+}
+
+inline void *ObjectPool::take(int sizeClass) {
+
+	live++;
+
+	void *block = freeLists[sizeClass];
+
+	if (block == NULL)
+		return cut((sizeClass + 1) * classSize);
+
+	freeLists[sizeClass] = *(void **) block;
+	return block;
+
+}
+
+#endif
@@ -45,10 +45,12 @@ class identList {
 
   // Functions
   void  make_unique( strandList *strands);
+  identList *copy( void );
   std::string toString(void);
 
   // public variables.
   long uid;
+  int index = 0; // set by the SimulationSystem, see orderingList::index
   char *id;
   PyObject *pyo_id;  // needed for correct ref counting dealloc.
   class identList *next;
@@ -142,6 +142,22 @@ help@multistrand.org
 #define pushTransitionInfo( options_obj, obj ) \
   _m_pushList( options_obj, obj, add_transition_info )
 
+// This macro DECREFs the passed obj once it's done with it.
+#define pushCTMC( options_obj, obj ) \
+  _m_pushList( options_obj, obj, add_ctmc )
+
+// This macro DECREFs the passed obj once it's done with it.
+#define pushTrajectoryColumns( options_obj, obj ) \
+  _m_pushList( options_obj, obj, add_trajectory_columns )
+
+// This macro DECREFs the passed obj once it's done with it.
+#define pushForwardFlux( options_obj, obj ) \
+  _m_pushList( options_obj, obj, add_forward_flux )
+
+// This macro DECREFs the passed obj once it's done with it.
+#define pushWeightedEnsemble( options_obj, obj ) \
+  _m_pushList( options_obj, obj, add_weighted_ensemble )
+
 #endif  // DEBUG_MACROS is FALSE (not set).
 
 /***************************************************
@@ -285,6 +301,22 @@ help@multistrand.org
 #define pushTransitionInfo( options_obj, obj ) \
   _m_d_pushList( options_obj, obj, add_transition_info )
 
+// This macro DECREFs the passed obj once it's done with it.
+#define pushCTMC( options_obj, obj ) \
+  _m_d_pushList( options_obj, obj, add_ctmc )
+
+// This macro DECREFs the passed obj once it's done with it.
+#define pushTrajectoryColumns( options_obj, obj ) \
+  _m_d_pushList( options_obj, obj, add_trajectory_columns )
+
+// This macro DECREFs the passed obj once it's done with it.
+#define pushForwardFlux( options_obj, obj ) \
+  _m_d_pushList( options_obj, obj, add_forward_flux )
+
+// This macro DECREFs the passed obj once it's done with it.
+#define pushWeightedEnsemble( options_obj, obj ) \
+  _m_d_pushList( options_obj, obj, add_weighted_ensemble )
+
 #endif
 
 /*****************************************************
@@ -306,6 +338,7 @@ static inline bool _m_testLongAttr(PyObject *obj, const char *attrname, const ch
 		return (local_val < value);
 	if (test[0] == '>')
 		return (local_val > value);
+	return false;
 }
 
 #ifdef DEBUG_MACROS
@@ -341,6 +374,7 @@ static inline bool _m_d_testLongAttr( PyObject *obj, const char *attrname, const
 		if( test[0] == '>' )
 		return (local_val > value );
 	}
+	return false;
 }
 #endif
 
@@ -483,6 +517,8 @@ const int SIMULATION_MODE_FLAG_FIRST_BIMOLECULAR = 0x0020;
 const int SIMULATION_MODE_FLAG_PYTHON = 0x0040;
 const int SIMULATION_MODE_FLAG_TRAJECTORY = 0x0080;
 const int SIMULATION_MODE_FLAG_TRANSITION = 0x0100;
+const int SIMULATION_MODE_FLAG_FORWARD_FLUX = 0x0200; // set together with FIRST_BIMOLECULAR
+const int SIMULATION_MODE_FLAG_WEIGHTED_ENSEMBLE = 0x0400;
 
 // stopconditions used in ssystem.
 // TODO: clean up/add docs.
@@ -26,10 +26,14 @@ public:
 	~StrandComplex(void);
 	void cleanup(void);
 
+	// a deep copy, with its own strands, loops and moves.
+	StrandComplex *copy(void);
+
 	// information retreival functions
 	double getTotalFlux(void); // returns total flux for all moves within the complex
 	int getStrandCount(void); // # of strands in the complex.
 	double getEnergy(void); // returns the energy of the complex
+	void getLoopEnergies(vector<double>& energies, vector<char>& types); // appends the energy and type of each loop
 	void generateMoves(void); // display function to output the dot-paren structure of all moves contained in this complex. Should be preceded by printing the sequence, possibly I should change it to just do that straight out. Used for testing purposes (comparing all moves adjacent and rates).
 	char *getSequence(void); // returns char representation of sequence
 	char *getStructure(void); // returns dot-paren notation structure for seq.
@@ -58,6 +62,21 @@ public:
 private:
 	Loop *beginLoop;
 
+	// Per-complex aggregate for the MoveTree container: a Fenwick tree over the rates of the loops,
+	// one slot per loop (Loop::fluxSlot). doChoice updates only the slots of loops a move removed,
+	// created or regenerated; a complex split or join, or running out of free slots, rebuilds it.
+	void buildFluxIndex(void);
+	void updateFluxIndex(Loop *newLoop, int removed[2]);
+	void setSlotRate(int slot, double rate);
+	int addToFluxIndex(Loop *loop);
+
+	vector<Loop*> slotLoops; // NULL for free slots
+	vector<double> slotRates;
+	vector<double> fluxTree; // 1-based partial sums over slotRates
+	vector<int> freeSlots; // lowest slot last
+	long indexUpdates = 0; // since the last rebuild, which also clears accumulated rounding
+	bool indexValid = false;
+
 //	double totalFlux = 0.0; // Total flux contained within this complex.
 
 };
@@ -12,12 +12,39 @@ help@multistrand.org
 #include <stdio.h>
 
 #include <iostream>
+#include <vector>
+#include <string>
+#include <unordered_map>
 
 using std::cout;
+using std::vector;
+using std::string;
 
 class SComplexListEntry;
 class JoinCriterea;
 
+// The stop conditions of a run, flattened so that a complex list can check them
+// incrementally. Built once per SimulationSystem and shared by every trajectory.
+class StopIndex {
+public:
+	StopIndex(stopComplexes *stopList);
+
+	int getConditionCount(void);
+
+	// conditions[c] owns the stop complexes items[conditionStart[c]] up to items[conditionStart[c + 1]]
+	vector<stopComplexes*> conditions;
+	vector<int> conditionStart;
+	vector<bool> conditionBound; // STOPTYPE_BOUND conditions are checked on the unpaired counts of every strand
+
+	vector<complexItem*> items;
+	vector<int> itemStrandCount;
+
+	// stop complexes keyed by the strand ID signature of the complex they describe
+	std::unordered_map<string, vector<int> > itemsBySignature;
+
+	static string signature(vector<const char*>& ids);
+};
+
 class SComplexList {
 public:
 
@@ -25,6 +52,9 @@ public:
 	~SComplexList(void);
 
 	SComplexListEntry *addComplex(StrandComplex *newComplex);
+	int getIdCounter(void);
+	void setIdCounter(int counter);
+	SComplexList *copy(void);
 	void initializeList(void);
 	void regenerateMoves(void);
 	double getTotalFlux(void);
@@ -45,12 +75,27 @@ public:
 	JoinCriteria cycleForJoinChoiceArr(double choice);
 	JoinCriteria findJoinNucleotides(BaseType, int, BaseCount&, SComplexListEntry*, HalfContext* = NULL);
 	int doJoinChoice(double choice);
+	double getLastMoveRate(void);
 	void doJoinChoiceArr(double choice);
 	bool checkStopComplexList(class complexItem *stoplist);
+	void setStopIndex(StopIndex *index);
+	void updateStopState(void);
+	bool checkStopCondition(int index);
 	string toString(void);
+	utility::state_fingerprint getFingerprint(void);
 	void updateOpenInfo(void);
 
 private:
+	void updateEntry(SComplexListEntry *entry);
+	void addToTotals(SComplexListEntry *entry);
+	void removeFromTotals(SComplexListEntry *entry);
+	void resyncTotals(void);
+
+	void addStopMatches(SComplexListEntry *entry);
+	void removeStopMatches(SComplexListEntry *entry);
+	bool addStopCounter(SComplexListEntry *entry, int item);
+	void patchStopCounters(SComplexListEntry *entry);
+
 	bool checkStopComplexList_Bound(class complexItem *stoplist);
 	bool checkStopComplexList_Structure_Disassoc(class complexItem *stoplist);
 	bool checkLooseStructure(char *our_struc, char *stop_struc, int count);
@@ -58,15 +103,46 @@ private:
 
 	int numOfComplexes = 0;
 	int idcounter = 0;
+	bool initialized = false; // loops and moves are generated, also for a copy of an initialized list
 
 	SComplexListEntry* first = NULL;
 	EnergyModel* eModel = NULL;
 
 	double joinRate = 0.0;
+	double lastMoveRate = 0.0; // rate of the move last done by doBasicChoice or doJoinChoice
+
+	// Running totals over all entries. A move only patches the entries it touched,
+	// so computing the total flux does not visit every complex.
+	double totalRate = 0.0;
+	BaseCount exposedBases;
+	int selfJoinCount = 0; // sum of multiCount of each entry's exterior bases with themselves
+	OpenInfo openInfo;
+	double selfJoinRateArr = 0.0; // as selfJoinCount, for the Arrhenius cross rates
+	int totalsUpdates = 0;
+
+	// the floating point totals are recomputed from scratch after this many updates, to bound rounding drift.
+	const static int resyncInterval = 4096;
+
+	// Stop complexes are matched against a complex only after it changed.
+	// itemMatchCount[i] is the number of complexes that currently match stop complex i.
+	StopIndex* stopIndex = NULL;
+	vector<int> itemMatchCount;
 
 }
 ;
 
+// The distance of a complex from a loose or count stop complex: the number of bases
+// whose partner differs from the stop structure. A '*' of a loose stop structure
+// matches any partner. Patched from the base pairs that changed, as long as the
+// strands of the complex stay the same.
+struct StopCounter {
+	int item;
+	int mismatches;
+	std::unordered_map<uint64_t, int> position; // index into the stop structure, by fingerprint key of the base
+	vector<int> partner; // partner in the stop structure of each index, or one of the values below
+	static const int unpaired = -1, any = -2, never = -3;
+};
+
 class SComplexListEntry {
 public:
 	SComplexListEntry(StrandComplex *newComplex, int newid);
@@ -83,6 +159,16 @@ public:
 	double energy;
 	double rate;
 
+	// what this entry contributed to the running totals of the list
+	bool inTotals;
+	BaseCount exteriorBases;
+	OpenInfo openInfo;
+
+	// set when the complex changed since the stop complexes were last matched against it
+	bool stopDirty;
+	vector<bool> stopMatches;
+	vector<StopCounter> stopCounters;
+
 	SComplexListEntry *next;
 };
 
@@ -30,6 +30,26 @@ using namespace utility;
 
 class EnergyOptions;
 
+// A call to the python side, kept while the simulation runs without the GIL.
+struct python_call {
+
+	enum call_type {
+		SEED, STATUS, STATUS_FIRST, END_STATE, TRAJECTORY_COUNT
+	};
+
+	call_type type;
+	long seed = 0;
+	int flag = 0; // stop result flag, or complex id for end states
+	double time = 0.0; // or the complex energy for end states
+	double rate = 0.0;
+	bool hasTag = false;
+	string tag, names, sequence, structure;
+
+	python_call(call_type type, long seed) :
+			type(type), seed(seed) {
+	}
+};
+
 class SimOptions {
 public:
 
@@ -40,14 +60,28 @@ public:
 	// Non-virtual
 	bool useFixedRandomSeed();
 	long getInitialSeed();
+	long getTrajectoryOffset();
+	long getNumThreads();
 	EnergyOptions* getEnergyOptions();
 	long getSimulationMode();
 	long getSimulationCount();
+	long getFluxTrials();
+	long getEnsembleWalkers();
+	double getEnsembleInterval();
 	long getOInterval(void);
 	double getOTime(void);
 	long getStopOptions(void);
 	long getStopCount(void);
 	double getMaxSimTime(void);
+	long getMoveContainer(void);
+	bool getExportCTMC(void);
+	bool getOColumnar(void);
+	long getOColumnarBlock(void);
+	string getOFile(void);
+	bool getODelta(void);
+	long getOKeyframeInterval(void);
+	string getCheckpointFile(void);
+	long getCheckpointInterval(void);
 
 	bool usingArrhenius(void);
 
@@ -55,6 +89,7 @@ public:
 
 	virtual PyObject* getPythonSettings(void) = 0;
 	virtual void generateComplexes(PyObject*, long) = 0;
+	virtual void setCurrentSeed(long) = 0; // for a trajectory that reuses the start state
 	virtual stopComplexes* getStopComplexes(int) = 0;
 
 	// Exit signalling
@@ -63,6 +98,22 @@ public:
 	virtual void stopResultNormal(long, double, char*) = 0;
 	virtual void stopResultTime(long, double) = 0;
 	virtual void stopResultBimolecular(string, long, double, double, char*) = 0;
+	virtual void sendEndState(long, int, char*, char*, char*, double) = 0;
+	virtual void incrementTrajectoryCount(void) = 0;
+
+	// While python calls are queued the simulation needs no GIL; flushPythonCalls
+	// then makes the queued calls in order. Only possible with a static start state.
+	virtual bool staticStartState(void) = 0;
+	virtual bool queuePythonCalls(void) = 0;
+	virtual void flushPythonCalls(void) = 0;
+
+	// Worker threads and cached energy models each keep their own copy. The
+	// python calls queued by a worker are merged back in trajectory order.
+	virtual SimOptions* copy(void) = 0;
+	virtual void mergePythonCalls(SimOptions*) = 0;
+
+	// The calls queued so far, which a checkpoint stores as the results of the run.
+	vector<python_call>& getQueuedCalls(void);
 
 // IO Methods
 	string toString(void);
@@ -72,20 +123,38 @@ public:
 	EnergyOptions* energyOptions = NULL;
 
 	const static bool countStates = false;
+	const static bool countStateNames = false; // also keep the full representation of each state counted
 
 protected:
 
 	long simulation_mode = 0;
 	long simulation_count = 0;
+	long flux_trials = 0;
+	long ensemble_walkers = 0;
+	double ensemble_interval = 0.0;
 	long o_interval = 0;
 	double o_time = 0;
+	bool o_columnar = false;
+	long o_columnar_block = 0;
+	string o_file = ""; // empty unless the trajectory is written to disk
+	bool o_delta = false;
+	long o_keyframe_interval = 0;
+	string checkpoint_file = ""; // empty unless checkpoints are written
+	long checkpoint_interval = 0;
 	long stop_options = 0;
 	long stop_count = 0;
 	double max_sim_time = 0;
+	long move_container = 0;
+	bool export_ctmc = false;
 	long seed = 0;
+	long trajectory_offset = 0;
+	long num_threads = 1;
 	bool fixedRandomSeed = false;
 	stopComplexes* myStopComplexes = NULL;
 
+	bool queueCalls = false;
+	vector<python_call> queuedCalls;
+
 };
 
 class PSimOptions: public SimOptions {
@@ -96,6 +165,7 @@ public:
 
 	PyObject* getPythonSettings(void);
 	void generateComplexes(PyObject *alternate_start, long current_seed);
+	void setCurrentSeed(long current_seed);
 	stopComplexes* getStopComplexes(int);
 
 	// Error signaling
@@ -104,20 +174,42 @@ public:
 	void stopResultNormal(long, double, char*);
 	void stopResultTime(long, double);
 	void stopResultBimolecular(string, long, double, double, char*);
+	void sendEndState(long, int, char*, char*, char*, double);
+	void incrementTrajectoryCount(void);
+
+	bool staticStartState(void);
+	bool queuePythonCalls(void);
+	void flushPythonCalls(void);
+
+	SimOptions* copy(void);
+	void mergePythonCalls(SimOptions*);
 
 protected:
 	bool debug;
 	PyObject *python_settings;
 
+private:
+	vector<complex_input>* readComplexes(PyObject *alternate_start);
+	void queueStatus(python_call::call_type, long, int, double, double, char*);
+
+	vector<complex_input>* startComplexes = NULL; // the static start state, read once
+
 };
 
+// Options read from a job file, for runs without python. Results are written to
+// a CSV or binary file instead, see system/runner.cc for both formats.
 class CSimOptions: public SimOptions {
 public:
 	//constructors
 	CSimOptions();
 
+	bool readJobFile(string path);
+	bool openOutput(void);
+	void closeOutput(void);
+
 	PyObject* getPythonSettings(void);
 	void generateComplexes(PyObject *alternate_start, long current_seed);
+	void setCurrentSeed(long current_seed);
 	stopComplexes* getStopComplexes(int);
 
 	// Error signaling
@@ -126,11 +218,36 @@ public:
 	void stopResultNormal(long, double, char*);
 	void stopResultTime(long, double);
 	void stopResultBimolecular(string, long, double, double, char*);
+	void sendEndState(long, int, char*, char*, char*, double);
+	void incrementTrajectoryCount(void);
+
+	bool staticStartState(void);
+	bool queuePythonCalls(void);
+	void flushPythonCalls(void);
+
+	SimOptions* copy(void);
+	void mergePythonCalls(SimOptions*);
 
 protected:
 	bool debug;
 	PyObject *python_settings = NULL;
 
+private:
+	identList* readStrandNames(string names, string& sequence);
+	void queueStatus(python_call::call_type, long, int, double, double, char*);
+	void writeCall(python_call&);
+
+	vector<string> strandNames;
+	vector<string> strandSequences;
+	vector<complex_input> startComplexes;
+	vector<string> stopTags;
+
+	string resultsPath = "";
+	bool resultsBinary = false;
+	string endStatesPath = "";
+	FILE *resultsFile = NULL;
+	FILE *endStatesFile = NULL;
+
 };
 
 #endif
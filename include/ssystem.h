@@ -16,10 +16,72 @@ help@multistrand.org
 
 #include "energymodel.h"
 #include "scomplexlist.h"
+#include "trajectoryfile.h"
+#include "objectpool.h"
+
+class Checkpoint;
 
 typedef std::vector<bool> boolvector;
 typedef std::vector<bool>::iterator boolvector_iterator;
 
+// A state of the explored state space, stored on its first visit.
+struct CTMCState {
+	std::vector<std::string> names, sequences, structures;
+	std::vector<double> energies;
+	double exitRate; // total rate out of the state, over all moves.
+};
+
+// Statistics of the trials towards one interface of a forward flux run.
+struct FluxStage {
+	long trials = 0;
+	long successes = 0;
+	long failures = 0;
+	long timeOuts = 0;
+	long steps = 0;
+};
+
+// A state reached at an interface, kept as a starting point for the next one.
+struct FluxState {
+	SComplexList *state;
+	int interface; // the furthest interface the state is at
+	double weight; // chance of being picked as a starting point, relative to the others
+};
+
+// A walker of a weighted ensemble run: a copy of the simulation that carries a
+// share of the probability of the ensemble.
+struct Walker {
+	SComplexList *state;
+	double weight;
+	int bin; // progress bin the state is in
+};
+
+// Trajectory output kept in C++ and handed to python as columns, see Options.output_columnar.
+// Per exported state there is a time, an arrType and a complex count, and per complex
+// of that state an id, an energy, the strand names and a structure.
+struct TrajectoryColumns {
+	std::vector<double> times;
+	std::vector<int> arrTypes;
+	std::vector<int> complexCounts;
+
+	std::vector<int> ids;
+	std::vector<double> energies;
+	std::vector<std::string> names;
+	std::vector<std::string> structures;
+
+	void clear(void);
+};
+
+// Energies of a batch of states, see SimulationSystem::calculateEnergies. Per state
+// an energy and, when loops are asked for, the energy and type ('S', 'H', 'B', 'I',
+// 'M' or 'O') of each of its loops: those of state i are at loopOffsets[i] up to
+// loopOffsets[i + 1].
+struct EnergyBatch {
+	std::vector<double> energies;
+	std::vector<double> loopEnergies;
+	std::vector<char> loopTypes;
+	std::vector<long> loopOffsets;
+};
+
 class SimulationSystem {
 public:
 	SimulationSystem(SimOptions* options);
@@ -32,24 +94,52 @@ public:
 	~SimulationSystem(void);
 
 	void StartSimulation(void);
+	int ResumeSimulation(std::string path, std::string& error);
 	void InitialInfo(void);	// printing function
 	void printTransition(double); // printing function
 
 	PyObject *calculateEnergy(PyObject *start_state, int typeflag);
+	static void calculateEnergies(EnergyModel *model, std::vector<std::string>& sequences, std::vector<std::string>& structures, int typeflag, bool loops,
+			EnergyBatch& batch);
 	int isEnergymodelNull(void);
 
 private:
+	SimulationSystem(SimulationSystem& parent, long firstTrajectory, long count);
+
+	void StartSimulation_Mode(void);
+	void StartSimulation_Threads(void);
+	bool runsWithoutPython(void);
+	long threadCount(void);
+
 	void StartSimulation_Standard(void);
 	void StartSimulation_FirstStep(void);
 	void StartSimulation_Trajectory(void);
 	void StartSimulation_Transition(void);
+	void StartSimulation_ForwardFlux(void);
+	void StartSimulation_WeightedEnsemble(void);
 
 	void SimulationLoop_Standard(void);
 	void SimulationLoop_FirstStep(void);
 	void SimulationLoop_Trajectory(void);
 	void SimulationLoop_Transition(void);
+	int SimulationLoop_Flux(int from, FluxStage& stage);
+	int fluxCrossing(int from);
+	FluxState saveFluxState(int interface, double weight);
+	void sendForwardFluxToPython(void);
+	bool SimulationLoop_Walker(Walker& walker, double start, double end);
+	int ensembleBin(void);
+	void resampleWalkers(std::vector<Walker>& walkers);
+	void sendWeightedEnsembleToPython(void);
 
 	int InitializeSystem(PyObject *alternate_start = NULL);
+	SComplexList *newComplexList(PyObject *alternate_start);
+
+	bool checkpointsSupported(void);
+	void startCheckpoints(void);
+	void saveCheckpoint(double stime, double frate);
+	void rebuildComplexList(void);
+	void storeComplexList(Checkpoint *point);
+	SComplexList *restoreComplexList(Checkpoint *point);
 
 	void InitializeRNG(void);
 	void generateNextRandom(void);
@@ -59,9 +149,17 @@ private:
 	// helper function for sending current state to Python side
 	void dumpCurrentStateToPython(void);
 	void sendTrajectory_CurrentStateToPython(double current_time, int arrType = -77);
+	void bufferTrajectoryState(double current_time, int arrType);
+	void sendTrajectoryColumnsToPython(void);
 	void sendTransitionStateVectorToPython(boolvector transition_states, double current_time);
 
+	void compileStopConditions(void);
+	stopComplexes* checkStopConditions(void);
+
 	void countState(SComplexList*);
+	int recordCTMCState(double exitRate);
+	void recordCTMCTransition(int source, int target, double rate);
+	void sendCTMCToPython(void);
 	void exportTime(double simTime, double* lastExportTime);
 	void exportInterval(double simTime, int period, int arrType = -88);
 	void exportTrajState(double simTime, double* lastExportTime, int period);
@@ -69,23 +167,83 @@ private:
 	void printAllMoves(void);
 
 	EnergyModel* energyModel;
+	std::shared_ptr<EnergyModel> energyModelHandle; // keeps the model alive after it leaves the registry
 
 	StrandComplex *startState;
 	SComplexList *complexList;
 
+	// with a static start state, the initialized complex list every trajectory is copied from
+	bool staticStart = false;
+	SComplexList *startTemplate = NULL;
+
+	// memory for the loops and moves of this system's complexes
+	ObjectPool objectPool;
+
 	PyObject *system_options;
 	SimOptions *simOptions;
 
+	// stop conditions, built once from the options and shared by every trajectory
+	stopComplexes* stopConditions = NULL;
+	StopIndex* stopIndex = NULL;
+
+	// every trajectory draws from its own stream, keyed on the run seed and its index.
+	utility::random_generator rng;
+	long run_seed = 0;
+	long trajectory_index = 0;
 	long current_seed = NULL;
 	long simulation_mode;
 	long simulation_count_remaining;
 
+	// first step runs without initial moves, and trajectories that hit the time limit
+	int noInitialMoves = 0;
+	int timeOut = 0;
+
+	// The complex list is rebuilt from its structures every rebuildInterval steps of
+	// a trajectory, as a resumed run builds it. Checkpoints are only written there or
+	// at the start of a trajectory, once checkpointInterval steps, counted over all
+	// trajectories, have passed since the last one; so writing one does not change the run.
+	static const long rebuildInterval = 4096;
+	long checkpointInterval = 0;
+	long nextCheckpoint = 0;
+	long steps = 0;
+	long trajectorySteps = 0;
+	Checkpoint *resumePoint = NULL; // set while the run resumes from a checkpoint
+
 	//bool triggers for output
 	bool exportStatesTime = false;
 	bool exportStatesInterval = false;
-
-	// some results objects
-	std::unordered_map<std::string, int> countMap;
+	bool exportColumnar = false;
+
+	TrajectoryColumns trajectoryColumns;
+
+	// set when the trajectory is written to simOptions->getOFile() instead of python
+	TrajectoryFile* trajectoryFile = NULL;
+
+	// some results objects, states are keyed by their fingerprint
+	std::unordered_map<utility::state_fingerprint, int, utility::state_fingerprint_hash> countMap;
+	std::unordered_map<utility::state_fingerprint, std::string, utility::state_fingerprint_hash> stateNames;
+
+	// explored state space and observed transitions, for simOptions->getExportCTMC()
+	bool exportCTMC = false;
+	std::unordered_map<utility::state_fingerprint, int, utility::state_fingerprint_hash> ctmcIndex;
+	std::vector<CTMCState> ctmcStates;
+	std::unordered_map<uint64_t, double> ctmcTransitions; // keyed by (source << 32 | target)
+	long ctmcConflicts = 0; // revisits that found a different exit rate or transition rate
+
+	// forward flux mode: the stop conditions that are interfaces, in order, and
+	// those that end a trial as failed.
+	std::vector<int> fluxInterfaces;
+	std::vector<int> fluxFailures;
+	std::vector<FluxStage> fluxStages;
+	double fluxCollisionRate = 0.0; // summed over the first step trials that reached the first interface
+
+	// weighted ensemble mode: the first passage times and weights of the walkers
+	// that reached the target, and the weight left when the runs were over.
+	std::vector<double> ensembleTimes;
+	std::vector<double> ensembleWeights;
+	double ensembleRemaining = 0.0;
+	long ensembleRuns = 0;
+	long ensembleSteps = 0;
 
 };
 
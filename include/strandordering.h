@@ -10,7 +10,9 @@ help@multistrand.org
 #include "loop.h"
 #include "scomplex.h"
 #include "optionlists.h"
+#include "utility.h"
 #include <string>
+#include <vector>
 
 // needed for the openloop components of a strand ordering
 
@@ -25,6 +27,8 @@ public:
 	OpenLoop *thisLoop; // corresponds to the OpenLoop to the 'left' of this strand
 	int size;
 	int uid;
+	int index = 0; // position in the start state of the system, unique unlike uid
+	int unpaired = 0; // bases of this strand that are not in a base pair
 };
 
 class StrandOrdering {
@@ -36,6 +40,11 @@ public:
 	~StrandOrdering(void);
 	void cleanup(void);
 	static StrandOrdering * joinOrdering(StrandOrdering *first, StrandOrdering *second);
+
+	// copy() duplicates the strands, registering them with map; copyLoops then
+	// points the copy at the copies of the open loops, once those exist.
+	StrandOrdering *copy(CopyMap& map);
+	void copyLoops(StrandOrdering *original, CopyMap& map);
 	StrandOrdering *breakOrdering(Loop *firstOldBreak, Loop *secondOldBreak, Loop *firstNewBreak, Loop *secondNewBreak); // maybe id or openloop pointer
 	void reorder(OpenLoop *index); // reorder so that open loop passed is the available openloop
 	void addBasepair(char *first_bp, char *second_bp);
@@ -77,6 +86,22 @@ public:
 	OpenInfo& getOpenInfo();
 	string toString(void);
 
+	// returns the fingerprint of the base pairs in this complex.
+	utility::state_fingerprint& getFingerprint(void);
+
+	// a base pair added or broken, by the fingerprint keys of its bases.
+	struct PairChange {
+		uint64_t first, second;
+		bool added;
+	};
+
+	// logs the base pairs changed from now on, for stop conditions that are patched instead of checked again.
+	// Joins and breaks change the strands of the ordering and end the log, as does a log grown too long.
+	void startPairLog(void);
+	void stopPairLog(void);
+	bool pairLogValid(void);
+	std::vector<PairChange>& getPairLog(void);
+
 	// replaces the first open loop in the ordering with the second.
 	void replaceOpenLoop(Loop *oldLoop, Loop *newLoop);
 
@@ -89,6 +114,11 @@ public:
 	OpenInfo openInfo;
 
 private:
+	void findBasepair(char *first_bp, char *second_bp, char **id, int *pos, uint64_t *key, orderingList **strand);
+	void computeFingerprint(void);
+	void logPair(uint64_t first, uint64_t second, bool added);
+
+	// flat sequence and structure, built on first request and then kept up to date by basepair changes, joins and breaks.
 	char* seq = NULL;
 	char* struc = NULL;
 	char* strandnames = NULL;
@@ -96,6 +126,15 @@ private:
 	int count = 0;
 	BaseCount exteriorBases;
 
+	// computed on first request, then toggled by basepair changes and combined on joins and breaks.
+	utility::state_fingerprint fingerprint;
+	bool fingerprintValid = false;
+
+	// a longer log is dropped, checking the stop conditions again costs about as much as applying it.
+	const static unsigned int pairLogLimit = 64;
+	std::vector<PairChange> pairLog;
+	bool pairLogging = false;
+
 };
 
 #endif
@@ -0,0 +1,98 @@
+/*
+Copyright (c) 2017 California Institute of Technology. All rights reserved.
+Multistrand nucleic acid kinetic simulator
+help@multistrand.org
+*/
+
+/* TrajectoryFile writes trajectory states straight to disk, see Options.output_file.
+
+ The file starts with a header:
+
+ 	char[8]	magic "MSTRAJ1"
+ 	int32	header size in bytes (records start at this offset)
+ 	int32	record size in bytes
+ 	int32	strand count
+ 	int32	base count N
+
+ followed by one entry per strand: int32 uid, int32 length, int32 name length,
+ the name and the sequence. Strands are laid out one after the other, giving each
+ base a fixed global index. The header is padded to a multiple of 8 bytes.
+
+ Every exported state is then written as one fixed size record, with S the strand count:
+
+ 	int64	seed
+ 	float64	time
+ 	int32	arrType
+ 	int32	complex count C
+ 	float64[S]	complex energies, the first C are used
+ 	int32[S]	complex ids, the first C are used
+ 	int32[S]	strands in complex list order, as indices into the strand table
+ 	int32[S]	for each of those strands, the complex it belongs to
+ 	int32[N]	pair table, the global index of the partner of each base, or -1
+
+ padded to a multiple of 8 bytes. All values are in native byte order.
+
+ With Options.output_delta the magic is "MSTRAJD" and each state is written as an
+ entry: int32 kind, int32 entry size in bytes (including these two fields), and a body.
+ Keyframes (kind 0) have the full record above as body. They are written for the first
+ state of every trajectory and then every Options.output_keyframe_interval states.
+ The other states (kind 1) only store what changed since the previous state:
+
+ 	float64	time
+ 	int32	arrType
+ 	int32	complex count C
+ 	int32	number of changed bases M
+ 	int32	1 if the strand order or complex membership changed, else 0
+ 	float64[C]	complex energies
+ 	int32[C]	complex ids
+ 	int32[S]	strands and int32[S] strand complexes, only if the flag above is 1
+ 	int32[2M]	(base, new partner or -1) for each changed base
+
+ padded to a multiple of 8 bytes.
+ */
+
+#ifndef __TRAJECTORYFILE_H__
+#define __TRAJECTORYFILE_H__
+
+#include <cstdio>
+#include <string>
+#include <vector>
+#include <unordered_map>
+#include <stdint.h>
+
+class SComplexList;
+
+class TrajectoryFile {
+public:
+	TrajectoryFile(std::string path, bool delta = false, long keyframeInterval = 0);
+	~TrajectoryFile(void);
+
+	bool isOpen(void);
+	void writeState(long seed, double time, int arrType, SComplexList *complexList);
+	void flush(void);
+
+private:
+	void writeHeader(SComplexList *complexList);
+	bool fillRecord(long seed, double time, int arrType, SComplexList *complexList);
+	void writeDelta(void);
+
+	FILE *file = NULL;
+	bool delta = false;
+	long keyframeInterval = 0;
+	long sinceKeyframe = 0;
+	bool headerWritten = false;
+	bool warnedUnknownStrand = false;
+
+	int strandCount = 0;
+	int baseCount = 0;
+	int recordSize = 0;
+	std::unordered_map<int, int> strandIndex; // strand index -> position in the strand table
+	std::vector<int> baseOffset; // global index of the first base of each strand
+
+	std::vector<char> record;
+	std::vector<char> previous; // the last record written, for delta encoding
+	std::vector<char> entry;
+	std::vector<int> openBases;
+};
+
+#endif
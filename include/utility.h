@@ -17,6 +17,7 @@ help@multistrand.org
 #include <string>
 #include <sstream>
 #include <iomanip>
+#include <stdint.h>
 
 #include "optionlists.h"
 
@@ -57,6 +58,106 @@ struct complex_input {
 	}
 };
 
+// A 128 bit Zobrist-style fingerprint of a set of base pairs: the XOR of a
+// pseudo-random key for each pair. Forming or breaking a pair toggles its key,
+// so the fingerprint can be maintained incrementally.
+struct state_fingerprint {
+
+	uint64_t low = 0;
+	uint64_t high = 0;
+
+	// bases are identified by the index of their strand in the start state (see
+	// orderingList::index) and their index within the strand.
+	static uint64_t baseKey(long strand, long index) {
+		return ((uint64_t) (uint32_t) strand << 32) | (uint32_t) index;
+	}
+
+	// splitmix64 finalizer
+	static uint64_t mix(uint64_t x) {
+		x ^= x >> 30;
+		x *= 0xbf58476d1ce4e5b9ULL;
+		x ^= x >> 27;
+		x *= 0x94d049bb133111ebULL;
+		x ^= x >> 31;
+		return x;
+	}
+
+	void toggle(uint64_t base1, uint64_t base2) {
+		if (base2 < base1) {
+			uint64_t temp = base1;
+			base1 = base2;
+			base2 = temp;
+		}
+		low ^= mix(mix(base1 + 0x9e3779b97f4a7c15ULL) ^ base2);
+		high ^= mix(mix(base2 + 0x632be59bd9b4e019ULL) ^ base1);
+	}
+
+	state_fingerprint& operator^=(const state_fingerprint& other) {
+		low ^= other.low;
+		high ^= other.high;
+		return *this;
+	}
+
+	bool operator==(const state_fingerprint& other) const {
+		return low == other.low && high == other.high;
+	}
+};
+
+struct state_fingerprint_hash {
+	size_t operator()(const state_fingerprint& fingerprint) const {
+		return (size_t) fingerprint.low;
+	}
+};
+
+// xoshiro256** generator, owned by each SimulationSystem. Trajectory i of a run
+// draws from the stream keyed by streamSeed(seed, i), which depends only on the
+// run seed and the index, so a batch gives the same trajectories however it is
+// split over workers.
+struct random_generator {
+
+	uint64_t s[4] = { 0, 0, 0, 0 };
+
+	// the state is filled from a splitmix64 sequence, which is never all zero.
+	void seed(uint64_t seed) {
+		for (int i = 0; i < 4; i++) {
+			seed += 0x9e3779b97f4a7c15ULL;
+			s[i] = state_fingerprint::mix(seed);
+		}
+	}
+
+	static uint64_t rotl(uint64_t x, int k) {
+		return (x << k) | (x >> (64 - k));
+	}
+
+	uint64_t next(void) {
+		uint64_t result = rotl(s[1] * 5, 7) * 9;
+		uint64_t t = s[1] << 17;
+
+		s[2] ^= s[0];
+		s[3] ^= s[1];
+		s[1] ^= s[2];
+		s[0] ^= s[3];
+		s[2] ^= t;
+		s[3] = rotl(s[3], 45);
+
+		return result;
+	}
+
+	// uniform on [0.0, 1.0), like drand48
+	double uniform(void) {
+		return (next() >> 11) * (1.0 / 9007199254740992.0);
+	}
+
+	// Trajectory 0 uses the run seed itself, so any reported trajectory seed
+	// reproduces that trajectory when given as initial_seed.
+	static long streamSeed(long seed, long index) {
+		if (index == 0)
+			return seed;
+		uint64_t key = state_fingerprint::mix((uint64_t) seed ^ state_fingerprint::mix((uint64_t) index * 0x9e3779b97f4a7c15ULL));
+		return (long) (key >> 1);
+	}
+};
+
 
 //helper functions
 
@@ -10,5 +10,5 @@
 #                                                                  #
 ####################################################################
 
-__all__ = ['objects','options','system','utils','experiment', 'concurrent']
+__all__ = ['objects','options','system','utils','experiment', 'concurrent', 'trajectoryfile']
 # defines what 'from multistrand import *' means.
@@ -43,6 +43,24 @@ class Interface(object):
         stop condition membership list)
         """
 
+        self.ctmc = None
+        """ The explored state space and the observed transitions, as a CTMC
+        object. Only set when Options.export_ctmc is True, once all
+        trajectories have completed.
+        """
+
+        self.forward_flux = None
+        """ The rate estimated by a forward flux run, with the statistics of
+        each interface, as a ForwardFlux object. Only set in forward flux
+        mode, once the run has completed.
+        """
+
+        self.weighted_ensemble = None
+        """ The first passage times found by a weighted ensemble run, with
+        their weights, as a WeightedEnsemble object. Only set in weighted
+        ensemble mode, once the run has completed.
+        """
+
         self._trajectory_count = 0
         # Current number of trajectories completed, is an internal that gets incremented
         # by the simsystem as it completes trajectories.
@@ -199,3 +217,226 @@ class ResultList( list ):
                 ])
             res += "{0[0]:<10} | {0[1]} | {0[2]} [{0[3]}]\n".format( data )
         return res
+
+
+class CTMC( object ):
+    """ The states visited by a set of trajectories and the transitions
+    observed between them, as a continuous time Markov chain.
+
+    states:      list of states, each a list of (strand names, sequence,
+                 structure, energy) tuples, one per complex.
+    exit_rates:  total rate out of each state, over all possible moves.
+    sources, targets, rates: the observed transitions.
+
+    Transitions that were never taken are not part of the chain. Their rate,
+    the exit rate of a state minus its observed rates, leads to an absorbing
+    "unexplored" state, so that nothing is silently dropped. The chain is only
+    exported when every visit to a state found the same rates.
+
+    States are told apart by the base pairs of each strand, and strands by
+    their position in the start state. Copies of one strand are therefore
+    not interchangeable: in a homodimer of s, the states that only differ by
+    swapping the two copies of s are separate states of the chain, with the
+    same energy and rates."""
+
+    def __init__(self, value_list):
+        self.states, self.exit_rates, self.sources, self.targets, self.rates = value_list
+
+    def __len__( self ):
+        return len(self.states)
+
+    def unexplored_rates( self ):
+        """ Returns, per state, the rate of the moves that were never taken. """
+        import numpy as np
+
+        out_rates = np.zeros(len(self.states))
+        np.add.at(out_rates, self.sources, self.rates)
+        return np.maximum(np.asarray(self.exit_rates, dtype=float) - out_rates, 0.0)
+
+    def rate_matrix( self ):
+        """ Returns the generator matrix as a scipy.sparse.csr_matrix, with
+        one more state than self.states: the last one is the absorbing
+        unexplored state. The diagonal holds minus the exit rates. """
+        import numpy as np
+        import scipy.sparse
+
+        n = len(self.states)
+        exit_rates = np.asarray(self.exit_rates, dtype=float)
+
+        rows = np.concatenate((self.sources, np.arange(n), np.arange(n)))
+        cols = np.concatenate((self.targets, np.arange(n), np.full(n, n)))
+        data = np.concatenate((self.rates, -exit_rates, self.unexplored_rates()))
+        return scipy.sparse.coo_matrix((data, (rows, cols)), shape=(n + 1, n + 1)).tocsr()
+
+    def first_passage_times( self, targets ):
+        """ Returns the expected time to reach any of the target states (a
+        list of state indices) from every state, as a numpy array.
+
+        A walk that takes a move that was never observed ends in the
+        unexplored state, so these are the times to reach a target or leave
+        the explored states; see escape_probabilities for how often the
+        latter happens. Where that is 0, the times are exact. """
+        import numpy as np
+        import scipy.sparse.linalg
+
+        n = len(self.states)
+        others = np.setdiff1d(np.arange(n), targets)
+        Q = self.rate_matrix()[others, :][:, others]
+
+        times = np.zeros(n)
+        times[others] = scipy.sparse.linalg.spsolve(-Q.tocsc(), np.ones(len(others)))
+        return times
+
+    def escape_probabilities( self, targets ):
+        """ Returns, from every state, the chance of taking a move that was
+        never observed before reaching any of the target states. """
+        import numpy as np
+        import scipy.sparse.linalg
+
+        n = len(self.states)
+        others = np.setdiff1d(np.arange(n), targets)
+        Q = self.rate_matrix()[others, :][:, others]
+
+        escape = np.zeros(n)
+        escape[others] = scipy.sparse.linalg.spsolve(-Q.tocsc(), self.unexplored_rates()[others])
+        return escape
+
+
+class ForwardFlux( object ):
+    """ The statistics of a forward flux run, per interface.
+
+    tags:       the tag of each interface, the last one is the target.
+    trials, successes, failures, time_outs, steps: per interface, the trials
+                run towards it, how many reached it, how many met a FAILURE
+                stop condition or ran out of time, and the steps simulated.
+    collision_rate: the summed collision rates of the first step trials
+                that reached the first interface.
+
+    Trials towards the first interface are first step trajectories from the
+    start state; the others start from the states reached at the previous
+    interface. A trial that is already past its interface succeeds without
+    taking a step."""
+
+    def __init__(self, value_list):
+        (self.tags, self.trials, self.successes, self.failures, self.time_outs,
+         self.steps, self.collision_rate) = value_list
+
+    def probabilities( self ):
+        """ Returns, per interface, the fraction of trials that reached it. """
+        return [float(s) / t if t > 0 else 0.0 for s, t in zip(self.successes, self.trials)]
+
+    def flux( self ):
+        """ The rate of reaching the first interface, in /M /s: the summed
+        collision rate of the successful first step trials over all first
+        step trials. """
+        if self.trials[0] == 0:
+            return 0.0
+        return self.collision_rate / self.trials[0]
+
+    def k1( self ):
+        """ The bimolecular rate of reaching the target, in /M /s: the flux
+        to the first interface times the probability of getting from each
+        interface to the next. """
+        k1 = self.flux()
+        for p in self.probabilities()[1:]:
+            k1 *= p
+        return k1
+
+    def __str__( self ):
+        row = "{0:<20} | {1:>10} | {2:>10} | {3:>10} | {4:>8} | {5:>12}\n"
+        res = row.format('Interface', 'Trials', 'Successes', 'Failures', 'Time-out', 'Steps')
+        for values in zip(self.tags, self.trials, self.successes, self.failures, self.time_outs, self.steps):
+            res += row.format(*values)
+        res += "k1 = %.3g /M /s \n" % self.k1()
+        return res
+
+
+class WeightedEnsemble( object ):
+    """ The first passage times of a weighted ensemble run.
+
+    times, weights: per walker that reached the target, the time it did and
+                its weight. The weights of a run add up to at most 1.
+    runs:       the number of runs, each started with weight 1.
+    remaining:  the weight of the walkers that had not reached the target
+                at simulation_time, summed over the runs.
+    steps:      the number of steps simulated, over all walkers.
+
+    The weights make the distribution unbiased: the chance of a first
+    passage before time t is the summed weight of the times up to t, over
+    the number of runs, even where it is far too small to be seen in
+    plain trajectories."""
+
+    def __init__(self, value_list):
+        (self.times, self.weights, self.runs, self.remaining,
+         self.steps) = value_list
+
+    def probability( self ):
+        """ The chance of reaching the target within simulation_time. """
+        if self.runs == 0:
+            return 0.0
+        return sum(self.weights, 0.0) / self.runs
+
+    def cumulative( self, times ):
+        """ Returns, for each time in times, the chance of reaching the
+        target by then. """
+        if self.runs == 0:
+            return [0.0 for t in times]
+        res = []
+        for t in times:
+            arrived = [w for s, w in zip(self.times, self.weights) if s <= t]
+            res.append(sum(arrived, 0.0) / self.runs)
+        return res
+
+    def mean_time( self ):
+        """ The mean first passage time of the walkers that reached the
+        target, weighted. Without remaining weight, this is the mean first
+        passage time. """
+        total = sum(self.weights, 0.0)
+        if total == 0.0:
+            return float('nan')
+        return sum(t * w for t, w in zip(self.times, self.weights)) / total
+
+    def __str__( self ):
+        res = "Runs:                %i \n" % self.runs
+        res += "Walkers at target:   %i \n" % len(self.times)
+        res += "Steps:               %i \n" % self.steps
+        res += "P(reach target):     %.3g \n" % self.probability()
+        res += "Mean passage time:   %.3g s \n" % self.mean_time()
+        return res
+
+
+class TrajectoryBlock( object ):
+    """ A block of consecutive trajectory states from one trajectory, as
+    numpy arrays.
+
+    Per state:    times, arr_types, complex_counts
+    Per complex:  ids, energies, names, structures (fixed width byte strings)
+
+    The complexes of state i are the complex_counts[i] entries starting at
+    offsets[i]. """
+
+    def __init__(self, value_list):
+        import numpy as np
+
+        (self.seed, times, arr_types, complex_counts, ids, energies,
+         names, names_width, structures, structures_width) = value_list
+
+        self.times = np.frombuffer(times, dtype=np.float64)
+        self.arr_types = np.frombuffer(arr_types, dtype=np.intc)
+        self.complex_counts = np.frombuffer(complex_counts, dtype=np.intc)
+        self.ids = np.frombuffer(ids, dtype=np.intc)
+        self.energies = np.frombuffer(energies, dtype=np.float64)
+        self.names = np.frombuffer(names, dtype="S{0}".format(names_width))
+        self.structures = np.frombuffer(structures, dtype="S{0}".format(structures_width))
+
+        self.offsets = np.zeros(len(self.complex_counts), dtype=np.intp)
+        np.cumsum(self.complex_counts[:-1], out=self.offsets[1:])
+
+    def __len__( self ):
+        return len(self.times)
+
+    def state( self, i ):
+        """ Returns state i as a list of (id, names, structure, energy) tuples. """
+        begin = self.offsets[i]
+        end = begin + self.complex_counts[i]
+        return zip(self.ids[begin:end], self.names[begin:end], self.structures[begin:end], self.energies[begin:end])
@@ -4,7 +4,7 @@
 # Chris Berlind                                                                
 # Frits Dannenberg                                                             
 
-from interface import Interface
+from interface import Interface, CTMC, ForwardFlux, WeightedEnsemble, TrajectoryBlock
 from ..objects import Strand, Complex, RestingState, StopCondition
 # from ..utils import JSKawasaki25, JSKawasaki37, JSMetropolis25, JSMetropolis37, JSDefault     # this is for 2.0 support only
 
@@ -52,6 +52,13 @@ class Options(object):
     firstStep =         48 # 0x0030
     transition =        256 # 0x0100
     trajectory =        128 # 0x0080
+    forwardFlux =       560 # 0x0230
+    weightedEnsemble =  1040 # 0x0410
+    
+    # Move container: how each loop stores and selects its moves
+    moveList = 0
+    moveTree = 1
+    moveContainerToString = [ "List", "Tree" ]
       
     
     # translation
@@ -59,6 +66,8 @@ class Options(object):
                         "First Step":               firstStep,
                         "Transition":               transition,
                         "Trajectory":               trajectory,
+                        "Forward Flux":             forwardFlux,
+                        "Weighted Ensemble":        weightedEnsemble,
                         "First Passage Time":       firstPassageTime}
 
     
@@ -90,6 +99,8 @@ class Options(object):
                                         parameters.
         rate_method                  -- Whether we want 'Kawasaki' or 'Metropolis'
                                         rate method for unimolecular steps.
+        move_container               -- Whether loops select moves by a linear
+                                        scan ('List') or a sum-tree ('Tree').
         useArrRates     [type=bool]  -- if TRUE, use Arrhenius rate model. If using, please set lnAEnd, lnALoop, lnAStack, lnAStackStack, lnALoopEnd, lnAStackEnd, lnAStackLoop
 EEnd, ELoop, EStack, EStackStack, ELoopEnd, EStackEnd, EStackLoop (double value).
         """
@@ -113,6 +124,7 @@ EEnd, ELoop, EStack, EStackStack, ELoopEnd, EStackEnd, EStackLoop (double value)
         self.full_trajectory = []
         self.full_trajectory_times = []
         self.full_trajectory_arrType = []
+        self.trajectory_blocks = []
         self.trajectory_complexes = []
         self.trajectory_state_count = 0
         self._current_end_state = []
@@ -210,6 +222,19 @@ EEnd, ELoop, EStack, EStackStack, ELoopEnd, EStackEnd, EStackLoop (double value)
         for that parameter file. None will pass an error back to
         Multistrand if it gets used.
         """
+        
+        self.compiled_parameters = None
+        """ Path of a parameter set written by
+        multistrand.system.compile_parameters. The energy model maps this file
+        instead of reading and parsing the parameter files, which makes
+        starting many processes with the same parameters cheaper.
+        
+        Type         Default
+        str          None
+        
+        The set must have been compiled for the same substrate_type, by the
+        same version of Multistrand.
+        """
 
         ####################
         #
@@ -232,10 +257,108 @@ EEnd, ELoop, EStack, EStackStack, ELoopEnd, EStackEnd, EStackLoop (double value)
         self.num_simulations = 1
         """ Total number of trajectories to run. 
         """
+
+        self.flux_trials = 1000
+        """ Number of trials started from each interface after the first,
+        in forward flux mode.
+
+        Type         Default
+        int          1000
+
+        In forward flux mode, num_simulations first step trajectories are
+        run from the start state, each until it reaches the first interface
+        or a FAILURE stop condition. The interfaces are the other stop
+        conditions, in the order given; the last one is the target state.
+        The states reached at each interface are then the starting points
+        of flux_trials trials towards the next one. A trial fails when it
+        meets a FAILURE (or REVERSE) stop condition or runs out of
+        simulation_time. The result is stored in interface.forward_flux, see
+        ForwardFlux.
+        """
+
+        self.ensemble_walkers = 4
+        """ Number of walkers kept in each progress bin, in weighted
+        ensemble mode.
+
+        Type         Default
+        int          4
+
+        In weighted ensemble mode, each of the num_simulations runs starts
+        from the start state with a single walker of weight 1. The last stop
+        condition is the target state; the others define the progress bins,
+        a state being in the bin after the last of them that it meets. Every
+        ensemble_interval of simulated time, the walkers in each bin are
+        split or merged until the bin holds ensemble_walkers of them, and a
+        walker that reaches the target is stopped. The first passage times
+        and weights are stored in interface.weighted_ensemble, see
+        WeightedEnsemble.
+        """
+
+        self.ensemble_interval = 1e-6
+        """ Simulated time between two resampling steps, in weighted
+        ensemble mode, see ensemble_walkers.
+
+        Type         Default
+        float        1e-6 (seconds)
+        """
         
         self.initial_seed = None
         """ Initial random number seed to use.
         If None when simulation starts, a random seed will be chosen
+        
+        Each trajectory draws from its own random stream, derived from this
+        seed and the index of the trajectory. The seed reported for a
+        trajectory reproduces it when used as initial_seed.
+        """
+        
+        self.trajectory_offset = 0
+        """ Index of the first trajectory of this run within a larger batch
+        that shares initial_seed.
+        
+        Type         Default
+        int          0
+        
+        Splitting num_simulations over several runs with consecutive offsets
+        gives the same trajectories as a single run.
+        """
+        
+        self.num_threads = 1
+        """ Number of threads SimSystem.start() runs the trajectories on.
+        
+        Type         Default
+        int          1
+        
+        0 uses one thread per core. Threads are used when the GIL can be
+        released for the run (see static_start_state) and neither
+        output_file nor export_ctmc is set. Results are the same as with a
+        single thread, in the same order.
+        """
+        
+        self.move_container = self.moveList
+        """ How the simulator stores and selects moves.
+        
+        List [0]: Linear scan over the moves of each loop, and over the
+                  loops of the complex.
+        Tree [1]: Sum-tree per loop and a per-complex index of loop rates,
+                  updated only where a step changed loops, so selection
+                  takes logarithmic time. Better for long strands; moves
+                  have the same probabilities as with List, but a given
+                  seed does not give the same trajectory.
+        """
+        
+        self.export_ctmc = False
+        """ Record the states visited and the transitions taken in
+        first passage time mode, and export them as a CTMC object in
+        self.interface.ctmc once the simulation completes.
+        
+        Type         Default
+        boolean      False
+        
+        Its rate_matrix() can be loaded into SciPy, for example to solve
+        mean first passage times exactly on small systems. If a revisit
+        finds a state with different rates than before (for example with a
+        parameter set whose loop energies depend on the orientation of the
+        loop), the rates do not form a Markov chain and nothing is exported.
         """
         
         self.name_dict = {}
@@ -336,6 +459,86 @@ EEnd, ELoop, EStack, EStackStack, ELoopEnd, EStackEnd, EStackLoop (double value)
         means output every state, 1 means every other state, and so on.
         """
         
+        self.output_columnar = False
+        """ Collect trajectory output in the simulator and hand it over as
+        TrajectoryBlock objects of numpy arrays, appended to
+        self.trajectory_blocks, instead of filling full_trajectory one
+        complex at a time.
+        
+        Type         Default
+        boolean      False
+        """
+        
+        self.output_columnar_block = 0
+        """ Maximum number of states in each TrajectoryBlock when
+        output_columnar is set.
+        
+        Type         Default
+        int          0
+        
+        A value of 0 means one block per trajectory.
+        """
+        
+        self.output_file = None
+        """ Path of a file that trajectory output is written to directly by
+        the simulator, as a binary record stream, instead of being handed to
+        python. Read it back with multistrand.trajectoryfile.TrajectoryFile.
+        
+        Type         Default
+        string       None
+        
+        The file is overwritten when the simulation starts. Takes priority
+        over output_columnar.
+        """
+        
+        self.output_delta = False
+        """ Write output_file delta encoded: each state only records the base
+        pairs that changed since the previous state, with a full keyframe at
+        the start of every trajectory and every output_keyframe_interval
+        states.
+        
+        Type         Default
+        boolean      False
+        """
+        
+        self.output_keyframe_interval = 1000
+        """ Number of delta encoded states between keyframes in output_file,
+        when output_delta is set. Keyframes bound the work needed to decode
+        a state picked at random.
+        
+        Type         Default
+        int          1000
+        
+        A value of 0 means keyframes are only written at the start of each
+        trajectory.
+        """
+
+        self.checkpoint_file = None
+        """ Path of a file the state of the run is saved to every
+        checkpoint_interval steps, so that SimSystem.resume() can continue an
+        interrupted run.
+
+        Type         Default
+        string       None
+
+        Only used in first passage time and first step mode, when the GIL is
+        released for the run (see static_start_state), and neither output_file
+        nor export_ctmc is set. The run then uses a single thread. A run that
+        is resumed gives the same results as a run without checkpoints.
+        """
+
+        self.checkpoint_interval = 100000000
+        """ Number of simulation steps between checkpoints, counted over all
+        trajectories of the run.
+
+        Type         Default
+        int          100000000
+
+        A checkpoint is written at the first point after these steps where
+        the complexes are rebuilt from their structures, as a resumed run
+        builds them: the start of a trajectory, or every 4096 steps of it.
+        """
+
         self.current_interval = 0
         """ Current value of output state counter.
         
@@ -536,8 +739,22 @@ EEnd, ELoop, EStack, EStackStack, ELoopEnd, EStackEnd, EStackLoop (double value)
             if s is not None:
                 s.boltzmann_sample = val
             else:
-                c.boltzmann_sample = val 
-    
+                c.boltzmann_sample = val
+
+    @property
+    def static_start_state(self):
+        """ Indicates whether every trajectory starts from the same state,
+        i.e. the start state consists of Complexes with exact structures.
+
+        Type         Default
+        boolean      True
+
+        When True, SimSystem.start() reads the start state once and releases
+        the GIL while the trajectories run, provided no trajectory states are
+        sent to python during the run (output_file may be used).
+        """
+        return all(s is None and not c.boltzmann_sample for c, s in self._start_state)
+
     @property
     def start_state(self):
         """ Get the start state, i.e. a list of Complex objects.
@@ -840,6 +1057,47 @@ EEnd, ELoop, EStack, EStackStack, ELoopEnd, EStackEnd, EStackLoop (double value)
         # print( "Time: {0[0]} Membership: {0[1]}".format( val ))
         self._current_transition_list.append(val)
 
+    @property
+    def add_ctmc(self):
+        return None
+
+    @add_ctmc.setter
+    def add_ctmc(self, val):
+        """ Takes a 5-tuple (states, exit rates, sources, targets, rates)
+            describing the explored state space, see CTMC."""
+        self.interface.ctmc = CTMC(val)
+
+    @property
+    def add_forward_flux(self):
+        return None
+
+    @add_forward_flux.setter
+    def add_forward_flux(self, val):
+        """ Takes a 7-tuple (tags, trials, successes, failures, time outs,
+            steps, summed collision rate) of a forward flux run, see
+            ForwardFlux."""
+        self.interface.forward_flux = ForwardFlux(val)
+
+    @property
+    def add_weighted_ensemble(self):
+        return None
+
+    @add_weighted_ensemble.setter
+    def add_weighted_ensemble(self, val):
+        """ Takes a 5-tuple (times, weights, runs, remaining weight, steps)
+            of a weighted ensemble run, see WeightedEnsemble."""
+        self.interface.weighted_ensemble = WeightedEnsemble(val)
+
+    @property
+    def add_trajectory_columns(self):
+        return None
+
+    @add_trajectory_columns.setter
+    def add_trajectory_columns(self, val):
+        """ Takes the raw buffers of a block of trajectory states, see
+            TrajectoryBlock."""
+        self.trajectory_blocks.append(TrajectoryBlock(val))
+
     @property
     def add_trajectory_complex(self):
         return None
@@ -935,6 +1193,7 @@ EEnd, ELoop, EStack, EStackStack, ELoopEnd, EStackEnd, EStackLoop (double value)
         dangles           |  'None', 'Some', 'All'
         parameter_type    |  'Nupack', 'Vienna'
         substrate_type    |  'DNA','RNA'
+        move_container    |  'List', 'Tree'
         
         sim_time          | [simulation_time] Max time to simulate
         num_sims          | [num_simulations] Number of trajectories to run
@@ -1002,5 +1261,8 @@ EEnd, ELoop, EStack, EStackStack, ELoopEnd, EStackEnd, EStackLoop (double value)
             elif (k == 'simulation_mode') &  (isinstance(kargs[k],basestring)):
                     self.simulation_mode = self.simulationMode[kargs[k]]
 
+            elif (k == 'move_container') & (isinstance(kargs[k], basestring)):
+                    self.move_container = self.moveContainerToString.index(kargs[k])
+
             else:
                 self.__setattr__(k, kargs[k])
@@ -617,7 +617,7 @@ def timeStamp(inTime=None):
 class MergeSim(object):
 
     numOfThreads = 2
-    seed = 7713147777
+    seed = None  # chosen at random when the first run starts, unless set
 
     def __init__(self, settings=None):
 
@@ -655,6 +655,12 @@ class MergeSim(object):
 
         self.numOfThreads = numOfThreads
 
+    # Worker k simulates trajectories k * trialsPerThread onwards of the batch
+    # keyed on this seed, so results do not depend on the number of threads.
+    def setSeed(self, seed):
+
+        self.seed = seed
+
     # this can be re-done using an args[] obj.
     def setOptionsFactory(self, optionsFactory):
 
@@ -788,10 +794,15 @@ class MergeSim(object):
         self.results = self.settings.rateFactory()
         self.endStates = []
 
-        def doSim(myFactory, aFactory, list0, list1, instanceSeed, nForwardIn, nReverseIn):
+        if self.seed == None:
+            self.seed = random.SystemRandom().randint(0, 2 ** 62)
+        self.launchCount = 0
+
+        def doSim(myFactory, aFactory, list0, list1, instanceSeed, trajectoryOffset, nForwardIn, nReverseIn):
 
             myOptions = myFactory.new(instanceSeed)
             myOptions.num_simulations = self.trialsPerThread
+            myOptions.trajectory_offset = trajectoryOffset
 
             s = SimSystem(myOptions)
             s.start()
@@ -819,8 +830,9 @@ class MergeSim(object):
                 aFactory.doAnalysis(myOptions)
 
         def getSimulation():
-            instanceSeed = self.seed + i * 3 * 5 * 19 + (time.time() * 10000) % (math.pow(2, 32) - 1)
-            return multiprocessing.Process(target=doSim, args=(self.factory, self.aFactory, self.managed_result, self.managed_endStates, instanceSeed, self.nForward, self.nReverse))
+            trajectoryOffset = self.launchCount * self.trialsPerThread
+            self.launchCount += 1
+            return multiprocessing.Process(target=doSim, args=(self.factory, self.aFactory, self.managed_result, self.managed_endStates, self.seed, trajectoryOffset, self.nForward, self.nReverse))
 
         # this saves the results generated so far as regular Python objects,
         # and clears the concurrent result lists.
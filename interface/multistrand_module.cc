@@ -83,6 +83,29 @@ static PyObject *SimSystemObject_start(SimSystemObject *self, PyObject *args) {
 	return Py_None;
 }
 
+static PyObject *SimSystemObject_resume(SimSystemObject *self, PyObject *args) {
+	char *path = NULL;
+
+	if (!PyArg_ParseTuple(args, "s:resume", &path))
+		return NULL;
+
+	if (self->ob_system == NULL) {
+		PyErr_SetString(PyExc_AttributeError, "The associated SimulationSystem [C++] object no longer exists, cannot resume the system.");
+		return NULL;
+	}
+
+	std::string error;
+	int result = self->ob_system->ResumeSimulation(path, error);
+
+	if (result != 0) {
+		PyErr_SetString(result == 1 ? PyExc_IOError : PyExc_ValueError, error.c_str());
+		return NULL;
+	}
+
+	Py_INCREF(Py_None);
+	return Py_None;
+}
+
 static PyObject *SimSystemObject_initialInfo(SimSystemObject *self, PyObject *args) {
 	if (!PyArg_ParseTuple(args, ":initialInfo"))
 		return NULL;
@@ -131,7 +154,22 @@ SimSystem.start( self )\n\
 \n\
 Start the simulation; only returns when the simulation has been completed. \n\
 Information is only returned from the simulation via the Options object it \n\
-was created with.\n";
+was created with.\n\
+\n\
+When the options have a static start state and trajectories are not sent to \n\
+python while running (see Options.static_start_state), the GIL is released \n\
+for the duration of the run, so SimSystems on several threads run in parallel.\n";
+
+const char docstring_SimSystem_resume[] =
+		"\
+SimSystem.resume( self, checkpoint_file )\n\
+\n\
+Continue a run from a checkpoint written by a SimSystem with the same options \n\
+(see Options.checkpoint_file); only returns when the simulation has been \n\
+completed. The results of the trajectories finished before the checkpoint are \n\
+added to the Options object as well, so it ends up as after an uninterrupted \n\
+start(). Raises IOError if the file can not be read, and ValueError if it does \n\
+not fit the options.\n";
 
 const char docstring_SimSystem_initialInfo[] = "\
 SimSystem.initialInfo( self )\n\
@@ -151,7 +189,8 @@ options [type=:class:`multistrand.options.Options`]  -- The options to use for\n
 \n";
 
 static PyMethodDef SimSystemObject_methods[] = { { "__init__", (PyCFunction) SimSystemObject_init, METH_COEXIST | METH_VARARGS, PyDoc_STR(
-		docstring_SimSystem_init) }, { "start", (PyCFunction) SimSystemObject_start, METH_VARARGS, PyDoc_STR(docstring_SimSystem_start) }, { "initialInfo",
+		docstring_SimSystem_init) }, { "start", (PyCFunction) SimSystemObject_start, METH_VARARGS, PyDoc_STR(docstring_SimSystem_start) }, { "resume",
+		(PyCFunction) SimSystemObject_resume, METH_VARARGS, PyDoc_STR(docstring_SimSystem_resume) }, { "initialInfo",
 		(PyCFunction) SimSystemObject_initialInfo, METH_VARARGS, PyDoc_STR(docstring_SimSystem_initialInfo) }, { NULL, NULL } /* Sentinel */
 /* Note that the dealloc, etc methods are not
  defined here, they're in the type object's
@@ -214,26 +253,83 @@ static PyObject *System_initialize_energymodel(PyObject *self, PyObject *args) {
 	if (!PyArg_ParseTuple(args, "|O:initialize_energy_model( [options])", &options_object))
 		return NULL;
 
-	EnergyModel *temp = Loop::GetEnergyModel();
-
-	if (temp != NULL)
-		delete temp;
-
 	if (options_object == NULL || options_object == Py_None)
 		Loop::SetEnergyModel( NULL);
 	else {
-		temp = NULL;
 		if (testLongAttr(options_object, parameter_type, =, 0))
 			throw std::invalid_argument("Attempting to load ViennaRNA parameters (depreciated)");
 		//temp = new ViennaEnergyModel( options_object );
-		else
-			temp = new NupackEnergyModel(options_object);
-		Loop::SetEnergyModel(temp);
+		else {
+			PSimOptions options(options_object);
+			Loop::SetEnergyModel(EnergyModelRegistry::get(&options));
+		}
 	}
 	Py_INCREF(Py_None);
 	return Py_None;
 }
 
+static PyObject *System_energy_model_cache(PyObject *self, PyObject *args) {
+	int capacity = -1;
+
+	if (!PyArg_ParseTuple(args, "|i:energy_model_cache( [capacity])", &capacity))
+		return NULL;
+
+	if (capacity >= 0)
+		EnergyModelRegistry::setCapacity(capacity);
+
+	return Py_BuildValue("{s:i,s:i,s:l,s:l}", "size", EnergyModelRegistry::getSize(), "capacity", EnergyModelRegistry::getCapacity(), "hits",
+			EnergyModelRegistry::getHits(), "misses", EnergyModelRegistry::getMisses());
+}
+
+static PyObject *System_clear_energy_model_cache(PyObject *self, PyObject *args) {
+	if (!PyArg_ParseTuple(args, ":clear_energy_model_cache()"))
+		return NULL;
+
+	EnergyModelRegistry::clear();
+
+	Py_INCREF(Py_None);
+	return Py_None;
+}
+
+static PyObject *System_loop_energy_cache(PyObject *self, PyObject *args) {
+	long capacity = -1;
+
+	if (!PyArg_ParseTuple(args, "|l:loop_energy_cache( [capacity])", &capacity))
+		return NULL;
+
+	if (capacity >= 0)
+		LoopEnergyCache::setCapacity(capacity);
+
+	return Py_BuildValue("{s:l,s:l,s:l,s:l}", "size", LoopEnergyCache::getSize(), "capacity", LoopEnergyCache::getCapacity(), "hits",
+			LoopEnergyCache::getHits(), "misses", LoopEnergyCache::getMisses());
+}
+
+static PyObject *System_clear_loop_energy_cache(PyObject *self, PyObject *args) {
+	if (!PyArg_ParseTuple(args, ":clear_loop_energy_cache()"))
+		return NULL;
+
+	LoopEnergyCache::clear();
+
+	Py_INCREF(Py_None);
+	return Py_None;
+}
+
+static PyObject *System_compile_parameters(PyObject *self, PyObject *args) {
+	PyObject *options_object = NULL;
+	char *path = NULL;
+
+	if (!PyArg_ParseTuple(args, "Os:compile_parameters(options, path)", &options_object, &path))
+		return NULL;
+
+	PSimOptions options(options_object);
+
+	if (!NupackEnergyModel::compileParameterSet(&options, string(path)))
+		return PyErr_SetFromErrnoWithFilename(PyExc_IOError, path);
+
+	Py_INCREF(Py_None);
+	return Py_None;
+}
+
 static PyObject *System_calculate_energy(PyObject *self, PyObject *args) {
 	// TODO: there is a bug where this destroys/invalidates the incoming python objects used to initialize the state.   02-21-13 JS
 	// REPRODUCE:
@@ -286,6 +382,257 @@ static PyObject *System_calculate_energy(PyObject *self, PyObject *args) {
 	return energy;
 }
 
+// A single string, or a sequence of strings.
+static bool readStrings(PyObject *input, vector<string>& output, const char *name) {
+
+	if (PyString_Check(input)) {
+		output.push_back(string(PyString_AsString(input)));
+		return true;
+	}
+
+	PyObject *items = PySequence_Fast(input, "");
+	if (items == NULL) {
+		PyErr_Format(PyExc_TypeError, "energy_batch: %s must be a string or a sequence of strings.", name);
+		return false;
+	}
+
+	Py_ssize_t count = PySequence_Fast_GET_SIZE(items);
+	output.reserve(count);
+
+	for (Py_ssize_t i = 0; i < count; i++) {
+		PyObject *item = PySequence_Fast_GET_ITEM(items, i);
+		if (!PyString_Check(item)) {
+			PyErr_Format(PyExc_TypeError, "energy_batch: %s[%zd] is not a string.", name, i);
+			Py_DECREF(items);
+			return false;
+		}
+		output.push_back(string(PyString_AsString(item)));
+	}
+
+	Py_DECREF(items);
+	return true;
+}
+
+// Paired bases have to form a Watson-Crick pair, or a GT pair if those are enabled.
+static bool canPair(char base1, char base2, bool gtenable) {
+
+	string pair;
+	pair += toupper(base1) == 'U' ? 'T' : toupper(base1);
+	pair += toupper(base2) == 'U' ? 'T' : toupper(base2);
+
+	return pair == "AT" || pair == "TA" || pair == "GC" || pair == "CG" || (gtenable && (pair == "GT" || pair == "TG"));
+}
+
+// The strand that represents the set of connected strands containing strand.
+static int strandSet(vector<int>& parent, int strand) {
+
+	while (parent[strand] != strand)
+		strand = parent[strand] = parent[parent[strand]];
+
+	return strand;
+}
+
+// The structure must be balanced and as long as the sequence, with '+' at the same places.
+// Hairpins need at least 3 bases, and the base pairs must connect all strands.
+static bool checkState(string& sequence, string& structure, long index, bool gtenable) {
+
+	vector<size_t> open;
+	vector<int> openStrand; // strand of each position in open
+	vector<int> parent(1, 0); // sets of strands connected by base pairs
+	long last = -1; // position of the last '(', ')' or '+'
+
+	if (sequence.empty() || sequence.size() != structure.size()) {
+		PyErr_Format(PyExc_ValueError, "energy_batch: state %ld has a sequence of length %ld and a structure of length %ld.", index,
+				(long) sequence.size(), (long) structure.size());
+		return false;
+	}
+
+	for (size_t i = 0; i < structure.size(); i++) {
+		char c = structure[i];
+		if ((c == '+') != (sequence[i] == '+') || (c != '(' && c != ')' && c != '.' && c != '+')) {
+			PyErr_Format(PyExc_ValueError, "energy_batch: state %ld has an invalid structure at position %ld.", index, (long) i);
+			return false;
+		}
+		if (c == '+')
+			parent.push_back(parent.size());
+		if (c == '(') {
+			open.push_back(i);
+			openStrand.push_back(parent.size() - 1);
+		}
+		if (c == ')') {
+			if (open.empty()) {
+				PyErr_Format(PyExc_ValueError, "energy_batch: state %ld has an unbalanced structure.", index);
+				return false;
+			}
+			if (!canPair(sequence[open.back()], sequence[i], gtenable)) {
+				PyErr_Format(PyExc_ValueError, "energy_batch: state %ld pairs positions %ld and %ld, which cannot pair.", index, (long) open.back(), (long) i);
+				return false;
+			}
+			// nothing but unpaired bases since the opening base: a hairpin.
+			if (last == (long) open.back() && i - open.back() - 1 < 3) {
+				PyErr_Format(PyExc_ValueError, "energy_batch: state %ld has a hairpin of %ld bases between positions %ld and %ld, hairpins need at least 3.",
+						index, (long) (i - open.back() - 1), (long) open.back(), (long) i);
+				return false;
+			}
+			parent[strandSet(parent, openStrand.back())] = strandSet(parent, parent.size() - 1);
+			open.pop_back();
+			openStrand.pop_back();
+		}
+		if (c != '.')
+			last = i;
+	}
+
+	if (!open.empty()) {
+		PyErr_Format(PyExc_ValueError, "energy_batch: state %ld has an unbalanced structure.", index);
+		return false;
+	}
+
+	for (int strand = 1; strand < (int) parent.size(); strand++) {
+		if (strandSet(parent, strand) != strandSet(parent, 0)) {
+			PyErr_Format(PyExc_ValueError, "energy_batch: state %ld has strands that are not connected by base pairs.", index);
+			return false;
+		}
+	}
+
+	return true;
+}
+
+// Copies values into a new numpy array. The array is made by numpy.frombuffer, so
+// the module needs no numpy headers to build.
+static PyObject *numpyArray(PyObject *numpy, const char *dtype, const void *values, Py_ssize_t size) {
+
+	PyObject *buffer = PyByteArray_FromStringAndSize((const char *) values, size);
+	if (buffer == NULL)
+		return NULL;
+
+	PyObject *array = PyObject_CallMethod(numpy, (char *) "frombuffer", (char *) "Os", buffer, dtype);
+	Py_DECREF(buffer);
+
+	return array;
+}
+
+// The model for the options from the registry, without writing the constants
+// file, or the default model if options is None. Like energy(), the model becomes
+// the default model if there is none yet.
+static EnergyModel *batchEnergyModel(PyObject *options_object, std::shared_ptr<EnergyModel>& model, const char *what) {
+
+	if (options_object == NULL || options_object == Py_None) {
+		EnergyModel *em = Loop::GetEnergyModel();
+		if (em == NULL)
+			PyErr_Format(PyExc_AttributeError,
+					"No energy model available, cannot compute %s. Please pass an options object, or use multistrand.system.initialize_energy_model(...).\n", what);
+		return em;
+	}
+
+	PSimOptions options(options_object);
+	model = EnergyModelRegistry::get(&options, false);
+	if (Loop::GetEnergyModel() == NULL)
+		Loop::SetEnergyModel(model);
+
+	return model.get();
+}
+
+static PyObject *System_energy_batch(PyObject *self, PyObject *args, PyObject *keywds) {
+
+	PyObject *sequences_object = NULL;
+	PyObject *structures_object = NULL;
+	PyObject *options_object = NULL;
+	int typeflag = 0;
+	int enthalpy = 0;
+	int loops = 0;
+	EnergyModel *em = NULL;
+	std::shared_ptr<EnergyModel> model;
+
+	static char *kwlist[] = { "sequences", "structures", "options", "energy_type", "enthalpy", "loops", NULL };
+
+	if (!PyArg_ParseTupleAndKeywords(args, keywds, "OO|Oiii:energy_batch(sequences, structures, [options=None, energy_type=0, enthalpy=False, loops=False])",
+			kwlist, &sequences_object, &structures_object, &options_object, &typeflag, &enthalpy, &loops))
+		return NULL;
+
+	vector<string> sequences, structures;
+
+	if (!readStrings(sequences_object, sequences, "sequences") || !readStrings(structures_object, structures, "structures"))
+		return NULL;
+
+	if (sequences.size() != structures.size() && sequences.size() != 1 && structures.size() != 1) {
+		PyErr_Format(PyExc_ValueError, "energy_batch: got %ld sequences and %ld structures.", (long) sequences.size(), (long) structures.size());
+		return NULL;
+	}
+
+	if (sequences.empty() || structures.empty())
+		sequences.clear(), structures.clear();
+
+	long count = max(sequences.size(), structures.size());
+
+	em = batchEnergyModel(options_object, model, "energy");
+	if (em == NULL)
+		return NULL;
+
+	bool gtenable = em->simOptions->energyOptions->getGtenable();
+
+	for (long i = 0; i < count; i++)
+		if (!checkState(sequences[sequences.size() == 1 ? 0 : i], structures[structures.size() == 1 ? 0 : i], i, gtenable))
+			return NULL;
+
+	PyObject *numpy = PyImport_ImportModule("numpy");
+	if (numpy == NULL)
+		return NULL;
+
+	EnergyBatch batch;
+	SimulationSystem::calculateEnergies(em, sequences, structures, typeflag, loops, batch);
+
+	PyObject *result = numpyArray(numpy, "=f8", batch.energies.data(), count * sizeof(double));
+
+	if (result != NULL && (enthalpy || loops)) {
+
+		PyObject *energies = result;
+		result = Py_BuildValue("{s:N}", "dG", energies);
+
+		// Every term of the model is linear in the temperature, so the energies one
+		// degree higher give the entropy, and with it the enthalpy.
+		if (result != NULL && enthalpy) {
+
+			double temperature = em->simOptions->energyOptions->getTemperature();
+
+			SimOptions *shifted = em->simOptions->copy();
+			shifted->energyOptions = shifted->energyOptions->copy();
+			shifted->energyOptions->setTemperature(temperature + 1.0);
+			std::shared_ptr<EnergyModel> warmer = EnergyModelRegistry::get(shifted, false);
+			delete shifted;
+
+			EnergyBatch warm;
+			SimulationSystem::calculateEnergies(warmer.get(), sequences, structures, typeflag, false, warm);
+
+			for (long i = 0; i < count; i++)
+				warm.energies[i] = batch.energies[i] - temperature * (warm.energies[i] - batch.energies[i]);
+
+			PyObject *dH = numpyArray(numpy, "=f8", warm.energies.data(), count * sizeof(double));
+			if (dH == NULL || PyDict_SetItemString(result, "dH", dH) < 0)
+				Py_CLEAR(result);
+			Py_XDECREF(dH);
+		}
+
+		if (result != NULL && loops) {
+
+			PyObject *loopEnergies = numpyArray(numpy, "=f8", batch.loopEnergies.data(), batch.loopEnergies.size() * sizeof(double));
+			PyObject *loopTypes = numpyArray(numpy, "S1", batch.loopTypes.data(), batch.loopTypes.size());
+			PyObject *loopOffsets = numpyArray(numpy, "=i8", batch.loopOffsets.data(), batch.loopOffsets.size() * sizeof(long));
+
+			if (loopEnergies == NULL || loopTypes == NULL || loopOffsets == NULL || PyDict_SetItemString(result, "loop_energies", loopEnergies) < 0
+					|| PyDict_SetItemString(result, "loop_types", loopTypes) < 0 || PyDict_SetItemString(result, "loop_offsets", loopOffsets) < 0)
+				Py_CLEAR(result);
+
+			Py_XDECREF(loopEnergies);
+			Py_XDECREF(loopTypes);
+			Py_XDECREF(loopOffsets);
+		}
+	}
+
+	Py_DECREF(numpy);
+
+	return result;
+}
+
 static PyObject *System_calculate_rate(PyObject *self, PyObject *args, PyObject *keywds) {
 
 	SimulationSystem *temp = NULL;
@@ -295,6 +642,7 @@ static PyObject *System_calculate_rate(PyObject *self, PyObject *args, PyObject
 	double start_energy, end_energy;
 	int joinflag = 0;
 	EnergyModel *em = NULL;
+	std::shared_ptr<EnergyModel> model;
 
 	static char *kwlist[] = { "start_energy", "end_energy", "options", "joinflag", NULL };
 
@@ -320,7 +668,9 @@ static PyObject *System_calculate_rate(PyObject *self, PyObject *args, PyObject
 			throw std::invalid_argument("Attempting to load ViennaRNA parameters (depreciated)");
 //        em = new ViennaEnergyModel( options_object );
 		} else {
-			em = new NupackEnergyModel(options_object);
+			PSimOptions options(options_object);
+			model = EnergyModelRegistry::get(&options);
+			em = model.get();
 		}
 
 		if (em == NULL) {
@@ -333,7 +683,7 @@ static PyObject *System_calculate_rate(PyObject *self, PyObject *args, PyObject
 			return NULL;
 		}
 		if (Loop::GetEnergyModel() == NULL) {
-			Loop::SetEnergyModel(em);
+			Loop::SetEnergyModel(model);
 		}
 	}
 
@@ -346,14 +696,93 @@ static PyObject *System_calculate_rate(PyObject *self, PyObject *args, PyObject
 
 	rate = PyFloat_FromDouble(drate);
 
-	if (em != Loop::GetEnergyModel())
-		delete em;
-
 	Py_XDECREF(options_object);
 
 	return rate;
 }
 
+static PyObject *System_calculate_rates(PyObject *self, PyObject *args, PyObject *keywds) {
+
+	PyObject *start_object = NULL;
+	PyObject *end_object = NULL;
+	PyObject *options_object = NULL;
+	PyObject *join_object = NULL;
+	EnergyModel *em = NULL;
+	std::shared_ptr<EnergyModel> model;
+
+	static char *kwlist[] = { "start_energies", "end_energies", "options", "joinflag", NULL };
+
+	if (!PyArg_ParseTupleAndKeywords(args, keywds, "OO|OO:calculate_rates(start_energies, end_energies, [options=None, joinflag=0])", kwlist, &start_object,
+			&end_object, &options_object, &join_object))
+		return NULL;
+
+	em = batchEnergyModel(options_object, model, "rates");
+	if (em == NULL)
+		return NULL;
+
+	PyObject *numpy = PyImport_ImportModule("numpy");
+	if (numpy == NULL)
+		return NULL;
+
+	// broadcast the arguments against each other, then read them as contiguous arrays
+	PyObject *joinflags = join_object == NULL ? PyInt_FromLong(0) : (Py_INCREF(join_object), join_object);
+	PyObject *broadcast = PyObject_CallMethod(numpy, (char *) "broadcast_arrays", (char *) "OOO", start_object, end_object, joinflags);
+	Py_DECREF(joinflags);
+
+	const char *dtypes[3] = { "=f8", "=f8", "=i4" };
+	PyObject *arrays[3] = { NULL, NULL, NULL };
+	Py_buffer views[3];
+	int viewed = 0;
+	PyObject *shape = NULL;
+	PyObject *result = NULL;
+
+	if (broadcast != NULL && PySequence_Check(broadcast) && PySequence_Size(broadcast) == 3) {
+
+		for (; viewed < 3; viewed++) {
+			PyObject *item = PySequence_GetItem(broadcast, viewed);
+			arrays[viewed] = item == NULL ? NULL : PyObject_CallMethod(numpy, (char *) "ascontiguousarray", (char *) "Os", item, dtypes[viewed]);
+			if (viewed == 0 && item != NULL)
+				shape = PyObject_GetAttrString(item, "shape");
+			Py_XDECREF(item);
+			if (arrays[viewed] == NULL || PyObject_GetBuffer(arrays[viewed], &views[viewed], PyBUF_SIMPLE) < 0)
+				break;
+		}
+	}
+
+	if (viewed == 3 && shape != NULL) {
+
+		long count = views[0].len / sizeof(double);
+		const double *start = (const double *) views[0].buf;
+		const double *end = (const double *) views[1].buf;
+		const int *join = (const int *) views[2].buf;
+		vector<double> rates(count);
+
+		for (long i = 0; i < count; i++) {
+			if (join[i] == 1) // join
+				rates[i] = em->getJoinRate();
+			else if (join[i] == 2) // break
+				rates[i] = em->returnRate(start[i], end[i], 3);
+			else
+				rates[i] = em->returnRate(start[i], end[i], 0);
+		}
+
+		PyObject *flat = numpyArray(numpy, "=f8", rates.data(), count * sizeof(double));
+		if (flat != NULL)
+			result = PyObject_CallMethod(flat, (char *) "reshape", (char *) "(O)", shape);
+		Py_XDECREF(flat);
+	}
+
+	for (int i = 0; i < viewed; i++)
+		PyBuffer_Release(&views[i]);
+	for (int i = 0; i < 3; i++)
+		Py_XDECREF(arrays[i]);
+	Py_XDECREF(shape);
+	Py_XDECREF(broadcast);
+	Py_DECREF(numpy);
+
+	return result;
+}
+
 static PyObject *System_run_system(PyObject *self, PyObject *args) {
 #ifdef PROFILING
 	HeapProfilerStart("ssystem_run_system.heap");
@@ -398,7 +827,17 @@ energy_type = 2 ('Complex energy'): include dG_assoc.  This is the NUPACK comple
 energy_type = 3 ('Tube energy'): include dG_volume + dG_assoc.  Summed over complexes, this is the system state energy.\n\
 \n\
 options = None [default]: Use the already initialized energy model.\n\
-options = ...: If not none, should be a multistrand.options.Options object, which will be used for initializing the energy model ONLY if there is not one already present.\n") },
+options = ...: If not none, should be a multistrand.options.Options object, whose energy model is used. It also becomes the default energy model if there is not one already present.\n") },
+				{ "energy_batch", (PyCFunction) System_energy_batch, METH_VARARGS | METH_KEYWORDS,
+						PyDoc_STR(
+								" \
+energy_batch( sequences, structures, options=None, energy_type=0, enthalpy=False, loops=False)\n\
+Computes the energies of many states at once, each a single complex given by a sequence and a dot-paren structure, with '+' between strands. Only the loops of each complex are built, using one energy model for the whole batch, so this is much faster than calling energy() per state. Returns a numpy array with the energy of each state.\n\n\
+Parameters\n\
+sequences, structures: lists of strings of the same length, or a single string that is used for every state.\n\
+options, energy_type: as for energy(). The model for the options is not written to the constants file.\n\
+enthalpy = True: return a dict instead, with the energies as 'dG' and the enthalpies as 'dH' (kcal/mol). The entropy is (dH - dG) / T, with T in Kelvin.\n\
+loops = True: return a dict instead, with the energies as 'dG' and the energy and type ('S'tack, 'H'airpin, 'B'ulge, 'I'nterior, 'M'ulti or 'O'pen) of every loop as 'loop_energies' and 'loop_types'. The loops of state i are at loop_offsets[i] up to loop_offsets[i + 1]. Loop energies include no volume or association terms.\n") },
 				{ "calculate_rate", (PyCFunction) System_calculate_rate, METH_VARARGS | METH_KEYWORDS,
 						PyDoc_STR(
 								" \
@@ -414,12 +853,55 @@ options = ...: If not none, should be a multistrand.options.Options object, whic
 joinflag = 0 [default]: unimolecular transition\n\
 joinflag = 1: bimolecular join, passed energies are not relevant\n\
 joinflag = 2: bimolecular break, energies are relevant\n") },
+				{ "calculate_rates", (PyCFunction) System_calculate_rates, METH_VARARGS | METH_KEYWORDS,
+						PyDoc_STR(
+								" \
+calculate_rates(start_energies, end_energies, options=None, joinflag=0)\n\
+Computes the rates of many transitions at once, as calculate_rate does for one. The arguments are numpy arrays or anything numpy can turn into one, and are broadcast against each other. Returns a numpy array of rates with the broadcast shape.\n\
+\n\
+Parameters\n\
+start_energies, end_energies: Energies should always be WITHOUT dG_assoc and dG_volume.\n\
+\n\
+options = None [default]: Use the already initialized energy model.\n\
+options = ...: If not none, should be a multistrand.options.Options object; the cached model for its conditions is used, see energy_model_cache. Sets the default energy model for later calls ONLY if there is not one already present.\n\
+\n\
+joinflag: 0, 1 or 2 as for calculate_rate, either for all transitions or per transition.\n") },
 				{ "initialize_energy_model", (PyCFunction) System_initialize_energymodel, METH_VARARGS,
 						PyDoc_STR(
 								" \
 initialize_energy_model( options = None )\n\
-Initialize the Multistrand module's energy model using the options object given. If a model already exists, this will remove the old model and create a new one - useful for certain parameter changes, but should be avoided if possible. This function is NOT required to use other parts of the module - by default they will create the model if it's not found, or use the one already initialized; this adds control over exactly what model is being used.\n\n\
-options [default=None]: when no options object is passed, this removes the old energy model and does not create a new one.\n") },
+Set the Multistrand module's default energy model, used by energy() and calculate_rate() when no options are passed, to the model for the options object given. Models are cached by their conditions (see energy_model_cache), so this only reads the parameter files if no model for these conditions exists yet. This function is NOT required to use other parts of the module - SimSystem always uses the model matching its own options.\n\n\
+options [default=None]: when no options object is passed, this removes the default energy model and does not set a new one.\n") },
+				{ "energy_model_cache", (PyCFunction) System_energy_model_cache, METH_VARARGS,
+						PyDoc_STR(
+								" \
+energy_model_cache( capacity = None )\n\
+Energy models are built once per set of conditions (substrate, temperature, salt, dangles, rate model, ...) and kept in a cache, so systems with the same conditions share a model and skip reading the parameter files. Returns a dict with the size and capacity of the cache, and the number of hits and misses so far.\n\n\
+capacity [default=None]: if given, the number of models kept; the least recently used models are removed first. 0 disables the cache.\n") },
+				{ "clear_energy_model_cache", (PyCFunction) System_clear_energy_model_cache, METH_VARARGS,
+						PyDoc_STR(
+								" \
+clear_energy_model_cache( )\n\
+Removes all energy models from the cache. Models still used by a SimSystem or as the default model stay alive until released.\n") },
+				{ "loop_energy_cache", (PyCFunction) System_loop_energy_cache, METH_VARARGS,
+						PyDoc_STR(
+								" \
+loop_energy_cache( capacity = None )\n\
+Hairpin, interior, multi- and open loop energies can be cached per thread, keyed by the bases and side lengths of the loop, so loops that recur during a simulation (for example in branch migration) are not recomputed. Returns a dict with the number of energies cached by the calling thread, the capacity of each thread's cache, and the number of hits and misses so far, including those of SimSystem worker threads that have finished.\n\n\
+The cache is off by default: with the Nupack parameter tables a lookup costs about as much as computing the energy. Turn it on to measure the hit rate of a workload.\n\n\
+capacity [default=None]: if given, the number of entries in each thread's cache, rounded up to a power of two; a new energy replaces the one in its slot. 0 disables the cache. Setting the capacity empties the caches and resets the counts.\n") },
+				{ "clear_loop_energy_cache", (PyCFunction) System_clear_loop_energy_cache, METH_VARARGS,
+						PyDoc_STR(
+								" \
+clear_loop_energy_cache( )\n\
+Empties the loop energy caches of all threads and resets the hit and miss counts.\n") },
+				{ "compile_parameters", (PyCFunction) System_compile_parameters, METH_VARARGS,
+						PyDoc_STR(
+								" \
+compile_parameters( options, path )\n\
+Reads the parameter files for the substrate and parameter file settings in options and writes them to path as a binary parameter set. Setting Options.compiled_parameters to this path lets energy models map the file instead of parsing the parameter files. The set holds the parameters at 37 C and is valid for any temperature and salt conditions.\n\n\
+options: a multistrand.options.Options object.\n\
+path: the file to write, it is overwritten if it exists.\n") },
 				{ "run_system", (PyCFunction) System_run_system, METH_VARARGS, PyDoc_STR(
 						" \
 run_system( options )\n\
@@ -67,6 +67,20 @@ identList::identList(long newuid, char *newid, class identList *old) {
 	next = old;
 }
 
+/*
+ identList *identList::copy( void )
+
+ Returns a new list with the same entries; StrandOrdering takes ownership of
+ the list it is given, so a start state used more than once hands out copies.
+ */
+
+identList *identList::copy(void) {
+	identList *rest = (next != NULL) ? next->copy() : NULL;
+	identList *copy = new identList(uid, id, rest);
+	copy->index = index;
+	return copy;
+}
+
 std::string identList::toString() {
 
 	if (id != NULL) {
@@ -0,0 +1,230 @@
+"""
+Reader for the binary trajectory files written when Options.output_file is set.
+
+The file holds a header with the strand table, followed by one fixed size
+record per exported state (see include/trajectoryfile.h for the layout). The
+records are opened with numpy.memmap, so states are only read from disk and
+turned into dot-paren structures when they are accessed.
+
+Files written with Options.output_delta hold keyframes with the full record
+and, in between, entries with only the base pairs that changed. Any state is
+decoded from the nearest keyframe before it.
+"""
+import struct
+
+import numpy as np
+
+
+MAGIC = "MSTRAJ1\0"
+DELTA_MAGIC = "MSTRAJD\0"
+
+KEYFRAME = 0
+DELTA = 1
+
+
+class TrajectoryFile(object):
+    """ A trajectory file written by the simulator.
+
+    strands:    list of (uid, name, sequence) tuples, in the order of the
+                global base indices.
+    records:    numpy record array (memory mapped) with fields seed, time,
+                arr_type, complex_count, energies, ids, strands,
+                strand_complex and pairs. For delta encoded files, these are
+                the keyframes only.
+    times, seeds, arr_types: per state, as numpy arrays.
+
+    Indexing or iterating gives states in the format of
+    Options.full_trajectory: a list of (seed, id, names, sequence, structure,
+    energy) tuples, one per complex. """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            head = f.read(len(MAGIC) + 16)
+            if head[:len(MAGIC)] not in (MAGIC, DELTA_MAGIC):
+                raise ValueError("{0} is not a Multistrand trajectory file.".format(path))
+
+            self.delta = head[:len(MAGIC)] == DELTA_MAGIC
+            header_size, record_size, strand_count, base_count = struct.unpack("=4i", head[len(MAGIC):])
+
+            self.strands = []
+            for _ in range(strand_count):
+                uid, length, name_length = struct.unpack("=3i", f.read(12))
+                name = f.read(name_length)
+                sequence = f.read(length)
+                self.strands.append((uid, name, sequence))
+
+        self.path = path
+        self.strand_count = strand_count
+        self.base_count = base_count
+        self.base_offsets = np.zeros(strand_count + 1, dtype=np.intp)
+        np.cumsum([len(s[2]) for s in self.strands], out=self.base_offsets[1:])
+
+        self.dtype = np.dtype({
+            'names': ['seed', 'time', 'arr_type', 'complex_count', 'energies',
+                      'ids', 'strands', 'strand_complex', 'pairs'],
+            'formats': ['=i8', '=f8', '=i4', '=i4', ('=f8', strand_count),
+                        ('=i4', strand_count), ('=i4', strand_count),
+                        ('=i4', strand_count), ('=i4', base_count)],
+            'offsets': [0, 8, 16, 20, 24, 24 + 8 * strand_count,
+                        24 + 12 * strand_count, 24 + 16 * strand_count,
+                        24 + 20 * strand_count],
+            'itemsize': record_size})
+
+        if self.delta:
+            self._index_entries(header_size, record_size)
+        else:
+            self._map_records(header_size, record_size)
+
+    def _map_records(self, header_size, record_size):
+        with open(self.path, "rb") as f:
+            f.seek(0, 2)
+            count = (f.tell() - header_size) // record_size
+
+        if count > 0:
+            self.records = np.memmap(self.path, dtype=self.dtype, mode='r',
+                                     offset=header_size, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=self.dtype)
+
+        self.times = self.records['time']
+        self.seeds = self.records['seed']
+        self.arr_types = self.records['arr_type']
+
+    def _index_entries(self, header_size, record_size):
+        """ Walks the entries once, noting where each one starts and which
+        keyframe it is decoded from. """
+        data = np.memmap(self.path, dtype=np.uint8, mode='r')
+        self.data = data
+
+        offsets, keyframes, times, seeds, arr_types = [], [], [], [], []
+        keyframe_offsets = []
+        position = header_size
+        seed = 0
+
+        while position + 8 <= len(data):
+            kind, size = np.frombuffer(data, dtype='=i4', count=2, offset=position)
+            if size <= 0 or position + size > len(data):
+                break  # truncated entry at the end of the file
+
+            if kind == KEYFRAME:
+                keyframe_offsets.append(position + 8)
+                seed, time, arr_type = struct.unpack_from("=qdi", data, position + 8)
+            else:
+                time, arr_type = struct.unpack_from("=di", data, position + 8)
+
+            offsets.append(position)
+            keyframes.append(len(keyframe_offsets) - 1)
+            times.append(time)
+            seeds.append(seed)
+            arr_types.append(arr_type)
+            position += size
+
+        self.offsets = np.array(offsets, dtype=np.intp)
+        self.keyframes = np.array(keyframes, dtype=np.intp)
+        self.keyframe_entries = np.flatnonzero(np.diff(np.concatenate(([-1], self.keyframes))))
+        self.times = np.array(times, dtype=np.float64)
+        self.seeds = np.array(seeds, dtype=np.int64)
+        self.arr_types = np.array(arr_types, dtype=np.int32)
+
+        self.records = np.zeros(len(keyframe_offsets), dtype=self.dtype)
+        for i, offset in enumerate(keyframe_offsets):
+            self.records[i] = np.frombuffer(data, dtype=self.dtype, count=1, offset=offset)[0]
+
+        self._decoded = None  # (index, one element array) of the last decoded state
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, i):
+        return self.state(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.state(i)
+
+    def record(self, i):
+        """ Returns state i as a numpy record of self.dtype. """
+        if not self.delta:
+            return self.records[i]
+
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("state index out of range")
+
+        keyframe = self.keyframes[i]
+        if self._decoded is not None and self.keyframes[self._decoded[0]] == keyframe and self._decoded[0] <= i:
+            j, current = self._decoded[0], self._decoded[1].copy()
+        else:
+            j, current = self.keyframe_entries[keyframe], self.records[keyframe:keyframe + 1].copy()
+
+        for k in range(j + 1, i + 1):
+            self._apply_delta(current[0], self.offsets[k])
+
+        self._decoded = (i, current)
+        return current[0]
+
+    def _apply_delta(self, current, offset):
+        data = self.data
+        time, arr_type, count, changes, topology = struct.unpack_from("=diiii", data, offset + 8)
+        position = offset + 32
+
+        current['time'] = time
+        current['arr_type'] = arr_type
+        current['complex_count'] = count
+        current['energies'][:count] = np.frombuffer(data, dtype='=f8', count=count, offset=position)
+        position += 8 * count
+        current['ids'][:count] = np.frombuffer(data, dtype='=i4', count=count, offset=position)
+        position += 4 * count
+
+        if topology:
+            current['strands'] = np.frombuffer(data, dtype='=i4', count=self.strand_count, offset=position)
+            position += 4 * self.strand_count
+            current['strand_complex'] = np.frombuffer(data, dtype='=i4', count=self.strand_count, offset=position)
+            position += 4 * self.strand_count
+
+        if changes:
+            change = np.frombuffer(data, dtype='=i4', count=2 * changes, offset=position).reshape(changes, 2)
+            current['pairs'][change[:, 0]] = change[:, 1]
+
+    def state(self, i):
+        """ Returns state i as a list of (seed, id, names, sequence,
+        structure, energy) tuples, one per complex. """
+        record = self.record(i)
+        pairs = record['pairs']
+        strands = record['strands']
+        strand_complex = record['strand_complex']
+
+        output = []
+        begin = 0
+        for c in range(record['complex_count']):
+            end = begin
+            while end < len(strands) and strand_complex[end] == c:
+                end += 1
+
+            members = strands[begin:end]
+            bases = np.concatenate([np.arange(self.base_offsets[s], self.base_offsets[s + 1]) for s in members])
+
+            # position of each global base index in the flat structure of this complex
+            position = np.full(self.base_offsets[-1], -1, dtype=np.intp)
+            position[bases] = np.arange(len(bases))
+
+            partner = pairs[bases]
+            flat = np.full(len(bases), '.', dtype='S1')
+            paired = partner >= 0
+            opening = np.zeros(len(bases), dtype=bool)
+            opening[paired] = position[partner[paired]] > np.arange(len(bases))[paired]
+            flat[opening] = '('
+            flat[paired & ~opening] = ')'
+
+            lengths = np.diff(self.base_offsets)[members]
+            cuts = np.cumsum(lengths)[:-1]
+            structure = "+".join(part.tostring() for part in np.split(flat, cuts))
+            sequence = "+".join(self.strands[s][2] for s in members)
+            names = ",".join("{0}:{1}".format(self.strands[s][0], self.strands[s][1]) for s in members)
+
+            output.append((int(record['seed']), int(record['ids'][c]), names, sequence,
+                           structure, float(record['energies'][c])))
+            begin = end
+
+        return output
@@ -19,11 +19,13 @@
 
 using std::string;
 
-EnergyModel* Loop::energyModel = NULL;
+thread_local EnergyModel* Loop::energyModel = NULL;
+thread_local int Loop::moveContainerType = MOVECONTAINER_LIST;
+std::shared_ptr<EnergyModel> Loop::defaultEnergyModel;
 
 struct RateArr;
 
-inline double Loop::getEnergy(void) {
+double Loop::getEnergy(void) {
 
 	if (energyComputed)
 		return energy;
@@ -98,6 +100,29 @@ double Loop::returnFlux(Loop *comefrom) {
 	return total;
 }
 
+void Loop::indexFlux(Loop *comefrom, vector<Loop*>& loops, vector<double>& cumulative) {
+
+	double total = cumulative.empty() ? 0.0 : cumulative.back();
+
+	loops.push_back(this);
+	cumulative.push_back(total + totalRate);
+
+	for (int loop = 0; loop < curAdjacent; loop++) {
+
+		if (adjacentLoops[loop] != comefrom) {
+			adjacentLoops[loop]->indexFlux(this, loops, cumulative);
+		}
+
+		assert(adjacentLoops[loop] != NULL);
+	}
+}
+
+Move *Loop::getLocalChoice(double *randomchoice) {
+
+	return moves->getChoice(randomchoice);
+
+}
+
 void Loop::firstGen(Loop *comefrom) {
 
 	generateMoves();
@@ -111,8 +136,48 @@ void Loop::firstGen(Loop *comefrom) {
 
 }
 
-inline double Loop::getTotalRate(void) {
-	return totalRate;
+void CopyMap::addStrand(char *from, char *to, int size) {
+
+	strand_copy strand = { from, to, size };
+	strands.push_back(strand);
+
+}
+
+// Loops point into the code sequence of a strand, or one base before its start.
+char *CopyMap::map(char *location) {
+
+	if (location == NULL)
+		return NULL;
+
+	for (strand_copy& strand : strands)
+		if (location >= strand.from - 1 && location <= strand.from + strand.size)
+			return strand.to + (location - strand.from);
+
+	assert(0);
+	return location;
+
+}
+
+Loop *CopyMap::map(Loop *loop) {
+
+	std::unordered_map<Loop*, Loop*>::iterator copy = loops.find(loop);
+
+	return (copy == loops.end()) ? NULL : copy->second;
+
+}
+
+void Loop::copyLinks(CopyMap& map) {
+
+	if (adjacentLoops != NULL) {
+		Loop **adjacent = adjacentLoops;
+		adjacentLoops = new Loop *[numAdjacent];
+		for (int index = 0; index < numAdjacent; index++)
+			adjacentLoops[index] = (index < curAdjacent) ? map.map(adjacent[index]) : NULL;
+	}
+
+	if (moves != NULL)
+		moves = moves->copy(map);
+
 }
 
 Loop::Loop(void) {
@@ -176,12 +241,32 @@ int Loop::replaceAdjacent(Loop *loopToReplace, Loop *loopToReplaceWith) {
 	return 0;
 }
 
-void Loop::SetEnergyModel(EnergyModel *newEnergyModel) {
+void Loop::SetEnergyModel(std::shared_ptr<EnergyModel> newEnergyModel) {
+	defaultEnergyModel = newEnergyModel;
+	energyModel = newEnergyModel.get();
+}
+
+// Sets the model used by loops on the calling thread only.
+void Loop::SetActiveEnergyModel(EnergyModel *newEnergyModel) {
 	energyModel = newEnergyModel;
 }
 
 EnergyModel *Loop::GetEnergyModel(void) {
-	return energyModel;
+	return defaultEnergyModel.get();
+}
+
+void Loop::SetMoveContainerType(int newType) {
+	moveContainerType = newType;
+}
+
+int Loop::GetMoveContainerType(void) {
+	return moveContainerType;
+}
+
+MoveContainer *Loop::newMoveContainer(int initial_size) {
+	if (moveContainerType == MOVECONTAINER_TREE)
+		return new MoveTree(initial_size);
+	return new MoveList(initial_size);
 }
 
 void Loop::performComplexSplit(Move *move, Loop **firstOpen, Loop **secondOpen) {
@@ -343,7 +428,7 @@ void Loop::generateAndSaveDeleteMove(Loop* input, int position) {
 
 		RateEnv rateEnv = RateEnv(tempRate.rate, energyModel, tempRate.left, tempRate.right);
 
-		moves->addMove(new Move(MOVE_DELETE | MOVE_1, rateEnv, this, input, position));
+		moves->addMove(Move(MOVE_DELETE | MOVE_1, rateEnv, this, input, position));
 
 	}
 
@@ -2572,7 +2657,7 @@ void StackLoop::generateDeleteMoves(void) {
 	double temprate;
 	if (moves != NULL)
 		delete moves;
-	moves = new MoveList(0); // always have 2 delete moves, no shift moves and no creation moves.
+	moves = newMoveContainer(0); // always have 2 delete moves, no shift moves and no creation moves.
 
 	generateAndSaveDeleteMove(adjacentLoops[0], 0);
 	generateAndSaveDeleteMove(adjacentLoops[1], 1);
@@ -2660,6 +2745,16 @@ char *StackLoop::verifyLoop(char *incoming_sequence, Loop *from) {
 	return NULL;
 }
 
+Loop *StackLoop::copy(void) {
+	return new StackLoop(*this);
+}
+
+void StackLoop::copyLinks(CopyMap& map) {
+	Loop::copyLinks(map);
+	seqs[0] = map.map(seqs[0]);
+	seqs[1] = map.map(seqs[1]);
+}
+
 StackLoop::StackLoop(void) {
 	numAdjacent = 2;
 	adjacentLoops = new Loop *[2];
@@ -2700,6 +2795,15 @@ string StackLoop::typeInternalsToString(void) {
  HairpinLoop Functions
  */
 
+Loop *HairpinLoop::copy(void) {
+	return new HairpinLoop(*this);
+}
+
+void HairpinLoop::copyLinks(CopyMap& map) {
+	Loop::copyLinks(map);
+	hairpin_seq = map.map(hairpin_seq);
+}
+
 HairpinLoop::HairpinLoop(void) {
 	numAdjacent = 1;
 	adjacentLoops = new Loop *[1];
@@ -2829,14 +2933,14 @@ void HairpinLoop::generateMoves(void) {
 		if (moves != NULL)
 			delete moves;
 
-		moves = new MoveList(0);
+		moves = newMoveContainer(0);
 		totalRate = 0.0;
 		generateDeleteMoves();
 		return;
 	} else {
 		if (moves != NULL)
 			delete moves;
-		moves = new MoveList(1);
+		moves = newMoveContainer(1);
 
 		// Indice 0 is the starting hairpin base. hairpinsize+1 is the ending hairpin base. Thus we want to start at hairpin indice 1, and go to hairpinsize - 3. (which could pair to indice hairpinsize)
 		for (loop = 1; loop <= hairpinsize - 4; loop++)
@@ -2860,7 +2964,7 @@ void HairpinLoop::generateMoves(void) {
 
 						// stack and hairpin, so this is loop and stack
 						rateEnv = RateEnv(tempRate, energyModel, loopMove, stackMove);
-						moves->addMove(new Move(MOVE_CREATE | MOVE_1, rateEnv, this, loop, loop2));
+						moves->addMove(Move(MOVE_CREATE | MOVE_1, rateEnv, this, loop, loop2));
 
 					}
 					// bulge + hairpin
@@ -2878,7 +2982,7 @@ void HairpinLoop::generateMoves(void) {
 						// new bulgeloop + hairpin: this is openMove and stackLoopMove
 
 						rateEnv = RateEnv(tempRate, energyModel, loopMove, stackLoopMove);
-						moves->addMove(new Move(MOVE_CREATE | MOVE_2, rateEnv, this, loop, loop2));
+						moves->addMove(Move(MOVE_CREATE | MOVE_2, rateEnv, this, loop, loop2));
 
 					} else // interior loop + hairpin case.
 					{
@@ -2893,7 +2997,7 @@ void HairpinLoop::generateMoves(void) {
 
 						rateEnv = RateEnv(tempRate, energyModel, loopMove, loopMove);
 
-						moves->addMove(new Move(MOVE_CREATE | MOVE_3, rateEnv, this, loop, loop2));
+						moves->addMove(Move(MOVE_CREATE | MOVE_3, rateEnv, this, loop, loop2));
 					}
 				}
 			}
@@ -2957,6 +3061,16 @@ char *HairpinLoop::verifyLoop(char *incoming_sequence, Loop *from) {
  BulgeLoop Functions
  */
 
+Loop *BulgeLoop::copy(void) {
+	return new BulgeLoop(*this);
+}
+
+void BulgeLoop::copyLinks(CopyMap& map) {
+	Loop::copyLinks(map);
+	bulge_seq[0] = map.map(bulge_seq[0]);
+	bulge_seq[1] = map.map(bulge_seq[1]);
+}
+
 BulgeLoop::BulgeLoop(void) {
 	numAdjacent = 2;
 	adjacentLoops = new Loop *[2];
@@ -3094,14 +3208,14 @@ void BulgeLoop::generateMoves(void) {
 		if (moves != NULL)
 			delete moves;
 
-		moves = new MoveList(0);
+		moves = newMoveContainer(0);
 		totalRate = 0.0;
 		generateDeleteMoves();
 		return;
 	} else {
 		if (moves != NULL)
 			delete moves;
-		moves = new MoveList(bsize); // what's the optimal #?
+		moves = newMoveContainer(bsize); // what's the optimal #?
 
 		// Indice 0 is the starting bulge base. bulgesize+1 is the ending hairpin base. Thus we want to start at hairpin indice 1, and go to hairpinsize - 4. (which could pair to indice hairpinsize)
 		for (loop = 1; loop <= bsize - 4; loop++)
@@ -3158,7 +3272,7 @@ void BulgeLoop::generateMoves(void) {
 
 					rateEnv = RateEnv(tempRate, energyModel, loopMove, multiMove);
 
-					moves->addMove(new Move(MOVE_CREATE, rateEnv, this, loop, loop2));
+					moves->addMove(Move(MOVE_CREATE, rateEnv, this, loop, loop2));
 				}
 			}
 	}
@@ -3236,6 +3350,16 @@ char *BulgeLoop::verifyLoop(char *incoming_sequence, Loop *from) {
  InteriorLoop functions
  */
 
+Loop *InteriorLoop::copy(void) {
+	return new InteriorLoop(*this);
+}
+
+void InteriorLoop::copyLinks(CopyMap& map) {
+	Loop::copyLinks(map);
+	int_seq[0] = map.map(int_seq[0]);
+	int_seq[1] = map.map(int_seq[1]);
+}
+
 InteriorLoop::InteriorLoop(void) {
 	numAdjacent = 2;
 	adjacentLoops = new Loop *[2];
@@ -3459,7 +3583,7 @@ void InteriorLoop::generateMoves(void) {
 // Creation moves
 	if (moves != NULL)
 		delete moves;
-	moves = new MoveList(nummoves);
+	moves = newMoveContainer(nummoves);
 
 // three loops here, the first is only side 0's possible creation moves
 //                   the second is only side 1's possible creation moves
@@ -3487,7 +3611,7 @@ void InteriorLoop::generateMoves(void) {
 				MoveType multiMove = energyModel->prefactorInternal(sidelen[0], sidelen[1]);
 				rateEnv = RateEnv(tempRate, energyModel, multiMove, loopMove);
 
-				moves->addMove(new Move(MOVE_CREATE | MOVE_1, rateEnv, this, loop, loop2));
+				moves->addMove(Move(MOVE_CREATE | MOVE_1, rateEnv, this, loop, loop2));
 			}
 		}
 	}
@@ -3511,7 +3635,7 @@ void InteriorLoop::generateMoves(void) {
 				MoveType multiMove = energyModel->prefactorInternal(sidelen[1], sidelen[2]);
 				rateEnv = RateEnv(tempRate, energyModel, loopMove, multiMove);
 
-				moves->addMove(new Move(MOVE_CREATE | MOVE_2, rateEnv, this, loop, loop2));
+				moves->addMove(Move(MOVE_CREATE | MOVE_2, rateEnv, this, loop, loop2));
 			}
 		}
 
@@ -3556,7 +3680,7 @@ void InteriorLoop::generateMoves(void) {
 				// interior loop is closing, so this could be anything.
 				rateEnv = RateEnv(tempRate, energyModel, leftMove, rightMove);
 
-				moves->addMove(new Move(MOVE_CREATE | MOVE_3, rateEnv, this, loop, loop2));
+				moves->addMove(Move(MOVE_CREATE | MOVE_3, rateEnv, this, loop, loop2));
 			}
 		}
 
@@ -3641,6 +3765,27 @@ void InteriorLoop::printMove(Loop *comefrom, char *structure_p, char *seq_p) {
 
 /* MultiLoop functions */
 
+Loop *MultiLoop::copy(void) {
+	return new MultiLoop(*this);
+}
+
+void MultiLoop::copyLinks(CopyMap& map) {
+
+	Loop::copyLinks(map);
+
+	int *sides = sidelen;
+	char **sequences = seqs;
+
+	sidelen = new int[numAdjacent];
+	seqs = new char *[numAdjacent];
+
+	for (int index = 0; index < numAdjacent; index++) {
+		sidelen[index] = sides[index];
+		seqs[index] = map.map(sequences[index]);
+	}
+
+}
+
 MultiLoop::MultiLoop(void) {
 	numAdjacent = 0;
 	adjacentLoops = NULL;
@@ -3947,7 +4092,7 @@ void MultiLoop::generateMoves(void) {
 
 	if (moves != NULL)
 		delete moves;
-	moves = new MoveList(sidelen[0] + 1);
+	moves = newMoveContainer(sidelen[0] + 1);
 // This is almost identical to OpenLoop::generateMoves, which was written first.
 //  Several options here:
 //     #1: creation move within a side this results in a hairpin and a multi loop with 1 greater magnitude.
@@ -4010,7 +4155,7 @@ void MultiLoop::generateMoves(void) {
 
 					rateEnv = RateEnv(tempRate, energyModel, loopMove, rightMove);
 
-					moves->addMove(new Move(MOVE_CREATE | MOVE_1, rateEnv, this, loop, loop2, loop3));
+					moves->addMove(Move(MOVE_CREATE | MOVE_1, rateEnv, this, loop, loop2, loop3));
 				}
 			}
 		}
@@ -4078,7 +4223,7 @@ void MultiLoop::generateMoves(void) {
 					MoveType rightMove = energyModel->prefactorInternal(sideLengths[loop3], sideLengths[loop4]);
 
 					rateEnv = RateEnv(tempRate, energyModel, leftMove, rightMove);
-					moves->addMove(new Move(MOVE_CREATE | MOVE_2, rateEnv, this, loop, loop2, loop3));
+					moves->addMove(Move(MOVE_CREATE | MOVE_2, rateEnv, this, loop, loop2, loop3));
 				}
 			}
 		}
@@ -4158,7 +4303,7 @@ void MultiLoop::generateMoves(void) {
 						MoveType rightMove = energyModel->prefactorInternal(sideLengths[loop3], sideLengths[loop4]);
 
 						rateEnv = RateEnv(tempRate, energyModel, leftMove, rightMove);
-						moves->addMove(new Move(MOVE_CREATE | MOVE_3, rateEnv, this, loops));
+						moves->addMove(Move(MOVE_CREATE | MOVE_3, rateEnv, this, loops));
 					}
 
 				}
@@ -4252,6 +4397,28 @@ char *MultiLoop::verifyLoop(char *incoming_sequence, Loop *from) {
 }
 
 /* OpenLoop functions */
+Loop *OpenLoop::copy(void) {
+	return new OpenLoop(*this);
+}
+
+// an open loop has one more side than it has adjacent loops.
+void OpenLoop::copyLinks(CopyMap& map) {
+
+	Loop::copyLinks(map);
+
+	int *sides = sidelen;
+	char **sequences = seqs;
+
+	sidelen = new int[numAdjacent + 1];
+	seqs = new char *[numAdjacent + 1];
+
+	for (int index = 0; index < numAdjacent + 1; index++) {
+		sidelen[index] = sides[index];
+		seqs[index] = map.map(sequences[index]);
+	}
+
+}
+
 OpenLoop::OpenLoop(void) {
 	numAdjacent = 0;
 	adjacentLoops = NULL;
@@ -4564,7 +4731,7 @@ void OpenLoop::generateMoves(void) {
 
 	if (moves != NULL)
 		delete moves;
-	moves = new MoveList(1);
+	moves = newMoveContainer(1);
 //  Several options here:
 //     #1: creation move within a side this results in a hairpin and a open loop with 1 greater magnitude.
 //     #2a: creation move between sides resulting in a stack and open loop
@@ -4621,8 +4788,7 @@ void OpenLoop::generateMoves(void) {
 					MoveType rightMove = energyModel->prefactorOpen(loop3, numAdjacent + 2, sideLengths);
 					rateEnv = RateEnv(tempRate, energyModel, loopMove, rightMove);
 
-					Move *tmove = new Move(MOVE_CREATE | MOVE_1, rateEnv, this, loop, loop2, loop3);
-					moves->addMove(tmove);
+					moves->addMove(Move(MOVE_CREATE | MOVE_1, rateEnv, this, loop, loop2, loop3));
 				}
 			}
 		}
@@ -4694,7 +4860,7 @@ void OpenLoop::generateMoves(void) {
 					MoveType rightMove = energyModel->prefactorOpen(loop3, numAdjacent + 1, sideLengths);
 
 					rateEnv = RateEnv(tempRate, energyModel, leftMove, rightMove);
-					moves->addMove(new Move(MOVE_CREATE | MOVE_2, rateEnv, this, loop, loop2, loop3));
+					moves->addMove(Move(MOVE_CREATE | MOVE_2, rateEnv, this, loop, loop2, loop3));
 				}
 			}
 
@@ -4765,7 +4931,7 @@ void OpenLoop::generateMoves(void) {
 
 						rateEnv = RateEnv(tempRate, energyModel, leftMove, rightMove);
 
-						moves->addMove(new Move(MOVE_CREATE | MOVE_3, rateEnv, this, loops));
+						moves->addMove(Move(MOVE_CREATE | MOVE_3, rateEnv, this, loops));
 					}
 
 				}
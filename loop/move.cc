@@ -7,6 +7,7 @@ help@multistrand.org
 // TEST
 #include <stdio.h>
 #include <assert.h>
+#include <string.h>
 #include <string>
 #include <sstream>
 #include <iomanip>
@@ -151,11 +152,11 @@ Move::~Move(void) {
 	affected[0] = affected[1] = NULL;
 }
 
-double Move::getRate(void) {
+double Move::getRate(void) const {
 	return rate.rate;
 }
 
-int Move::getType(void) {
+int Move::getType(void) const {
 	return type;
 }
 
@@ -220,176 +221,360 @@ string Move::toString(bool useArr) {
 //
 ///* MoveList */
 
-MoveList::MoveList(int initial_size) {
-	totalrate = 0.0;
-	moves_size = initial_size;
-	if (moves_size >= 1) {
-		moves = new Move *[moves_size];
+/*
 
-		for (moves_index = 0; moves_index < moves_size; moves_index++)
-			moves[moves_index] = NULL;
+ MoveArray
 
-		moves_index = 0;
-	} else {
-		moves = NULL;
-		moves_size = 0;
-		moves_index = 0;
+ */
+
+MoveArray::MoveArray(void) {
+	count = 0;
+	capacity = 0;
+	block = NULL;
+	rates = NULL;
+	partners = NULL;
+	arrTypes = NULL;
+	indices = NULL;
+	types = NULL;
+	owner = NULL;
+}
+
+MoveArray::~MoveArray(void) {
+	ObjectPool::release(block, capacity * bytesPerMove);
+}
+
+// the columns are laid out one after the other in a block from the active ObjectPool, widest first so each stays aligned.
+void MoveArray::reserve(int size) {
+
+	if (size <= capacity)
+		return;
+
+	char *newBlock = (char *) ObjectPool::allocate(size * bytesPerMove);
+	double *newRates = (double *) newBlock;
+	Loop **newPartners = (Loop **) (newRates + size);
+	int *newArrTypes = (int *) (newPartners + size);
+	int *newIndices = newArrTypes + size;
+	unsigned char *newTypes = (unsigned char *) (newIndices + 4 * size);
+
+	if (count > 0) {
+		memcpy(newRates, rates, count * sizeof(double));
+		memcpy(newPartners, partners, count * sizeof(Loop *));
+		memcpy(newArrTypes, arrTypes, count * sizeof(int));
+		memcpy(newIndices, indices, 4 * count * sizeof(int));
+		memcpy(newTypes, types, count);
 	}
 
-	del_moves = NULL;
-	del_moves_size = 0;
-	del_moves_index = 0;
+	ObjectPool::release(block, capacity * bytesPerMove);
+
+	block = newBlock;
+	rates = newRates;
+	partners = newPartners;
+	arrTypes = newArrTypes;
+	indices = newIndices;
+	types = newTypes;
+	capacity = size;
+
+}
+
+void MoveArray::add(const Move& move) {
+
+	if (count == capacity)
+		reserve(capacity < 2 ? 2 : capacity * 2);
+
+	assert(count == 0 || owner == move.affected[0]);
+	owner = move.affected[0];
+
+	rates[count] = move.rate.rate;
+	partners[count] = move.affected[1];
+	arrTypes[count] = move.rate.arrType;
+	memcpy(indices + 4 * count, move.index, 4 * sizeof(int));
+	types[count] = move.type;
+	count++;
+
+}
+
+void MoveArray::copy(MoveArray& other, CopyMap& map) {
+
+	clear();
+	reserve(other.capacity);
+
+	for (int index = 0; index < other.count; index++) {
+		rates[index] = other.rates[index];
+		partners[index] = map.map(other.partners[index]);
+		arrTypes[index] = other.arrTypes[index];
+		types[index] = other.types[index];
+	}
+
+	memcpy(indices, other.indices, 4 * other.count * sizeof(int));
+
+	count = other.count;
+	owner = map.map(other.owner);
+
+}
+
+void MoveArray::clear(void) {
+	count = 0;
+}
+
+Move *MoveArray::get(int index) {
+
+	current.type = types[index];
+	current.rate.rate = rates[index];
+	current.rate.arrType = arrTypes[index];
+	memcpy(current.index, indices + 4 * index, 4 * sizeof(int));
+	current.affected[0] = owner;
+	current.affected[1] = partners[index];
+
+	return &current;
+
+}
+
+/*
+
+ MoveList
+
+ */
+
+MoveList::MoveList(int initial_size) {
+	totalrate = 0.0;
+	moves.reserve(initial_size);
 	int_index = 0;
 }
 
 MoveList::~MoveList(void) {
-	int iter = 0;
-	// must remove all moves in the movelist.
-	while (iter < moves_index) {
-		if (moves[iter] != NULL) {
-			delete moves[iter];
-			moves[iter] = NULL;
-		}
-		iter++;
-	}
-	if (moves != NULL)
-		delete[] moves;
-
-	iter = 0;
-	while (iter < del_moves_index) {
-		if (del_moves[iter] != NULL) {
-			delete del_moves[iter];
-			del_moves[iter] = NULL;
-		}
-		iter++;
-	}
-	if (del_moves != NULL)
-		delete[] del_moves;
 }
 
-void MoveList::resetDeleteMoves(void) {
-	int iter = 0;
-	while (iter < del_moves_index) {
-		if (del_moves[iter] != NULL) {
-			delete del_moves[iter];
-			del_moves[iter] = NULL;
-		}
-		iter++;
-	}
-	if (del_moves != NULL)
-		delete[] del_moves;
+MoveContainer *MoveList::copy(CopyMap& map) {
+
+	MoveList *copy = new MoveList(0);
+
+	copy->totalrate = totalrate;
+	copy->int_index = int_index;
+	copy->moves.copy(moves, map);
+	copy->del_moves.copy(del_moves, map);
+
+	return copy;
 
-	if (del_moves == NULL) {
-		del_moves = new Move *[2];
-		del_moves_size = 2;
-	}
-	del_moves_index = 0;
+}
+
+void MoveList::resetDeleteMoves(void) {
+	del_moves.clear();
 }
 
 void MoveList::printAllMoves(bool useArr) {
 
-	for (int i = 0; i < moves_index; i++) {
+	for (int i = 0; i < moves.size(); i++) {
 
 		cout << "Move" << i << " ";
-		cout << moves[i]->toString(useArr);
+		cout << moves.get(i)->toString(useArr);
 
 	}
 
-	for (int i = 0; i < del_moves_index; i++) {
+	for (int i = 0; i < del_moves.size(); i++) {
 
-		cout << "Move" << i + moves_index << " ";
-		cout << del_moves[i]->toString(useArr);
+		cout << "Move" << i + moves.size() << " ";
+		cout << del_moves.get(i)->toString(useArr);
 
 	}
 
 }
 
-void MoveList::addMove(Move *newmove) {
-	int type = newmove->getType();
-	if (!(type & MOVE_DELETE)) {
+void MoveList::addMove(const Move& newmove) {
 
-		moves[moves_index] = newmove;
-		totalrate += newmove->getRate();
-		moves_index++;
-		// next add would be an overflow.
-		if (moves_index == moves_size) {
-			Move **temp = moves;
-			moves = new Move *[moves_size * 2];
-			for (int loop = 0; loop < moves_size * 2; loop++) {
-				if (loop < moves_size) {
-					moves[loop] = temp[loop];
-					temp[loop] = NULL;
-				} else
-					moves[loop] = NULL;
-			}
-			moves_size = moves_size * 2;
-			delete[] temp;
-		}
-	} else // if type is delete move
-	{
-		totalrate += newmove->getRate();
-		if (del_moves == NULL) {
-			del_moves = new Move *[2];
-			del_moves_size = 2;
-			del_moves_index = 0;
-		}
-		// we do the bounds checking in the opposite order as before, as we want the size for deletion moves to default to 2 and not expand except when we are assured we need more, as opposed to creation moves where we pretty much always will need more. Though perhaps I should change it there also so as to remove an extra operation in the end position cases.
-		if (del_moves_index == del_moves_size) {
-			Move **temp = del_moves;
-			del_moves = new Move *[del_moves_size * 2];
-			for (int loop = 0; loop < del_moves_size * 2; loop++) {
-				if (loop < del_moves_size) {
-					del_moves[loop] = temp[loop];
-					temp[loop] = NULL;
-				} else
-					del_moves[loop] = NULL;
-			}
-			del_moves_size = del_moves_size * 2;
-			delete[] temp;
-		}
+	totalrate += newmove.getRate();
+
+	if (newmove.getType() & MOVE_DELETE)
+		del_moves.add(newmove);
+	else
+		moves.add(newmove);
 
-		del_moves[del_moves_index] = newmove;
-		del_moves_index++;
-	}
 }
 
 Move *MoveList::getMove(Move *iterator) {
 	if (iterator == NULL)
 		int_index = 0;
 
-	if (int_index == moves_size)
+	if (int_index == moves.size())
 		return NULL;
 
-	return moves[int_index++];
+	return moves.get(int_index++);
 }
 
 Move *MoveList::getChoice(double *rnd) {
 
-	double tmp;
+	const double *rates = moves.getRates();
 
-	for (int index = 0; index < moves_index + del_moves_index; index++) {
+	for (int index = 0; index < moves.size(); index++) {
+		if (*rnd < rates[index])
+			return moves.get(index);
+		*rnd -= rates[index];
+	}
 
-		if (index < moves_index) {
-			tmp = moves[index]->getRate();
-		} else {
-			tmp = del_moves[index - moves_index]->getRate();
-		}
-		if (*rnd < tmp && index < moves_index) {
-			return moves[index];
-		} else if (*rnd < tmp) {
-//			// TODO
-//			cout << "Returning delete move!! \n ";
-//			cout << del_moves[index - moves_index]->toString(true);
-//			cout.flush();
-			return del_moves[index - moves_index];
-		} else {
-			*rnd -= tmp;
-		}
+	rates = del_moves.getRates();
+
+	for (int index = 0; index < del_moves.size(); index++) {
+		if (*rnd < rates[index])
+			return del_moves.get(index);
+		*rnd -= rates[index];
 	}
+
 	assert(*rnd > 0);
 	assert(0); // should never call for a move from a container unless it will get one.
 	return NULL;
 }
+/*
+
+ MoveTree
+
+ */
+
+MoveTree::MoveTree(int initial_size) {
+	totalrate = 0.0;
+	moves_rate = 0.0;
+	moves.reserve(initial_size);
+	dirty = false;
+	int_index = 0;
+}
+
+MoveTree::~MoveTree(void) {
+}
+
+MoveContainer *MoveTree::copy(CopyMap& map) {
+
+	MoveTree *copy = new MoveTree(0);
+
+	copy->totalrate = totalrate;
+	copy->moves_rate = moves_rate;
+	copy->dirty = dirty;
+	copy->int_index = int_index;
+	copy->moves.copy(moves, map);
+	copy->del_moves.copy(del_moves, map);
+	copy->moves_tree = moves_tree;
+	copy->del_moves_tree = del_moves_tree;
+
+	return copy;
+
+}
+
+void MoveTree::resetDeleteMoves(void) {
+	for (int index = 0; index < del_moves.size(); index++)
+		totalrate -= del_moves.getRate(index);
+	del_moves.clear();
+	del_moves_tree.clear();
+}
+
+void MoveTree::printAllMoves(bool useArr) {
+
+	for (int i = 0; i < moves.size(); i++) {
+
+		cout << "Move" << i << " ";
+		cout << moves.get(i)->toString(useArr);
+
+	}
+
+	for (int i = 0; i < del_moves.size(); i++) {
+
+		cout << "Move" << i + moves.size() << " ";
+		cout << del_moves.get(i)->toString(useArr);
+
+	}
+
+}
+
+void MoveTree::addMove(const Move& newmove) {
+
+	totalrate += newmove.getRate();
+
+	if (newmove.getType() & MOVE_DELETE) {
+		del_moves.add(newmove);
+	} else {
+		moves_rate += newmove.getRate();
+		moves.add(newmove);
+	}
+
+	// moves are added in bulk by Loop::generateMoves, so the sums are built once on the first choice.
+	dirty = true;
+}
+
+Move *MoveTree::getMove(Move *iterator) {
+	if (iterator == NULL)
+		int_index = 0;
+
+	if (int_index == moves.size())
+		return NULL;
+
+	return moves.get(int_index++);
+}
+
+void MoveTree::buildTree(MoveArray& list, vector<double>& tree) {
+
+	int size = list.size();
+	const double *rates = list.getRates();
+
+	tree.assign(size + 1, 0.0);
+	for (int index = 1; index <= size; index++)
+		tree[index] = rates[index - 1];
+
+	// O(n) construction: push every partial sum into its parent.
+	for (int index = 1; index <= size; index++) {
+		int parent = index + (index & -index);
+		if (parent <= size)
+			tree[parent] += tree[index];
+	}
+}
+
+Move *MoveTree::searchTree(MoveArray& list, vector<double>& tree, double *rnd) {
+
+	int size = list.size();
+	int pos = 0;
+	int step = 1;
+
+	if (size == 0)
+		return NULL;
+
+	while (2 * step <= size)
+		step *= 2;
+
+	// find the first move whose cumulative rate exceeds rnd; MoveList makes the same choice with a linear scan.
+	for (; step > 0; step /= 2) {
+		if (pos + step <= size && tree[pos + step] <= *rnd) {
+			pos += step;
+			*rnd -= tree[pos];
+		}
+	}
+
+	// rounding can leave rnd just past the final partial sum; take the last move that has a rate.
+	if (pos == size) {
+		pos = size - 1;
+		while (pos > 0 && list.getRate(pos) <= 0.0)
+			pos--;
+		*rnd = 0.0;
+	}
+
+	return list.get(pos);
+}
+
+Move *MoveTree::getChoice(double *rnd) {
+
+	Move *choice;
+
+	if (dirty) {
+		buildTree(moves, moves_tree);
+		buildTree(del_moves, del_moves_tree);
+		dirty = false;
+	}
+
+	if (*rnd < moves_rate || del_moves.size() == 0) {
+		choice = searchTree(moves, moves_tree, rnd);
+	} else {
+		*rnd -= moves_rate;
+		choice = searchTree(del_moves, del_moves_tree, rnd);
+	}
+
+	assert(choice != NULL); // should never call for a move from a container unless it will get one.
+	return choice;
+}
+
 /*
 
  MoveContainer
@@ -0,0 +1,94 @@
+/*
+Copyright (c) 2017 California Institute of Technology. All rights reserved.
+Multistrand nucleic acid kinetic simulator
+help@multistrand.org
+*/
+
+#include "objectpool.h"
+
+thread_local ObjectPool *ObjectPool::active = NULL;
+
+ObjectPool::ObjectPool(void) {
+
+	for (int i = 0; i < classCount; i++)
+		freeLists[i] = NULL;
+
+}
+
+// Blocks still in use would point into the chunks, so those are only freed once
+// everything has been returned.
+ObjectPool::~ObjectPool(void) {
+
+	clearActive(this);
+
+	if (live != 0)
+		return;
+
+	for (char *memory : chunks)
+		delete[] memory;
+
+}
+
+void ObjectPool::setActive(ObjectPool *pool) {
+
+	active = pool;
+
+}
+
+void ObjectPool::clearActive(ObjectPool *pool) {
+
+	if (active == pool)
+		active = NULL;
+
+}
+
+ObjectPool *ObjectPool::getActive(void) {
+
+	return active;
+
+}
+
+// Cuts a new block of size bytes from the current chunk, moving on to the next one
+// when it is used up.
+void *ObjectPool::cut(size_t size) {
+
+	if (next == NULL || next + size > end) {
+
+		// chunks kept from before a reset are used again first.
+		if (next != NULL)
+			chunk++;
+
+		if (chunk == chunks.size())
+			chunks.push_back(new char[chunkSize]);
+
+		next = chunks[chunk];
+		end = next + chunkSize;
+	}
+
+	void *block = next;
+	next += size;
+
+	return block;
+
+}
+
+// Only once nothing from the pool is in use; otherwise the free lists are kept.
+void ObjectPool::reset(void) {
+
+	if (live != 0 || chunks.empty())
+		return;
+
+	for (int i = 0; i < classCount; i++)
+		freeLists[i] = NULL;
+
+	chunk = 0;
+	next = chunks[0];
+	end = next + chunkSize;
+
+}
+
+long ObjectPool::getLive(void) {
+
+	return live;
+
+}
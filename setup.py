@@ -14,6 +14,7 @@ sources = ["system/utility.cc",
            "interface/optionlists.cc",
            "interface/options.cc",
            "loop/move.cc",
+           "loop/objectpool.cc",
            "loop/moveutil.cc",
            "loop/loop.cc",
            "system/energyoptions.cc",
@@ -23,6 +24,8 @@ sources = ["system/utility.cc",
            "state/scomplexlist.cc",
            "system/simoptions.cc",
            "system/ssystem.cc",
+           "system/trajectoryfile.cc",
+           "system/checkpoint.cc",
            "state/strandordering.cc"
            ]
 
@@ -33,7 +36,8 @@ def setup_ext( ):
                           include_dirs=["./include"],
                           language="c++",
                         undef_macros=['NDEBUG'],
-                        extra_compile_args = ['-O3','-g', '-w', "-std=c++11", ], #FD: adding c11 flag
+                        extra_compile_args = ['-O3','-g', '-w', "-std=c++11", "-pthread", ], #FD: adding c11 flag
+                        extra_link_args = ["-pthread"],
                           )
     return multi_ext
 
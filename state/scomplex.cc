@@ -8,6 +8,7 @@
 #include <string.h>
 #include <assert.h>
 #include <vector>
+#include <algorithm>
 #include <iostream>
 #include <sstream>
 #include "scomplex.h"
@@ -90,6 +91,35 @@ void StrandComplex::cleanup(void) {
 	ordering->cleanup();
 }
 
+StrandComplex *StrandComplex::copy(void) {
+
+	CopyMap map;
+	StrandOrdering *newOrdering = ordering->copy(map);
+
+	LoopVector loops;
+	if (beginLoop != NULL)
+		loops.push_back(beginLoop);
+
+	for (unsigned int index = 0; index < loops.size(); index++) {
+		Loop* current = loops[index];
+		map.loops[current] = current->copy();
+		for (int i = 0; i < current->getCurAdjacent(); i++)
+			if (current->getAdjacent(i) != NULL && map.loops.count(current->getAdjacent(i)) == 0)
+				loops.push_back(current->getAdjacent(i));
+	}
+
+	for (Loop* current : loops)
+		map.loops[current]->copyLinks(map);
+
+	newOrdering->copyLoops(ordering, map);
+
+	StrandComplex *copy = new StrandComplex(newOrdering);
+	copy->beginLoop = map.map(beginLoop);
+
+	return copy;
+
+}
+
 /* 
  int StrandComplex::checkIDList( class identlist *stoplist, int id_count )
 
@@ -160,6 +190,8 @@ StrandComplex *StrandComplex::performComplexJoin(JoinCriteria crit, bool useArr)
 	new_ordering->replaceOpenLoop(loops[1], new_loops[1]);
 
 	complexes[0]->beginLoop = new_ordering->getLoop();
+	complexes[0]->indexValid = false;
+	complexes[1]->indexValid = false;
 
 	complexes[0]->beginLoop->verifyLoop(NULL, NULL);
 
@@ -177,10 +209,18 @@ StrandComplex * StrandComplex::doChoice(Move * move) {
 	// TODO: fix for two affected loops being deleted, must get a 'good' starting loop for the complex still.
 	Loop *temp = NULL, *temp2 = NULL, *temp3 = NULL;
 	char id2, id3;
+	int removed[2] = { -1, -1 };
 
 	temp2 = move->affected[0];
 	temp3 = move->affected[1];
 
+	// the move frees the affected loops, so their flux slots are read first.
+	if (indexValid) {
+		removed[0] = temp2->fluxSlot;
+		if (temp3 != NULL && (move->getType() & MOVE_DELETE))
+			removed[1] = temp3->fluxSlot;
+	}
+
 	if (utility::debugTraces) {
 
 		cout << "Triggering move: " << endl;
@@ -216,6 +256,7 @@ StrandComplex * StrandComplex::doChoice(Move * move) {
 
 		newOrdering = ordering->breakOrdering(temp2, temp3, newLoop[0], newLoop[1]);
 		beginLoop = ordering->getLoop();
+		indexValid = false;
 
 		if (utility::debugTraces) {
 			cout << "Going to break the complex!! 3/3 ********************** " << std::endl;
@@ -243,6 +284,9 @@ StrandComplex * StrandComplex::doChoice(Move * move) {
 				assert(0);
 		}
 		beginLoop->verifyLoop( NULL, NULL);
+
+		if (indexValid)
+			updateFluxIndex(temp, removed);
 	}
 	return NULL;
 }
@@ -624,6 +668,8 @@ int StrandComplex::generateLoops(void) {
 		delete[] structure;
 	if (charsequence != NULL)
 		delete[] charsequence;
+
+	return 0;
 }
 
 void StrandComplex::printAllMoves(void) {
@@ -670,7 +716,124 @@ StrandOrdering * StrandComplex::getOrdering() {
 }
 
 double StrandComplex::getTotalFlux(void) {
-	return beginLoop->returnFlux(NULL);
+
+	if (Loop::GetMoveContainerType() != MOVECONTAINER_TREE)
+		return beginLoop->returnFlux(NULL);
+
+	// accumulated updates drift from the exact sum by rounding, so a long run rebuilds now and then.
+	if (!indexValid || indexUpdates > 64 * (long) slotLoops.size())
+		buildFluxIndex();
+
+	double total = 0.0;
+	for (int index = slotLoops.size(); index > 0; index -= (index & -index))
+		total += fluxTree[index];
+
+	return total;
+}
+
+void StrandComplex::buildFluxIndex(void) {
+
+	vector<Loop*> loops;
+	vector<double> cumulative;
+	beginLoop->indexFlux(NULL, loops, cumulative);
+
+	// spare slots let moves that make loops be added without a rebuild.
+	int size = std::max(16, 2 * (int) loops.size());
+
+	slotLoops.assign(size, NULL);
+	slotRates.assign(size, 0.0);
+	fluxTree.assign(size + 1, 0.0);
+	freeSlots.clear();
+
+	for (int slot = 0; slot < (int) loops.size(); slot++) {
+		slotLoops[slot] = loops[slot];
+		slotRates[slot] = loops[slot]->getTotalRate();
+		fluxTree[slot + 1] = slotRates[slot];
+		loops[slot]->fluxSlot = slot;
+	}
+
+	for (int slot = size - 1; slot >= (int) loops.size(); slot--)
+		freeSlots.push_back(slot);
+
+	// O(n) construction, as in MoveTree::buildTree.
+	for (int index = 1; index <= size; index++) {
+		int parent = index + (index & -index);
+		if (parent <= size)
+			fluxTree[parent] += fluxTree[index];
+	}
+
+	indexUpdates = 0;
+	indexValid = true;
+}
+
+void StrandComplex::setSlotRate(int slot, double rate) {
+
+	double change = rate - slotRates[slot];
+	slotRates[slot] = rate;
+
+	for (int index = slot + 1; index <= (int) slotLoops.size(); index += (index & -index))
+		fluxTree[index] += change;
+
+	indexUpdates++;
+}
+
+int StrandComplex::addToFluxIndex(Loop *loop) {
+
+	if (freeSlots.empty())
+		return -1;
+
+	int slot = freeSlots.back();
+	freeSlots.pop_back();
+
+	slotLoops[slot] = loop;
+	loop->fluxSlot = slot;
+	setSlotRate(slot, loop->getTotalRate());
+
+	return slot;
+}
+
+// After a move inside the complex: the affected loops are gone, the loops the move made
+// (newLoop and any new loops next to it) have no slot yet, and the neighbours of the new
+// loops regenerated their moves. No other loop changed.
+void StrandComplex::updateFluxIndex(Loop *newLoop, int removed[2]) {
+
+	for (int i = 0; i < 2; i++) {
+		if (removed[i] >= 0) {
+			setSlotRate(removed[i], 0.0);
+			slotLoops[removed[i]] = NULL;
+			freeSlots.push_back(removed[i]);
+		}
+	}
+
+	vector<Loop*> created;
+	if (addToFluxIndex(newLoop) < 0) {
+		indexValid = false;
+		return;
+	}
+	created.push_back(newLoop);
+
+	for (unsigned int index = 0; index < created.size(); index++) {
+
+		Loop *current = created[index];
+
+		for (int i = 0; i < current->getCurAdjacent(); i++) {
+
+			Loop *adjacent = current->getAdjacent(i);
+
+			if (adjacent == NULL)
+				continue;
+
+			if (adjacent->fluxSlot < 0) {
+				if (addToFluxIndex(adjacent) < 0) {
+					indexValid = false;
+					return;
+				}
+				created.push_back(adjacent);
+			} else {
+				setSlotRate(adjacent->fluxSlot, adjacent->getTotalRate());
+			}
+		}
+	}
 }
 
 char *StrandComplex::getSequence(void) {
@@ -718,12 +881,63 @@ double StrandComplex::getEnergy(void) {
 
 }
 
+// Walks the loop graph like cleanup, starting from beginLoop.
+void StrandComplex::getLoopEnergies(vector<double>& energies, vector<char>& types) {
+
+	vector<std::pair<Loop*, Loop*> > loops; // a loop and the loop it was reached from
+	loops.push_back(std::make_pair(beginLoop, (Loop*) NULL));
+
+	while (loops.size() > 0) {
+		Loop* current = loops.back().first;
+		Loop* from = loops.back().second;
+		loops.pop_back();
+
+		energies.push_back(current->getEnergy());
+		types.push_back(current->getType());
+
+		for (int i = current->getCurAdjacent() - 1; i >= 0; i--)
+			if (current->getAdjacent(i) != NULL && current->getAdjacent(i) != from)
+				loops.push_back(std::make_pair(current->getAdjacent(i), current));
+	}
+
+}
+
 void StrandComplex::generateMoves(void) {
 	beginLoop->firstGen( NULL);
 }
 
 Move *StrandComplex::getChoice(double *rand_choice) {
-	return beginLoop->getChoice(rand_choice, NULL);
+
+	if (Loop::GetMoveContainerType() != MOVECONTAINER_TREE)
+		return beginLoop->getChoice(rand_choice, NULL);
+
+	if (!indexValid)
+		buildFluxIndex();
+
+	int size = slotLoops.size();
+	int pos = 0;
+	int step = 1;
+
+	while (2 * step <= size)
+		step *= 2;
+
+	// find the first slot whose cumulative rate exceeds the choice, as in MoveTree::searchTree.
+	for (; step > 0; step /= 2) {
+		if (pos + step <= size && fluxTree[pos + step] <= *rand_choice) {
+			pos += step;
+			*rand_choice -= fluxTree[pos];
+		}
+	}
+
+	// rounding can leave the choice past the last loop with moves (or on a free slot); take that loop.
+	if (pos == size || slotLoops[pos] == NULL) {
+		pos = size - 1;
+		while (pos > 0 && (slotLoops[pos] == NULL || slotRates[pos] <= 0.0))
+			pos--;
+		*rand_choice = slotRates[pos];
+	}
+
+	return slotLoops[pos]->getLocalChoice(rand_choice);
 }
 
 int StrandComplex::getStrandCount(void) {
@@ -13,6 +13,7 @@ help@multistrand.org
 #include <math.h>
 
 #include <vector>
+#include <algorithm>
 #include <iostream>
 #include <simoptions.h>
 #include <utility.h>
@@ -22,6 +23,81 @@ help@multistrand.org
 typedef std::vector<int> intvec;
 typedef std::vector<int>::iterator intvec_it;
 
+/*
+
+ StopIndex Constructor
+
+ */
+
+StopIndex::StopIndex(stopComplexes *stopList) {
+
+	for (stopComplexes *traverse = stopList; traverse != NULL; traverse = traverse->next) {
+
+		conditions.push_back(traverse);
+		conditionStart.push_back(items.size());
+		// as in SComplexList::checkStopComplexList, the first stop complex decides the type of check.
+		conditionBound.push_back(traverse->citem->type == STOPTYPE_BOUND);
+
+		for (complexItem *item = traverse->citem; item != NULL; item = item->next) {
+
+			vector<const char*> ids;
+			for (identList *id = item->strand_ids; id != NULL; id = id->next) {
+				ids.push_back(id->id);
+			}
+
+			if (!conditionBound.back()) {
+				itemsBySignature[signature(ids)].push_back(items.size());
+			}
+
+			items.push_back(item);
+			itemStrandCount.push_back(ids.size());
+
+		}
+	}
+
+	conditionStart.push_back(items.size());
+
+}
+
+int StopIndex::getConditionCount(void) {
+
+	return conditions.size();
+
+}
+
+/*
+ StopIndex::signature
+
+ Returns the same key for all circular permutations of a list of strand IDs,
+ by concatenating the IDs from the lexicographically smallest rotation.
+ */
+
+string StopIndex::signature(vector<const char*>& ids) {
+
+	int size = ids.size();
+	int best = 0;
+
+	for (int rotation = 1; rotation < size; rotation++) {
+		for (int k = 0; k < size; k++) {
+			int cmp = strcmp(ids[(rotation + k) % size], ids[(best + k) % size]);
+			if (cmp != 0) {
+				if (cmp < 0)
+					best = rotation;
+				break;
+			}
+		}
+	}
+
+	string output;
+	for (int k = 0; k < size; k++) {
+		output.append(ids[(best + k) % size]);
+		output.push_back('\0');
+	}
+
+	return output;
+
+}
+
 /*
 
  SComplexListEntry Constructor/Destructor
@@ -36,6 +112,8 @@ SComplexListEntry::SComplexListEntry(StrandComplex *newComplex, int newid) {
 	ee_energy.nTdS = 0;
 	next = NULL;
 	id = newid;
+	inTotals = false;
+	stopDirty = true;
 }
 
 SComplexListEntry::~SComplexListEntry(void) {
@@ -160,12 +238,56 @@ SComplexListEntry *SComplexList::addComplex(StrandComplex *newComplex) {
 	return first;
 }
 
+// The id the next complex added will get.
+int SComplexList::getIdCounter(void) {
+
+	return idcounter;
+
+}
+
+void SComplexList::setIdCounter(int counter) {
+
+	idcounter = counter;
+
+}
+
+// A deep copy of the list: every complex is copied with its loops and moves, and
+// the running totals and stop condition matches are carried over.
+SComplexList *SComplexList::copy(void) {
+
+	SComplexList *copy = new SComplexList(*this);
+	SComplexListEntry *last = NULL;
+
+	copy->first = NULL;
+
+	for (SComplexListEntry *traverse = first; traverse != NULL; traverse = traverse->next) {
+
+		SComplexListEntry *entry = new SComplexListEntry(*traverse);
+		entry->thisComplex = traverse->thisComplex->copy();
+		entry->next = NULL;
+
+		if (last == NULL)
+			copy->first = entry;
+		else
+			last->next = entry;
+		last = entry;
+
+	}
+
+	return copy;
+
+}
+
 /*
  SComplexList::initializeList
  */
 
 void SComplexList::initializeList(void) {
 
+	if (initialized)
+		return;
+	initialized = true;
+
 	for (SComplexListEntry* temp = first; temp != NULL; temp = temp->next) {
 
 		temp->initializeComplex();
@@ -174,7 +296,7 @@ void SComplexList::initializeList(void) {
 			cout << "Done initializing a complex!" << endl;
 		}
 
-		temp->fillData(eModel);
+		updateEntry(temp);
 
 	}
 
@@ -189,7 +311,7 @@ void SComplexList::regenerateMoves(void) {
 	for (SComplexListEntry* temp = first; temp != NULL; temp = temp->next) {
 
 		temp->regenerateMoves();
-		temp->fillData(eModel);
+		updateEntry(temp);
 
 	}
 
@@ -201,13 +323,7 @@ void SComplexList::regenerateMoves(void) {
 
 double SComplexList::getTotalFlux(void) {
 
-	double total = 0.0;
-
-	for( SComplexListEntry *temp = first; temp != NULL; temp = temp->next){
-
-		total += temp->rate;
-
-	}
+	double total = totalRate;
 
 	joinRate = getJoinFlux();
 	total += joinRate;
@@ -218,30 +334,114 @@ double SComplexList::getTotalFlux(void) {
 
 BaseCount SComplexList::getExposedBases() {
 
-	BaseCount output;
+	return exposedBases;
 
-	for (SComplexListEntry* it = first; it != NULL; it = it->next) {
+}
+
+OpenInfo SComplexList::getOpenInfo() {
+
+	return openInfo;
+
+}
+
+/*
+ SComplexList::updateEntry
 
-		BaseCount& ext_bases = it->thisComplex->getExteriorBases();
-		output.increment(ext_bases);
+ Recomputes the energy and rate of an entry whose complex changed,
+ and patches the running totals with the difference.
+ */
+
+void SComplexList::updateEntry(SComplexListEntry *entry) {
 
+	if (entry->inTotals) {
+		removeFromTotals(entry);
+	}
+
+	entry->fillData(eModel);
+	addToTotals(entry);
+	entry->stopDirty = true;
+
+	totalsUpdates++;
+	if (totalsUpdates >= resyncInterval) {
+		resyncTotals();
 	}
 
-	return output;
 }
 
-OpenInfo SComplexList::getOpenInfo() {
+void SComplexList::addToTotals(SComplexListEntry *entry) {
+
+	totalRate += entry->rate;
 
-	OpenInfo output;
+	entry->exteriorBases = entry->thisComplex->getExteriorBases();
+	exposedBases.increment(entry->exteriorBases);
+	selfJoinCount += entry->exteriorBases.multiCount(entry->exteriorBases);
 
-	for (SComplexListEntry* it = first; it != NULL; it = it->next) {
+	if (eModel->useArrhenius()) {
 
-		OpenInfo& ext_bases = it->thisComplex->ordering->getOpenInfo();
-		output.increment(ext_bases);
+		entry->openInfo = entry->thisComplex->ordering->getOpenInfo();
+		openInfo.increment(entry->openInfo);
+		selfJoinRateArr += entry->openInfo.crossRate(entry->openInfo, *eModel);
 
 	}
 
-	return output;
+	entry->inTotals = true;
+
+}
+
+void SComplexList::removeFromTotals(SComplexListEntry *entry) {
+
+	totalRate -= entry->rate;
+
+	exposedBases.decrement(entry->exteriorBases);
+	selfJoinCount -= entry->exteriorBases.multiCount(entry->exteriorBases);
+
+	if (eModel->useArrhenius()) {
+
+		openInfo.decrement(entry->openInfo);
+		selfJoinRateArr -= entry->openInfo.crossRate(entry->openInfo, *eModel);
+
+	}
+
+	entry->inTotals = false;
+
+}
+
+// Recomputes the totals from the entries, which also checks the running counts:
+// exposed bases are integers, so any difference from a full recount is a bug.
+void SComplexList::resyncTotals(void) {
+
+	double rate = 0.0;
+	BaseCount bases;
+	int selfJoin = 0;
+
+	selfJoinRateArr = 0.0;
+	openInfo.clear();
+
+	for (SComplexListEntry *temp = first; temp != NULL; temp = temp->next) {
+
+		if (temp->inTotals) {
+
+			rate += temp->rate;
+
+			BaseCount& exterior = temp->thisComplex->getExteriorBases();
+			bases.increment(exterior);
+			selfJoin += exterior.multiCount(exterior);
+
+			if (eModel->useArrhenius()) {
+
+				openInfo.increment(temp->openInfo);
+				selfJoinRateArr += temp->openInfo.crossRate(temp->openInfo, *eModel);
+
+			}
+		}
+	}
+
+	assert(bases.count == exposedBases.count && selfJoin == selfJoinCount);
+	assert(fabs(rate - totalRate) <= 1e-9 * std::max(rate, 1.0)); // rounding only
+
+	totalRate = rate;
+	totalsUpdates = 0;
+
 }
 
 /*
@@ -270,18 +470,9 @@ double SComplexList::getJoinFlux(void) {
 	}
 
 	double output = 0.0;
-	int moveCount = 0;
-
-	BaseCount totalBases = getExposedBases();
-
-	for (SComplexListEntry* temp = first; temp != NULL; temp = temp->next) {
 
-		BaseCount& ext_bases = temp->thisComplex->getExteriorBases();
-		totalBases.decrement(ext_bases);
-
-		moveCount += totalBases.multiCount(ext_bases);
-
-	}
+	// Each pair of complexes counted once: all pairs of exposed bases, minus the pairs within a complex.
+	int moveCount = (exposedBases.multiCount(exposedBases) - selfJoinCount) / 2;
 
 // There are plenty of multi-complex structures with no moves.
 	if (moveCount > 0) {
@@ -303,16 +494,14 @@ double SComplexList::getJoinFlux(void) {
 // always have the same structure
 double SComplexList::getJoinFluxArr(void) {
 
-// The trick is to compute all rates between the first complex,
-// and the remaining complexes. Then, compute the rate between the second complex,
-// and the remaining complexes (set minus first and second), and so on.
-
-	double rate = 0.0;
-
-	for (SComplexListEntry* temp = first; temp != NULL; temp = temp->next) {
+// The cross rate is bilinear and symmetric in the exposed bases, so the rate between
+// all pairs of complexes is the cross rate of the running total with itself, minus
+// each complex with itself, halved. computeArrBiRate gives the same sum pair by pair.
 
-		rate += computeArrBiRate(temp);
+	double rate = (openInfo.crossRate(openInfo, *eModel) - selfJoinRateArr) / 2.0;
 
+	if (rate < 0.0) {
+		rate = 0.0; // rounding, when no joins are possible.
 	}
 
 	return rate;
@@ -397,6 +586,10 @@ int SComplexList::getCount(void) {
 	return numOfComplexes;
 }
 
+double SComplexList::getLastMoveRate(void) {
+	return lastMoveRate;
+}
+
 int SComplexList::doBasicChoice(double choice, double newtime) {
 
 	double rchoice = choice, moverate;
@@ -426,42 +619,54 @@ int SComplexList::doBasicChoice(double choice, double newtime) {
 
 	temp = first;
 	StrandComplex *pickedComplex = NULL;
+	SComplexListEntry *lastWithRate = NULL;
 
 	while (temp != NULL) {
-		if (rchoice < temp->rate && pickedComplex == NULL) {
+		if (rchoice < temp->rate) {
 			pickedComplex = temp->thisComplex;
 			temp2 = temp;
+			break;
 		}
-		if (pickedComplex == NULL) {
-			//	  assert( rchoice != temp->rate && temp->next == NULL);
-			rchoice -= temp->rate;
-
-		}
+		//	  assert( rchoice != temp->rate && temp->next == NULL);
+		if (temp->rate > 0.0)
+			lastWithRate = temp;
+		rchoice -= temp->rate;
 		temp = temp->next;
 	}
-// POST: pickedComplex points to the complex that contains the executable move
 
-	assert(pickedComplex != NULL);
+	// the running totalRate can drift past the sum of the entry rates by rounding,
+	// leaving the choice past the last complex; take the last move of the last complex that has moves.
+	if (pickedComplex == NULL) {
+		assert(lastWithRate != NULL);
+		pickedComplex = lastWithRate->thisComplex;
+		temp2 = lastWithRate;
+		rchoice = nextafter(lastWithRate->rate, 0.0);
+	}
+// POST: pickedComplex points to the complex that contains the executable move
 
 	tempmove = pickedComplex->getChoice(&rchoice);
 	moverate = tempmove->getRate();
 	type = tempmove->getType();
+	int arrType = tempmove->getArrType(); // doChoice frees the move
+
+	// a deletion move is held by both loops adjacent to the pair, each with half the rate.
+	lastMoveRate = (type & MOVE_DELETE) ? 2.0 * moverate : moverate;
 	newComplex = pickedComplex->doChoice(tempmove);
 
 	if (newComplex != NULL) {
 
 		temp = addComplex(newComplex);
-		temp->fillData(eModel);
+		updateEntry(temp);
 
 	}
 
-	temp2->fillData(eModel);
+	updateEntry(temp2);
 
 	if (utility::debugTraces) {
 		cout << "Going to return the arrType in doBasicChoice!! **************** " << std::endl;
 	}
 
-	return tempmove->getArrType();
+	return arrType;
 
 }
 
@@ -502,6 +707,8 @@ int SComplexList::doJoinChoice(double choice) {
 	assert(crit.complexes[0]!=NULL);
 	assert(crit.complexes[1]!=NULL);
 
+	lastMoveRate = crit.rate;
+
 //	cout << toString();
 
 // here we actually perform the complex join, using criteria as input.
@@ -513,13 +720,15 @@ int SComplexList::doJoinChoice(double choice) {
 	for (SComplexListEntry* temp = first; temp != NULL; temp = temp->next) {
 
 		if (temp->thisComplex == crit.complexes[0]) {
-			temp->fillData(eModel);
+			updateEntry(temp);
 		}
 
 		if (temp->next != NULL) {
 
 			if (temp->next->thisComplex == deleted) {
 				temp2 = temp->next;
+				removeFromTotals(temp2);
+				removeStopMatches(temp2);
 				temp->next = temp2->next;
 				temp2->next = NULL;
 				delete temp2;
@@ -531,6 +740,8 @@ int SComplexList::doJoinChoice(double choice) {
 
 	if (first->thisComplex == deleted) {
 		temp2 = first;
+		removeFromTotals(temp2);
+		removeStopMatches(temp2);
 		first = first->next;
 		temp2->next = NULL;
 		delete temp2;
@@ -559,7 +770,9 @@ JoinCriteria SComplexList::cycleForJoinChoice(double choice) {
 			if (int_choice < combinations) {
 
 				// break both loops, because the right bases are identified.
-				return findJoinNucleotides(base, int_choice, external, temp);
+				JoinCriteria crit = findJoinNucleotides(base, int_choice, external, temp);
+				crit.rate = eModel->applyPrefactors(eModel->getJoinRate(), loopMove, loopMove);
+				return crit;
 
 			} else {
 				int_choice -= combinations;
@@ -692,6 +905,7 @@ JoinCriteria SComplexList::cycleForJoinChoiceArr(double choice) {
 									crit.half[1] = con.first;
 
 									crit.arrType = moveutil::getPrimeCode(left, right);
+									crit.rate = joinRate;
 
 									return crit;
 
@@ -783,6 +997,244 @@ bool SComplexList::checkStopComplexList(class complexItem *stoplist) {
 
 }
 
+/*
+ SComplexList::setStopIndex, updateStopState, checkStopCondition
+
+ The stop complexes are matched against a complex only when it changed
+ since the last check: each entry remembers which stop complexes it matches,
+ and the list counts the matching entries for every stop complex.
+ A complex is only compared to the stop complexes with the same strand ID
+ signature, so for exact and disassoc stop complexes the check is a hash lookup.
+ Loose and count stop complexes keep a count of mismatched bases per entry,
+ patched from the base pairs that changed while the strands stay the same.
+ */
+
+void SComplexList::setStopIndex(StopIndex *index) {
+
+	stopIndex = index;
+	itemMatchCount.clear();
+
+	if (stopIndex != NULL) {
+		itemMatchCount.resize(stopIndex->items.size(), 0);
+	}
+
+	for (SComplexListEntry *temp = first; temp != NULL; temp = temp->next) {
+		temp->stopMatches.clear();
+		temp->stopCounters.clear();
+		temp->thisComplex->ordering->stopPairLog();
+		temp->stopDirty = true;
+	}
+
+}
+
+void SComplexList::updateStopState(void) {
+
+	for (SComplexListEntry *temp = first; temp != NULL; temp = temp->next) {
+
+		if (temp->stopDirty) {
+			removeStopMatches(temp);
+			addStopMatches(temp);
+		}
+
+	}
+
+}
+
+bool SComplexList::checkStopCondition(int index) {
+
+	assert(stopIndex != NULL);
+
+	int begin = stopIndex->conditionStart[index];
+	int end = stopIndex->conditionStart[index + 1];
+
+	if (stopIndex->conditionBound[index]) {
+		return checkStopComplexList_Bound(stopIndex->items[begin]);
+	}
+
+	if (end - begin > numOfComplexes)
+		return false; // can't match more entries than we have complexes.
+
+	for (int i = begin; i < end; i++) {
+		if (itemMatchCount[i] == 0)
+			return false;
+	}
+
+	return true;
+
+}
+
+void SComplexList::addStopMatches(SComplexListEntry *entry) {
+
+	entry->stopDirty = false;
+
+	if (stopIndex == NULL)
+		return;
+
+	StrandOrdering *ordering = entry->thisComplex->ordering;
+
+	// while the strands stay the same, the distances to loose and count stop complexes
+	// are patched from the base pairs that changed, instead of comparing the structures again.
+	bool patched = ordering->pairLogValid();
+
+	if (patched) {
+		patchStopCounters(entry);
+	} else {
+		entry->stopCounters.clear();
+	}
+
+	vector<const char*> ids;
+	for (orderingList *traverse = ordering->first; traverse != NULL; traverse = traverse->next) {
+		ids.push_back(traverse->thisTag);
+	}
+
+	std::unordered_map<string, vector<int> >::iterator found = stopIndex->itemsBySignature.find(StopIndex::signature(ids));
+
+	if (found != stopIndex->itemsBySignature.end()) {
+
+		entry->stopMatches.resize(stopIndex->items.size(), false);
+
+		for (vector<int>::iterator it = found->second.begin(); it != found->second.end(); it++) {
+
+			complexItem *item = stopIndex->items[*it];
+			bool successflag = false;
+
+			if (item->type == STOPTYPE_LOOSE_STRUCTURE || item->type == STOPTYPE_PERCENT_OR_COUNT_STRUCTURE) {
+
+				if (!patched) {
+					// checkIDList also rotates the complex to the strand order of the stop complex.
+					if (entry->thisComplex->checkIDList(item->strand_ids, stopIndex->itemStrandCount[*it]) > 0)
+						addStopCounter(entry, *it);
+				}
+
+				for (unsigned int k = 0; k < entry->stopCounters.size(); k++) {
+					if (entry->stopCounters[k].item == *it)
+						successflag = (entry->stopCounters[k].mismatches <= item->count);
+				}
+
+			} else if (entry->thisComplex->checkIDList(item->strand_ids, stopIndex->itemStrandCount[*it]) > 0) {
+				if (item->type == STOPTYPE_STRUCTURE) {
+					successflag = (strcmp(entry->thisComplex->getStructure(), item->structure) == 0);
+				} else if (item->type == STOPTYPE_DISASSOC) {
+					successflag = true;
+				}
+			}
+
+			if (successflag) {
+				entry->stopMatches[*it] = true;
+				itemMatchCount[*it]++;
+			}
+		}
+	}
+
+	if (entry->stopCounters.empty()) {
+		ordering->stopPairLog();
+	} else {
+		ordering->startPairLog();
+	}
+
+}
+
+// Counts the bases of the complex, in the strand order of stop complex item, whose partner differs from the stop structure.
+// This is the distance checkLooseStructure and checkCountStructure compare to the count of the stop complex.
+bool SComplexList::addStopCounter(SComplexListEntry *entry, int item) {
+
+	char *ourStructure = entry->thisComplex->getStructure();
+	char *stopStructure = stopIndex->items[item]->structure;
+	bool loose = (stopIndex->items[item]->type == STOPTYPE_LOOSE_STRUCTURE);
+
+	int length = strlen(stopStructure);
+	if ((int) strlen(ourStructure) != length)
+		return false; // as in checkLooseStructure, the strand IDs matched so this should not happen.
+
+	StopCounter counter;
+	counter.item = item;
+	counter.mismatches = 0;
+	counter.partner.assign(length, StopCounter::unpaired);
+
+	vector<int> ourPartner(length, StopCounter::unpaired);
+	intvec ourPairs, stopPairs;
+
+	for (int loop = 0; loop < length; loop++) {
+
+		if (stopStructure[loop] == '(') {
+			stopPairs.push_back(loop);
+		} else if (stopStructure[loop] == ')') {
+			counter.partner[loop] = stopPairs.back();
+			counter.partner[stopPairs.back()] = loop;
+			stopPairs.pop_back();
+		} else if (stopStructure[loop] == '*') {
+			counter.partner[loop] = loose ? StopCounter::any : StopCounter::never;
+		}
+
+		if (ourStructure[loop] == '(') {
+			ourPairs.push_back(loop);
+		} else if (ourStructure[loop] == ')') {
+			ourPartner[loop] = ourPairs.back();
+			ourPartner[ourPairs.back()] = loop;
+			ourPairs.pop_back();
+		}
+	}
+
+	for (int loop = 0; loop < length; loop++) {
+		if (counter.partner[loop] != StopCounter::any && ourPartner[loop] != counter.partner[loop])
+			counter.mismatches++;
+	}
+
+	int cpos = 0;
+	for (orderingList *traverse = entry->thisComplex->ordering->first; traverse != NULL; cpos += traverse->size + 1, traverse = traverse->next) {
+		for (int loop = 0; loop < traverse->size; loop++) {
+			counter.position[utility::state_fingerprint::baseKey(traverse->index, loop)] = cpos + loop;
+		}
+	}
+
+	entry->stopCounters.push_back(counter);
+
+	return true;
+
+}
+
+// Change in the mismatches of a counter when base pairs with other, having been unpaired.
+static int pairedMismatchChange(StopCounter& counter, int base, int other) {
+
+	int partner = counter.partner[base];
+
+	if (partner == StopCounter::any)
+		return 0;
+
+	return (partner != other) - (partner != StopCounter::unpaired);
+
+}
+
+void SComplexList::patchStopCounters(SComplexListEntry *entry) {
+
+	vector<StrandOrdering::PairChange>& log = entry->thisComplex->ordering->getPairLog();
+
+	for (vector<StopCounter>::iterator counter = entry->stopCounters.begin(); counter != entry->stopCounters.end(); counter++) {
+		for (vector<StrandOrdering::PairChange>::iterator change = log.begin(); change != log.end(); change++) {
+
+			int first = counter->position[change->first];
+			int second = counter->position[change->second];
+			int difference = pairedMismatchChange(*counter, first, second) + pairedMismatchChange(*counter, second, first);
+
+			counter->mismatches += change->added ? difference : -difference;
+
+		}
+	}
+
+}
+
+void SComplexList::removeStopMatches(SComplexListEntry *entry) {
+
+	for (unsigned int i = 0; i < entry->stopMatches.size(); i++) {
+		if (entry->stopMatches[i]) {
+			itemMatchCount[i]--;
+		}
+	}
+
+	entry->stopMatches.clear();
+
+}
+
 string SComplexList::toString() {
 
 	string output = "";
@@ -797,6 +1249,25 @@ string SComplexList::toString() {
 
 }
 
+/*
+ SComplexList::getFingerprint
+
+ The fingerprint of the system state, combined from the fingerprints
+ each complex keeps up to date as its base pairs change.
+ */
+
+utility::state_fingerprint SComplexList::getFingerprint(void) {
+
+	utility::state_fingerprint output;
+
+	for (SComplexListEntry *temp = first; temp != NULL; temp = temp->next) {
+		output ^= temp->thisComplex->ordering->getFingerprint();
+	}
+
+	return output;
+
+}
+
 void SComplexList::updateOpenInfo(void) {
 
 	SComplexListEntry *temp = first;
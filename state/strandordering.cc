@@ -19,6 +19,55 @@ help@multistrand.org
 
 using std::cout;
 
+// Helpers for splicing the cached flat sequence and structure when orderings are joined or broken.
+
+// Returns a new string holding left + separator + right.
+static char *joinFlat(char *left, char *right, char separator = '+') {
+	int leftLength = strlen(left);
+	int rightLength = strlen(right);
+
+	char *output = new char[leftLength + rightLength + 2];
+	memcpy(output, left, leftLength);
+	output[leftLength] = separator;
+	memcpy(output + leftLength + 1, right, rightLength + 1);
+
+	return output;
+}
+
+// Returns a new string holding source[begin, end) followed by source[begin2, end2).
+static char *spliceFlat(char *source, int begin, int end, int begin2 = 0, int end2 = 0) {
+	int length = (end - begin) + (end2 - begin2);
+
+	char *output = new char[length + 1];
+	memcpy(output, source + begin, end - begin);
+	memcpy(output + (end - begin), source + begin2, end2 - begin2);
+	output[length] = '\0';
+
+	return output;
+}
+
+// Returns a new string holding source[begin, end) followed by separator and source[0, begin - 1),
+// for a begin just past a separator: the parts of source rotated to start at begin.
+static char *rotateFlat(char *source, int begin, char separator) {
+	int length = strlen(source);
+
+	char *output = new char[length + 1];
+	memcpy(output, source + begin, length - begin);
+	output[length - begin] = separator;
+	memcpy(output + length - begin + 1, source, begin - 1);
+	output[length] = '\0';
+
+	return output;
+}
+
+// The length of the entry of a strand in the strand names, including the ',' after it.
+static int nameLength(orderingList *strand) {
+	char tmpstr[8];
+	snprintf(tmpstr, 7, "%d:", strand->uid); // as in StrandOrdering::getStrandNames
+
+	return strlen(tmpstr) + strlen(strand->thisTag) + 1;
+}
+
 orderingList::orderingList(int insize, int n_id, char *inTag, char *inSeq, char *inCodeSeq, char* inStruct) {
 	size = insize;
 	uid = n_id;
@@ -42,6 +91,10 @@ orderingList::orderingList(int insize, int n_id, char *inTag, char *inSeq, char
 	thisCodeSeq[size] = '\0';
 	thisStruct[size] = '\0';
 
+	for (int loop = 0; loop < size; loop++)
+		if (thisStruct[loop] == '.')
+			unpaired++;
+
 	next = prev = NULL;
 	thisLoop = NULL;
 
@@ -92,6 +145,61 @@ void StrandOrdering::cleanup(void) {
 	}
 }
 
+static char *copyString(char *input) {
+
+	if (input == NULL)
+		return NULL;
+
+	char *output = new char[strlen(input) + 1];
+	strcpy(output, input);
+
+	return output;
+
+}
+
+StrandOrdering *StrandOrdering::copy(CopyMap& map) {
+
+	StrandOrdering *copy = new StrandOrdering();
+	orderingList *newItem = NULL;
+
+	for (orderingList *traverse = first; traverse != NULL; traverse = traverse->next) {
+
+		newItem = new orderingList(traverse->size, traverse->uid, traverse->thisTag, traverse->thisSeq, traverse->thisCodeSeq, traverse->thisStruct);
+		newItem->index = traverse->index;
+		map.addStrand(traverse->thisCodeSeq, newItem->thisCodeSeq, traverse->size);
+
+		if (copy->first == NULL) {
+			copy->first = newItem;
+		} else {
+			copy->last->next = newItem;
+			newItem->prev = copy->last;
+		}
+		copy->last = newItem;
+
+	}
+
+	copy->count = count;
+	copy->openInfo = openInfo;
+	copy->seq = copyString(seq);
+	copy->struc = copyString(struc);
+	copy->strandnames = copyString(strandnames);
+	copy->exteriorBases = exteriorBases;
+	copy->fingerprint = fingerprint;
+	copy->fingerprintValid = fingerprintValid;
+
+	return copy;
+
+}
+
+void StrandOrdering::copyLoops(StrandOrdering *original, CopyMap& map) {
+
+	orderingList *traverse, *source;
+
+	for (traverse = first, source = original->first; traverse != NULL; traverse = traverse->next, source = source->next)
+		traverse->thisLoop = (OpenLoop *) map.map(source->thisLoop);
+
+}
+
 StrandOrdering::StrandOrdering(void) {
 
 }
@@ -208,6 +316,7 @@ StrandOrdering::StrandOrdering(char *in_seq, char *in_structure, char *in_cseq,
 			assert(traverse != NULL);
 			new_elem = new orderingList(strand_size, traverse->uid, traverse->id, &in_seq[index - strand_size], &in_cseq[index - strand_size],
 					&in_structure[index - strand_size]);
+			new_elem->index = traverse->index;
 			traverse = traverse->next;
 			// TODO: do i want orderinglist to be circular? does it help anything?
 			if (first == NULL)
@@ -236,6 +345,7 @@ StrandOrdering::StrandOrdering(char *in_seq, char *in_structure, char *in_cseq,
 		assert(traverse != NULL);
 		new_elem = new orderingList(strand_size, traverse->uid, traverse->id, &in_seq[index - strand_size], &in_cseq[index - strand_size],
 				&in_structure[index - strand_size]);
+		new_elem->index = traverse->index;
 		traverse = traverse->next;
 
 		// TODO: do i want orderinglist to be circular? does it help anything?
@@ -259,22 +369,41 @@ StrandOrdering * StrandOrdering::joinOrdering(StrandOrdering *first, StrandOrder
 
 	first->count += second->count;
 
-	if (first->seq != NULL) {
+	if (first->seq != NULL && second->seq != NULL) {
+		char *joined = joinFlat(first->seq, second->seq);
+		delete[] first->seq;
+		first->seq = joined;
+	} else if (first->seq != NULL) {
 		delete[] first->seq;
 		first->seq = NULL;
 	}
-	if (first->struc != NULL) {
+	if (first->struc != NULL && second->struc != NULL) {
+		char *joined = joinFlat(first->struc, second->struc);
+		delete[] first->struc;
+		first->struc = joined;
+	} else if (first->struc != NULL) {
 		delete[] first->struc;
 		first->struc = NULL;
 	}
-	if (first->strandnames != NULL) {
+	if (first->strandnames != NULL && second->strandnames != NULL) {
+		char *joined = joinFlat(first->strandnames, second->strandnames, ',');
+		delete[] first->strandnames;
+		first->strandnames = joined;
+	} else if (first->strandnames != NULL) {
 		delete[] first->strandnames;
 		first->strandnames = NULL;
 	}
 	second->first = NULL;
 	second->last = NULL;
 
+	if (first->fingerprintValid && second->fingerprintValid) {
+		first->fingerprint ^= second->fingerprint;
+	} else {
+		first->fingerprintValid = false;
+	}
+
 	first->openInfo.upToDate = false;
+	first->stopPairLog();
 
 	return first;
 }
@@ -284,9 +413,13 @@ StrandOrdering * StrandOrdering::joinOrdering(StrandOrdering *first, StrandOrder
 void StrandOrdering::reorder(OpenLoop *index) {
 	orderingList *traverse = first, *traverse_second = NULL;
 	int loop, count;
+	// offsets of traverse into the flat strings and the strand names, and a position in the flat strings
+	int pos = 0, namesPos = 0, cpos;
 
-	for (traverse = first; traverse != NULL && traverse->thisLoop != index; traverse = traverse->next)
-		;
+	for (traverse = first; traverse != NULL && traverse->thisLoop != index; traverse = traverse->next) {
+		pos += traverse->size + 1;
+		namesPos += nameLength(traverse);
+	}
 
 	// traverse is now either NULL (bad!) or pointing atthe entry for hte open loop we wish to pivot around. Shouldcheck to makesure this isn't the original one, as no reordering is needed in that case.
 	assert(traverse != NULL);
@@ -294,29 +427,37 @@ void StrandOrdering::reorder(OpenLoop *index) {
 	if (traverse == first)
 		return; // no reordering needed.
 
+	// the cached structure gets the same bracket flips as the strands.
 	count = 0;
-	for (traverse_second = traverse; traverse_second != NULL; traverse_second = traverse_second->next) {
+	cpos = pos;
+	for (traverse_second = traverse; traverse_second != NULL; cpos += traverse_second->size + 1, traverse_second = traverse_second->next) {
 		for (loop = 0; loop < traverse_second->size; loop++) {
 			if (traverse_second->thisStruct[loop] == '(')
 				count++;
 			if (traverse_second->thisStruct[loop] == ')') {
-				if (count == 0)
+				if (count == 0) {
 					traverse_second->thisStruct[loop] = '(';
-				else
+					if (struc != NULL)
+						struc[cpos + loop] = '(';
+				} else
 					count--;
 			}
 		}
 	}
 
 	count = 0;
+	cpos = pos - 1;
 	for (traverse_second = traverse->prev; traverse_second != NULL; traverse_second = traverse_second->prev) {
+		cpos -= traverse_second->size + 1;
 		for (loop = traverse_second->size - 1; loop >= 0; loop--) {
 			if (traverse_second->thisStruct[loop] == ')')
 				count++;
 			if (traverse_second->thisStruct[loop] == '(') {
-				if (count == 0)
+				if (count == 0) {
 					traverse_second->thisStruct[loop] = ')';
-				else
+					if (struc != NULL)
+						struc[cpos + 1 + loop] = ')';
+				} else
 					count--;
 			}
 		}
@@ -330,17 +471,21 @@ void StrandOrdering::reorder(OpenLoop *index) {
 	first = traverse;
 	last = traverse_second;
 
+	// the flat strings are rotated to start at the new first strand, as the list was.
 	if (seq != NULL) {
+		char *rotated = rotateFlat(seq, pos, '+');
 		delete[] seq;
-		seq = NULL;
+		seq = rotated;
 	}
 	if (struc != NULL) {
+		char *rotated = rotateFlat(struc, pos, '+');
 		delete[] struc;
-		struc = NULL;
+		struc = rotated;
 	}
 	if (strandnames != NULL) {
+		char *rotated = rotateFlat(strandnames, namesPos, ',');
 		delete[] strandnames;
-		strandnames = NULL;
+		strandnames = rotated;
 	}
 }
 
@@ -395,16 +540,9 @@ int StrandOrdering::checkIDBound(char *id) {
 
 	orderingList *traverse = first;
 
-	unsigned int loop;
-	int flag;
 	while (traverse != NULL) {
 		if (strcmp(traverse->thisTag, id) == 0) {
-			flag = 0;
-			for (loop = 0; loop < strlen(traverse->thisStruct) && (flag == 0); loop++)
-				if (traverse->thisStruct[loop] == '.')
-					flag = 1;
-
-			if (flag == 0)
+			if (traverse->unpaired == 0)
 				return 1;
 		}
 		traverse = traverse->next;
@@ -654,21 +792,35 @@ StrandOrdering *StrandOrdering::breakOrdering(Loop *firstOldBreak, Loop *secondO
 	StrandOrdering *newOrdering;
 
 	openInfo.upToDate = false;
+	stopPairLog();
 
 	int numitems = 0;
-	for (traverse = first; traverse != NULL; traverse = traverse->next) {
+	// offsets of temp and temp2 into the flat sequence and the strand names, and their total lengths
+	int tempPos = 0, temp2Pos = 0, cpos = 0;
+	int namesTempPos = 0, namesTemp2Pos = 0, namesPos = 0;
+	for (traverse = first; traverse != NULL; cpos += traverse->size + 1, namesPos += nameLength(traverse), traverse = traverse->next) {
 		if (traverse->thisLoop == (OpenLoop *) firstOldBreak) {
-			if (temp == NULL)
+			if (temp == NULL) {
 				temp = traverse;
-			else
+				tempPos = cpos;
+				namesTempPos = namesPos;
+			} else {
 				temp2 = traverse;
+				temp2Pos = cpos;
+				namesTemp2Pos = namesPos;
+			}
 			traverse->thisLoop = (OpenLoop *) firstNewBreak;
 		}
 		if (traverse->thisLoop == (OpenLoop *) secondOldBreak) {
-			if (temp == NULL)
+			if (temp == NULL) {
 				temp = traverse;
-			else
+				tempPos = cpos;
+				namesTempPos = namesPos;
+			} else {
 				temp2 = traverse;
+				temp2Pos = cpos;
+				namesTemp2Pos = namesPos;
+			}
 			traverse->thisLoop = (OpenLoop *) secondNewBreak;
 		}
 		if (temp != NULL && temp2 == NULL)
@@ -682,6 +834,24 @@ StrandOrdering *StrandOrdering::breakOrdering(Loop *firstOldBreak, Loop *secondO
 		newOrdering = new StrandOrdering(temp2, last, count - numitems);
 		last = extra;
 		count = numitems;
+
+		// the new ordering is a suffix of the flat strings, we keep the prefix.
+		if (seq != NULL && struc != NULL) {
+			newOrdering->seq = spliceFlat(seq, temp2Pos, cpos - 1);
+			newOrdering->struc = spliceFlat(struc, temp2Pos, cpos - 1);
+			char *newSeq = spliceFlat(seq, 0, temp2Pos - 1);
+			char *newStruc = spliceFlat(struc, 0, temp2Pos - 1);
+			delete[] seq;
+			delete[] struc;
+			seq = newSeq;
+			struc = newStruc;
+		}
+		if (strandnames != NULL) {
+			newOrdering->strandnames = spliceFlat(strandnames, namesTemp2Pos, namesPos - 1);
+			char *newNames = spliceFlat(strandnames, 0, namesTemp2Pos - 1);
+			delete[] strandnames;
+			strandnames = newNames;
+		}
 	} else {
 		extra = temp2->prev;
 		extra->next = NULL;
@@ -691,20 +861,39 @@ StrandOrdering *StrandOrdering::breakOrdering(Loop *firstOldBreak, Loop *secondO
 
 		newOrdering = new StrandOrdering(temp, extra, numitems);
 		count = count - numitems;
+
+		// the new ordering is a middle section of the flat strings, we keep what surrounds it.
+		if (seq != NULL && struc != NULL) {
+			newOrdering->seq = spliceFlat(seq, tempPos, temp2Pos - 1);
+			newOrdering->struc = spliceFlat(struc, tempPos, temp2Pos - 1);
+			char *newSeq = spliceFlat(seq, 0, tempPos, temp2Pos, cpos - 1);
+			char *newStruc = spliceFlat(struc, 0, tempPos, temp2Pos, cpos - 1);
+			delete[] seq;
+			delete[] struc;
+			seq = newSeq;
+			struc = newStruc;
+		}
+		if (strandnames != NULL) {
+			newOrdering->strandnames = spliceFlat(strandnames, namesTempPos, namesTemp2Pos - 1);
+			char *newNames = spliceFlat(strandnames, 0, namesTempPos, namesTemp2Pos, namesPos - 1);
+			delete[] strandnames;
+			strandnames = newNames;
+		}
 	}
 
-	if (seq != NULL) {
-		delete[] seq;
-		seq = NULL;
+	// the broken off strands take their base pairs with them.
+	if (fingerprintValid) {
+		fingerprint ^= newOrdering->getFingerprint();
 	}
-	if (struc != NULL) {
-		delete[] struc;
+
+	if (seq == NULL || struc == NULL) {
+		if (seq != NULL)
+			delete[] seq;
+		if (struc != NULL)
+			delete[] struc;
+		seq = NULL;
 		struc = NULL;
 	}
-	if (strandnames != NULL) {
-		delete[] strandnames;
-		strandnames = NULL;
-	}
 	firstOldBreak->cleanupAdjacent();
 	secondOldBreak->cleanupAdjacent();
 	delete firstOldBreak;
@@ -896,43 +1085,28 @@ string StrandOrdering::toString(void) {
 void StrandOrdering::addBasepair(char *first_bp, char *second_bp) {
 
 	char *id[2] = { NULL, NULL };
-	char *temp;
-	orderingList *traverse = NULL;
-	int iflag = 0;
+	int pos[2] = { 0, 0 };
+	uint64_t key[2] = { 0, 0 };
+	orderingList *strand[2] = { NULL, NULL };
 
-	openInfo.upToDate = false;
+	findBasepair(first_bp, second_bp, id, pos, key, strand);
 
-	for (traverse = first; traverse != NULL; traverse = traverse->next, iflag = 0) {
-		if (((first_bp - traverse->thisCodeSeq) < traverse->size) && ((first_bp - traverse->thisCodeSeq) >= 0)) {
-			if (id[0] == NULL)
-				id[0] = &traverse->thisStruct[first_bp - traverse->thisCodeSeq];
-			else
-				id[1] = &traverse->thisStruct[first_bp - traverse->thisCodeSeq];
-			iflag = 1;
-		}
-		if (((second_bp - traverse->thisCodeSeq) < traverse->size) && ((second_bp - traverse->thisCodeSeq) >= 0)) {
-			if (id[0] == NULL)
-				id[0] = &traverse->thisStruct[second_bp - traverse->thisCodeSeq];
-			else {
-				temp = &traverse->thisStruct[second_bp - traverse->thisCodeSeq];
-				if (iflag == 1 && (temp < id[0])) {
-					id[1] = id[0];
-					id[0] = temp;
-				} else
-					id[1] = temp;
-			}
-		}
-	}
 	assert(*id[0] == '.' && *id[1] == '.');
 	*id[0] = '(';
 	*id[1] = ')';
-	if (seq != NULL) {
-		delete[] seq;
-		seq = NULL;
-	}
+	strand[0]->unpaired--;
+	strand[1]->unpaired--;
+
+	if (fingerprintValid)
+		fingerprint.toggle(key[0], key[1]);
+
+	if (pairLogging)
+		logPair(key[0], key[1], true);
+
+	// the sequence is unchanged, and the cached structure is patched in place.
 	if (struc != NULL) {
-		delete[] struc;
-		struc = NULL;
+		struc[pos[0]] = '(';
+		struc[pos[1]] = ')';
 	}
 
 	return;
@@ -942,51 +1116,161 @@ void StrandOrdering::addBasepair(char *first_bp, char *second_bp) {
 void StrandOrdering::breakBasepair(char *first_bp, char *second_bp) {
 
 	char *id[2] = { NULL, NULL };
+	int pos[2] = { 0, 0 };
+	uint64_t key[2] = { 0, 0 };
+	orderingList *strand[2] = { NULL, NULL };
+
+	for (orderingList *traverse = first; traverse != NULL; traverse = traverse->next) {
+		traverse->thisLoop->openInfo.upToDate = false;
+	}
+
+	findBasepair(first_bp, second_bp, id, pos, key, strand);
+
+// FD: id points to the characters in thisStruct that will change from ( and ) to . and .
+	assert((*id[0] == '(' && *id[1] == ')'));
+	*id[0] = '.';
+	*id[1] = '.';
+	strand[0]->unpaired++;
+	strand[1]->unpaired++;
+
+	if (fingerprintValid)
+		fingerprint.toggle(key[0], key[1]);
+
+	if (pairLogging)
+		logPair(key[0], key[1], false);
+
+	if (struc != NULL) {
+		struc[pos[0]] = '.';
+		struc[pos[1]] = '.';
+	}
+
+	return;
+}
+
+// findBasepair( char *first_bp, char *second_bp, char **id, int *pos, uint64_t *key, orderingList **strand )
+// -- Finds the structure characters of the two given bases, in the order they appear in the complex.
+// id[] receives pointers into the strands' thisStruct, pos[] the matching indices into the flat structure,
+// key[] the fingerprint keys of the bases and strand[] the strands holding them.
+void StrandOrdering::findBasepair(char *first_bp, char *second_bp, char **id, int *pos, uint64_t *key, orderingList **strand) {
+
 	char *temp = NULL;
 	orderingList *traverse = NULL;
 	int iflag = 0;
+	int cpos = 0;
 
 	openInfo.upToDate = false;
 
-	for (traverse = first; traverse != NULL; traverse = traverse->next, iflag = 0) {
-
-		traverse->thisLoop->openInfo.upToDate  = false;
-
+	for (traverse = first; traverse != NULL; cpos += traverse->size + 1, traverse = traverse->next, iflag = 0) {
 		if (((first_bp - traverse->thisCodeSeq) < traverse->size) && ((first_bp - traverse->thisCodeSeq) >= 0)) {
-			if (id[0] == NULL)
+			if (id[0] == NULL) {
 				id[0] = &traverse->thisStruct[first_bp - traverse->thisCodeSeq];
-			else
+				pos[0] = cpos + (first_bp - traverse->thisCodeSeq);
+				key[0] = utility::state_fingerprint::baseKey(traverse->index, first_bp - traverse->thisCodeSeq);
+				strand[0] = traverse;
+			} else {
 				id[1] = &traverse->thisStruct[first_bp - traverse->thisCodeSeq];
+				pos[1] = cpos + (first_bp - traverse->thisCodeSeq);
+				key[1] = utility::state_fingerprint::baseKey(traverse->index, first_bp - traverse->thisCodeSeq);
+				strand[1] = traverse;
+			}
 			iflag = 1;
 		}
 		if (((second_bp - traverse->thisCodeSeq) < traverse->size) && ((second_bp - traverse->thisCodeSeq) >= 0)) {
-			if (id[0] == NULL)
+			if (id[0] == NULL) {
 				id[0] = &traverse->thisStruct[second_bp - traverse->thisCodeSeq];
-			else {
+				pos[0] = cpos + (second_bp - traverse->thisCodeSeq);
+				key[0] = utility::state_fingerprint::baseKey(traverse->index, second_bp - traverse->thisCodeSeq);
+				strand[0] = traverse;
+			} else {
 				temp = &traverse->thisStruct[second_bp - traverse->thisCodeSeq];
 				if (iflag == 1 && (temp < id[0])) {
 					id[1] = id[0];
+					pos[1] = pos[0];
+					key[1] = key[0];
+					strand[1] = strand[0];
 					id[0] = temp;
-				} else
+					pos[0] = cpos + (second_bp - traverse->thisCodeSeq);
+					key[0] = utility::state_fingerprint::baseKey(traverse->index, second_bp - traverse->thisCodeSeq);
+					strand[0] = traverse;
+				} else {
 					id[1] = temp;
+					pos[1] = cpos + (second_bp - traverse->thisCodeSeq);
+					key[1] = utility::state_fingerprint::baseKey(traverse->index, second_bp - traverse->thisCodeSeq);
+					strand[1] = traverse;
+				}
 			}
 		}
 	}
+}
 
-// FD: id points to the characters in thisStruct that will change from ( and ) to . and .
-	assert((*id[0] == '(' && *id[1] == ')'));
-	*id[0] = '.';
-	*id[1] = '.';
-	if (seq != NULL) {
-		delete[] seq;
-		seq = NULL;
+void StrandOrdering::startPairLog(void) {
+
+	pairLog.clear();
+	pairLogging = true;
+
+}
+
+void StrandOrdering::stopPairLog(void) {
+
+	pairLog.clear();
+	pairLogging = false;
+
+}
+
+bool StrandOrdering::pairLogValid(void) {
+
+	return pairLogging;
+
+}
+
+std::vector<StrandOrdering::PairChange>& StrandOrdering::getPairLog(void) {
+
+	return pairLog;
+
+}
+
+void StrandOrdering::logPair(uint64_t first, uint64_t second, bool added) {
+
+	if (pairLog.size() >= pairLogLimit) {
+		stopPairLog();
+		return;
 	}
-	if (struc != NULL) {
-		delete[] struc;
-		struc = NULL;
+
+	PairChange change = { first, second, added };
+	pairLog.push_back(change);
+
+}
+
+utility::state_fingerprint& StrandOrdering::getFingerprint(void) {
+
+	if (!fingerprintValid)
+		computeFingerprint();
+
+	return fingerprint;
+}
+
+// computeFingerprint( void )
+// -- Recomputes the fingerprint from the structure of each strand. Brackets are matched across strands
+// in the order of the ordering, which is valid for any rotation.
+void StrandOrdering::computeFingerprint(void) {
+
+	vector<uint64_t> open;
+
+	fingerprint = utility::state_fingerprint();
+
+	for (orderingList *traverse = first; traverse != NULL; traverse = traverse->next) {
+		for (int loop = 0; loop < traverse->size; loop++) {
+			if (traverse->thisStruct[loop] == '(') {
+				open.push_back(utility::state_fingerprint::baseKey(traverse->index, loop));
+			} else if (traverse->thisStruct[loop] == ')') {
+				assert(!open.empty());
+				fingerprint.toggle(open.back(), utility::state_fingerprint::baseKey(traverse->index, loop));
+				open.pop_back();
+			}
+		}
 	}
 
-	return;
+	fingerprintValid = true;
 }
 
 int StrandOrdering::getStrandCount(void) {
@@ -0,0 +1,260 @@
+/*
+Copyright (c) 2017 California Institute of Technology. All rights reserved.
+Multistrand nucleic acid kinetic simulator
+help@multistrand.org
+*/
+
+#include "checkpoint.h"
+
+#include <cstring>
+
+static const char checkpointMagic[8] = "MSCHKP2";
+
+bool Checkpoint::write(std::string path) {
+
+	std::string temporary = path + ".tmp";
+
+	file = fopen(temporary.c_str(), "wb");
+	failed = (file == NULL);
+
+	if (failed) {
+		error = "could not open " + temporary + " for writing";
+		return false;
+	}
+
+	fwrite(checkpointMagic, sizeof(checkpointMagic), 1, file);
+
+	putLong(simulationMode);
+	putLong(simulationCount);
+	putLong(runSeed);
+	putLong(trajectoryIndex);
+	putLong(currentSeed);
+	putLong(remaining);
+	putLong(steps);
+	putLong(trajectorySteps);
+	putLong(noInitialMoves);
+	putLong(timeOut);
+	for (int i = 0; i < 4; i++)
+		putLong(rng[i]);
+
+	putDouble(time);
+	putDouble(forwardRate);
+	putInt(idCounter);
+	putInt(complexes.size());
+
+	for (checkpoint_complex& complex : complexes) {
+
+		putInt(complex.id);
+		putInt(complex.uids.size());
+
+		for (unsigned int i = 0; i < complex.uids.size(); i++) {
+			putInt(complex.uids[i]);
+			putInt(complex.indices[i]);
+			putString(complex.names[i]);
+		}
+
+		putString(complex.sequence);
+		putString(complex.structure);
+
+	}
+
+	putInt(calls.size());
+
+	for (python_call& call : calls) {
+
+		putInt(call.type);
+		putLong(call.seed);
+		putInt(call.flag);
+		putDouble(call.time);
+		putDouble(call.rate);
+		putInt(call.hasTag);
+		putString(call.tag);
+		putString(call.names);
+		putString(call.sequence);
+		putString(call.structure);
+
+	}
+
+	if (fclose(file) != 0)
+		failed = true;
+	file = NULL;
+
+	if (failed || rename(temporary.c_str(), path.c_str()) != 0) {
+		error = "could not write " + path;
+		return false;
+	}
+
+	return true;
+
+}
+
+bool Checkpoint::read(std::string path) {
+
+	file = fopen(path.c_str(), "rb");
+	failed = (file == NULL);
+
+	if (failed) {
+		error = "could not open " + path;
+		return false;
+	}
+
+	char magic[8];
+
+	if (fread(magic, sizeof(magic), 1, file) != 1 || memcmp(magic, checkpointMagic, sizeof(magic)) != 0) {
+		fclose(file);
+		file = NULL;
+		error = path + " is not a checkpoint file";
+		return false;
+	}
+
+	simulationMode = getLong();
+	simulationCount = getLong();
+	runSeed = getLong();
+	trajectoryIndex = getLong();
+	currentSeed = getLong();
+	remaining = getLong();
+	steps = getLong();
+	trajectorySteps = getLong();
+	noInitialMoves = getLong();
+	timeOut = getLong();
+	for (int i = 0; i < 4; i++)
+		rng[i] = getLong();
+
+	time = getDouble();
+	forwardRate = getDouble();
+	idCounter = getInt();
+
+	int complexCount = getInt();
+
+	for (int c = 0; c < complexCount && !failed; c++) {
+
+		checkpoint_complex complex;
+
+		complex.id = getInt();
+		int strandCount = getInt();
+
+		for (int i = 0; i < strandCount && !failed; i++) {
+			complex.uids.push_back(getInt());
+			complex.indices.push_back(getInt());
+			complex.names.push_back(getString());
+		}
+
+		complex.sequence = getString();
+		complex.structure = getString();
+
+		complexes.push_back(complex);
+
+	}
+
+	int callCount = failed ? 0 : getInt();
+
+	for (int c = 0; c < callCount && !failed; c++) {
+
+		python_call::call_type type = (python_call::call_type) getInt();
+		python_call call(type, getLong());
+
+		call.flag = getInt();
+		call.time = getDouble();
+		call.rate = getDouble();
+		call.hasTag = getInt();
+		call.tag = getString();
+		call.names = getString();
+		call.sequence = getString();
+		call.structure = getString();
+
+		calls.push_back(call);
+
+	}
+
+	fclose(file);
+	file = NULL;
+
+	if (failed || complexCount <= 0) {
+		error = path + " is truncated or damaged";
+		return false;
+	}
+
+	return true;
+
+}
+
+void Checkpoint::putInt(int32_t value) {
+
+	if (fwrite(&value, sizeof(value), 1, file) != 1)
+		failed = true;
+
+}
+
+void Checkpoint::putLong(int64_t value) {
+
+	if (fwrite(&value, sizeof(value), 1, file) != 1)
+		failed = true;
+
+}
+
+void Checkpoint::putDouble(double value) {
+
+	if (fwrite(&value, sizeof(value), 1, file) != 1)
+		failed = true;
+
+}
+
+void Checkpoint::putString(const std::string& value) {
+
+	putInt(value.size());
+
+	if (!value.empty() && fwrite(value.data(), value.size(), 1, file) != 1)
+		failed = true;
+
+}
+
+int32_t Checkpoint::getInt(void) {
+
+	int32_t value = 0;
+
+	if (fread(&value, sizeof(value), 1, file) != 1)
+		failed = true;
+
+	return value;
+
+}
+
+int64_t Checkpoint::getLong(void) {
+
+	int64_t value = 0;
+
+	if (fread(&value, sizeof(value), 1, file) != 1)
+		failed = true;
+
+	return value;
+
+}
+
+double Checkpoint::getDouble(void) {
+
+	double value = 0.0;
+
+	if (fread(&value, sizeof(value), 1, file) != 1)
+		failed = true;
+
+	return value;
+
+}
+
+std::string Checkpoint::getString(void) {
+
+	int32_t size = getInt();
+
+	if (failed || size < 0 || size > (1 << 24)) {
+		failed = true;
+		return std::string();
+	}
+
+	std::string value(size, '\0');
+
+	if (size > 0 && fread(&value[0], size, 1, file) != 1)
+		failed = true;
+
+	return value;
+
+}
@@ -36,6 +36,12 @@ double EnergyOptions::getTemperature(void) {
 
 }
 
+void EnergyOptions::setTemperature(double newTemperature) {
+
+	temperature = newTemperature;
+
+}
+
 long EnergyOptions::getDangles(void) {
 
 	return dangles;
@@ -53,6 +59,24 @@ bool EnergyOptions::getGtenable(void) {
 
 }
 
+long EnergyOptions::getSubstrateType(void) {
+
+	return substrate_type;
+
+}
+
+string EnergyOptions::getCompiledParameters(void) {
+
+	return compiledParameters;
+
+}
+
+string EnergyOptions::getParameterFile(void) {
+
+	return parameterFile;
+
+}
+
 long EnergyOptions::getKineticRateMethod(void) {
 
 	return kinetic_rate_method;
@@ -89,9 +113,6 @@ double EnergyOptions::getUniScale(void) {
 
 string EnergyOptions::toString(void) {
 
-// not sure if these are long
-	long substrate_type = NULL;
-
 	std::stringstream ss;
 
 	ss << "temperature = " << temperature << " \n";
@@ -103,6 +124,8 @@ string EnergyOptions::toString(void) {
 	ss << "biScale = " << biScale << " \n";
 	ss << "uniScale = " << uniScale << " \n";
 	ss << " substrate_type = " << substrate_type << " \n";
+	ss << "compiledParameters = " << compiledParameters << " \n";
+	ss << "parameterFile = " << parameterFile << " \n";
 
 	string output = ss.str();
 
@@ -122,6 +145,26 @@ PEnergyOptions::PEnergyOptions(PyObject* input) :
 	getLongAttr(python_settings, log_ml, &logml);
 	getBoolAttr(python_settings, gt_enable, &gtenable);
 	getLongAttr(python_settings, rate_method, &kinetic_rate_method);
+	getLongAttr(python_settings, substrate_type, &substrate_type);
+
+	// compiled_parameters is None unless a compiled parameter set should be loaded.
+	PyObject *py_compiled = PyObject_GetAttrString(python_settings, "compiled_parameters");
+	if (py_compiled == NULL) {
+		PyErr_Clear();
+	} else {
+		if (PyString_Check(py_compiled))
+			compiledParameters = PyString_AS_STRING(py_compiled);
+		Py_DECREF(py_compiled);
+	}
+
+	PyObject *py_parameter_file = PyObject_GetAttrString(python_settings, "parameter_file");
+	if (py_parameter_file == NULL) {
+		PyErr_Clear();
+	} else {
+		if (PyString_Check(py_parameter_file))
+			parameterFile = PyString_AS_STRING(py_parameter_file);
+		Py_DECREF(py_parameter_file);
+	}
 
 	getDoubleAttr(python_settings, bimolecular_scaling, &biScale);
 	getDoubleAttr(python_settings, unimolecular_scaling, &uniScale);
@@ -233,9 +276,9 @@ bool PEnergyOptions::compareSubstrateType(long type) {
 
 }
 
-void PEnergyOptions::getParameterFile(char* input, PyObject* tempString) {
+EnergyOptions* PEnergyOptions::copy(void) {
 
-	input = (char *) getStringAttr(python_settings, parameter_file, tempString);
+	return new PEnergyOptions(*this);
 
 }
 
@@ -252,6 +295,7 @@ CEnergyOptions::CEnergyOptions() :
 	logml = 0;
 	gtenable = 0;
 	kinetic_rate_method = 2;
+	substrate_type = SUBSTRATE_DNA;
 
 	biScale = 1.38e+06;
 	uniScale = 1.5e+08;
@@ -262,13 +306,72 @@ CEnergyOptions::CEnergyOptions() :
 
 bool CEnergyOptions::compareSubstrateType(long type) {
 
-	return (SUBSTRATE_DNA == type); // only test TRUE for when substrate is DNA.
+	return (substrate_type == type);
 
 }
 
-// functionality to specify an energy file in a custom place for non-DNA/RNA substrates. unused atm.
-void CEnergyOptions::getParameterFile(char* input, PyObject* tempString) {
+EnergyOptions* CEnergyOptions::copy(void) {
+
+	return new CEnergyOptions(*this);
 
-	input = "";
 }
 
+// The keys are the names of the matching Options attributes. Constants such as
+// the substrate type are given by name, as in Options.
+bool CEnergyOptions::readOption(string& key, std::istream& value) {
+
+	string word;
+
+	if (key == "temperature") {
+		value >> temperature;
+		if (0.0 <= temperature && temperature <= 100.0) // Celsius, as in Options
+			temperature += 273.15;
+	} else if (key == "dangles") {
+		value >> word;
+		if (word == "none" || word == "0")
+			dangles = DANGLES_NONE;
+		else if (word == "some" || word == "1")
+			dangles = DANGLES_SOME;
+		else if (word == "all" || word == "2")
+			dangles = DANGLES_ALL;
+		else
+			return false;
+	} else if (key == "substrate_type") {
+		value >> word;
+		if (word == "DNA")
+			substrate_type = SUBSTRATE_DNA;
+		else if (word == "RNA")
+			substrate_type = SUBSTRATE_RNA;
+		else
+			return false;
+	} else if (key == "rate_method") {
+		value >> word;
+		if (word == "metropolis")
+			kinetic_rate_method = RATE_METHOD_METROPOLIS;
+		else if (word == "kawasaki")
+			kinetic_rate_method = RATE_METHOD_KAWASAKI;
+		else
+			return false;
+	} else if (key == "gt_enable") {
+		value >> gtenable;
+	} else if (key == "log_ml") {
+		value >> logml;
+	} else if (key == "unimolecular_scaling") {
+		value >> uniScale;
+	} else if (key == "bimolecular_scaling") {
+		value >> biScale;
+	} else if (key == "join_concentration") {
+		value >> joinConcentration;
+	} else if (key == "sodium") {
+		value >> sodium;
+	} else if (key == "magnesium") {
+		value >> magnesium;
+	} else if (key == "compiled_parameters") {
+		value >> compiledParameters;
+	} else {
+		return false;
+	}
+
+	return !value.fail();
+
+}
@@ -0,0 +1,105 @@
+/*
+Copyright (c) 2017 California Institute of Technology. All rights reserved.
+Multistrand nucleic acid kinetic simulator
+help@multistrand.org
+*/
+
+/* ------------------------------------------------------------------------
+
+ Headless runner, built with 'make runner':
+
+ 	multistrand_run job.txt [checkpoint]
+
+ runs the trajectories described by a job file without starting python, or
+ continues the run saved in a checkpoint file of that job. The
+ parameter files are found through NUPACKHOME, as for the python module.
+
+ A job file has one option per line, a key followed by its values. Text after
+ a '#' is ignored. For example:
+
+ 	strand		top		GTTAGACTCGGAGGTGG
+ 	strand		bottom	CCACCTCCGAGTCTAAC
+ 	start		top		.................
+ 	start		bottom	.................
+ 	stop		SUCCESS	exact	0	top,bottom	(((((((((((((((((+)))))))))))))))))
+ 	stop		REVERSE	dissoc	0	top		.................
+ 	simulation_mode		first_step
+ 	num_simulations		10000
+ 	temperature			25
+ 	results				results.csv
+
+ strand <name> <sequence>
+ 	Strand names are unique, and strands are referred to by name below.
+ start <names> <structure>
+ 	One complex of the start state, with its strands as a comma separated list.
+ stop <tag> <type> <count> <names> <structure>
+ 	One complex of the stop condition tagged tag; lines with the same tag form a
+ 	single condition. The type is the macrostate type: exact, bound, dissoc,
+ 	loose or count.
+
+ The other keys are the names of the matching Options attributes:
+ simulation_mode (normal, first_step or trajectory), num_simulations,
+ initial_seed, num_threads, simulation_time, move_container (list or tree),
+ output_interval, output_time, output_file, temperature, dangles (none, some or
+ all), substrate_type (DNA or RNA), rate_method (metropolis or kawasaki),
+ gt_enable, log_ml, unimolecular_scaling, bimolecular_scaling,
+ join_concentration, sodium, magnesium, compiled_parameters, checkpoint_file
+ and checkpoint_interval. Trajectory states can only be exported to an
+ output_file. With checkpoints, results are written when the run is over.
+
+ results <path>
+ 	Required. One line per trajectory: seed,result,time,rate,tag
+ 	with result one of normal, time, forward, reverse, ftime, nomoves, error
+ 	or nan, as in Options.interface.results.
+ results_format csv | binary
+ 	The binary file starts with char[8] magic "MSRSLT1", int32 tag count and per
+ 	tag an int32 length and the tag, followed by one record per trajectory:
+ 	int64 seed, int32 result (the STOPRESULT constant), int32 tag index or -1,
+ 	float64 time and float64 rate. All values are in native byte order.
+ end_states <path>
+ 	Optional. The final complexes of every trajectory, one per line:
+ 	seed,id,names,sequence,structure,energy
+
+ ------------------------------------------------------------------------ */
+
+#include <iostream>
+#include "ssystem.h"
+#include "simoptions.h"
+
+int main(int argc, char **argv) {
+
+	if (argc != 2 && argc != 3) {
+		cerr << "usage: " << argv[0] << " job_file [checkpoint_file]\n";
+		return 2;
+	}
+
+	CSimOptions *options = new CSimOptions();
+
+	if (!options->readJobFile(argv[1]) || !options->openOutput())
+		return 1;
+
+	SimulationSystem *system = new SimulationSystem(options);
+
+	int result = 0;
+
+	if (argc == 3) {
+
+		string error;
+
+		if (system->ResumeSimulation(argv[2], error) != 0) {
+			cerr << "MULTISTRAND: " << error << ".\n";
+			result = 1;
+		}
+
+	} else {
+
+		system->StartSimulation();
+
+	}
+
+	delete system;
+	options->closeOutput();
+
+	return result;
+
+}
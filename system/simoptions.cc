@@ -21,7 +21,10 @@ help@multistrand.org
 #include <iostream>
 #include <string>
 #include <sstream>
+#include <fstream>
+#include <algorithm>
 #include <cstring>
+#include <stdint.h>
 
 using std::vector;
 using std::string;
@@ -60,15 +63,50 @@ PSimOptions::PSimOptions(PyObject* input) :
 
 	}
 
+	getLongAttr(python_settings, trajectory_offset, &trajectory_offset);
+	getLongAttr(python_settings, num_threads, &num_threads);
+
 	energyOptions = new PEnergyOptions(python_settings);
 
 	getLongAttr(python_settings, simulation_mode, &simulation_mode);
 	getLongAttr(python_settings, num_simulations, &simulation_count);
+	getLongAttr(python_settings, flux_trials, &flux_trials);
+	getLongAttr(python_settings, ensemble_walkers, &ensemble_walkers);
+	getDoubleAttr(python_settings, ensemble_interval, &ensemble_interval);
 	getLongAttr(python_settings, output_interval, &o_interval);
 	getDoubleAttr(python_settings, output_time, &o_time);
+	getBoolAttr(python_settings, output_columnar, &o_columnar);
+	getLongAttr(python_settings, output_columnar_block, &o_columnar_block);
+
+	// output_file is None unless the trajectory should be written to disk.
+	PyObject *py_file = PyObject_GetAttrString(python_settings, "output_file");
+	if (py_file == NULL) {
+		PyErr_Clear();
+	} else {
+		if (PyString_Check(py_file))
+			o_file = PyString_AS_STRING(py_file);
+		Py_DECREF(py_file);
+	}
+
+	getBoolAttr(python_settings, output_delta, &o_delta);
+	getLongAttr(python_settings, output_keyframe_interval, &o_keyframe_interval);
+
+	PyObject *py_checkpoint = PyObject_GetAttrString(python_settings, "checkpoint_file");
+	if (py_checkpoint == NULL) {
+		PyErr_Clear();
+	} else {
+		if (PyString_Check(py_checkpoint))
+			checkpoint_file = PyString_AS_STRING(py_checkpoint);
+		Py_DECREF(py_checkpoint);
+	}
+
+	getLongAttr(python_settings, checkpoint_interval, &checkpoint_interval);
+
 	getLongAttr(python_settings, stop_count, &stop_count);
 	getLongAttr(python_settings, use_stop_conditions, &stop_options);
 	getDoubleAttr(python_settings, simulation_time, &max_sim_time);
+	getLongAttr(python_settings, move_container, &move_container);
+	getBoolAttr(python_settings, export_ctmc, &export_ctmc);
 
 	debug = false;	// this is the main switch for simOptions debug, for now.
 
@@ -80,12 +118,26 @@ string SimOptions::toString() {
 
 	ss << "simulation_mode = " << simulation_mode << " \n";
 	ss << "simulation_count = " << simulation_count << " \n";
+	ss << "flux_trials = " << flux_trials << " \n";
+	ss << "ensemble_walkers = " << ensemble_walkers << " \n";
+	ss << "ensemble_interval = " << ensemble_interval << " \n";
 	ss << "o_interval = " << o_interval << " \n";
 	ss << "o_time = " << o_time << " \n";
+	ss << "o_columnar = " << o_columnar << " \n";
+	ss << "o_columnar_block = " << o_columnar_block << " \n";
+	ss << "o_file = " << o_file << " \n";
+	ss << "o_delta = " << o_delta << " \n";
+	ss << "o_keyframe_interval = " << o_keyframe_interval << " \n";
+	ss << "checkpoint_file = " << checkpoint_file << " \n";
+	ss << "checkpoint_interval = " << checkpoint_interval << " \n";
 	ss << "stop_options = " << stop_options << " \n";
 	ss << "stop_count = " << stop_count << " \n";
 	ss << "max_sim_time = " << max_sim_time << " \n";
+	ss << "move_container = " << move_container << " \n";
+	ss << "export_ctmc = " << export_ctmc << " \n";
 	ss << "seed = " << seed << " \n";
+	ss << "trajectory_offset = " << trajectory_offset << " \n";
+	ss << "num_threads = " << num_threads << " \n";
 
 //	ss << "myComplexes = { ";
 //
@@ -124,6 +176,18 @@ long SimOptions::getInitialSeed() {
 
 }
 
+long SimOptions::getTrajectoryOffset() {
+
+	return trajectory_offset;
+
+}
+
+long SimOptions::getNumThreads() {
+
+	return num_threads;
+
+}
+
 EnergyOptions* SimOptions::getEnergyOptions() {
 
 	return energyOptions;
@@ -142,6 +206,24 @@ long SimOptions::getSimulationCount(void) {
 
 }
 
+long SimOptions::getFluxTrials(void) {
+
+	return flux_trials;
+
+}
+
+long SimOptions::getEnsembleWalkers(void) {
+
+	return ensemble_walkers;
+
+}
+
+double SimOptions::getEnsembleInterval(void) {
+
+	return ensemble_interval;
+
+}
+
 long SimOptions::getOInterval(void) {
 
 	return o_interval;
@@ -154,6 +236,54 @@ double SimOptions::getOTime(void) {
 
 }
 
+bool SimOptions::getOColumnar(void) {
+
+	return o_columnar;
+
+}
+
+long SimOptions::getOColumnarBlock(void) {
+
+	return o_columnar_block;
+
+}
+
+string SimOptions::getOFile(void) {
+
+	return o_file;
+
+}
+
+bool SimOptions::getODelta(void) {
+
+	return o_delta;
+
+}
+
+long SimOptions::getOKeyframeInterval(void) {
+
+	return o_keyframe_interval;
+
+}
+
+string SimOptions::getCheckpointFile(void) {
+
+	return checkpoint_file;
+
+}
+
+long SimOptions::getCheckpointInterval(void) {
+
+	return checkpoint_interval;
+
+}
+
+vector<python_call>& SimOptions::getQueuedCalls(void) {
+
+	return queuedCalls;
+
+}
+
 long SimOptions::getStopOptions(void) {
 
 	return stop_options;
@@ -172,6 +302,18 @@ double SimOptions::getMaxSimTime(void) {
 
 }
 
+long SimOptions::getMoveContainer(void) {
+
+	return move_container;
+
+}
+
+bool SimOptions::getExportCTMC(void) {
+
+	return export_ctmc;
+
+}
+
 bool SimOptions::usingArrhenius(void) {
 
 	return energyOptions->usingArrhenius();
@@ -186,85 +328,110 @@ PyObject* PSimOptions::getPythonSettings() {
 
 void PSimOptions::generateComplexes(PyObject *alternate_start, long current_seed) {
 
-	myComplexes = new vector<complex_input>(0); // wipe the pointer to the previous object;
+	// a static start state was read once, when python calls started to be queued.
+	if (queueCalls && alternate_start == NULL) {
+		myComplexes = new vector<complex_input>(*startComplexes);
+		for (complex_input& input : *myComplexes)
+			input.list = input.list->copy();
+		setCurrentSeed(current_seed);
+		return;
+	}
+
+	vector<complex_input>* complexes = readComplexes(alternate_start);
+
+	if (complexes == NULL)
+		return;
+
+	myComplexes = complexes; // wipe the pointer to the previous object;
+
+	// Update the current seed and store the starting structures
+	//   note: only if we actually have a system_options, e.g. no alternate start
+	if (alternate_start == NULL) {
+		setCurrentSeed(current_seed);
+	}
+	seed = current_seed;
+
+	return;
+}
+
+void PSimOptions::setCurrentSeed(long current_seed) {
+
+	if (queueCalls)
+		queuedCalls.push_back(python_call(python_call::SEED, current_seed));
+	else if (python_settings != NULL)
+		setLongAttr(python_settings, interface_current_seed, current_seed);
+
+	seed = current_seed;
 
+}
+
+// Reads the (possibly sampled) start state from python, or NULL if that failed.
+vector<complex_input>* PSimOptions::readComplexes(PyObject *alternate_start) {
+
+	vector<complex_input>* complexes = new vector<complex_input>(0);
+
+	char *sequence, *structure;
+	class identList *id;
+	int start_count;
 	PyObject *py_start_state = NULL, *py_complex = NULL;
 	PyObject *py_seq = NULL, *py_struc = NULL;
 	PyObject *py_err = NULL;
 
-	if (myComplexes->size() == 0) {
-
-		complex_input *tempcomplex = NULL;
-		char *sequence, *structure;
-		class identList *id;
-		int start_count;
-		PyObject *py_start_state = NULL, *py_complex = NULL;
-		PyObject *py_seq = NULL, *py_struc = NULL;
-		PyObject *py_err = NULL;
+	if (alternate_start != NULL)
+		py_start_state = alternate_start;
+	else
+		py_start_state = getListAttr(python_settings, start_state);
 
-		if (alternate_start != NULL)
-			py_start_state = alternate_start;
-		else
-			py_start_state = getListAttr(python_settings, start_state);
+	start_count = PyList_GET_SIZE(py_start_state);
+	// doesn't need reference counting for this size call.
+	// the getlistattr call we decref later.
 
-		start_count = PyList_GET_SIZE(py_start_state);
-		// doesn't need reference counting for this size call.
-		// the getlistattr call we decref later.
+	for (int index = 0; index < start_count; index++) {
 
-		for (int index = 0; index < start_count; index++) {
-
-			// #ifndef DEBUG_MACROS
-			py_complex = PyList_GET_ITEM(py_start_state, index);
-			// Borrowed reference, we do NOT decref it at end of loop.
+		// #ifndef DEBUG_MACROS
+		py_complex = PyList_GET_ITEM(py_start_state, index);
+		// Borrowed reference, we do NOT decref it at end of loop.
 
 #ifdef DEBUG_MACROS
-			printPyError_withLineNumber();
+		printPyError_withLineNumber();
 #endif
 
-			sequence = getStringAttr(py_complex, sequence, py_seq);
-			// new reference
-
-			structure = getStringAttr(py_complex, structure, py_struc);
-			// new reference
-			// Need to check if an error occurred, specifically, it could be an IOError due to sample failing. If so, we need to get the heck out of dodge right now.
-			py_err = PyErr_Occurred();
-			// py_err is a borrowed reference
-
-			if (py_err != NULL) { // then an error occurred while getting the structure. Test for IOError (sample failure):
-				if (PyErr_ExceptionMatches(PyExc_IOError)) {
-					fprintf(stderr,
-							"MULTISTRAND: Starting Structure could not be retrieved for index %d in your options object's start_state. This is likely due to Boltzmann sampling failing: please check that the program 'sample' exists and points correctly to the NUPACK sample binary. Or try 'print o.start_state[%d].structure' where 'o' is your options object and refer to that error message (if any).\n",
-							index, index);
-				} else {
-					fprintf(stderr, "MULTISTRAND: An unidentified exception occurred while trying to initialize the system.\n");
-
-				}
-				return;
-			}
+		sequence = getStringAttr(py_complex, sequence, py_seq);
+		// new reference
 
-			id = getID_list(python_settings, index, alternate_start);
+		structure = getStringAttr(py_complex, structure, py_struc);
+		// new reference
+		// Need to check if an error occurred, specifically, it could be an IOError due to sample failing. If so, we need to get the heck out of dodge right now.
+		py_err = PyErr_Occurred();
+		// py_err is a borrowed reference
 
-			complex_input myTempComplex = complex_input(sequence, structure, id);
+		if (py_err != NULL) { // then an error occurred while getting the structure. Test for IOError (sample failure):
+			if (PyErr_ExceptionMatches(PyExc_IOError)) {
+				fprintf(stderr,
+						"MULTISTRAND: Starting Structure could not be retrieved for index %d in your options object's start_state. This is likely due to Boltzmann sampling failing: please check that the program 'sample' exists and points correctly to the NUPACK sample binary. Or try 'print o.start_state[%d].structure' where 'o' is your options object and refer to that error message (if any).\n",
+						index, index);
+			} else {
+				fprintf(stderr, "MULTISTRAND: An unidentified exception occurred while trying to initialize the system.\n");
 
-			// StrandComplex does make its own copy of the seq/structure, so we can now decref.
-			myComplexes->push_back(myTempComplex);
+			}
+			myComplexes = complexes;
+			return NULL;
+		}
 
-			Py_DECREF(py_seq);
-			Py_DECREF(py_struc);
+		id = getID_list(python_settings, index, alternate_start);
 
-		}
-		Py_DECREF(py_start_state);
+		complex_input myTempComplex = complex_input(sequence, structure, id);
 
-		// Update the current seed and store the starting structures
-		//   note: only if we actually have a system_options, e.g. no alternate start
-		if (alternate_start == NULL && python_settings != NULL) {
-			setLongAttr(python_settings, interface_current_seed, current_seed);
-		}
-		seed = current_seed;
+		// StrandComplex does make its own copy of the seq/structure, so we can now decref.
+		complexes->push_back(myTempComplex);
+
+		Py_DECREF(py_seq);
+		Py_DECREF(py_struc);
 
 	}
+	Py_DECREF(py_start_state);
 
-	return;
+	return complexes;
 }
 
 stopComplexes* PSimOptions::getStopComplexes(int) {
@@ -277,51 +444,203 @@ stopComplexes* PSimOptions::getStopComplexes(int) {
 
 void PSimOptions::stopResultError(long seed) {
 
-	printStatusLine(python_settings, seed, STOPRESULT_ERROR, 0.0, NULL);
+	if (queueCalls)
+		queueStatus(python_call::STATUS, seed, STOPRESULT_ERROR, 0.0, 0.0, NULL);
+	else
+		printStatusLine(python_settings, seed, STOPRESULT_ERROR, 0.0, NULL);
 	return;
 
 }
 
 void PSimOptions::stopResultNan(long seed) {
 
-	printStatusLine(python_settings, seed, STOPRESULT_NAN, 0.0, NULL);
+	if (queueCalls)
+		queueStatus(python_call::STATUS, seed, STOPRESULT_NAN, 0.0, 0.0, NULL);
+	else
+		printStatusLine(python_settings, seed, STOPRESULT_NAN, 0.0, NULL);
 	return;
 
 }
 
 void PSimOptions::stopResultNormal(long seed, double time, char* message) {
 
-	printStatusLine(python_settings, seed, STOPRESULT_NORMAL, time, message);
+	if (queueCalls)
+		queueStatus(python_call::STATUS, seed, STOPRESULT_NORMAL, time, 0.0, message);
+	else
+		printStatusLine(python_settings, seed, STOPRESULT_NORMAL, time, message);
 	return;
 
 }
 
 void PSimOptions::stopResultTime(long seed, double time) {
 
-	printStatusLine(python_settings, seed, STOPRESULT_TIME, time, NULL);
+	if (queueCalls)
+		queueStatus(python_call::STATUS, seed, STOPRESULT_TIME, time, 0.0, NULL);
+	else
+		printStatusLine(python_settings, seed, STOPRESULT_TIME, time, NULL);
 	return;
 
 }
 
 void PSimOptions::stopResultBimolecular(string type, long seed, double stopTime, double rate, char* message) {
 
+	int flag;
+
 	if (type.compare("Reverse")) {
 
-		printStatusLine_First_Bimolecular(python_settings, seed, STOPRESULT_REVERSE, stopTime, rate, message);
+		flag = STOPRESULT_REVERSE;
 
 	} else if (type.compare("Forward")) {
 
-		printStatusLine_First_Bimolecular(python_settings, seed, STOPRESULT_FORWARD, stopTime, rate, message);
+		flag = STOPRESULT_FORWARD;
 
 	} else if (type.compare("FTime")) {
 
-		printStatusLine_First_Bimolecular(python_settings, seed, STOPRESULT_FTIME, stopTime, rate, NULL);
+		flag = STOPRESULT_FTIME;
+		message = NULL;
 
 	} else if (type.compare("NoMoves")) {
-		printStatusLine_First_Bimolecular(python_settings, seed, STOPRESULT_NOMOVES, stopTime, rate, NULL);
 
+		flag = STOPRESULT_NOMOVES;
+		message = NULL;
+
+	} else {
+		return;
+	}
+
+	if (queueCalls)
+		queueStatus(python_call::STATUS_FIRST, seed, flag, stopTime, rate, message);
+	else
+		printStatusLine_First_Bimolecular(python_settings, seed, flag, stopTime, rate, message);
+
+}
+
+void PSimOptions::sendEndState(long seed, int id, char* names, char* sequence, char* structure, double energy) {
+
+	if (!queueCalls) {
+		printComplexStateLine(python_settings, seed, id, names, sequence, structure, energy);
+		return;
 	}
 
+	python_call call(python_call::END_STATE, seed);
+
+	call.flag = id;
+	call.names = names;
+	call.sequence = sequence;
+	call.structure = structure;
+	call.time = energy;
+
+	queuedCalls.push_back(call);
+
+}
+
+void PSimOptions::incrementTrajectoryCount(void) {
+
+	if (queueCalls)
+		queuedCalls.push_back(python_call(python_call::TRAJECTORY_COUNT, 0));
+	else
+		pingAttr(python_settings, increment_trajectory_count);
+
+}
+
+void PSimOptions::queueStatus(python_call::call_type type, long seed, int flag, double time, double rate, char* tag) {
+
+	python_call call(type, seed);
+
+	call.flag = flag;
+	call.time = time;
+	call.rate = rate;
+	call.hasTag = (tag != NULL);
+	if (tag != NULL)
+		call.tag = tag;
+
+	queuedCalls.push_back(call);
+
+}
+
+bool PSimOptions::staticStartState(void) {
+
+	PyObject *py_static = PyObject_GetAttrString(python_settings, "static_start_state");
+
+	if (py_static == NULL) {
+		PyErr_Clear();
+		return false;
+	}
+
+	bool output = PyObject_IsTrue(py_static) == 1;
+	Py_DECREF(py_static);
+
+	return output;
+
+}
+
+bool PSimOptions::queuePythonCalls(void) {
+
+	startComplexes = readComplexes(NULL);
+
+	if (startComplexes == NULL)
+		return false;
+
+	queuedCalls.clear();
+	queueCalls = true;
+
+	return true;
+
+}
+
+void PSimOptions::flushPythonCalls(void) {
+
+	for (python_call& call : queuedCalls) {
+
+		char *tag = call.hasTag ? (char *) call.tag.c_str() : NULL;
+
+		switch (call.type) {
+		case python_call::SEED:
+			setLongAttr(python_settings, interface_current_seed, call.seed);
+			break;
+		case python_call::STATUS:
+			printStatusLine(python_settings, call.seed, call.flag, call.time, tag);
+			break;
+		case python_call::STATUS_FIRST:
+			printStatusLine_First_Bimolecular(python_settings, call.seed, call.flag, call.time, call.rate, tag);
+			break;
+		case python_call::END_STATE:
+			printComplexStateLine(python_settings, call.seed, call.flag, (char *) call.names.c_str(), (char *) call.sequence.c_str(),
+					(char *) call.structure.c_str(), call.time);
+			break;
+		case python_call::TRAJECTORY_COUNT:
+			pingAttr(python_settings, increment_trajectory_count);
+			break;
+		}
+	}
+
+	queuedCalls.clear();
+	queueCalls = false;
+
+	for (complex_input& input : *startComplexes)
+		delete input.list;
+	delete startComplexes;
+	startComplexes = NULL;
+
+}
+
+// A copy shares the start state read by queuePythonCalls, but has its own queue.
+SimOptions* PSimOptions::copy(void) {
+
+	PSimOptions *copy = new PSimOptions(*this);
+	copy->queuedCalls.clear();
+
+	return copy;
+
+}
+
+void PSimOptions::mergePythonCalls(SimOptions* worker) {
+
+	vector<python_call>& calls = ((PSimOptions *) worker)->queuedCalls;
+
+	queuedCalls.insert(queuedCalls.end(), calls.begin(), calls.end());
+	calls.clear();
+
 }
 
 ///// CSIMOPTIONS
@@ -332,80 +651,595 @@ CSimOptions::CSimOptions(void) {
 	fixedRandomSeed = true;
 
 	seed = 7777;
+	trajectory_offset = 0;
+	num_threads = 1;
 
 	energyOptions = new CEnergyOptions();
 
 	simulation_mode = 16;
 	simulation_count = 1000;
-	o_time = 0;
-	o_interval = 0;
-	stop_count = 1;
-	stop_options = 1;
+	o_time = -1.0;
+	o_interval = -1;
+	o_columnar = false;
+	o_columnar_block = 0;
+	o_file = "";
+	o_delta = false;
+	o_keyframe_interval = 0;
+	checkpoint_interval = 100000000;
+	stop_count = 0;
+	stop_options = 0;
 	max_sim_time = 0.1;
+	move_container = MOVECONTAINER_LIST;
+	export_ctmc = false;
 
 	debug = false;	// this is the main switch for simOptions debug, for now.
 
 }
 
+static const char resultsMagic[8] = "MSRSLT1";
+
+// one trajectory of a binary results file
+struct results_record {
+
+	int64_t seed;
+	int32_t result;
+	int32_t tag; // index into the tags of the header, or -1
+	double time;
+	double rate;
+
+};
+
+struct job_stop_item {
+
+	string tag, names, structure;
+	int type = STOPTYPE_STRUCTURE;
+	int count = 0;
+
+};
+
+// Whether structure is a dot-paren structure of sequence: the same length, a '+'
+// where the sequence has one and balanced brackets. Loose and count stop
+// conditions may also have a '*' for a base that is paired or not.
+static bool matchesSequence(const string& structure, const string& sequence, bool wildcards) {
+
+	if (structure.size() != sequence.size())
+		return false;
+
+	int open = 0;
+
+	for (unsigned int i = 0; i < structure.size(); i++) {
+
+		char c = structure[i];
+
+		if ((c == '+') != (sequence[i] == '+'))
+			return false;
+		if (c == '(')
+			open++;
+		else if (c == ')' && --open < 0)
+			return false;
+		else if (c != '.' && c != '+' && c != ')' && !(wildcards && c == '*'))
+			return false;
+
+	}
+
+	return open == 0;
+
+}
+
+// Reads the options of a headless run, see system/runner.cc for the format.
+// Problems are reported on stderr, with the line they were found on.
+bool CSimOptions::readJobFile(string path) {
+
+	std::ifstream input(path.c_str());
+
+	if (!input) {
+		cerr << "MULTISTRAND: could not open job file " << path << ".\n";
+		return false;
+	}
+
+	CEnergyOptions *cEnergyOptions = (CEnergyOptions *) energyOptions;
+	vector<job_stop_item> stopItems;
+
+	string line, key, word, error;
+	int lineNumber = 0;
+
+	while (std::getline(input, line)) {
+
+		lineNumber++;
+
+		if (line.find('#') != string::npos)
+			line.erase(line.find('#'));
+
+		std::istringstream fields(line);
+
+		if (!(fields >> key))
+			continue;
+
+		error = "";
+
+		if (key == "strand") {
+
+			string name, sequence;
+			fields >> name >> sequence;
+
+			if (std::find(strandNames.begin(), strandNames.end(), name) != strandNames.end())
+				error = "strand " + name + " is defined twice";
+			else if (sequence.find_first_not_of("ACGTUacgtu") != string::npos)
+				error = "invalid sequence " + sequence + " for strand " + name;
+
+			strandNames.push_back(name);
+			strandSequences.push_back(sequence);
+
+		} else if (key == "start") {
+
+			string names, structure, sequence;
+			fields >> names >> structure;
+
+			identList *ids = readStrandNames(names, sequence);
+
+			if (ids == NULL)
+				error = "unknown strand in " + names;
+			else if (!matchesSequence(structure, sequence, false))
+				error = "structure " + structure + " does not match the strands " + names;
+			else
+				startComplexes.push_back(complex_input(&sequence[0], &structure[0], ids));
+
+		} else if (key == "stop") {
+
+			job_stop_item item;
+			fields >> item.tag >> word >> item.count >> item.names >> item.structure;
+
+			if (word == "exact")
+				item.type = STOPTYPE_STRUCTURE;
+			else if (word == "bound")
+				item.type = STOPTYPE_BOUND;
+			else if (word == "dissoc")
+				item.type = STOPTYPE_DISASSOC;
+			else if (word == "loose")
+				item.type = STOPTYPE_LOOSE_STRUCTURE;
+			else if (word == "count")
+				item.type = STOPTYPE_PERCENT_OR_COUNT_STRUCTURE;
+			else
+				error = "unknown macrostate type " + word;
+
+			stopItems.push_back(item);
+
+		} else if (key == "simulation_mode") {
+
+			fields >> word;
+
+			if (word == "normal" || word == "first_passage_time")
+				simulation_mode = SIMULATION_MODE_NORMAL;
+			else if (word == "first_step")
+				simulation_mode = SIMULATION_MODE_FIRST_BIMOLECULAR;
+			else if (word == "trajectory")
+				simulation_mode = SIMULATION_MODE_FLAG_TRAJECTORY;
+			else
+				error = "simulation_mode " + word + " can not be run without python";
+
+		} else if (key == "move_container") {
+
+			fields >> word;
+
+			if (word == "list")
+				move_container = MOVECONTAINER_LIST;
+			else if (word == "tree")
+				move_container = MOVECONTAINER_TREE;
+			else
+				error = "unknown move_container " + word;
+
+		} else if (key == "num_simulations") {
+			fields >> simulation_count;
+		} else if (key == "initial_seed") {
+			fields >> seed;
+		} else if (key == "num_threads") {
+			fields >> num_threads;
+		} else if (key == "simulation_time") {
+			fields >> max_sim_time;
+		} else if (key == "output_interval") {
+			fields >> o_interval;
+		} else if (key == "output_time") {
+			fields >> o_time;
+		} else if (key == "output_file") {
+			fields >> o_file;
+		} else if (key == "checkpoint_file") {
+			fields >> checkpoint_file;
+		} else if (key == "checkpoint_interval") {
+			fields >> checkpoint_interval;
+		} else if (key == "results") {
+			fields >> resultsPath;
+		} else if (key == "results_format") {
+			fields >> word;
+			resultsBinary = (word == "binary");
+			if (word != "binary" && word != "csv")
+				error = "results_format is csv or binary";
+		} else if (key == "end_states") {
+			fields >> endStatesPath;
+		} else if (!cEnergyOptions->readOption(key, fields)) {
+			error = "unknown option or invalid value for " + key;
+		}
+
+		if (error.empty() && fields.fail())
+			error = "missing or invalid value for " + key;
+
+		if (!error.empty()) {
+			cerr << "MULTISTRAND: " << path << ", line " << lineNumber << ": " << error << ".\n";
+			return false;
+		}
+
+	}
+
+	if (startComplexes.empty())
+		error = "no start state is given";
+	else if (resultsPath.empty())
+		error = "no results file is given";
+	else if ((o_interval >= 0 || o_time >= 0) && o_file.empty())
+		error = "states can only be exported to an output_file";
+
+	// conditions are kept in the order of their first line, like the items of each.
+	for (int i = stopItems.size() - 1; i >= 0 && error.empty(); i--) {
+
+		if (std::find(stopTags.begin(), stopTags.end(), stopItems[i].tag) != stopTags.end())
+			continue;
+
+		stopTags.push_back(stopItems[i].tag);
+
+		complexItem *items = NULL;
+
+		for (int j = stopItems.size() - 1; j >= 0; j--) {
+
+			job_stop_item& item = stopItems[j];
+			string sequence;
+
+			if (item.tag != stopItems[i].tag)
+				continue;
+
+			identList *ids = readStrandNames(item.names, sequence);
+
+			if (ids == NULL) {
+				error = "unknown strand in stop condition " + item.tag;
+				break;
+			}
+
+			bool wildcards = (item.type == STOPTYPE_LOOSE_STRUCTURE || item.type == STOPTYPE_PERCENT_OR_COUNT_STRUCTURE);
+
+			if (!matchesSequence(item.structure, sequence, wildcards)) {
+				delete ids;
+				error = "structure " + item.structure + " does not match the strands " + item.names + " in stop condition " + item.tag;
+				break;
+			}
+
+			items = new complexItem(&item.structure[0], ids, items, item.type, item.count);
+
+		}
+
+		myStopComplexes = new stopComplexes(&stopItems[i].tag[0], items, myStopComplexes);
+
+	}
+
+	if (!error.empty()) {
+		cerr << "MULTISTRAND: " << path << ": " << error << ".\n";
+		return false;
+	}
+
+	std::reverse(stopTags.begin(), stopTags.end());
+
+	stop_count = stopTags.size();
+	stop_options = (stop_count > 0);
+
+	return true;
+
+}
+
+// The strand ids for a comma separated list of strand names, or NULL if one of
+// them is unknown. Also returns the sequence of the complex.
+identList* CSimOptions::readStrandNames(string names, string& sequence) {
+
+	vector<int> indices;
+	std::istringstream input(names);
+	string name;
+
+	while (std::getline(input, name, ',')) {
+
+		int index = std::find(strandNames.begin(), strandNames.end(), name) - strandNames.begin();
+
+		if (index == (int) strandNames.size())
+			return NULL;
+
+		sequence += (indices.empty() ? "" : "+") + strandSequences[index];
+		indices.push_back(index);
+
+	}
+
+	identList *ids = NULL;
+
+	for (int i = indices.size() - 1; i >= 0; i--)
+		ids = new identList(indices[i] + 1, &strandNames[indices[i]][0], ids);
+
+	return ids;
+
+}
+
+bool CSimOptions::openOutput(void) {
+
+	resultsFile = fopen(resultsPath.c_str(), resultsBinary ? "wb" : "w");
+
+	if (resultsFile == NULL) {
+		cerr << "MULTISTRAND: could not open results file " << resultsPath << ".\n";
+		return false;
+	}
+
+	if (resultsBinary) {
+
+		int tagCount = stopTags.size();
+
+		fwrite(resultsMagic, 1, 8, resultsFile);
+		fwrite(&tagCount, sizeof(int), 1, resultsFile);
+
+		for (string& tag : stopTags) {
+			int length = tag.size();
+			fwrite(&length, sizeof(int), 1, resultsFile);
+			fwrite(tag.data(), 1, length, resultsFile);
+		}
+
+	} else {
+
+		fprintf(resultsFile, "seed,result,time,rate,tag\n");
+
+	}
+
+	if (endStatesPath.empty())
+		return true;
+
+	endStatesFile = fopen(endStatesPath.c_str(), "w");
+
+	if (endStatesFile == NULL) {
+		cerr << "MULTISTRAND: could not open end states file " << endStatesPath << ".\n";
+		return false;
+	}
+
+	fprintf(endStatesFile, "seed,id,names,sequence,structure,energy\n");
+
+	return true;
+
+}
+
+void CSimOptions::closeOutput(void) {
+
+	if (resultsFile != NULL)
+		fclose(resultsFile);
+	if (endStatesFile != NULL)
+		fclose(endStatesFile);
+
+	resultsFile = NULL;
+	endStatesFile = NULL;
+
+}
+
 PyObject* CSimOptions::getPythonSettings() {
 
-	cout << "getPythonSettings, cannot proceed \n";
-	abort();
 	return NULL;
 
 }
 
 void CSimOptions::generateComplexes(PyObject *alternate_start, long current_seed) {
 
-	myComplexes = new vector<complex_input>(0); // wipe the pointer to the previous object;
+	myComplexes = new vector<complex_input>(startComplexes);
+	for (complex_input& input : *myComplexes)
+		input.list = input.list->copy();
 
-//	// setting default value
-//	char* mySeq = "GTTAGACTCGGAGGTGGTAGCAATGGATCAG+CTGATCCATTGCTACCACCTCCGAGTCTAACCATATC+GATATGGTTAGACTCGGAGGTGGTAGCAATG";
-//	char* myStructure = ".........................((((((+))))))(((((((((((((((((((((((((((((((+)))))))))))))))))))))))))))))))";
-//	identList* myIdentity1 = new identList(1337, "myID-1", NULL);
-//	identList* myIdentity2 = new identList(1338, "myID-2", myIdentity1);
-//	identList* myIdentity3 = new identList(1339, "myID-3", myIdentity2);
-//
-//	complex_input myInput = complex_input(mySeq, myStructure, NULL);
-//
-//	myComplexes->push_back(myInput);
+	seed = current_seed;
+
+}
+
+void CSimOptions::setCurrentSeed(long current_seed) {
+
+	seed = current_seed;
 
 }
 
 stopComplexes* CSimOptions::getStopComplexes(int) {
 
-	cout << "getStopComplexes, cannot proceed \n";
-	abort();
-	return NULL;
+	return myStopComplexes;
+
 }
 
 void CSimOptions::stopResultError(long seed) {
 
-	cout << "stopResultError, cannot send to python \n";
+	queueStatus(python_call::STATUS, seed, STOPRESULT_ERROR, 0.0, 0.0, NULL);
 
 }
 
 void CSimOptions::stopResultNan(long seed) {
 
-	cout << "stopResultNan, cannot send to python \n";
+	queueStatus(python_call::STATUS, seed, STOPRESULT_NAN, 0.0, 0.0, NULL);
 
 }
 
 void CSimOptions::stopResultNormal(long seed, double time, char* message) {
 
-	cout << "stopResultNormal, cannot send to python \n";
+	queueStatus(python_call::STATUS, seed, STOPRESULT_NORMAL, time, 0.0, message);
 
 }
 
 void CSimOptions::stopResultTime(long seed, double time) {
 
-	cout << "stopResultTime, cannot send to python \n";
+	queueStatus(python_call::STATUS, seed, STOPRESULT_TIME, time, 0.0, NULL);
 
 }
 
 void CSimOptions::stopResultBimolecular(string type, long seed, double stopTime, double rate, char* message) {
 
-	cout << "stopResultBimolecular, cannot send to python \n";
+	int flag;
+
+	if (type == "Reverse") {
+		flag = STOPRESULT_REVERSE;
+	} else if (type == "Forward") {
+		flag = STOPRESULT_FORWARD;
+	} else if (type == "FTime") {
+		flag = STOPRESULT_FTIME;
+	} else if (type == "NoMoves") {
+		flag = STOPRESULT_NOMOVES;
+	} else {
+		return;
+	}
+
+	queueStatus(python_call::STATUS_FIRST, seed, flag, stopTime, rate, message);
+
+}
+
+void CSimOptions::sendEndState(long seed, int id, char* names, char* sequence, char* structure, double energy) {
+
+	python_call call(python_call::END_STATE, seed);
+
+	call.flag = id;
+	call.names = names;
+	call.sequence = sequence;
+	call.structure = structure;
+	call.time = energy;
+
+	if (queueCalls)
+		queuedCalls.push_back(call);
+	else
+		writeCall(call);
+
+}
+
+void CSimOptions::incrementTrajectoryCount(void) {
+
+	// nothing to count on the python side.
+
+}
+
+void CSimOptions::queueStatus(python_call::call_type type, long seed, int flag, double time, double rate, char* tag) {
+
+	python_call call(type, seed);
+
+	call.flag = flag;
+	call.time = time;
+	call.rate = rate;
+	call.hasTag = (tag != NULL);
+	if (tag != NULL)
+		call.tag = tag;
+
+	if (queueCalls)
+		queuedCalls.push_back(call);
+	else
+		writeCall(call);
 
 }
 
+static const char *resultName(int flag) {
+
+	switch (flag) {
+	case STOPRESULT_NORMAL:
+		return "normal";
+	case STOPRESULT_TIME:
+		return "time";
+	case STOPRESULT_FORWARD:
+		return "forward";
+	case STOPRESULT_FTIME:
+		return "ftime";
+	case STOPRESULT_REVERSE:
+		return "reverse";
+	case STOPRESULT_NOMOVES:
+		return "nomoves";
+	case STOPRESULT_NAN:
+		return "nan";
+	default:
+		return "error";
+	}
+
+}
+
+// Writes a result or end state to the output files.
+void CSimOptions::writeCall(python_call& call) {
+
+	if (call.type == python_call::END_STATE) {
+
+		if (endStatesFile != NULL)
+			fprintf(endStatesFile, "%ld,%d,%s,%s,%s,%.17g\n", call.seed, call.flag, call.names.c_str(), call.sequence.c_str(), call.structure.c_str(),
+					call.time);
+		return;
+
+	}
+
+	if (resultsFile == NULL)
+		return;
+
+	if (!resultsBinary) {
+		fprintf(resultsFile, "%ld,%s,%.17g,%.17g,%s\n", call.seed, resultName(call.flag), call.time, call.rate, call.tag.c_str());
+		return;
+	}
+
+	results_record record;
+
+	record.seed = call.seed;
+	record.result = call.flag;
+	record.tag = -1;
+	record.time = call.time;
+	record.rate = call.rate;
+
+	if (call.hasTag) {
+		vector<string>::iterator tag = std::find(stopTags.begin(), stopTags.end(), call.tag);
+		if (tag != stopTags.end())
+			record.tag = tag - stopTags.begin();
+	}
+
+	fwrite(&record, sizeof(results_record), 1, resultsFile);
+
+}
+
+// Every start state is the same; it is read from the job file once.
+bool CSimOptions::staticStartState(void) {
+
+	return true;
+
+}
+
+// Results are written as they come in, only worker copies queue theirs. With
+// checkpoints the results are kept until the run is over, as part of its state.
+bool CSimOptions::queuePythonCalls(void) {
+
+	queuedCalls.clear();
+	queueCalls = !checkpoint_file.empty();
+
+	return true;
+
+}
+
+void CSimOptions::flushPythonCalls(void) {
+
+	for (python_call& call : queuedCalls)
+		writeCall(call);
+
+	queuedCalls.clear();
+	queueCalls = false;
+
+	if (resultsFile != NULL)
+		fflush(resultsFile);
+	if (endStatesFile != NULL)
+		fflush(endStatesFile);
+
+}
+
+SimOptions* CSimOptions::copy(void) {
+
+	CSimOptions *copy = new CSimOptions(*this);
+	copy->queuedCalls.clear();
+	copy->queueCalls = true;
+
+	return copy;
+
+}
+
+void CSimOptions::mergePythonCalls(SimOptions* worker) {
+
+	vector<python_call>& calls = ((CSimOptions *) worker)->queuedCalls;
+
+	for (python_call& call : calls)
+		writeCall(call);
+
+	calls.clear();
+
+}
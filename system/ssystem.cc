@@ -7,15 +7,15 @@ help@multistrand.org
 #include "options.h"
 #include "ssystem.h"
 #include "simoptions.h"
+#include "checkpoint.h"
 
 #include <string.h>
 #include <time.h>
 #include <stdlib.h>
 #include <vector>
 #include <iostream>
-
-int noInitialMoves = 0;
-int timeOut = 0;
+#include <algorithm>
+#include <thread>
 
 SimulationSystem::SimulationSystem(PyObject *system_o) {
 
@@ -24,7 +24,6 @@ SimulationSystem::SimulationSystem(PyObject *system_o) {
 	simOptions = new PSimOptions(system_o);
 
 	construct();
-	energyModel->writeConstantsToFile();
 
 }
 
@@ -34,7 +33,6 @@ SimulationSystem::SimulationSystem(SimOptions* options) {
 	simOptions = options;
 
 	construct();
-	energyModel->writeConstantsToFile();
 
 }
 
@@ -47,12 +45,12 @@ void SimulationSystem::construct(void) {
 	simulation_mode = simOptions->getSimulationMode();
 	simulation_count_remaining = simOptions->getSimulationCount();
 
+	// the model for these conditions, shared with other systems
+	energyModelHandle = EnergyModelRegistry::get(simOptions);
+	energyModel = energyModelHandle.get();
+
 	if (Loop::GetEnergyModel() == NULL) {
-		energyModel = NULL;
-		energyModel = new NupackEnergyModel(simOptions->getPythonSettings());
-		Loop::SetEnergyModel(energyModel);
-	} else {
-		energyModel = Loop::GetEnergyModel();
+		Loop::SetEnergyModel(energyModelHandle);
 	}
 
 	startState = NULL;
@@ -61,10 +59,75 @@ void SimulationSystem::construct(void) {
 	// move these to sim_settings
 	exportStatesInterval = (simOptions->getOInterval() >= 0);
 	exportStatesTime = (simOptions->getOTime() >= 0);
+	exportCTMC = simOptions->getExportCTMC();
+	exportColumnar = simOptions->getOColumnar();
+
+	trajectoryFile = NULL;
+	if ((exportStatesInterval || exportStatesTime) && !simOptions->getOFile().empty()) {
+		trajectoryFile = new TrajectoryFile(simOptions->getOFile(), simOptions->getODelta(), simOptions->getOKeyframeInterval());
+	}
+
+	compileStopConditions();
 
 }
 
+// Stop conditions do not change during a run, so the linked list is read from
+// the options once here instead of being rebuilt after every step.
+void SimulationSystem::compileStopConditions(void) {
+
+	stopConditions = NULL;
+	stopIndex = NULL;
+
+	if (simOptions->getStopOptions() && simOptions->getStopCount() > 0) {
+		stopConditions = simOptions->getStopComplexes(0);
+		stopIndex = new StopIndex(stopConditions);
+	}
+
+}
+
+// Returns the first stop condition met by the current state, or NULL.
+stopComplexes* SimulationSystem::checkStopConditions(void) {
+
+	if (stopIndex == NULL)
+		return NULL;
+
+	complexList->updateStopState();
+
+	for (int i = 0; i < stopIndex->getConditionCount(); i++) {
+		if (complexList->checkStopCondition(i)) {
+			return stopIndex->conditions[i];
+		}
+	}
+
+	return NULL;
+}
+
+
 
+// A worker for StartSimulation_Threads, running count trajectories from index
+// firstTrajectory on. It shares the energy model and stop conditions of parent.
+SimulationSystem::SimulationSystem(SimulationSystem& parent, long firstTrajectory, long count) {
+
+	system_options = parent.system_options;
+	simOptions = parent.simOptions->copy();
+	energyModel = parent.energyModel;
+	energyModelHandle = parent.energyModelHandle;
+
+	simulation_mode = parent.simulation_mode;
+	simulation_count_remaining = count;
+	staticStart = parent.staticStart;
+
+	startState = NULL;
+	complexList = NULL;
+	stopConditions = parent.stopConditions;
+	stopIndex = parent.stopIndex;
+
+	run_seed = parent.run_seed;
+	trajectory_index = firstTrajectory;
+	current_seed = utility::random_generator::streamSeed(run_seed, trajectory_index);
+	rng.seed(current_seed);
+
+}
 
 SimulationSystem::SimulationSystem(void) {
 
@@ -83,6 +146,8 @@ SimulationSystem::SimulationSystem(void) {
 	simOptions = NULL;
 	startState = NULL;
 	complexList = NULL;
+	stopConditions = NULL;
+	stopIndex = NULL;
 }
 
 int SimulationSystem::isEnergymodelNull(void) {
@@ -96,6 +161,26 @@ SimulationSystem::~SimulationSystem(void) {
 		delete complexList;
 	complexList = NULL;
 
+	if (stopIndex != NULL)
+		delete stopIndex;
+	stopIndex = NULL;
+
+	if (stopConditions != NULL)
+		delete stopConditions;
+	stopConditions = NULL;
+
+	if (trajectoryFile != NULL)
+		delete trajectoryFile;
+	trajectoryFile = NULL;
+
+	if (startTemplate != NULL)
+		delete startTemplate;
+	startTemplate = NULL;
+
+	if (resumePoint != NULL)
+		delete resumePoint;
+	resumePoint = NULL;
+
 // the remaining members are not our responsibility, we null them out
 // just in case something thread-unsafe happens.
 
@@ -108,7 +193,228 @@ void SimulationSystem::StartSimulation(void) {
 
 	InitializeRNG();
 
-	if (simulation_mode & SIMULATION_MODE_FLAG_FIRST_BIMOLECULAR) {
+	staticStart = simOptions->staticStartState();
+	if (startTemplate != NULL)
+		delete startTemplate;
+	startTemplate = NULL;
+
+	// Without python callbacks during the run, other threads may use the
+	// interpreter meanwhile; the results are handed over afterwards. Headless
+	// runs have no interpreter to release.
+	if (runsWithoutPython() && simOptions->queuePythonCalls()) {
+
+		startCheckpoints();
+
+		PyThreadState *threadState = NULL;
+
+		if (system_options != NULL)
+			threadState = PyEval_SaveThread();
+
+		if (threadCount() > 1)
+			StartSimulation_Threads();
+		else
+			StartSimulation_Mode();
+
+		if (threadState != NULL)
+			PyEval_RestoreThread(threadState);
+
+		simOptions->flushPythonCalls();
+
+	} else {
+
+		if (!simOptions->getCheckpointFile().empty())
+			cout << "Checkpoints need a static start state and no trajectory output to python; no checkpoints are written. \n";
+
+		StartSimulation_Mode();
+
+	}
+
+	finalizeSimulation();
+
+}
+
+// Continues the run saved in a checkpoint file, written by a system with the same
+// options. Returns 1 if the file can not be read and 2 if it does not fit the options.
+int SimulationSystem::ResumeSimulation(string path, string& error) {
+
+	Checkpoint *point = new Checkpoint();
+
+	if (!point->read(path)) {
+		error = point->error;
+		delete point;
+		return 1;
+	}
+
+	staticStart = simOptions->staticStartState();
+
+	if (point->simulationMode != simulation_mode || point->simulationCount != simOptions->getSimulationCount())
+		error = path + " was written for a different simulation_mode or num_simulations";
+	else if (!checkpointsSupported())
+		error = "checkpoints need a static start state and no trajectory output to python";
+
+	if (!error.empty()) {
+		delete point;
+		return 2;
+	}
+
+	resumePoint = point;
+	StartSimulation();
+
+	return 0;
+
+}
+
+// Checkpoints are written in first passage time and first step mode, when the
+// results are queued until the run is over.
+bool SimulationSystem::checkpointsSupported(void) {
+
+	if (simulation_mode & (SIMULATION_MODE_FLAG_FORWARD_FLUX | SIMULATION_MODE_FLAG_WEIGHTED_ENSEMBLE))
+		return false;
+
+	if (!(simulation_mode & SIMULATION_MODE_FLAG_FIRST_BIMOLECULAR))
+		if (simulation_mode & (SIMULATION_MODE_FLAG_TRAJECTORY | SIMULATION_MODE_FLAG_TRANSITION))
+			return false;
+
+	if (trajectoryFile != NULL || exportCTMC || SimOptions::countStates)
+		return false;
+
+	return runsWithoutPython();
+
+}
+
+// Called once the python calls are queued: a resumed run takes the results so far
+// from its checkpoint.
+void SimulationSystem::startCheckpoints(void) {
+
+	checkpointInterval = 0;
+
+	if (!simOptions->getCheckpointFile().empty() && simOptions->getCheckpointInterval() > 0) {
+
+		if (checkpointsSupported())
+			checkpointInterval = simOptions->getCheckpointInterval();
+		else
+			cout << "Checkpoints are only written in first passage time and first step mode, without output_file or export_ctmc; no checkpoints are written. \n";
+
+	}
+
+	nextCheckpoint = steps + checkpointInterval;
+
+	if (resumePoint != NULL)
+		simOptions->getQueuedCalls() = resumePoint->calls;
+
+}
+
+// Writes the state of the run to the checkpoint file. The complex list must be as
+// a resumed run builds it: at the start of a trajectory, or just rebuilt.
+void SimulationSystem::saveCheckpoint(double stime, double frate) {
+
+	Checkpoint point;
+
+	point.simulationMode = simulation_mode;
+	point.simulationCount = simOptions->getSimulationCount();
+	point.runSeed = run_seed;
+	point.trajectoryIndex = trajectory_index;
+	point.currentSeed = current_seed;
+	point.remaining = simulation_count_remaining;
+	point.steps = steps;
+	point.trajectorySteps = trajectorySteps;
+	point.noInitialMoves = noInitialMoves;
+	point.timeOut = timeOut;
+	for (int i = 0; i < 4; i++)
+		point.rng[i] = rng.s[i];
+
+	point.time = stime;
+	point.forwardRate = frate;
+
+	storeComplexList(&point);
+
+	point.calls = simOptions->getQueuedCalls();
+
+	if (!point.write(simOptions->getCheckpointFile()))
+		cout << "Checkpoint is not written: " << point.error << ". \n";
+
+	nextCheckpoint = steps + checkpointInterval;
+
+}
+
+// Builds the complex list again from the structures of its complexes, as a
+// resumed run does. The moves are then in the order a resumed run has them.
+void SimulationSystem::rebuildComplexList(void) {
+
+	Checkpoint point;
+	storeComplexList(&point);
+
+	delete complexList;
+	complexList = restoreComplexList(&point);
+	complexList->initializeList();
+	startState = complexList->getFirst()->thisComplex;
+
+}
+
+// Stores the complexes of the complex list in point, see restoreComplexList.
+void SimulationSystem::storeComplexList(Checkpoint *point) {
+
+	point->idCounter = complexList->getIdCounter();
+
+	for (SComplexListEntry *entry = complexList->getFirst(); entry != NULL; entry = entry->next) {
+
+		checkpoint_complex complex;
+		complex.id = entry->id;
+
+		for (orderingList *strand = entry->thisComplex->getOrdering()->first; strand != NULL; strand = strand->next) {
+			complex.uids.push_back(strand->uid);
+			complex.indices.push_back(strand->index);
+			complex.names.push_back(strand->thisTag);
+		}
+
+		complex.sequence = entry->thisComplex->getSequence();
+		complex.structure = entry->thisComplex->getStructure();
+
+		point->complexes.push_back(complex);
+
+	}
+
+}
+
+// Builds the complexes saved in a checkpoint, in the same order and with the same ids.
+SComplexList *SimulationSystem::restoreComplexList(Checkpoint *point) {
+
+	SComplexList *newList = new SComplexList(energyModel);
+	newList->setStopIndex(stopIndex);
+
+	// addComplex puts each complex in front, so the list is filled from the back.
+	for (int c = point->complexes.size() - 1; c >= 0; c--) {
+
+		checkpoint_complex& complex = point->complexes[c];
+		identList *ids = NULL;
+
+		for (int i = complex.uids.size() - 1; i >= 0; i--) {
+			ids = new identList(complex.uids[i], (char *) complex.names[i].c_str(), ids);
+			ids->index = complex.indices[i];
+		}
+
+		StrandComplex *newComplex = new StrandComplex((char *) complex.sequence.c_str(), (char *) complex.structure.c_str(), ids);
+		newList->addComplex(newComplex)->id = complex.id;
+
+	}
+
+	newList->setIdCounter(point->idCounter);
+
+	return newList;
+
+}
+
+void SimulationSystem::StartSimulation_Mode(void) {
+
+	// InitializeSystem makes our pool active on this thread; it stops being so
+	// when the run returns, as this system may be deleted before the thread's next one.
+	ActivePool activePool(&objectPool);
+
+	if (simulation_mode & SIMULATION_MODE_FLAG_FORWARD_FLUX) {
+		StartSimulation_ForwardFlux();
+	} else if (simulation_mode & SIMULATION_MODE_FLAG_WEIGHTED_ENSEMBLE) {
+		StartSimulation_WeightedEnsemble();
+	} else if (simulation_mode & SIMULATION_MODE_FLAG_FIRST_BIMOLECULAR) {
 		StartSimulation_FirstStep();
 	} else if (simulation_mode & SIMULATION_MODE_FLAG_TRAJECTORY) {
 		StartSimulation_Trajectory();
@@ -117,7 +423,89 @@ void SimulationSystem::StartSimulation(void) {
 	} else
 		StartSimulation_Standard();
 
-	finalizeSimulation();
+}
+
+// True if the trajectories can be run without the GIL: every start state is
+// the same, and nothing is sent to python until the run is over.
+bool SimulationSystem::runsWithoutPython(void) {
+
+	if (!staticStart)
+		return false;
+
+	if (simulation_mode & SIMULATION_MODE_FLAG_TRANSITION)
+		return false;
+
+	if (exportStatesInterval || exportStatesTime) {
+		if (exportColumnar || trajectoryFile == NULL || !trajectoryFile->isOpen())
+			return false;
+	}
+
+	return true;
+
+}
+
+// Number of threads to split the remaining trajectories over. Trajectory
+// files and the explored state space are kept per system, so those use one,
+// as do forward flux and weighted ensemble runs, where the trajectories are
+// started from each other.
+long SimulationSystem::threadCount(void) {
+
+	long threads = simOptions->getNumThreads();
+
+	if (threads == 0)
+		threads = std::thread::hardware_concurrency();
+
+	if (trajectoryFile != NULL || exportCTMC || SimOptions::countStates || checkpointInterval > 0)
+		return 1;
+
+	if (simulation_mode & (SIMULATION_MODE_FLAG_FORWARD_FLUX | SIMULATION_MODE_FLAG_WEIGHTED_ENSEMBLE))
+		return 1;
+
+	return std::max(1L, std::min(threads, simulation_count_remaining));
+
+}
+
+// Runs the remaining trajectories on worker systems, each taking a consecutive
+// range of trajectory indices. Their queued python calls are merged in order,
+// so the results are the same as for a single thread.
+void SimulationSystem::StartSimulation_Threads(void) {
+
+	long threads = threadCount();
+	long first = trajectory_index;
+
+	vector<SimulationSystem*> workers;
+	vector<std::thread> pool;
+
+	for (long i = 0; i < threads; i++) {
+
+		long count = simulation_count_remaining / threads + (i < simulation_count_remaining % threads ? 1 : 0);
+
+		workers.push_back(new SimulationSystem(*this, first, count));
+		first += count;
+
+	}
+
+	for (SimulationSystem* worker : workers)
+		pool.push_back(std::thread(&SimulationSystem::StartSimulation_Mode, worker));
+
+	for (std::thread& thread : pool)
+		thread.join();
+
+	for (SimulationSystem* worker : workers) {
+
+		simOptions->mergePythonCalls(worker->simOptions);
+		noInitialMoves += worker->noInitialMoves;
+		timeOut += worker->timeOut;
+
+		// the stop conditions are ours, the options copy is the worker's.
+		worker->stopConditions = NULL;
+		worker->stopIndex = NULL;
+		delete worker->simOptions;
+		delete worker;
+
+	}
+
+	simulation_count_remaining = 0;
 
 }
 
@@ -154,32 +542,450 @@ void SimulationSystem::StartSimulation_Transition(void) {
 			return;
 		}
 
-		SimulationLoop_Transition();
-		finalizeRun();
+		SimulationLoop_Transition();
+		finalizeRun();
+
+	}
+}
+
+void SimulationSystem::StartSimulation_Trajectory(void) {
+
+	while (simulation_count_remaining > 0) {
+
+		if (InitializeSystem() != 0) {
+
+			cout << "system not initialized; returning \n";
+			return;
+		}
+
+		SimulationLoop_Trajectory();
+		finalizeRun();
+
+	}
+}
+
+// Forward flux sampling. Every stop condition not tagged FAILURE or REVERSE is
+// an interface, in the order given, the last one being the target. First step
+// trials from the start state are run until they reach an interface; then, for
+// each next interface, flux trials start from a state picked among those that
+// reached the previous one. A trial fails at a FAILURE or REVERSE stop condition,
+// or when it runs out of time. The rate is the flux to the first interface times
+// the probability of getting from each interface to the next, see ForwardFlux.
+void SimulationSystem::StartSimulation_ForwardFlux(void) {
+
+	fluxInterfaces.clear();
+	fluxFailures.clear();
+
+	for (int c = 0; stopIndex != NULL && c < stopIndex->getConditionCount(); c++) {
+
+		char *tag = stopIndex->conditions[c]->tag;
+
+		if (strcmp(tag, "FAILURE") == 0 || strcmp(tag, "REVERSE") == 0)
+			fluxFailures.push_back(c);
+		else
+			fluxInterfaces.push_back(c);
+
+	}
+
+	if (fluxInterfaces.empty()) {
+		cout << "Forward flux mode needs at least one stop condition that is not tagged FAILURE or REVERSE. \n";
+		return;
+	}
+
+	fluxStages.assign(fluxInterfaces.size(), FluxStage());
+	fluxCollisionRate = 0.0;
+
+	vector<FluxState> current, next;
+
+	// the states at the first interface carry the collision rate of their first step,
+	// so that they are picked in proportion to it.
+	while (simulation_count_remaining > 0) {
+
+		if (InitializeSystem() != 0)
+			return;
+
+		complexList->initializeList();
+		fluxStages[0].trials++;
+
+		double rate = complexList->getJoinFlux();
+
+		if (rate == 0.0) {
+
+			noInitialMoves++;
+
+		} else {
+
+			complexList->doJoinChoice(rate * rng.uniform());
+			double frate = rate * energyModel->getJoinRate_NoVolumeTerm() / energyModel->getJoinRate();
+
+			int reached = SimulationLoop_Flux(-1, fluxStages[0]);
+
+			if (reached >= 0) {
+				fluxCollisionRate += frate;
+				next.push_back(saveFluxState(reached, frate));
+			}
+
+		}
+
+		simulation_count_remaining--;
+		generateNextRandom();
+
+	}
+
+	for (unsigned int stage = 1; stage < fluxInterfaces.size() && !next.empty(); stage++) {
+
+		current.swap(next);
+
+		vector<double> cumulative;
+		double total = 0.0;
+
+		for (FluxState& state : current) {
+			total += state.weight;
+			cumulative.push_back(total);
+		}
+
+		for (long trial = 0; trial < simOptions->getFluxTrials(); trial++) {
+
+			double choice = total * rng.uniform();
+			FluxState& start = current[std::upper_bound(cumulative.begin(), cumulative.end(), choice) - cumulative.begin()];
+
+			fluxStages[stage].trials++;
+
+			if (start.interface >= (int) stage) {
+
+				// reached this interface in an earlier trial already
+				fluxStages[stage].successes++;
+
+				ActivePool heap(NULL);
+				FluxState copy = { start.state->copy(), start.interface, 1.0 };
+
+				next.push_back(copy);
+
+			} else {
+
+				startState = NULL;
+				if (complexList != NULL)
+					delete complexList;
+				objectPool.reset();
+
+				complexList = start.state->copy();
+				startState = complexList->getFirst()->thisComplex;
+
+				int reached = SimulationLoop_Flux(stage - 1, fluxStages[stage]);
+
+				if (reached >= (int) stage)
+					next.push_back(saveFluxState(reached, 1.0));
+
+			}
+
+			generateNextRandom();
+
+		}
+
+		for (FluxState& state : current)
+			delete state.state;
+		current.clear();
+
+	}
+
+	for (FluxState& state : next)
+		delete state.state;
+
+	simulation_count_remaining = 0;
+
+}
+
+// Runs the trial in complexList from interface from towards the next one, and
+// returns the furthest interface reached, or -1 if the trial failed.
+int SimulationSystem::SimulationLoop_Flux(int from, FluxStage& stage) {
+
+	double rchoice, rate, stime = 0.0;
+	double maxsimtime = simOptions->getMaxSimTime();
+	long trialSteps = 0;
+
+	rate = complexList->getTotalFlux();
+
+	while (true) {
+
+		rchoice = rate * rng.uniform();
+		stime += (log(1. / (1.0 - rng.uniform())) / rate);
+
+		if (stime >= maxsimtime) {
+			stage.timeOuts++;
+			return -1;
+		}
+
+		complexList->doBasicChoice(rchoice, stime);
+		rate = complexList->getTotalFlux();
+		stage.steps++;
+
+		int reached = fluxCrossing(from);
+
+		if (reached < from) {
+			stage.failures++;
+			return -1;
+		}
+
+		if (reached > from) {
+			stage.successes++;
+			return reached;
+		}
+
+		// as in first step mode, so that the first trials are its trajectories.
+		if (++trialSteps % rebuildInterval == 0) {
+			rebuildComplexList();
+			rate = complexList->getTotalFlux();
+		}
+
+	}
+
+}
+
+// The furthest interface past from that the current state is at, from if there
+// is none, or from - 1 if the state meets a failure condition.
+int SimulationSystem::fluxCrossing(int from) {
+
+	complexList->updateStopState();
+
+	for (int i = fluxInterfaces.size() - 1; i > from; i--)
+		if (complexList->checkStopCondition(fluxInterfaces[i]))
+			return i;
+
+	for (int c : fluxFailures)
+		if (complexList->checkStopCondition(c))
+			return from - 1;
+
+	return from;
+
+}
+
+// A copy of the current state, kept on the heap so the pool can still be reset between trials.
+FluxState SimulationSystem::saveFluxState(int interface, double weight) {
+
+	ActivePool heap(NULL);
+	FluxState state = { complexList->copy(), interface, weight };
+
+	return state;
+
+}
+
+// Weighted ensemble sampling of first passage times. The last stop condition is
+// the target; the others define progress bins, a state being in bin i + 1 when it
+// meets condition i (the last one that it meets) and in bin 0 when it meets none.
+// Every run starts with a single walker of weight 1. All walkers are advanced by
+// ensemble_interval of simulated time; then in each bin the heaviest walkers are
+// split in two, or the lightest merged, until the bin holds ensemble_walkers of
+// them. Splitting copies the complex list, so walkers do not start over. A walker
+// that reaches the target stops, and its time and weight are recorded.
+void SimulationSystem::StartSimulation_WeightedEnsemble(void) {
+
+	if (stopIndex == NULL || stopIndex->getConditionCount() == 0) {
+		cout << "Weighted ensemble mode needs a stop condition for the target state. \n";
+		return;
+	}
+
+	double interval = simOptions->getEnsembleInterval();
+	double maxsimtime = simOptions->getMaxSimTime();
+
+	if (interval <= 0.0 || simOptions->getEnsembleWalkers() < 1) {
+		cout << "Weighted ensemble mode needs a positive ensemble_interval and ensemble_walkers. \n";
+		return;
+	}
+
+	ensembleTimes.clear();
+	ensembleWeights.clear();
+	ensembleRemaining = 0.0;
+	ensembleRuns = 0;
+	ensembleSteps = 0;
+
+	while (simulation_count_remaining > 0) {
+
+		if (InitializeSystem() != 0)
+			return;
+
+		complexList->initializeList();
+
+		// the walkers own their complex lists; they are made the current one in turn.
+		vector<Walker> walkers;
+		Walker start = { complexList, 1.0, ensembleBin() };
+		complexList = NULL;
+		startState = NULL;
+
+		if (start.bin < 0) {
+			ensembleTimes.push_back(0.0);
+			ensembleWeights.push_back(1.0);
+			delete start.state;
+		} else {
+			walkers.push_back(start);
+		}
+
+		for (double time = 0.0; !walkers.empty() && time < maxsimtime; time += interval) {
+
+			resampleWalkers(walkers);
+
+			double end = std::min(time + interval, maxsimtime);
+			unsigned int kept = 0;
+
+			for (unsigned int w = 0; w < walkers.size(); w++) {
+
+				if (SimulationLoop_Walker(walkers[w], time, end))
+					delete walkers[w].state;
+				else
+					walkers[kept++] = walkers[w];
+
+			}
+
+			walkers.resize(kept);
+
+		}
+
+		for (Walker& walker : walkers) {
+			ensembleRemaining += walker.weight;
+			delete walker.state;
+		}
+
+		complexList = NULL;
+		ensembleRuns++;
+
+		simulation_count_remaining--;
+		generateNextRandom();
+
+	}
+
+}
+
+// Advances the walker from time start to end, and returns true if it reached the
+// target. The waiting time drawn past end is dropped, which leaves the statistics
+// unchanged because waiting times are memoryless.
+bool SimulationSystem::SimulationLoop_Walker(Walker& walker, double start, double end) {
+
+	double rchoice, rate, stime = start;
+
+	complexList = walker.state;
+	rate = complexList->getTotalFlux();
+
+	while (true) {
+
+		rchoice = rate * rng.uniform();
+		stime += (log(1. / (1.0 - rng.uniform())) / rate);
+
+		if (stime >= end)
+			break;
+
+		complexList->doBasicChoice(rchoice, stime);
+		rate = complexList->getTotalFlux();
+		ensembleSteps++;
+
+		walker.bin = ensembleBin();
+
+		if (walker.bin < 0) {
+			ensembleTimes.push_back(stime);
+			ensembleWeights.push_back(walker.weight);
+			break;
+		}
+
+	}
+
+	complexList = NULL;
+
+	return walker.bin < 0;
+
+}
+
+// The progress bin of the current state, or -1 if it is at the target.
+int SimulationSystem::ensembleBin(void) {
+
+	int target = stopIndex->getConditionCount() - 1;
+
+	complexList->updateStopState();
+
+	if (complexList->checkStopCondition(target))
+		return -1;
+
+	for (int c = target - 1; c >= 0; c--)
+		if (complexList->checkStopCondition(c))
+			return c + 1;
+
+	return 0;
+
+}
+
+// Splits and merges the walkers of every bin, keeping the weight of the bin, until
+// each occupied bin holds ensemble_walkers of them (Huber and Kim, 1996). Two merged
+// walkers become the one picked with a chance in proportion to its weight.
+void SimulationSystem::resampleWalkers(vector<Walker>& walkers) {
+
+	unsigned int target = simOptions->getEnsembleWalkers();
+	vector<Walker> resampled;
+
+	std::stable_sort(walkers.begin(), walkers.end(), [](const Walker& a, const Walker& b) {
+		return a.bin < b.bin;
+	});
+
+	for (auto first = walkers.begin(); first != walkers.end();) {
+
+		auto last = first;
+		while (last != walkers.end() && last->bin == first->bin)
+			last++;
+
+		vector<Walker> bin(first, last);
+		first = last;
+
+		// lightest first
+		auto lighter = [](const Walker& a, const Walker& b) {
+			return a.weight < b.weight;
+		};
+
+		while (bin.size() > target) {
+
+			std::sort(bin.begin(), bin.end(), lighter);
 
-	}
-}
+			Walker& a = bin[0];
+			Walker& b = bin[1];
+			double weight = a.weight + b.weight;
 
-void SimulationSystem::StartSimulation_Trajectory(void) {
+			if (rng.uniform() * weight < a.weight) {
+				delete b.state;
+				b = a;
+			} else {
+				delete a.state;
+			}
 
-	while (simulation_count_remaining > 0) {
+			b.weight = weight;
+			bin.erase(bin.begin());
 
-		if (InitializeSystem() != 0) {
+		}
+
+		while (bin.size() < target) {
+
+			Walker& heaviest = *std::max_element(bin.begin(), bin.end(), lighter);
+
+			heaviest.weight /= 2.0;
+			Walker copy = { heaviest.state->copy(), heaviest.weight, heaviest.bin };
+			bin.push_back(copy);
 
-			cout << "system not initialized; returning \n";
-			return;
 		}
 
-		SimulationLoop_Trajectory();
-		finalizeRun();
+		resampled.insert(resampled.end(), bin.begin(), bin.end());
 
 	}
+
+	walkers.swap(resampled);
+
 }
 
 void SimulationSystem::finalizeRun(void) {
 
+	if (exportColumnar) {
+		sendTrajectoryColumnsToPython();
+	}
+
+	if (trajectoryFile != NULL) {
+		trajectoryFile->flush();
+	}
+
 	simulation_count_remaining--;
-	pingAttr(system_options, increment_trajectory_count);
+	simOptions->incrementTrajectoryCount();
 
 	generateNextRandom();
 }
@@ -204,6 +1010,24 @@ void SimulationSystem::finalizeSimulation(void) {
 
 	}
 
+	if (exportCTMC) {
+
+		sendCTMCToPython();
+
+	}
+
+	if (simulation_mode & SIMULATION_MODE_FLAG_FORWARD_FLUX) {
+
+		sendForwardFluxToPython();
+
+	}
+
+	if (simulation_mode & SIMULATION_MODE_FLAG_WEIGHTED_ENSEMBLE) {
+
+		sendWeightedEnsembleToPython();
+
+	}
+
 	cout << flush;
 }
 
@@ -213,7 +1037,8 @@ void SimulationSystem::SimulationLoop_Standard(void) {
 	rchoice = rate = stime = ctime = 0.0;
 
 	bool checkresult = false;
-	class stopComplexes *traverse = NULL, *first = NULL;
+	class stopComplexes *traverse = NULL;
+	int ctmcCurrent = 0;
 
 	double maxsimtime = simOptions->getMaxSimTime();
 	long stopcount = simOptions->getStopCount();
@@ -221,12 +1046,26 @@ void SimulationSystem::SimulationLoop_Standard(void) {
 
 	complexList->initializeList();
 
+	if (resumePoint != NULL) {
+		stime = resumePoint->time;
+		delete resumePoint;
+		resumePoint = NULL;
+	} else {
+		trajectorySteps = 0;
+		if (checkpointInterval > 0 && steps >= nextCheckpoint)
+			saveCheckpoint(stime, 0.0);
+	}
+
 	rate = complexList->getTotalFlux();
 
+	if (exportCTMC) {
+		ctmcCurrent = recordCTMCState(rate);
+	}
+
 	do {
 
-		rchoice = rate * drand48();
-		stime += (log(1. / (1.0 - drand48())) / rate);
+		rchoice = rate * rng.uniform();
+		stime += (log(1. / (1.0 - rng.uniform())) / rate);
 
 		// 1.0 - drand as drand returns in the [0.0, 1.0) range, we need a (0.0,1.0] range.
 		// see notes below in First Step mode.
@@ -254,6 +1093,12 @@ void SimulationSystem::SimulationLoop_Standard(void) {
 
 			rate = complexList->getTotalFlux();
 
+			if (exportCTMC) {
+				int ctmcNext = recordCTMCState(rate);
+				recordCTMCTransition(ctmcCurrent, ctmcNext, complexList->getLastMoveRate());
+				ctmcCurrent = ctmcNext;
+			}
+
 			if (stopoptions) {
 
 				if (stopcount <= 0) {
@@ -261,22 +1106,16 @@ void SimulationSystem::SimulationLoop_Standard(void) {
 					return;
 				}
 
-				checkresult = false;
-				first = simOptions->getStopComplexes(0);
-				checkresult = complexList->checkStopComplexList(first->citem);
-				traverse = first;
+				traverse = checkStopConditions();
+				checkresult = (traverse != NULL);
+			}
 
-				while (traverse->next != NULL && !checkresult) {
-					traverse = traverse->next;
-					checkresult = complexList->checkStopComplexList(traverse->citem);
-				}
-				// Note: we cannot delete first here if checkresult != 0,
-				// as traverse->tag may be needed. It will get checked at
-				// that point and deleted once traverse->tag is used,
-				// later.
-				if (!checkresult) {
-					delete first;
-				}
+			steps++;
+			if (++trajectorySteps % rebuildInterval == 0 && !checkresult) {
+				rebuildComplexList();
+				rate = complexList->getTotalFlux();
+				if (checkpointInterval > 0 && steps >= nextCheckpoint)
+					saveCheckpoint(stime, 0.0);
 			}
 		}
 	} while (stime < maxsimtime && !checkresult);
@@ -289,7 +1128,6 @@ void SimulationSystem::SimulationLoop_Standard(void) {
 
 		dumpCurrentStateToPython();
 		simOptions->stopResultNormal(current_seed, stime, traverse->tag);
-		delete first;
 
 	} else { // stime >= maxsimtime
 
@@ -303,15 +1141,19 @@ void SimulationSystem::countState(SComplexList* complexList) {
 
 	if (SimOptions::countStates) {
 
-		string myComplex = complexList->toString();
+		utility::state_fingerprint myState = complexList->getFingerprint();
 
-		if (countMap.count(myComplex) == 0) {
+		if (countMap.count(myState) == 0) {
 
-			countMap[myComplex] = 1;
+			countMap[myState] = 1;
+
+			if (SimOptions::countStateNames) {
+				stateNames[myState] = complexList->toString();
+			}
 
 		} else {
 
-			countMap[myComplex]++;
+			countMap[myState]++;
 
 		}
 
@@ -319,6 +1161,65 @@ void SimulationSystem::countState(SComplexList* complexList) {
 
 }
 
+// Two rates recorded for the same state or transition agree up to rounding.
+static bool sameRate(double first, double second) {
+
+	return fabs(first - second) <= 1e-9 * std::max(fabs(first), fabs(second));
+
+}
+
+// Returns the index of the current state in the explored state space, adding it on
+// the first visit. The exit rate of a state should not depend on the path taken to
+// it; when a revisit finds a different one, the chain is not exported.
+int SimulationSystem::recordCTMCState(double exitRate) {
+
+	utility::state_fingerprint myState = complexList->getFingerprint();
+
+	std::unordered_map<utility::state_fingerprint, int, utility::state_fingerprint_hash>::iterator found = ctmcIndex.find(myState);
+
+	if (found != ctmcIndex.end()) {
+		if (!sameRate(ctmcStates[found->second].exitRate, exitRate))
+			ctmcConflicts++;
+		return found->second;
+	}
+
+	CTMCState state;
+	state.exitRate = exitRate;
+
+	int id;
+	char *names, *sequence, *structure;
+	double energy;
+
+	for (SComplexListEntry *temp = complexList->getFirst(); temp != NULL; temp = temp->next) {
+
+		temp->dumpComplexEntryToPython(&id, &names, &sequence, &structure, &energy);
+		state.names.push_back(names);
+		state.sequences.push_back(sequence);
+		state.structures.push_back(structure);
+		state.energies.push_back(energy);
+
+	}
+
+	int index = ctmcStates.size();
+	ctmcIndex[myState] = index;
+	ctmcStates.push_back(state);
+
+	return index;
+
+}
+
+// Records the rate of an observed transition. Distinct moves lead to distinct states,
+// so a transition seen again should have the same rate; if not, the chain is not exported.
+void SimulationSystem::recordCTMCTransition(int source, int target, double rate) {
+
+	std::pair<std::unordered_map<uint64_t, double>::iterator, bool> inserted = ctmcTransitions.insert(
+			std::make_pair(((uint64_t) source << 32) | (uint32_t) target, rate));
+
+	if (!inserted.second && !sameRate(inserted.first->second, rate))
+		ctmcConflicts++;
+
+}
+
 void SimulationSystem::SimulationLoop_Trajectory() {
 
 	double rchoice, rate, stime, last_trajectory_time;
@@ -330,7 +1231,7 @@ void SimulationSystem::SimulationLoop_Trajectory() {
 
 	bool stopFlag = false;
 	long current_state_count = 0;
-	class stopComplexes *traverse = NULL, *first = NULL;
+	class stopComplexes *traverse = NULL;
 
 	complexList->initializeList();
 	rate = complexList->getTotalFlux();
@@ -348,7 +1249,6 @@ void SimulationSystem::SimulationLoop_Trajectory() {
 			simOptions->stopResultError(current_seed);
 			return;
 		}
-		first = simOptions->getStopComplexes(0);
 	}
 
 	// write the initial state:
@@ -358,8 +1258,8 @@ void SimulationSystem::SimulationLoop_Trajectory() {
 
 	do {
 
-		rchoice = rate * drand48();
-		stime += (log(1. / (1.0 - drand48())) / rate);
+		rchoice = rate * rng.uniform();
+		stime += (log(1. / (1.0 - rng.uniform())) / rate);
 		// 1.0 - drand as drand returns in the [0.0, 1.0) range, we need a (0.0,1.0] range.
 		// see notes below in First Step mode.
 
@@ -382,13 +1282,8 @@ void SimulationSystem::SimulationLoop_Trajectory() {
 		}
 
 		if (stopoptions) {
-			stopFlag = false;
-			stopFlag = complexList->checkStopComplexList(first->citem);
-			traverse = first;
-			while (traverse->next != NULL && !stopFlag) {
-				traverse = traverse->next;
-				stopFlag = complexList->checkStopComplexList(traverse->citem);
-			}
+			traverse = checkStopConditions();
+			stopFlag = (traverse != NULL);
 		}
 
 	} while (stime < maxsimtime && !stopFlag);
@@ -406,10 +1301,6 @@ void SimulationSystem::SimulationLoop_Trajectory() {
 		simOptions->stopResultTime(current_seed, stime);
 
 	}
-
-	if (first != NULL) {
-		delete first;
-	}
 }
 
 void SimulationSystem::SimulationLoop_Transition(void) {
@@ -424,7 +1315,7 @@ void SimulationSystem::SimulationLoop_Transition(void) {
 	bool stopFlag = false;
 	bool state_changed = false;
 	long stopcount = 0;
-	class stopComplexes *traverse = NULL, *first = NULL;
+	class stopComplexes *traverse = NULL;
 
 	long stopoptions = simOptions->getStopOptions();
 	stopcount = simOptions->getStopCount();
@@ -446,19 +1337,18 @@ void SimulationSystem::SimulationLoop_Transition(void) {
 
 	complexList->initializeList();
 
-	first = simOptions->getStopComplexes(0);
-	traverse = first;
+	complexList->updateStopState();
+	traverse = stopConditions;
 	checkresult = false;
 	for (int idx = 0; idx < stopcount; idx++) {
 		if (strstr(traverse->tag, "stop:") == traverse->tag)
 			stop_entries[idx] = true;
 
-		checkresult = complexList->checkStopComplexList(traverse->citem);
+		checkresult = complexList->checkStopCondition(idx);
 
 		transition_states[idx] = checkresult;
 		traverse = traverse->next;
 	}
-	delete first;
 	sendTransitionStateVectorToPython(transition_states, stime);
 // start
 
@@ -467,8 +1357,8 @@ void SimulationSystem::SimulationLoop_Transition(void) {
 	stopFlag = false;
 	do {
 
-		rchoice = rate * drand48();
-		stime += (log(1. / (1.0 - drand48())) / rate);
+		rchoice = rate * rng.uniform();
+		stime += (log(1. / (1.0 - rng.uniform())) / rate);
 		// 1.0 - drand as drand returns in the [0.0, 1.0) range, we need a (0.0,1.0] range.
 		// see notes below in First Step mode.
 
@@ -480,11 +1370,11 @@ void SimulationSystem::SimulationLoop_Transition(void) {
 
 			// check if our transition state membership vector has changed
 			checkresult = false;
-			first = simOptions->getStopComplexes(0);
-			traverse = first;
+			complexList->updateStopState();
+			traverse = stopConditions;
 			for (int idx = 0; idx < stopcount; idx++) {
 
-				checkresult = complexList->checkStopComplexList(traverse->citem);
+				checkresult = complexList->checkStopCondition(idx);
 
 				if (checkresult && stop_entries[idx] == true) {
 					// multiple stop states could suddenly be true, we add
@@ -503,10 +1393,6 @@ void SimulationSystem::SimulationLoop_Transition(void) {
 				transition_states[idx] = checkresult;
 				traverse = traverse->next;
 			}
-			delete first; // we can do this now as we no longer need to
-						  // save the stoplist until the loop exits, due
-						  // to moving printStatusLine to immediately upon
-						  // finding the stopping condition.
 			if (state_changed) {
 				sendTransitionStateVectorToPython(transition_states, stime);
 				state_changed = false;
@@ -536,7 +1422,7 @@ void SimulationSystem::SimulationLoop_FirstStep(void) {
 	bool stopFlag = false;
 	double last_trajectory_time = 0.0;
 
-	class stopComplexes *traverse = NULL, *first = NULL;
+	class stopComplexes *traverse = NULL;
 	double frate = 0.0;
 
 	double maxsimtime = simOptions->getMaxSimTime();
@@ -548,50 +1434,71 @@ void SimulationSystem::SimulationLoop_FirstStep(void) {
 
 	complexList->initializeList();
 
-	rate = complexList->getJoinFlux();
+	// a trajectory resumed after its start has taken its join step before the checkpoint.
+	bool joined = (resumePoint != NULL && resumePoint->trajectorySteps > 0);
+
+	if (joined) {
+		stime = resumePoint->time;
+		frate = resumePoint->forwardRate;
+	}
+
+	if (resumePoint != NULL) {
+		delete resumePoint;
+		resumePoint = NULL;
+	} else {
+		trajectorySteps = 0;
+		if (checkpointInterval > 0 && steps >= nextCheckpoint)
+			saveCheckpoint(0.0, 0.0);
+	}
 
-// scomplexlist returns a 0.0 rate if there was a single complex in
-// the system, and a -1.0 rate if there are exactly 0 join moves. So
-// the 0.0 rate should probably be caught, though if you use a
-// single complex system for a starting state it's probably
-// deserved.
+	if (!joined) {
 
-	if (rate == 0.0) { // no initial moves
+		rate = complexList->getJoinFlux();
 
-		noInitialMoves++;
+		// scomplexlist returns a 0.0 rate if there was a single complex in
+		// the system, and a -1.0 rate if there are exactly 0 join moves. So
+		// the 0.0 rate should probably be caught, though if you use a
+		// single complex system for a starting state it's probably
+		// deserved.
 
-		simOptions->stopResultBimolecular("NoMoves", current_seed, 0.0, 0.0,
-		NULL);
-		return;
-	}
+		if (rate == 0.0) { // no initial moves
+
+			noInitialMoves++;
+
+			simOptions->stopResultBimolecular("NoMoves", current_seed, 0.0, 0.0,
+			NULL);
+			return;
+		}
 
-	rchoice = rate * drand48();
+		rchoice = rate * rng.uniform();
 
-	int ArrMoveType = complexList->doJoinChoice(rchoice);
+		int ArrMoveType = complexList->doJoinChoice(rchoice);
 
-	if (exportStatesInterval) {
-		exportInterval(stime, current_state_count, ArrMoveType);
-	}
+		if (exportStatesInterval) {
+			exportInterval(stime, current_state_count, ArrMoveType);
+		}
+
+		// store the forward rate used for the initial step so we can record it.
+		frate = rate * energyModel->getJoinRate_NoVolumeTerm() / energyModel->getJoinRate();
 
-// store the forward rate used for the initial step so we can record it.
-	frate = rate * energyModel->getJoinRate_NoVolumeTerm() / energyModel->getJoinRate();
+		// rate is the total flux across all join moves - this is exactly equal to total_move_count *
+		// dnaEnergyModel->getJoinRate()
 
-// rate is the total flux across all join moves - this is exactly equal to total_move_count *
-// dnaEnergyModel->getJoinRate()
+		// This join rate is the dG_volume * bimolecular scaling constant
+		// used for forward transitions.  What we actually need is the
+		// bimolecular scaling constant * total move count. (dG volume is
+		// the volume dependent term that is not actually related to the
+		// 'collision' rate, but rather the volume we are simulating.
 
-// This join rate is the dG_volume * bimolecular scaling constant
-// used for forward transitions.  What we actually need is the
-// bimolecular scaling constant * total move count. (dG volume is
-// the volume dependent term that is not actually related to the
-// 'collision' rate, but rather the volume we are simulating.
+	}
 
 // Begin normal steps.
 	rate = complexList->getTotalFlux();
 
 	do {
 
-		rchoice = rate * drand48();
-		stime += (log(1. / (1.0 - drand48())) / rate);
+		rchoice = rate * rng.uniform();
+		stime += (log(1. / (1.0 - rng.uniform())) / rate);
 
 		if (debugTraces) {
 			cout << "Printing my complexlist! *************************************** \n";
@@ -613,18 +1520,16 @@ void SimulationSystem::SimulationLoop_FirstStep(void) {
 
 		if (stopcount > 0 && stopoptions) {
 
-			stopFlag = false;
-			first = simOptions->getStopComplexes(0);
-			traverse = first;
-			stopFlag = complexList->checkStopComplexList(traverse->citem);
-
-			while (traverse->next != NULL && !stopFlag) {
-				traverse = traverse->next;
-				stopFlag = complexList->checkStopComplexList(traverse->citem);
-			}
+			traverse = checkStopConditions();
+			stopFlag = (traverse != NULL);
+		}
 
-			if (!stopFlag && first != NULL)
-				delete first;
+		steps++;
+		if (++trajectorySteps % rebuildInterval == 0 && !stopFlag && stime < maxsimtime) {
+			rebuildComplexList();
+			rate = complexList->getTotalFlux();
+			if (checkpointInterval > 0 && steps >= nextCheckpoint)
+				saveCheckpoint(stime, frate);
 		}
 
 	} while (stime < maxsimtime && !stopFlag);
@@ -635,7 +1540,6 @@ void SimulationSystem::SimulationLoop_FirstStep(void) {
 			simOptions->stopResultBimolecular("Reverse", current_seed, stime, frate, traverse->tag);
 		else
 			simOptions->stopResultBimolecular("Forward", current_seed, stime, frate, traverse->tag);
-		delete first;
 	} else {
 		timeOut++;
 		dumpCurrentStateToPython();
@@ -658,7 +1562,7 @@ void SimulationSystem::dumpCurrentStateToPython(void) {
 	temp = complexList->getFirst();
 	while (temp != NULL) {
 		temp->dumpComplexEntryToPython(&id, &names, &sequence, &structure, &energy);
-		printComplexStateLine(simOptions->getPythonSettings(), current_seed, id, names, sequence, structure, energy);
+		simOptions->sendEndState(current_seed, id, names, sequence, structure, energy);
 		temp = temp->next;
 	}
 }
@@ -709,6 +1613,129 @@ void SimulationSystem::sendTransitionStateVectorToPython(boolvector transition_s
 
 }
 
+/////////////////////////////////////////////////////////////////////////////////
+// void sendCTMCToPython( void );												//
+// 																				//
+// Helper function to send the explored state space to the python side, as a   //
+// tuple (states, exit rates, sources, targets, rates). Each state is a list of //
+// (strand names, sequence, structure, energy) tuples, one per complex.		//
+/////////////////////////////////////////////////////////////////////////////////
+
+void SimulationSystem::sendCTMCToPython(void) {
+
+	if (system_options == NULL)
+		return;
+
+	// the observed rates out of a state cannot add up to more than its exit rate.
+	vector<double> outRates(ctmcStates.size(), 0.0);
+
+	for (std::unordered_map<uint64_t, double>::iterator it = ctmcTransitions.begin(); it != ctmcTransitions.end(); it++)
+		outRates[it->first >> 32] += it->second;
+
+	for (unsigned int i = 0; i < ctmcStates.size(); i++)
+		if (outRates[i] > ctmcStates[i].exitRate && !sameRate(outRates[i], ctmcStates[i].exitRate))
+			ctmcConflicts++;
+
+	if (ctmcConflicts > 0) {
+		cout << "The explored state space is not exported: " << ctmcConflicts
+				<< " rates depended on the path taken to a state, so they do not form a Markov chain. \n";
+		return;
+	}
+
+	PyObject *states = PyList_New((Py_ssize_t) ctmcStates.size());
+	PyObject *exitRates = PyList_New((Py_ssize_t) ctmcStates.size());
+
+	for (unsigned int i = 0; i < ctmcStates.size(); i++) {
+
+		CTMCState& state = ctmcStates[i];
+		PyObject *complexes = PyList_New((Py_ssize_t) state.names.size());
+
+		for (unsigned int j = 0; j < state.names.size(); j++) {
+			PyList_SET_ITEM(complexes, j,
+					Py_BuildValue("sssd", state.names[j].c_str(), state.sequences[j].c_str(), state.structures[j].c_str(), state.energies[j]));
+		}
+
+		PyList_SET_ITEM(states, i, complexes);
+		PyList_SET_ITEM(exitRates, i, PyFloat_FromDouble(state.exitRate));
+		// ownership of these references has been stolen by PyList_SET_ITEM.
+	}
+
+	PyObject *sources = PyList_New((Py_ssize_t) ctmcTransitions.size());
+	PyObject *targets = PyList_New((Py_ssize_t) ctmcTransitions.size());
+	PyObject *rates = PyList_New((Py_ssize_t) ctmcTransitions.size());
+
+	Py_ssize_t index = 0;
+	for (std::unordered_map<uint64_t, double>::iterator it = ctmcTransitions.begin(); it != ctmcTransitions.end(); it++, index++) {
+		PyList_SET_ITEM(sources, index, PyInt_FromLong((long) (it->first >> 32)));
+		PyList_SET_ITEM(targets, index, PyInt_FromLong((long) (it->first & 0xffffffff)));
+		PyList_SET_ITEM(rates, index, PyFloat_FromDouble(it->second));
+	}
+
+	PyObject *ctmc_tuple = Py_BuildValue("(NNNNN)", states, exitRates, sources, targets, rates);
+// the N format steals our references to the lists.
+
+	pushCTMC(system_options, ctmc_tuple);
+
+// ctmc_tuple has been decreffed by this macro, so we no longer own any references to it
+
+}
+
+// Sends the statistics of a forward flux run as a tuple (tags, trials, successes,
+// failures, time outs, steps, collision rate), with a list entry per interface.
+void SimulationSystem::sendForwardFluxToPython(void) {
+
+	if (system_options == NULL || fluxStages.empty())
+		return;
+
+	PyObject *columns[6];
+
+	for (int i = 0; i < 6; i++)
+		columns[i] = PyList_New((Py_ssize_t) fluxStages.size());
+
+	for (unsigned int i = 0; i < fluxStages.size(); i++) {
+
+		FluxStage& stage = fluxStages[i];
+
+		PyList_SET_ITEM(columns[0], i, PyString_FromString(stopIndex->conditions[fluxInterfaces[i]]->tag));
+		PyList_SET_ITEM(columns[1], i, PyInt_FromLong(stage.trials));
+		PyList_SET_ITEM(columns[2], i, PyInt_FromLong(stage.successes));
+		PyList_SET_ITEM(columns[3], i, PyInt_FromLong(stage.failures));
+		PyList_SET_ITEM(columns[4], i, PyInt_FromLong(stage.timeOuts));
+		PyList_SET_ITEM(columns[5], i, PyInt_FromLong(stage.steps));
+		// ownership of these references has been stolen by PyList_SET_ITEM.
+	}
+
+	PyObject *flux_tuple = Py_BuildValue("(NNNNNNd)", columns[0], columns[1], columns[2], columns[3], columns[4], columns[5], fluxCollisionRate);
+// the N format steals our references to the lists.
+
+	pushForwardFlux(system_options, flux_tuple);
+
+}
+
+// Sends the result of a weighted ensemble run as a tuple (times, weights, runs,
+// remaining weight, steps), with a list entry per walker that reached the target.
+void SimulationSystem::sendWeightedEnsembleToPython(void) {
+
+	if (system_options == NULL)
+		return;
+
+	PyObject *times = PyList_New((Py_ssize_t) ensembleTimes.size());
+	PyObject *weights = PyList_New((Py_ssize_t) ensembleWeights.size());
+
+	for (unsigned int i = 0; i < ensembleTimes.size(); i++) {
+
+		PyList_SET_ITEM(times, i, PyFloat_FromDouble(ensembleTimes[i]));
+		PyList_SET_ITEM(weights, i, PyFloat_FromDouble(ensembleWeights[i]));
+		// ownership of these references has been stolen by PyList_SET_ITEM.
+	}
+
+	PyObject *ensemble_tuple = Py_BuildValue("(NNldl)", times, weights, ensembleRuns, ensembleRemaining, ensembleSteps);
+// the N format steals our references to the lists.
+
+	pushWeightedEnsemble(system_options, ensemble_tuple);
+
+}
+
 ///////////////////////////////////////////////////////////
 // void sendTrajectory_CurrentStateToPython( void );	  //
 // 													  //
@@ -716,6 +1743,17 @@ void SimulationSystem::sendTransitionStateVectorToPython(boolvector transition_s
 ///////////////////////////////////////////////////////////
 
 void SimulationSystem::sendTrajectory_CurrentStateToPython(double current_time, int arrType) {
+
+	if (trajectoryFile != NULL && trajectoryFile->isOpen()) {
+		trajectoryFile->writeState(current_seed, current_time, arrType, complexList);
+		return;
+	}
+
+	if (exportColumnar) {
+		bufferTrajectoryState(current_time, arrType);
+		return;
+	}
+
 	int id;
 	char *names, *sequence, *structure;
 	double energy;
@@ -735,36 +1773,152 @@ void SimulationSystem::sendTrajectory_CurrentStateToPython(double current_time,
 
 }
 
+void TrajectoryColumns::clear(void) {
+
+	times.clear();
+	arrTypes.clear();
+	complexCounts.clear();
+	ids.clear();
+	energies.clear();
+	names.clear();
+	structures.clear();
+
+}
+
+// Appends the current state to the trajectory columns, and hands them over
+// whenever Options.output_columnar_block states have been collected.
+void SimulationSystem::bufferTrajectoryState(double current_time, int arrType) {
+
+	int id, count = 0;
+	char *names, *sequence, *structure;
+	double energy;
+
+	for (SComplexListEntry *temp = complexList->getFirst(); temp != NULL; temp = temp->next, count++) {
+
+		temp->dumpComplexEntryToPython(&id, &names, &sequence, &structure, &energy);
+
+		trajectoryColumns.ids.push_back(id);
+		trajectoryColumns.energies.push_back(energy);
+		trajectoryColumns.names.push_back(names);
+		trajectoryColumns.structures.push_back(structure);
+
+	}
+
+	trajectoryColumns.times.push_back(current_time);
+	trajectoryColumns.arrTypes.push_back(arrType);
+	trajectoryColumns.complexCounts.push_back(count);
+
+	long block = simOptions->getOColumnarBlock();
+
+	if (block > 0 && (long) trajectoryColumns.times.size() >= block) {
+		sendTrajectoryColumnsToPython();
+	}
+
+}
+
+// Packs a list of strings into one buffer of fixed width entries, padded with '\0'.
+static PyObject *packFixedWidth(std::vector<std::string>& input, int *width) {
+
+	*width = 1;
+	for (unsigned int i = 0; i < input.size(); i++) {
+		*width = std::max(*width, (int) input[i].size());
+	}
+
+	std::string output(input.size() * (*width), '\0');
+	for (unsigned int i = 0; i < input.size(); i++) {
+		output.replace(i * (*width), input[i].size(), input[i]);
+	}
+
+	return PyString_FromStringAndSize(output.data(), output.size());
+
+}
+
+/////////////////////////////////////////////////////////////////////////////////////
+// void sendTrajectoryColumnsToPython( void );										   //
+// 																				   //
+// Helper function to hand the buffered trajectory states to python in one call,   //
+// as raw buffers that the python side wraps in numpy arrays:					   //
+// (seed, times, arrTypes, complexCounts, ids, energies, names, names width,	   //
+//  structures, structures width)												   //
+/////////////////////////////////////////////////////////////////////////////////////
+
+void SimulationSystem::sendTrajectoryColumnsToPython(void) {
+
+	if (system_options == NULL || trajectoryColumns.times.empty()) {
+		trajectoryColumns.clear();
+		return;
+	}
+
+	TrajectoryColumns& tc = trajectoryColumns;
+	int namesWidth, structuresWidth;
+
+	PyObject *names = packFixedWidth(tc.names, &namesWidth);
+	PyObject *structures = packFixedWidth(tc.structures, &structuresWidth);
+
+	PyObject *columns = Py_BuildValue("(ls#s#s#s#s#NiNi)", current_seed,
+			(char *) tc.times.data(), (int) (tc.times.size() * sizeof(double)),
+			(char *) tc.arrTypes.data(), (int) (tc.arrTypes.size() * sizeof(int)),
+			(char *) tc.complexCounts.data(), (int) (tc.complexCounts.size() * sizeof(int)),
+			(char *) tc.ids.data(), (int) (tc.ids.size() * sizeof(int)),
+			(char *) tc.energies.data(), (int) (tc.energies.size() * sizeof(double)),
+			names, namesWidth, structures, structuresWidth);
+// the N format steals our references to names and structures.
+
+	pushTrajectoryColumns(system_options, columns);
+
+// columns has been decreffed by this macro, so we no longer own any references to it
+
+	trajectoryColumns.clear();
+
+}
+
 // FD: OK to have alternate_start = NULL
 int SimulationSystem::InitializeSystem(PyObject *alternate_start) {
 
-	class StrandComplex *tempcomplex;
-	class identList *id;
-
-	simOptions->generateComplexes(alternate_start, current_seed);
+	Loop::SetActiveEnergyModel(energyModel);
+	Loop::SetMoveContainerType(simOptions->getMoveContainer());
+	ObjectPool::setActive(&objectPool);
 
 // FD: Somehow, check if complex list is pre-populated.
 	startState = NULL;
 	if (complexList != NULL)
 		delete complexList;
+	complexList = NULL;
 
-	complexList = new SComplexList(energyModel);
+	// the previous trajectory is gone, so its memory is reused from the start.
+	objectPool.reset();
 
-// FD: this is the python - C interface
-	for (unsigned int i = 0; i < simOptions->myComplexes->size(); i++) {
+	// the trajectory in progress when the checkpoint was written
+	if (resumePoint != NULL) {
+		complexList = restoreComplexList(resumePoint);
+		startState = complexList->getFirst()->thisComplex;
+		return 0;
+	}
 
-		char* tempSequence = copyToCharArray(simOptions->myComplexes->at(i).sequence);
-		char* tempStructure = copyToCharArray(simOptions->myComplexes->at(i).structure);
+	// A static start state is built, with its loops and moves, for the first
+	// trajectory only; the others start from a copy. The template is kept on the
+	// heap, so that the pool can still be reset between trajectories.
+	if (alternate_start == NULL && staticStart) {
+
+		if (startTemplate == NULL) {
+			ActivePool heap(NULL);
+			startTemplate = newComplexList(NULL);
+			startTemplate->initializeList();
+		} else {
+			simOptions->setCurrentSeed(current_seed);
+		}
 
-		id = simOptions->myComplexes->at(i).list;
+		complexList = startTemplate->copy();
 
-		tempcomplex = new StrandComplex(tempSequence, tempStructure, id);
+	} else {
 
-		startState = tempcomplex;
-		complexList->addComplex(tempcomplex);
+		complexList = newComplexList(alternate_start);
 
 	}
 
+	if (complexList->getFirst() != NULL)
+		startState = complexList->getFirst()->thisComplex;
+
 	if (utility::debugTraces) {
 
 		cout << "Done initializing!" << endl;
@@ -774,37 +1928,91 @@ int SimulationSystem::InitializeSystem(PyObject *alternate_start) {
 	return 0;
 }
 
+// Builds the start state given by the options, or by alternate_start. Strands
+// are numbered in the order they are read, which identifies them for the rest of
+// the run: the python strand ids are not unique, a strand and its complement
+// can share one and a strand can appear more than once in the start state.
+SComplexList *SimulationSystem::newComplexList(PyObject *alternate_start) {
+
+	simOptions->generateComplexes(alternate_start, current_seed);
+
+	SComplexList *newList = new SComplexList(energyModel);
+	newList->setStopIndex(stopIndex);
+
+	int strandIndex = 0;
+
+// FD: this is the python - C interface
+	for (unsigned int i = 0; i < simOptions->myComplexes->size(); i++) {
+
+		char* tempSequence = copyToCharArray(simOptions->myComplexes->at(i).sequence);
+		char* tempStructure = copyToCharArray(simOptions->myComplexes->at(i).structure);
+
+		identList *id = simOptions->myComplexes->at(i).list;
+
+		for (identList *strand = id; strand != NULL; strand = strand->next)
+			strand->index = strandIndex++;
+
+		newList->addComplex(new StrandComplex(tempSequence, tempStructure, id));
+
+	}
+
+	return newList;
+
+}
+
 void SimulationSystem::InitializeRNG(void) {
 
 	FILE *fp = NULL;
 
 	if (simOptions->useFixedRandomSeed()) {
-		current_seed = simOptions->getInitialSeed();
+		run_seed = simOptions->getInitialSeed();
 	} else {
 		if ((fp = fopen("/dev/urandom", "r")) != NULL) { // if urandom exists, use it to provide a seed
 			long deviceseed;
 			(void) fread(&deviceseed, sizeof(long), 1, fp);
 
-			current_seed = deviceseed;
+			run_seed = deviceseed;
 			fclose(fp);
 		} else // use the possibly flawed time as a seed.
 		{
-			current_seed = time(NULL);
+			run_seed = time(NULL);
 		}
 	}
-// now initialize this generator using our random seed, so that we can reproduce as necessary.
-	srand48(current_seed);
+// now initialize the generator for the first trajectory, so that we can reproduce as necessary.
+	trajectory_index = simOptions->getTrajectoryOffset();
+	current_seed = utility::random_generator::streamSeed(run_seed, trajectory_index);
+	rng.seed(current_seed);
+
+	// a resumed run continues from the trajectory and generator state of its checkpoint.
+	if (resumePoint != NULL) {
+
+		run_seed = resumePoint->runSeed;
+		trajectory_index = resumePoint->trajectoryIndex;
+		current_seed = resumePoint->currentSeed;
+		for (int i = 0; i < 4; i++)
+			rng.s[i] = resumePoint->rng[i];
+
+		simulation_count_remaining = resumePoint->remaining;
+		steps = resumePoint->steps;
+		trajectorySteps = resumePoint->trajectorySteps;
+		noInitialMoves = resumePoint->noInitialMoves;
+		timeOut = resumePoint->timeOut;
+
+	}
 }
 
 void SimulationSystem::generateNextRandom(void) {
-	current_seed = lrand48();
-	srand48(current_seed);
+	trajectory_index++;
+	current_seed = utility::random_generator::streamSeed(run_seed, trajectory_index);
+	rng.seed(current_seed);
 }
 
 PyObject *SimulationSystem::calculateEnergy(PyObject *start_state, int typeflag) {
 	double *values = NULL;
 	PyObject *retval = NULL;
 
+	ActivePool activePool(&objectPool); // as in StartSimulation_Mode
+
 // calc based on current state, do not clean up anything.
 	if (start_state != Py_None) {
 		InitializeSystem(start_state);
@@ -825,6 +2033,55 @@ PyObject *SimulationSystem::calculateEnergy(PyObject *start_state, int typeflag)
 	return retval;
 }
 
+// Every state is a single complex, given by its sequence and structure with '+'
+// between strands; a single sequence or structure is used for all states. Only the
+// loops of each complex are built, not its moves, so this is much cheaper than
+// calculateEnergy, and nothing is sent to python. The energy type is as for
+// calculateEnergy.
+void SimulationSystem::calculateEnergies(EnergyModel *model, vector<string>& sequences, vector<string>& structures, int typeflag, bool loops,
+		EnergyBatch& batch) {
+
+	long count = max(sequences.size(), structures.size());
+
+	Loop::SetActiveEnergyModel(model);
+
+	// there is no system here, so the loops come from a pool of our own, which
+	// is dropped on return; each complex reuses the blocks of the one before.
+	ObjectPool pool;
+	ActivePool activePool(&pool);
+
+	batch.energies.resize(count);
+	if (loops)
+		batch.loopOffsets.assign(1, 0);
+
+	for (long i = 0; i < count; i++) {
+
+		string& sequence = sequences[sequences.size() == 1 ? 0 : i];
+		string& structure = structures[structures.size() == 1 ? 0 : i];
+
+		StrandComplex complex((char *) sequence.c_str(), (char *) structure.c_str());
+		complex.generateLoops();
+
+		double energy = complex.getEnergy();
+		int joins = complex.getStrandCount() - 1;
+
+		if (typeflag & 0x01)
+			energy += model->getVolumeEnergy() * joins;
+		if (typeflag & 0x02)
+			energy += model->getAssocEnergy() * joins;
+
+		batch.energies[i] = energy;
+
+		if (loops) {
+			complex.getLoopEnergies(batch.loopEnergies, batch.loopTypes);
+			batch.loopOffsets.push_back(batch.loopEnergies.size());
+		}
+
+		complex.cleanup();
+	}
+
+}
+
 void SimulationSystem::printTransition(double input) {
 
 	cout << "Using RNG =" << input;
@@ -870,6 +2127,8 @@ void SimulationSystem::printAllMoves() {
 // FD: a simple peak into the initial state
 void SimulationSystem::InitialInfo(void) {
 
+	ActivePool activePool(&objectPool); // as in StartSimulation_Mode
+
 	if (InitializeSystem() != 0) {
 		return;
 	}
@@ -0,0 +1,256 @@
+/*
+Copyright (c) 2017 California Institute of Technology. All rights reserved.
+Multistrand nucleic acid kinetic simulator
+help@multistrand.org
+*/
+
+#include "trajectoryfile.h"
+#include "scomplexlist.h"
+
+#include <cstring>
+#include <iostream>
+
+using std::cout;
+
+static const char trajectoryMagic[8] = "MSTRAJ1";
+static const char deltaMagic[8] = "MSTRAJD";
+
+static const int32_t keyframeEntry = 0;
+static const int32_t deltaEntry = 1;
+
+static int padTo8(int size) {
+
+	return (size + 7) & ~7;
+
+}
+
+TrajectoryFile::TrajectoryFile(std::string path, bool delta, long keyframeInterval) {
+
+	this->delta = delta;
+	this->keyframeInterval = keyframeInterval;
+
+	file = fopen(path.c_str(), "wb");
+
+	if (file == NULL) {
+		cout << "Could not open output_file " << path << " for writing, trajectory is not written to disk. \n";
+	}
+
+}
+
+TrajectoryFile::~TrajectoryFile(void) {
+
+	if (file != NULL)
+		fclose(file);
+	file = NULL;
+
+}
+
+bool TrajectoryFile::isOpen(void) {
+
+	return file != NULL;
+
+}
+
+void TrajectoryFile::flush(void) {
+
+	if (file != NULL)
+		fflush(file);
+
+}
+
+// The strand table is taken from the first exported state: strands keep their
+// index (see orderingList::index) for the whole run, so every later state maps
+// onto the same global base indices.
+void TrajectoryFile::writeHeader(SComplexList *complexList) {
+
+	std::string strands;
+
+	for (SComplexListEntry *temp = complexList->getFirst(); temp != NULL; temp = temp->next) {
+		orderingList *traverse = temp->thisComplex->getOrdering()->first;
+
+		for (; traverse != NULL; traverse = traverse->next) {
+
+			int32_t entry[3] = { traverse->uid, traverse->size, (int32_t) strlen(traverse->thisTag) };
+
+			strands.append((char *) entry, sizeof(entry));
+			strands.append(traverse->thisTag, entry[2]);
+			strands.append(traverse->thisSeq, traverse->size);
+
+			strandIndex[traverse->index] = strandCount;
+			baseOffset.push_back(baseCount);
+			baseCount += traverse->size;
+			strandCount++;
+
+		}
+	}
+
+	int32_t fields[4];
+	fields[0] = padTo8(sizeof(trajectoryMagic) + sizeof(fields) + strands.size());
+	fields[1] = padTo8(24 + 24 * strandCount + 4 * baseCount);
+	fields[2] = strandCount;
+	fields[3] = baseCount;
+
+	std::string header(delta ? deltaMagic : trajectoryMagic, sizeof(trajectoryMagic));
+	header.append((char *) fields, sizeof(fields));
+	header.append(strands);
+	header.resize(fields[0], '\0');
+
+	fwrite(header.data(), 1, header.size(), file);
+
+	recordSize = fields[1];
+	record.assign(recordSize, 0);
+	headerWritten = true;
+
+}
+
+void TrajectoryFile::writeState(long seed, double time, int arrType, SComplexList *complexList) {
+
+	if (file == NULL)
+		return;
+
+	if (!headerWritten)
+		writeHeader(complexList);
+
+	if (!fillRecord(seed, time, arrType, complexList))
+		return;
+
+	if (!delta) {
+		fwrite(record.data(), 1, recordSize, file);
+		return;
+	}
+
+	// a new trajectory always starts with a keyframe, so decoding never crosses seeds.
+	bool keyframe = previous.empty() || memcmp(&record[0], &previous[0], 8) != 0;
+	keyframe = keyframe || (keyframeInterval > 0 && sinceKeyframe >= keyframeInterval);
+
+	if (keyframe) {
+
+		int32_t prefix[2] = { keyframeEntry, (int32_t) (8 + recordSize) };
+
+		fwrite(prefix, sizeof(int32_t), 2, file);
+		fwrite(record.data(), 1, recordSize, file);
+		sinceKeyframe = 0;
+
+	} else {
+
+		writeDelta();
+		sinceKeyframe++;
+
+	}
+
+	previous.swap(record);
+	record.resize(recordSize);
+
+}
+
+// Writes the difference between record and previous as a delta entry.
+void TrajectoryFile::writeDelta(void) {
+
+	int32_t complexCount = *(int32_t *) &record[20];
+	int32_t *strands = (int32_t *) &record[24 + 12 * strandCount];
+	int32_t *pairs = strands + 2 * strandCount;
+	int32_t *oldStrands = (int32_t *) &previous[24 + 12 * strandCount];
+	int32_t *oldPairs = oldStrands + 2 * strandCount;
+
+	int32_t topology = (complexCount != *(int32_t *) &previous[20]);
+	topology = topology || memcmp(strands, oldStrands, 2 * strandCount * sizeof(int32_t)) != 0;
+
+	entry.resize(32);
+
+	entry.insert(entry.end(), &record[24], &record[24 + 8 * complexCount]);
+	entry.insert(entry.end(), &record[24 + 8 * strandCount], &record[24 + 8 * strandCount + 4 * complexCount]);
+
+	if (topology)
+		entry.insert(entry.end(), (char *) strands, (char *) pairs);
+
+	int32_t changeCount = 0;
+
+	for (int i = 0; i < baseCount; i++) {
+		if (pairs[i] != oldPairs[i]) {
+			int32_t change[2] = { i, pairs[i] };
+			entry.insert(entry.end(), (char *) change, (char *) (change + 2));
+			changeCount++;
+		}
+	}
+
+	entry.resize(padTo8(entry.size()), '\0');
+
+	int32_t header[8] = { deltaEntry, (int32_t) entry.size(), 0, 0, *(int32_t *) &record[16], complexCount, changeCount, topology };
+
+	memcpy(&entry[0], header, sizeof(header));
+	memcpy(&entry[8], &record[8], 8);
+
+	fwrite(entry.data(), 1, entry.size(), file);
+
+}
+
+// Fills record with the current state, returns false if the state does not fit the header.
+bool TrajectoryFile::fillRecord(long seed, double time, int arrType, SComplexList *complexList) {
+
+	int64_t seed64 = seed;
+	int32_t arrType32 = arrType;
+	int32_t complexCount = 0;
+
+	double *energies = (double *) &record[24];
+	int32_t *ids = (int32_t *) &record[24 + 8 * strandCount];
+	int32_t *strands = ids + strandCount;
+	int32_t *strandComplex = strands + strandCount;
+	int32_t *pairs = strandComplex + strandCount;
+
+	int position = 0;
+
+	for (int i = 0; i < baseCount; i++)
+		pairs[i] = -1;
+
+	for (SComplexListEntry *temp = complexList->getFirst(); temp != NULL; temp = temp->next, complexCount++) {
+
+		energies[complexCount] = temp->energy;
+		ids[complexCount] = temp->id;
+		openBases.clear();
+
+		orderingList *traverse = temp->thisComplex->getOrdering()->first;
+
+		for (; traverse != NULL; traverse = traverse->next, position++) {
+
+			std::unordered_map<int, int>::iterator index = strandIndex.find(traverse->index);
+
+			if (index == strandIndex.end() || position >= strandCount) {
+				if (!warnedUnknownStrand)
+					cout << "Strand " << traverse->thisTag << " is not in the header of output_file, state is not written. \n";
+				warnedUnknownStrand = true;
+				return false;
+			}
+
+			strands[position] = index->second;
+			strandComplex[position] = complexCount;
+
+			int offset = baseOffset[index->second];
+
+			for (int k = 0; k < traverse->size; k++) {
+
+				if (traverse->thisStruct[k] == '(') {
+					openBases.push_back(offset + k);
+				} else if (traverse->thisStruct[k] == ')') {
+					int partner = openBases.back();
+					openBases.pop_back();
+					pairs[partner] = offset + k;
+					pairs[offset + k] = partner;
+				}
+			}
+		}
+	}
+
+	// unused slots are cleared, so the file does not depend on earlier states
+	for (int i = complexCount; i < strandCount; i++) {
+		energies[i] = 0.0;
+		ids[i] = 0;
+	}
+
+	memcpy(&record[0], &seed64, 8);
+	memcpy(&record[8], &time, 8);
+	memcpy(&record[16], &arrType32, 4);
+	memcpy(&record[20], &complexCount, 4);
+
+	return true;
+
+}
@@ -18,6 +18,8 @@ except ImportError:
     print("Could not import Multistrand.")
     raise
 
+import shutil
+import tempfile
 import unittest
 import warnings
 # for IPython, some of the IPython libs used by unittest have a
@@ -160,6 +162,12 @@ class MI_Options_Object_TestCase(unittest.TestCase):
         #Do some tests?
         # For the moment, if creation doesn't fail, we're happy. :)
 
+    def test_options_move_container(self):
+        """ Test [Options]: Select the move container by name or by constant"""
+        self.assertEqual( Options().move_container, Options.moveList )
+        self.assertEqual( Options(move_container = 'Tree').move_container, Options.moveTree )
+        self.assertEqual( Options(move_container = Options.moveTree).move_container, Options.moveTree )
+
 
 
 class MI_System_Object_TestCase(unittest.TestCase):
@@ -247,6 +255,816 @@ class MI_System_Object_TestCase(unittest.TestCase):
         MI_System_Object_TestCase.str_run_system_several_times += "Third run results [yet another system]:\n{0}\n".format(str(self.options.interface))
 
 
+class MI_State_Space_TestCase(unittest.TestCase):
+    """ This test case checks the states recorded by a simulation, through the CTMC export.
+
+    """
+    def runCTMC(self, first, second):
+        hairpin = Complex(strands=[first], structure="((....))")
+
+        o = Options(simulation_mode="First Passage Time", num_simulations=20, simulation_time=1e-3,
+                    rate_method="Metropolis", dangles="Some", temperature=25)
+        o.start_state = [Complex(strands=[first], structure="........"), Complex(strands=[second], structure="........")]
+        o.stop_conditions = [StopCondition("CLOSED", [(hairpin, 0, 0)])]
+        o.initial_seed = 11
+        o.export_ctmc = True
+        o.join_concentration = 1e-12
+        o.unimolecular_scaling = 1.5e8
+        o.bimolecular_scaling = 1.38e6
+
+        SimSystem(o).start()
+        return o.interface.ctmc
+
+    def test_complementary_strands(self):
+        """ Test [State Space]: A strand and its complement give the same states as distinct strands
+
+        Strand and ComplementaryStrand number their ids separately, so s and
+        s.C can share an id; states must still be told apart. Both strands
+        fold on their own, joining is made negligible."""
+        s = Strand(name="hairpin", sequence="GGAAAACC")
+        shared = self.runCTMC(s, s.C)
+        distinct = self.runCTMC(Strand(name="hairpin", sequence="GGAAAACC"), Strand(name="other", sequence="GGTTTTCC"))
+
+        self.assertEqual(len(shared), len(distinct))
+        self.assertEqual(list(shared.exit_rates), list(distinct.exit_rates))
+        self.assertEqual(list(shared.sources), list(distinct.sources))
+        self.assertEqual(list(shared.targets), list(distinct.targets))
+
+    def test_first_passage_times(self):
+        """ Test [State Space]: Mean first passage time of the CTMC matches the simulated one
+
+        The hairpin of GGAAAACC has six states, all of which are seen."""
+        import numpy as np  # needs numpy and scipy
+
+        strand = Strand(name="hairpin", sequence="GGAAAACC")
+        start = Complex(strands=[strand], structure="........")
+        closed = Complex(strands=[strand], structure="((....))")
+
+        o = Options(simulation_mode="First Passage Time", num_simulations=300, simulation_time=1.0,
+                    start_state=[start], rate_method="Metropolis", dangles="Some", temperature=25)
+        o.stop_conditions = [StopCondition("CLOSED", [(closed, 0, 0)])]
+        o.initial_seed = 1
+        o.export_ctmc = True
+        o.unimolecular_scaling = 1.5e8
+        o.bimolecular_scaling = 1.38e6
+        SimSystem(o).start()
+
+        ctmc = o.interface.ctmc
+        structures = [state[0][2] for state in ctmc.states]
+        targets = [structures.index("((....))")]
+        others = [i for i in range(len(ctmc)) if i not in targets]
+
+        self.assertEqual(len(ctmc), 6)
+        self.assertTrue(np.allclose(ctmc.unexplored_rates()[others], 0.0, atol=1e-6 * max(ctmc.exit_rates)))
+        self.assertAlmostEqual(ctmc.escape_probabilities(targets)[0], 0.0)
+
+        times = np.array([result.time for result in o.interface.results])
+        error = times.std() / np.sqrt(len(times))
+        self.assertLess(abs(ctmc.first_passage_times(targets)[0] - times.mean()), 4 * error)
+
+
+class MI_Trajectory_File_TestCase(unittest.TestCase):
+    """ This test case reads trajectory files back and compares them to the python trajectory output.
+
+    """
+    def setUp(self):
+        strand = Strand(name="top", sequence="GCAGTGAC")
+        self.duplex = Complex(strands=[strand, strand.C], structure="((((((((+))))))))")
+        handle, self.path = tempfile.mkstemp(suffix=".traj")
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def makeOptions(self):
+        o = Options(simulation_mode="Trajectory", num_simulations=1, simulation_time=1e-6, output_interval=1,
+                    start_state=[self.duplex], rate_method="Metropolis", dangles="Some", temperature=25)
+        o.initial_seed = 3
+        o.unimolecular_scaling = 1.5e8
+        o.bimolecular_scaling = 1.38e6
+        return o
+
+    def checkRoundTrip(self, delta):
+        from multistrand.trajectoryfile import TrajectoryFile  # needs numpy
+
+        expected = self.makeOptions()
+        SimSystem(expected).start()
+
+        o = self.makeOptions()
+        o.output_file = self.path
+        o.output_delta = delta
+        SimSystem(o).start()
+
+        trajectory = TrajectoryFile(self.path)
+        self.assertEqual(len(trajectory), len(expected.full_trajectory))
+        for i in range(len(trajectory)):
+            self.assertEqual(trajectory.state(i), expected.full_trajectory[i])
+            self.assertEqual(trajectory.record(i)['time'], expected.full_trajectory_times[i])
+
+    def test_round_trip(self):
+        """ Test [Trajectory File]: States read from output_file equal full_trajectory
+
+        The duplex of a strand and its complement, which share a strand id."""
+        self.checkRoundTrip(False)
+
+    def test_round_trip_delta(self):
+        """ Test [Trajectory File]: States read from a delta encoded output_file equal full_trajectory"""
+        self.checkRoundTrip(True)
+
+
+class MI_Energy_TestCase(unittest.TestCase):
+    """ This test case compares the ways of evaluating energies.
+
+    """
+    def setUp(self):
+        strand = Strand(name="top", sequence="GGGACCTTAGGCAAAC")
+        self.duplex = Complex(strands=[strand, strand.C], structure="((((((..((((((((+))))))))..))))))")
+
+    def makeOptions(self, temperature, **kargs):
+        o = Options(temperature=temperature, dangles="Some", rate_method="Metropolis", **kargs)
+        o.unimolecular_scaling = 1.5e8
+        o.bimolecular_scaling = 1.38e6
+        return o
+
+    def test_compiled_parameters(self):
+        """ Test [Energy]: A compiled parameter set gives the energies of the parameter files
+
+        At 37 C the mapped tables are used as they are, at other temperatures
+        the dG tables are copied and rescaled."""
+        from multistrand.system import compile_parameters
+
+        handle, path = tempfile.mkstemp(suffix=".par")
+        os.close(handle)
+        try:
+            compile_parameters(self.makeOptions(37.0), path)
+            for temperature in [37.0, 25.0, 50.0]:
+                parsed = energy([self.duplex], self.makeOptions(temperature), 0)
+                mapped = energy([self.duplex], self.makeOptions(temperature, compiled_parameters=path), 0)
+                self.assertEqual(parsed, mapped)
+        finally:
+            os.remove(path)
+
+    def test_batch_energies(self):
+        """ Test [Energy]: energy_batch gives the energies of energy() for every energy type"""
+        from multistrand.system import energy_batch  # needs numpy
+
+        hairpin = Complex(strands=[Strand(name="hairpin", sequence="GGGAAACCCTT")], structure="(((...)))..")
+        states = [self.duplex, hairpin]
+        o = self.makeOptions(25.0)
+
+        for energy_type in range(4):
+            batch = energy_batch([c.sequence for c in states], [c.structure for c in states], o, energy_type)
+            for i in range(len(states)):
+                self.assertAlmostEqual(batch[i], energy([states[i]], o, energy_type)[0], places=9)
+
+    def test_batch_invalid_states(self):
+        """ Test [Energy]: energy_batch rejects states the energy model cannot evaluate"""
+        from multistrand.system import energy_batch  # needs numpy
+
+        o = self.makeOptions(25.0)
+        for sequence, structure in [("ACGT", "(..)"), ("GGCC", "(())"), ("GGGAAACC", "(((...)"),
+                                    ("GGGAAAGCC", "(((...)))"), ("AAAAAAAA+TTTTTTTT", "........+........"),
+                                    ("GGAA+GGAA+TTCC+TTCC", "((((+((((+))))+))))")]:
+            self.assertRaises(ValueError, energy_batch, sequence, structure, o)
+
+    def test_parameter_file(self):
+        """ Test [Energy]: Models read from different parameter files are cached separately"""
+        from multistrand.system import energy_model_cache
+
+        source = os.path.join(os.environ.get("NUPACKHOME", "."), "parameters", "dna1998.dG")
+        directory = tempfile.mkdtemp()
+        try:
+            first, second = os.path.join(directory, "first.dG"), os.path.join(directory, "second.dG")
+            shutil.copy(source, first)
+            shutil.copy(source, second)
+
+            expected = energy([self.duplex], self.makeOptions(37.0), 0)
+            self.assertEqual(energy([self.duplex], self.makeOptions(37.0, substrate_type=0, parameter_file=first), 0), expected)
+
+            misses = energy_model_cache()["misses"]
+            energy([self.duplex], self.makeOptions(37.0, substrate_type=0, parameter_file=second), 0)
+            self.assertEqual(energy_model_cache()["misses"], misses + 1)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_batch_rates(self):
+        """ Test [Energy]: calculate_rates gives the rates of calculate_rate, with the join flag broadcast or per transition"""
+        import numpy as np  # needs numpy
+        from multistrand.system import calculate_rate, calculate_rates
+
+        start = np.array([-3.0, 0.0, 1.5, -10.25, 2.0, -0.5])
+        end = np.array([-1.0, -2.5, 1.5, -9.0, -4.0, 0.75])
+        flags = np.array([0, 1, 2, 0, 2, 1])
+
+        for rate_method in [Options.metropolis, Options.kawasaki]:
+            o = self.makeOptions(25.0)
+            o.rate_method = rate_method
+            for joinflag in range(3):
+                rates = calculate_rates(start, end, o, joinflag)
+                self.assertEqual(rates.shape, start.shape)
+                for i in range(len(start)):
+                    self.assertAlmostEqual(rates[i], calculate_rate(start[i], end[i], o, joinflag), delta=1e-12 * rates[i])
+
+            rates = calculate_rates(start, end, o, flags)
+            for i in range(len(start)):
+                self.assertAlmostEqual(rates[i], calculate_rate(start[i], end[i], o, flags[i]), delta=1e-12 * rates[i])
+
+
+class MI_Runner_TestCase(unittest.TestCase):
+    """ This test case runs a job file with the headless runner built by 'make runner'.
+
+    """
+    job = """
+strand top GTTAGACTCGGAGGTGG
+strand bottom CCACCTCCGAGTCTAAC
+start top .................
+start bottom .................
+stop SUCCESS exact 0 top,bottom (((((((((((((((((+)))))))))))))))))
+stop REVERSE dissoc 0 top .................   # the strands fell apart again
+simulation_mode first_step
+num_simulations 20
+initial_seed 7777
+temperature 25
+simulation_time 1.0
+rate_method kawasaki
+dangles some
+unimolecular_scaling 1.5e8
+bimolecular_scaling 1.38e6
+join_concentration 1e-6
+results results.csv
+"""
+
+    def setUp(self):
+        self.runner = os.environ.get("MULTISTRAND_RUN",
+                                     os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "multistrand_run"))
+        if not os.path.exists(self.runner):
+            self.skipTest("the runner is not built, see 'make runner'")
+
+    def test_job_file(self):
+        """ Test [Runner]: A job file gives the first step results of the matching options"""
+        import csv
+        import subprocess
+
+        top = Strand(name="top", sequence="GTTAGACTCGGAGGTGG")
+        bottom = Strand(name="bottom", sequence="CCACCTCCGAGTCTAAC")
+        single = Complex(strands=[top], structure="." * 17)
+        duplex = Complex(strands=[top, bottom], structure="(" * 17 + "+" + ")" * 17)
+        o = Options(simulation_mode="First Step", num_simulations=20, temperature=25, simulation_time=1.0,
+                    start_state=[single, Complex(strands=[bottom], structure="." * 17)],
+                    rate_method="Kawasaki", dangles="Some")
+        o.stop_conditions = [StopCondition("SUCCESS", [(duplex, 0, 0)]), StopCondition("REVERSE", [(single, 2, 0)])]
+        o.initial_seed = 7777
+        o.unimolecular_scaling = 1.5e8
+        o.bimolecular_scaling = 1.38e6
+        o.join_concentration = 1e-6
+        SimSystem(o).start()
+
+        directory = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(directory, "job.txt"), "w") as job:
+                job.write(self.job)
+            with open(os.devnull, "w") as devnull:
+                self.assertEqual(subprocess.call([self.runner, "job.txt"], cwd=directory, stdout=devnull), 0)
+            with open(os.path.join(directory, "results.csv")) as results:
+                rows = list(csv.reader(results))[1:]
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertEqual(len(rows), len(o.interface.results))
+        for r, row in zip(o.interface.results, rows):
+            self.assertEqual(int(row[0]), r.seed)
+            self.assertEqual(row[4], r.tag)
+            self.assertAlmostEqual(float(row[2]), r.time, delta=1e-12 * max(1.0, r.time))
+
+    def test_malformed_job_files(self):
+        """ Test [Runner]: A malformed job file is reported with its line, and nothing is run"""
+        import subprocess
+
+        edits = [("start top .................", "start top ((((............."),
+                 ("start top .................", "start nowhere ................."),
+                 ("strand top GTTAGACTCGGAGGTGG", "strand top GTTAGACXCGGAGGTGG"),
+                 ("stop SUCCESS exact 0 top,bottom (((((((((((((((((+)))))))))))))))))", "stop SUCCESS exact 0 top,bottom ((((("),
+                 ("stop SUCCESS exact", "stop SUCCESS nearly"),
+                 ("num_simulations 20", "num_simulations many"),
+                 ("results results.csv", "")]
+
+        for old, new in edits:
+            directory = tempfile.mkdtemp()
+            try:
+                with open(os.path.join(directory, "job.txt"), "w") as job:
+                    job.write(self.job.replace(old, new))
+                runner = subprocess.Popen([self.runner, "job.txt"], cwd=directory, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                errors = runner.communicate()[1]
+                self.assertFalse(os.path.exists(os.path.join(directory, "results.csv")))
+            finally:
+                shutil.rmtree(directory)
+
+            self.assertEqual(runner.returncode, 1, new)
+            self.assertTrue(errors.startswith("MULTISTRAND: job.txt"), errors)
+
+
+class MI_Trajectory_Output_TestCase(unittest.TestCase):
+    """ This test case compares the ways trajectory states are handed to python.
+
+    """
+    def setUp(self):
+        strand = Strand(name="top", sequence="GCAGTGAC")
+        self.duplex = Complex(strands=[strand, strand.C], structure="((((((((+))))))))")
+
+    def makeOptions(self):
+        o = Options(simulation_mode="Trajectory", num_simulations=1, simulation_time=1e-6, output_interval=1,
+                    start_state=[self.duplex], rate_method="Metropolis", dangles="Some", temperature=25)
+        o.initial_seed = 3
+        o.unimolecular_scaling = 1.5e8
+        o.bimolecular_scaling = 1.38e6
+        return o
+
+    def test_columnar(self):
+        """ Test [Trajectory Output]: TrajectoryBlocks of output_columnar equal full_trajectory
+
+        Blocks of at most 3 states are joined back into one trajectory."""
+        expected = self.makeOptions()
+        SimSystem(expected).start()
+
+        o = self.makeOptions()
+        o.output_columnar = True
+        o.output_columnar_block = 3
+        SimSystem(o).start()
+
+        self.assertEqual(o.full_trajectory, [])
+        self.assertTrue(all(0 < len(block) <= 3 for block in o.trajectory_blocks))
+
+        states = [block.state(i) for block in o.trajectory_blocks for i in range(len(block))]
+        times = [t for block in o.trajectory_blocks for t in block.times]
+        self.assertEqual(len(states), len(expected.full_trajectory))
+        for state, complexes in zip(states, expected.full_trajectory):
+            self.assertEqual(state, [(c[1], c[2], c[4], c[5]) for c in complexes])
+        self.assertEqual(times, expected.full_trajectory_times)
+
+
+class MI_Simulation_TestCase(unittest.TestCase):
+    """ This test case compares simulation runs that should give the same trajectories, or the same statistics.
+
+    """
+    def setUp(self):
+        top = Strand(name="top", sequence="GTTAGACTCGGAGGTGG")
+        bottom = Strand(name="bottom", sequence="CCACCTCCGAGTCTAAC")
+        self.single = Complex(strands=[top], structure="." * 17)
+        self.start = [self.single, Complex(strands=[bottom], structure="." * 17)]
+        self.duplex = Complex(strands=[top, bottom], structure="(" * 17 + "+" + ")" * 17)
+
+    def makeOptions(self, num_simulations, simulation_mode="First Step", interfaces=[], **kargs):
+        o = Options(simulation_mode=simulation_mode, num_simulations=num_simulations, simulation_time=1.0,
+                    start_state=self.start, rate_method="Kawasaki", dangles="Some", temperature=25, **kargs)
+        o.stop_conditions = interfaces + [StopCondition("SUCCESS", [(self.duplex, 0, 0)]), StopCondition("REVERSE", [(self.single, 2, 0)])]
+        o.initial_seed = 7777
+        o.join_concentration = 1e-6
+        o.unimolecular_scaling = 1.5e8
+        o.bimolecular_scaling = 1.38e6
+        return o
+
+    def results(self, o):
+        return [(r.seed, r.tag, r.time, r.collision_rate) for r in o.interface.results]
+
+    def test_trajectory_offset(self):
+        """ Test [Simulation]: A run split with trajectory_offset gives the trajectories of one run"""
+        whole = self.makeOptions(20)
+        SimSystem(whole).start()
+
+        first, second = self.makeOptions(12), self.makeOptions(8)
+        second.trajectory_offset = 12
+        SimSystem(first).start()
+        SimSystem(second).start()
+
+        self.assertEqual(len(self.results(whole)), 20)
+        self.assertEqual(self.results(first) + self.results(second), self.results(whole))
+
+    def test_num_threads(self):
+        """ Test [Simulation]: A run on several threads gives the results of a single thread, in order"""
+        single = self.makeOptions(40)
+        SimSystem(single).start()
+
+        threaded = self.makeOptions(40, num_threads=4)
+        SimSystem(threaded).start()
+
+        self.assertEqual(self.results(threaded), self.results(single))
+
+    def test_loop_energy_cache(self):
+        """ Test [Simulation]: Trajectories are the same with the loop energy cache on and off"""
+        from multistrand.system import loop_energy_cache
+
+        plain = self.makeOptions(40)
+        SimSystem(plain).start()
+
+        loop_energy_cache(1 << 12)
+        try:
+            cached = self.makeOptions(40)
+            SimSystem(cached).start()
+            counts = loop_energy_cache()
+        finally:
+            loop_energy_cache(0)
+
+        self.assertEqual(self.results(cached), self.results(plain))
+        self.assertGreater(counts["hits"], 0)
+        self.assertGreater(counts["misses"], 0)
+        self.assertLessEqual(counts["size"], counts["capacity"])
+        self.assertEqual(loop_energy_cache()["hits"], 0)
+
+    def test_trajectory_seeds(self):
+        """ Test [Simulation]: Each trajectory of a run equals a run started from its seed
+
+        Later trajectories of a run reuse the memory of the ones before them,
+        a run started from the seed has a fresh object pool."""
+        run = self.makeOptions(10)
+        SimSystem(run).start()
+
+        for result in self.results(run):
+            o = self.makeOptions(1)
+            o.initial_seed = result[0]
+            SimSystem(o).start()
+            self.assertEqual(self.results(o), [result])
+
+    def test_known_trajectories(self):
+        """ Test [Simulation]: The List container gives the trajectories recorded before moves were stored as arrays
+
+        The Tree container picks moves in a different order, so its
+        trajectories differ for the same seed, see test_move_containers."""
+        known = [("REVERSE", 5.545277901378575e-08), ("SUCCESS", 2.945817285612869e-08), ("SUCCESS", 5.1881798230452204e-08),
+                 ("SUCCESS", 6.454287299064116e-09), ("SUCCESS", 4.088060919704262e-08)]
+
+        o = self.makeOptions(5, move_container=Options.moveList)
+        SimSystem(o).start()
+        self.assertEqual([r.tag for r in o.interface.results], [tag for tag, time in known])
+        for r, (tag, time) in zip(o.interface.results, known):
+            self.assertAlmostEqual(r.time, time, delta=1e-9 * time)
+
+    def test_start_template(self):
+        """ Test [Simulation]: Trajectories started from copies of the start state equal ones built from its structures
+
+        A start state given as resting states is not static, so it is read and
+        built again for every trajectory."""
+        copied = self.makeOptions(20)
+        SimSystem(copied).start()
+
+        self.start = [RestingState("start", [c]) for c in self.start]
+        built = self.makeOptions(20)
+        self.assertFalse(built.static_start_state)
+        SimSystem(built).start()
+
+        self.assertEqual(self.results(built), self.results(copied))
+
+    def test_resume(self):
+        """ Test [Simulation]: A run resumed after it was killed gives the results of the full run
+
+        The run is started in a child process that is killed once it has
+        written a checkpoint."""
+        import signal
+        import time
+
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "run.checkpoint")
+        try:
+            full = self.makeOptions(2000)
+            SimSystem(full).start()
+
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    SimSystem(self.makeOptions(2000, checkpoint_file=path, checkpoint_interval=5000)).start()
+                finally:
+                    os._exit(0)
+
+            deadline = time.time() + 60.0
+            while not os.path.exists(path) and time.time() < deadline:
+                time.sleep(0.001)
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+
+            resumed = self.makeOptions(2000, checkpoint_file=path, checkpoint_interval=5000)
+            SimSystem(resumed).resume(path)
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertEqual(self.results(resumed), self.results(full))
+
+    def test_resume_in_trajectory(self):
+        """ Test [Simulation]: A run resumed in the middle of a trajectory gives the results of a run without checkpoints
+
+        Opening the hairpin takes many thousands of steps, so the last checkpoint
+        is written in a trajectory. Writing checkpoints does not change the
+        run either."""
+        import struct
+
+        strand = Strand(name="hairpin", sequence="GGCGCAAAAGCGCC")
+        closed = Complex(strands=[strand], structure="(((((....)))))")
+        opened = Complex(strands=[strand], structure="." * 14)
+
+        def run(**kargs):
+            o = Options(simulation_mode="First Passage Time", num_simulations=3, simulation_time=1e-2,
+                        start_state=[closed], rate_method="Metropolis", dangles="Some", temperature=25, **kargs)
+            o.stop_conditions = [StopCondition("OPEN", [(opened, 0, 0)])]
+            o.initial_seed = 5
+            o.unimolecular_scaling = 1.5e8
+            o.bimolecular_scaling = 1.38e6
+            return o
+
+        def results(o):
+            return [(r.seed, r.tag, r.time) for r in o.interface.results]
+
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "run.checkpoint")
+        try:
+            plain = run()
+            SimSystem(plain).start()
+
+            saved = run(checkpoint_file=path, checkpoint_interval=1000)
+            SimSystem(saved).start()
+            with open(path, "rb") as checkpoint:
+                trajectorySteps = struct.unpack("=q", checkpoint.read(72)[64:])[0]
+
+            resumed = run(checkpoint_file=path, checkpoint_interval=1000)
+            SimSystem(resumed).resume(path)
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertGreater(trajectorySteps, 0)
+        self.assertEqual(results(saved), results(plain))
+        self.assertEqual(results(resumed), results(plain))
+
+    def test_forward_flux(self):
+        """ Test [Simulation]: Forward flux sampling gives the k1 of first step mode
+
+        With the target as the only interface the trials are the first step
+        trajectories, so k1 is the same. With an interface in between, at six
+        base pairs from the duplex, k1 is within four standard errors."""
+        import numpy as np  # needs numpy
+
+        o = self.makeOptions(400)
+        SimSystem(o).start()
+        rates = np.array([r.collision_rate if r.tag == "SUCCESS" else 0.0 for r in o.interface.results])
+        error = rates.std() / np.sqrt(len(rates))
+
+        direct = self.makeOptions(400, simulation_mode="Forward Flux")
+        SimSystem(direct).start()
+        self.assertAlmostEqual(direct.interface.forward_flux.k1(), rates.mean(), delta=1e-9 * rates.mean())
+
+        half = StopCondition("HALF", [(self.duplex, Options.countMacrostate, 6)])
+        staged = self.makeOptions(400, simulation_mode="Forward Flux", interfaces=[half], flux_trials=200)
+        SimSystem(staged).start()
+        self.assertEqual(staged.interface.forward_flux.tags, ["HALF", "SUCCESS"])
+        self.assertLess(abs(staged.interface.forward_flux.k1() - rates.mean()), 4 * error)
+
+    def test_weighted_ensemble(self):
+        """ Test [Simulation]: Weighted ensemble gives the chance of a first passage seen in plain trajectories
+
+        A four base pair hairpin opening within a microsecond, with an
+        interface at every base pair. The chance by the end and by half of
+        simulation_time is within four standard errors of the plain estimate."""
+        import numpy as np  # needs numpy
+
+        strand = Strand(name="hairpin", sequence="GGCGAAAACGCC")
+        closed = Complex(strands=[strand], structure="((((....))))")
+        target = StopCondition("OPEN", [(Complex(strands=[strand], structure="." * 12), 0, 0)])
+
+        def makeOptions(simulation_mode, num_simulations):
+            o = Options(simulation_mode=simulation_mode, num_simulations=num_simulations, simulation_time=1e-6,
+                        start_state=[closed], rate_method="Metropolis", dangles="Some", temperature=25)
+            o.initial_seed = 5
+            o.unimolecular_scaling = 1.5e8
+            o.bimolecular_scaling = 1.38e6
+            return o
+
+        plain = makeOptions("First Passage Time", 4000)
+        plain.stop_conditions = [target]
+        SimSystem(plain).start()
+        times = np.array([r.time if r.tag == "OPEN" else np.inf for r in plain.interface.results])
+
+        o = makeOptions("Weighted Ensemble", 400)
+        o.stop_conditions = [StopCondition("D%i" % d, [(closed, Options.countMacrostate, d)]) for d in [1, 2, 3]] + [target]
+        o.ensemble_walkers = 4
+        o.ensemble_interval = 5e-8
+        SimSystem(o).start()
+        ensemble = o.interface.weighted_ensemble
+
+        self.assertAlmostEqual(ensemble.cumulative([1e-6])[0], ensemble.probability())
+        for time, p in zip([5e-7, 1e-6], ensemble.cumulative([5e-7, 1e-6])):
+            expected = np.mean(times <= time)
+            error = np.sqrt(expected * (1.0 - expected) / len(times))
+            self.assertLess(abs(p - expected), 4 * error)
+
+    def test_move_containers(self):
+        """ Test [Simulation]: The List and Tree move containers give the same first passage times
+
+        The containers pick moves in a different order, so trajectories differ
+        for a seed. Opening the hairpin takes thousands of steps, so the loop
+        index of the Tree container is rebuilt several times per trajectory."""
+        import numpy as np  # needs numpy
+
+        strand = Strand(name="hairpin", sequence="GGCGAAAACGCC")
+        closed = Complex(strands=[strand], structure="((((....))))")
+        opened = Complex(strands=[strand], structure="." * 12)
+
+        statistics = []
+        for container in [Options.moveList, Options.moveTree]:
+            o = Options(simulation_mode="First Passage Time", num_simulations=300, simulation_time=1e-3,
+                        start_state=[closed], rate_method="Metropolis", dangles="Some", temperature=25,
+                        move_container=container)
+            o.stop_conditions = [StopCondition("OPEN", [(opened, 0, 0)])]
+            o.initial_seed = 5
+            o.unimolecular_scaling = 1.5e8
+            o.bimolecular_scaling = 1.38e6
+            SimSystem(o).start()
+
+            self.assertEqual(set(r.tag for r in o.interface.results), set(["OPEN"]))
+            times = np.array([r.time for r in o.interface.results])
+            statistics.append((times.mean(), times.var() / len(times)))
+
+        (listMean, listVariance), (treeMean, treeVariance) = statistics
+        self.assertLess(abs(listMean - treeMean), 4 * np.sqrt(listVariance + treeVariance))
+
+    def scanStructure(self, ours, stop, count, loose):
+        """ The full scan the simulator used to match loose (stop type 3) and
+        count (stop type 4) stop complexes, for one complex in the strand
+        order of the stop complex."""
+        remaining = count
+        ourPairs, stopPairs = [], []
+        for i in range(len(ours)):
+            if ours[i] != stop[i] and not (loose and stop[i] == '*'):
+                remaining -= 1
+            if ours[i] == '(':
+                ourPairs.append(i)
+            if stop[i] == '(':
+                stopPairs.append(i)
+            if ours[i] == ')' and stop[i] == ')':
+                if ourPairs[-1] != stopPairs[-1]:
+                    remaining -= 1
+                    if ours[stopPairs[-1]] == '(':
+                        remaining -= 1
+                ourPairs.pop()
+                stopPairs.pop()
+            else:
+                if ours[i] == ')':
+                    ourPairs.pop()
+                if stop[i] == ')':
+                    if ours[stopPairs[-1]] == '(':
+                        remaining -= 1
+                    stopPairs.pop()
+            if remaining < 0:
+                return False
+        return True
+
+    def rotateStructure(self, structure, strands):
+        """ Moves the first strands of a dot-paren structure to its end. """
+        parts = structure.split('+')
+        flat = "".join(parts)
+        shift = sum(len(part) for part in parts[:strands])
+
+        partner, stack = {}, []
+        for i, c in enumerate(flat):
+            if c == '(':
+                stack.append(i)
+            elif c == ')':
+                partner[i] = stack.pop()
+                partner[partner[i]] = i
+
+        rotated = ['.'] * len(flat)
+        for i, j in partner.items():
+            rotated[(i - shift) % len(flat)] = '(' if (i - shift) % len(flat) < (j - shift) % len(flat) else ')'
+
+        parts = parts[strands:] + parts[:strands]
+        output, i = [], 0
+        for part in parts:
+            output.append("".join(rotated[i:i + len(part)]))
+            i += len(part)
+        return '+'.join(output)
+
+    def scanState(self, state, condition):
+        """ Whether the old full scan finds the stop complexes of a condition in a trajectory state. """
+        for stopComplex, stopType, count in condition.complex_items:
+            stopNames = [strand.name for strand in stopComplex.strand_list]
+            found = False
+            for (seed, id, names, sequence, structure, energy) in state:
+                names = [name.split(':')[1] for name in names.split(',')]
+                for k in range(len(names)):
+                    if names[k:] + names[:k] == stopNames:
+                        ours = self.rotateStructure(structure, k)
+                        found = found or self.scanStructure(ours, stopComplex.structure, count, stopType == 3)
+                        break
+            if not found:
+                return False
+        return True
+
+    def test_loose_stop_conditions(self):
+        """ Test [Simulation]: Loose and count stop conditions match the states the full scan matches
+
+        The distance of a complex to a loose or count stop complex is patched
+        from the base pairs that change. The trajectories stop at the first
+        state in which the full scan over the structures finds a condition."""
+        top = Strand(name="top", sequence="GTCAGTAC")
+        duplex = [top, top.C]
+
+        conditions = [StopCondition("LOOSE", [(Complex(strands=duplex, structure="((****((+))****))"), 3, 1)]),
+                      StopCondition("COUNT", [(Complex(strands=duplex, structure="((((((((+))))))))"), 4, 3)]),
+                      StopCondition("HAIRPIN", [(Complex(strands=[top.C], structure="*(....)*"), 3, 0)])]
+        tags = set()
+
+        for seed in range(1, 21):
+            o = Options(simulation_mode="Trajectory", num_simulations=1, simulation_time=1e-2, output_interval=1,
+                        rate_method="Metropolis", dangles="Some", temperature=25)
+            o.start_state = [Complex(strands=[s], structure="........") for s in duplex]
+            o.stop_conditions = conditions
+            o.initial_seed = seed
+            o.join_concentration = 1e-3
+            o.unimolecular_scaling = 1.5e8
+            o.bimolecular_scaling = 1.38e6
+            SimSystem(o).start()
+
+            tag = o.interface.results[0].tag
+            tags.add(tag)
+            for state in o.full_trajectory[:-1]:
+                self.assertFalse(any(self.scanState(state, c) for c in conditions))
+            met = [c.tag for c in conditions if self.scanState(o.full_trajectory[-1], c)]
+            self.assertEqual(met[:1], [tag])
+
+        self.assertEqual(tags, set(["LOOSE", "COUNT", "HAIRPIN"]))
+
+    def test_running_totals(self):
+        """ Test [Simulation]: The running totals of the complex list agree with a full recount
+
+        Every 4096 updates, the total rate, exposed bases and self join count
+        kept by the complex list are recounted from its complexes, and the
+        simulation asserts that they agree. Three strands join and break apart
+        over many thousands of moves here."""
+        top = Strand(name="top", sequence="GTCAGTAC")
+        other = Strand(name="other", sequence="CAGTACGT")
+
+        o = Options(simulation_mode="Trajectory", num_simulations=1, simulation_time=5e-4, output_interval=1,
+                    rate_method="Metropolis", dangles="Some", temperature=25)
+        o.start_state = [Complex(strands=[s], structure="........") for s in [top, top.C, other]]
+        o.initial_seed = 7
+        o.join_concentration = 1e-3
+        o.unimolecular_scaling = 1.5e8
+        o.bimolecular_scaling = 1.38e6
+        SimSystem(o).start()
+
+        self.assertGreater(len(o.full_trajectory), 4 * 4096)
+        self.assertEqual(set(len(state) for state in o.full_trajectory), set([2, 3]))
+
+    def test_flat_structures(self):
+        """ Test [Simulation]: The flat structures patched after every move equal the ones built from the loops
+
+        The sequence, structure and strand names of a complex are patched when
+        strands join, break apart or are rotated. Read back as base pairs of
+        named strands, consecutive states of the trajectory must differ by the
+        single base pair of the move between them."""
+        top = Strand(name="top", sequence="GTCAGTAC")
+        other = Strand(name="other", sequence="CAGTACGT")
+        sequences = dict((s.name, s.sequence) for s in [top, top.C, other])
+        complement = {"A": "T", "T": "A", "G": "C", "C": "G"}
+
+        o = Options(simulation_mode="Trajectory", num_simulations=1, simulation_time=5e-4, output_interval=1,
+                    rate_method="Metropolis", dangles="Some", temperature=25)
+        o.start_state = [Complex(strands=[s], structure="........") for s in [top, top.C, other]]
+        o.initial_seed = 11
+        o.join_concentration = 1e-3
+        o.unimolecular_scaling = 1.5e8
+        o.bimolecular_scaling = 1.38e6
+        SimSystem(o).start()
+
+        self.assertGreater(len(o.full_trajectory), 1000)
+        self.assertIn(1, set(len(state) for state in o.full_trajectory))
+        previous = None
+        for state in o.full_trajectory:
+            pairs = set()
+            for complex in state:
+                pairs |= self.namedPairs(complex[2], complex[3], complex[4], sequences, complement)
+            if previous is not None:
+                self.assertEqual(len(pairs ^ previous), 1)
+            previous = pairs
+
+    def namedPairs(self, names, sequence, structure, sequences, complement):
+        """ Returns the base pairs of a complex as pairs of (strand id, offset), checking the flat strings agree."""
+        names = [name.split(":") for name in names.split(",")]
+        strands = zip(names, sequence.split("+"), structure.split("+"))
+        self.assertEqual(len(strands), len(names))
+        self.assertEqual(len(strands), len(structure.split("+")))
+
+        bases, pairs, stack = [], set(), []
+        for (uid, name), strandSequence, strandStructure in strands:
+            self.assertEqual(strandSequence, sequences[name])
+            self.assertEqual(len(strandStructure), len(strandSequence))
+            for offset, (base, c) in enumerate(zip(strandSequence, strandStructure)):
+                bases.append(((uid, offset), base))
+                if c == "(":
+                    stack.append(len(bases) - 1)
+                elif c == ")":
+                    (key, other), (key2, base2) = bases[stack.pop()], bases[-1]
+                    self.assertEqual(complement[other], base2)
+                    pairs.add(frozenset([key, key2]))
+        self.assertEqual(stack, [])
+        return pairs
+
+
 class SetupSuite( object ):
     """ Container for default set of tests and standard method for running them."""
 
@@ -259,6 +1077,24 @@ class SetupSuite( object ):
         self._suite.addTests(
             unittest.TestLoader().loadTestsFromTestCase(
                 MI_Options_Object_TestCase ))
+        self._suite.addTests(
+            unittest.TestLoader().loadTestsFromTestCase(
+                MI_State_Space_TestCase ))
+        self._suite.addTests(
+            unittest.TestLoader().loadTestsFromTestCase(
+                MI_Trajectory_File_TestCase ))
+        self._suite.addTests(
+            unittest.TestLoader().loadTestsFromTestCase(
+                MI_Energy_TestCase ))
+        self._suite.addTests(
+            unittest.TestLoader().loadTestsFromTestCase(
+                MI_Runner_TestCase ))
+        self._suite.addTests(
+            unittest.TestLoader().loadTestsFromTestCase(
+                MI_Trajectory_Output_TestCase ))
+        self._suite.addTests(
+            unittest.TestLoader().loadTestsFromTestCase(
+                MI_Simulation_TestCase ))
 
     def runTests(self):
         if hasattr(self, "_suite") and self._suite is not None: